@@ -2,18 +2,19 @@
 База данных для арены - отдельная система для PvP
 """
 import sqlite3
-import os
 from typing import Dict, List, Optional
 import time
 
-# Путь к базе данных арены
-ARENA_DB_PATH = os.path.join(os.path.dirname(__file__), 'database', 'arena.db')
+import leaderboard
+import sqlite_pool
+from database import DB_PATH
+
+# Арена хранится в общей БД game_bot.db (старый arena.db вливается миграцией database.py)
+ARENA_DB_PATH = DB_PATH
 
 def get_arena_connection():
-    """Получить соединение с базой данных арены"""
-    # Создаем папку если не существует
-    os.makedirs(os.path.dirname(ARENA_DB_PATH), exist_ok=True)
-    return sqlite3.connect(ARENA_DB_PATH)
+    """Получить соединение с базой данных арены из общего пула (папка создается пулом)"""
+    return sqlite_pool.connect(ARENA_DB_PATH)
 
 def init_arena_database():
     """Инициализация базы данных арены"""
@@ -35,10 +36,17 @@ def init_arena_database():
             total_healing INTEGER DEFAULT 0,
             games_played INTEGER DEFAULT 0,
             last_game_time INTEGER DEFAULT 0,
-            created_at INTEGER DEFAULT 0
+            created_at INTEGER DEFAULT 0,
+            xp INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            last_bonus_win_date TEXT,          -- дата последнего большого бонуса за победу
+            pending_level_rewards INTEGER DEFAULT 0
         )
     ''')
     
+    # Индекс для топа и мест в рейтинге (leaderboard.py)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_arena_ratings_rating ON arena_ratings(rating, wins)')
+    
     # Таблица истории боев
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS arena_battles (
@@ -94,25 +102,7 @@ def init_arena_database():
     ''')
     
     conn.commit()
-    
-    # Миграции: добавляем недостающие колонки для опыта/уровней
-    try:
-        cursor.execute("PRAGMA table_info(arena_ratings)")
-        cols = {row[1] for row in cursor.fetchall()}
-        # Опыт и уровень игрока в арене
-        if 'xp' not in cols:
-            cursor.execute("ALTER TABLE arena_ratings ADD COLUMN xp INTEGER DEFAULT 0")
-        if 'level' not in cols:
-            cursor.execute("ALTER TABLE arena_ratings ADD COLUMN level INTEGER DEFAULT 1")
-        # Дата последнего ежедневного большого бонуса за победу
-        if 'last_bonus_win_date' not in cols:
-            cursor.execute("ALTER TABLE arena_ratings ADD COLUMN last_bonus_win_date TEXT")
-        # Количество ожидающих наград за повышение уровня
-        if 'pending_level_rewards' not in cols:
-            cursor.execute("ALTER TABLE arena_ratings ADD COLUMN pending_level_rewards INTEGER DEFAULT 0")
-        conn.commit()
-    except Exception as mig_e:
-        print(f"⚠️ Миграция таблицы arena_ratings: {mig_e}")
+    # Колонки xp/level/... у старых таблиц добавляет миграция 8 в database.py
     conn.close()
     print("✅ База данных арены инициализирована")
 
@@ -195,21 +185,8 @@ def get_player_rating(user_id: int, username: Optional[str] = None) -> Dict:
     return rating_data
 
 def get_player_rank(user_id: int) -> int:
-    """Получить ранг игрока в общей таблице"""
-    conn = get_arena_connection()
-    cursor = conn.cursor()
-    
-    # Получаем ранг игрока по рейтингу
-    cursor.execute('''
-        SELECT COUNT(*) + 1 as rank 
-        FROM arena_ratings 
-        WHERE rating > (SELECT rating FROM arena_ratings WHERE user_id = ? LIMIT 1)
-    ''', (user_id,))
-    
-    result = cursor.fetchone()
-    conn.close()
-    
-    return result[0] if result else 1
+    """Получить ранг игрока в общей таблице (бинарный поиск по снимку рейтингов)"""
+    return leaderboard.get_rank("arena", user_id)
 
 def update_player_rating(user_id: int, username: str, rating_change: int, is_win: bool, 
                         damage_dealt: int = 0, damage_taken: int = 0, healing: int = 0):
@@ -340,20 +317,22 @@ def save_battle_result(player1_data: Dict, player2_data: Dict, winner_id: int,
     conn.close()
 
 def get_top_players(limit: int = 10) -> List[Dict]:
-    """Получить топ игроков по рейтингу"""
-    conn = get_arena_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT user_id, username, rating, wins, losses, win_streak, games_played
-        FROM arena_ratings 
-        WHERE games_played > 0
-        ORDER BY rating DESC, wins DESC 
-        LIMIT ?
-    ''', (limit,))
-    
-    results = cursor.fetchall()
-    conn.close()
+    """Получить топ игроков по рейтингу (из периодически обновляемого снимка)"""
+    if limit <= leaderboard.TOP_SIZE:
+        # Строки снимка: user_id, rating, username, wins, losses, win_streak, games_played
+        results = [(r[0], r[2], r[1], r[3], r[4], r[5], r[6]) for r in leaderboard.get_top("arena", limit)]
+    else:
+        conn = get_arena_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, username, rating, wins, losses, win_streak, games_played
+            FROM arena_ratings 
+            WHERE games_played > 0
+            ORDER BY rating DESC, wins DESC 
+            LIMIT ?
+        ''', (limit,))
+        results = cursor.fetchall()
+        conn.close()
     
     players = []
     for i, result in enumerate(results):
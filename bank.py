@@ -1,22 +1,28 @@
 # === БАНКОВСКАЯ СИСТЕМА ===
-import sqlite3
 import os
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List, Tuple
 
-# Путь к базе данных банка
-BANK_DB_PATH = os.path.join(os.path.dirname(__file__), "database", "bank.db")
+import sqlite_pool
+from database import DB_PATH
+
+# Банк хранится в общей БД game_bot.db (старый bank.db вливается миграцией database.py)
+BANK_DB_PATH = DB_PATH
 
 class BankSystem:
     def __init__(self):
         self.db_path = BANK_DB_PATH
         self.init_db()
     
+    def _connect(self):
+        """Соединение из общего пула; with-блок коммитит и возвращает его в пул"""
+        return sqlite_pool.connect(self.db_path)
+    
     def init_db(self):
         """Инициализация базы данных банка"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             # Таблица депозитов
@@ -51,7 +57,7 @@ class BankSystem:
     def add_deposit(self, user_id: int, username: str, amount: float, duration_days: int, interest_rate: float) -> bool:
         """Добавить депозит с указанным сроком и процентной ставкой"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Вычисляем дату погашения
@@ -74,10 +80,25 @@ class BankSystem:
             print(f"Ошибка добавления депозита: {e}")
             return False
     
+    def mature_deposits(self) -> int:
+        """Перевести созревшие активные депозиты в статус matured (периодическая задача)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE deposits SET status = 'matured'
+                    WHERE status = 'active' AND maturity_date IS NOT NULL AND maturity_date <= ?
+                ''', (datetime.now().isoformat(),))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"Ошибка обновления созревших депозитов: {e}")
+            return 0
+    
     def get_user_deposits(self, user_id: int) -> List[Dict[str, Any]]:
         """Получить все депозиты пользователя"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT id, amount, deposit_date, duration_days, interest_rate, status, maturity_date
@@ -133,7 +154,7 @@ class BankSystem:
     def get_user_total_deposits(self, user_id: int) -> float:
         """Получить общую сумму активных депозитов пользователя"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT SUM(amount) FROM deposits 
@@ -149,7 +170,7 @@ class BankSystem:
     def get_total_bank_deposits(self) -> float:
         """Получить общую сумму всех депозитов в банке"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT SUM(amount) FROM deposits WHERE status = 'active'
@@ -164,7 +185,7 @@ class BankSystem:
     def get_user_deposits_count(self, user_id: int) -> int:
         """Получить количество активных депозитов пользователя"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT COUNT(*) FROM deposits 
@@ -179,7 +200,7 @@ class BankSystem:
     def get_total_deposits_count(self) -> int:
         """Получить общее количество всех депозитов в мире"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT COUNT(*) FROM deposits 
@@ -194,7 +215,7 @@ class BankSystem:
     def withdraw_deposit(self, user_id: int, deposit_id: int) -> Tuple[bool, str, float]:
         """Снять депозит"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Получаем информацию о депозите
@@ -254,7 +275,7 @@ class BankSystem:
     def close_deposit_early(self, user_id: int, deposit_id: int) -> Tuple[bool, str]:
         """Досрочно закрыть депозит"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Получаем информацию о депозите
@@ -291,7 +312,7 @@ class BankSystem:
     def collect_completed_deposit(self, user_id: int, deposit_id: int) -> Tuple[bool, str, float]:
         """Забрать доходы с завершенного депозита"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Получаем информацию о депозите
@@ -330,7 +351,7 @@ class BankSystem:
     def get_deposit_info(self, user_id: int, deposit_id: int) -> Optional[Dict[str, Any]]:
         """Получить подробную информацию о депозите"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT id, amount, deposit_date, duration_days, interest_rate, status, maturity_date
@@ -372,7 +393,7 @@ class BankSystem:
     def get_user_operations(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
         """Получить историю операций пользователя"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT operation_type, amount, description, operation_date
@@ -0,0 +1,432 @@
+"""
+Рассылки сообщений пользователям (/tell, уведомления лотереи).
+
+Раньше рассылка выбирала все user_id одним запросом и отправляла сообщения
+по одному с фиксированной паузой 0.05–0.1 с: 50 тысяч пользователей — больше
+часа, TelegramRetryAfter игнорировался, а перезапуск бота обрывал рассылку
+без возможности продолжить. Здесь:
+
+- получатели читаются из БД страницами по PAGE_SIZE (keyset по user_id), в
+  памяти только текущая страница;
+- сообщения отправляются параллельно (не больше CONCURRENCY одновременно)
+  через общий ограничитель скорости: token bucket на GLOBAL_RATE сообщений в
+  секунду (лимит Telegram ~30/с на бота) и не чаще раза в PER_CHAT_INTERVAL
+  секунд в один чат;
+- TelegramRetryAfter приостанавливает все рассылки на retry_after секунд,
+  сообщение отправляется повторно;
+- пользователи, заблокировавшие бота или удалившие аккаунт, попадают в
+  таблицу broadcast_blocked и в следующие рассылки не включаются; /start
+  снимает отметку (unblock);
+- курсор и счётчики сохраняются в таблицу broadcasts после каждой страницы,
+  незавершённые рассылки продолжаются после перезапуска (resume_all). При
+  падении посреди страницы её часть может быть отправлена повторно;
+- прогресс показывается в одном сообщении админу, которое обновляется не
+  чаще раза в PROGRESS_INTERVAL секунд.
+
+    broadcast.setup(bot)
+    await broadcast.start("text", {"text": text, "parse_mode": "HTML"}, report_chat_id=ADMIN_ID)
+    await broadcast.start("forward", {"from_chat_id": chat_id, "message_id": message_id})
+"""
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+
+import database as db
+import db_async
+
+# Сообщений в секунду на весь бот (Telegram допускает около 30)
+GLOBAL_RATE = 25
+# Сколько сообщений можно отправить разом после простоя
+GLOBAL_BURST = 5
+# Минимальный интервал между сообщениями в один чат, секунд
+PER_CHAT_INTERVAL = 1.0
+# Сколько сообщений одной рассылки отправляется одновременно
+CONCURRENCY = 8
+# Получателей на страницу (после каждой страницы сохраняется прогресс)
+PAGE_SIZE = 200
+# Попыток на одно сообщение (RetryAfter и сетевые ошибки)
+MAX_ATTEMPTS = 3
+# Как часто обновлять сообщение с прогрессом, секунд
+PROGRESS_INTERVAL = 5.0
+
+# Ошибки TelegramBadRequest, после которых писать пользователю бессмысленно
+_GONE_ERRORS = ("chat not found", "user is deactivated", "bot was blocked", "peer_id_invalid")
+
+
+class RateLimiter:
+    """Token bucket на весь бот плюс ограничение частоты по чатам."""
+
+    def __init__(self, rate: float, burst: int, per_chat_interval: float):
+        self.rate = rate
+        self.burst = burst
+        self.per_chat_interval = per_chat_interval
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        # chat_id -> ближайший момент, когда в чат можно писать
+        self._chat_next: Dict[int, float] = {}
+
+    def pause(self, seconds: float):
+        """Остановить отправку на seconds секунд (после RetryAfter)."""
+        resume_at = time.monotonic() + seconds
+        if resume_at > self._updated:
+            # Токены не копятся во время паузы — после неё снова не больше rate в секунду
+            self._tokens = 0.0
+            self._updated = resume_at
+
+    async def _reserve_chat(self, chat_id: int):
+        now = time.monotonic()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.per_chat_interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: at for chat, at in self._chat_next.items() if at > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def acquire(self, chat_id: Optional[int] = None):
+        if chat_id is not None:
+            await self._reserve_chat(chat_id)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now >= self._updated:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+                else:
+                    # Идёт пауза после RetryAfter
+                    delay = self._updated - now
+                await asyncio.sleep(delay)
+
+
+limiter = RateLimiter(GLOBAL_RATE, GLOBAL_BURST, PER_CHAT_INTERVAL)
+
+
+class Broadcast:
+    """Состояние одной рассылки (строка таблицы broadcasts)."""
+
+    def __init__(self, row):
+        (self.id, self.title, self.kind, payload, self.audience, self.audience_arg, self.cursor,
+         self.total, self.sent, self.failed, self.blocked, self.status,
+         self.report_chat_id, self.report_message_id) = row
+        self.payload = json.loads(payload)
+        self.stop_requested = False
+        self.reported_at = 0.0
+
+    def progress_text(self) -> str:
+        done = self.sent + self.failed + self.blocked
+        percent = done * 100 // self.total if self.total else 100
+        header = {
+            "running": f"📡 <b>{self.title} #{self.id}</b>: {percent}%",
+            "done": f"✅ <b>{self.title} #{self.id} завершена</b>",
+            "cancelled": f"⛔ <b>{self.title} #{self.id} остановлена</b>",
+            "error": f"❌ <b>{self.title} #{self.id} прервана ошибкой</b>",
+        }.get(self.status, f"{self.title} #{self.id}: {self.status}")
+        return (
+            f"{header}\n\n"
+            f"📊 Статистика:\n"
+            f"✅ Успешно: {self.sent}\n"
+            f"❌ Ошибок: {self.failed}\n"
+            f"🚫 Заблокировали бота: {self.blocked}\n"
+            f"👥 Обработано: {done} из {self.total}"
+        )
+
+
+_bot = None
+_running: Dict[int, Broadcast] = {}
+_tasks: Dict[int, asyncio.Task] = {}
+
+_COLUMNS = ("id, title, kind, payload, audience, audience_arg, cursor, total, sent, failed, blocked, "
+            "status, report_chat_id, report_message_id")
+
+
+def setup(bot):
+    """Передать модулю экземпляр бота (до start/resume_all)."""
+    global _bot
+    _bot = bot
+
+
+# ---------- Работа с БД (выполняется в пуле потоков db_async) ----------
+
+def _audience_query(audience: str):
+    """SQL страницы получателей (параметры: [аргумент], курсор, лимит) и подсчёта."""
+    not_blocked = "user_id NOT IN (SELECT user_id FROM broadcast_blocked)"
+    if audience == "users":
+        return (
+            f"SELECT user_id FROM users WHERE user_id > ? AND {not_blocked} ORDER BY user_id LIMIT ?",
+            f"SELECT COUNT(*) FROM users WHERE {not_blocked}",
+        )
+    if audience == "lottery":
+        # Участники розыгрыша за дату audience_arg
+        where = f"draw_date = ? AND status IN ('active', 'drawn') AND {not_blocked}"
+        return (
+            f"SELECT DISTINCT user_id FROM lottery_tickets WHERE {where} AND user_id > ? ORDER BY user_id LIMIT ?",
+            f"SELECT COUNT(DISTINCT user_id) FROM lottery_tickets WHERE {where}",
+        )
+    raise ValueError(f"неизвестная аудитория рассылки: {audience}")
+
+
+def _audience_args(audience: str, audience_arg) -> tuple:
+    return (audience_arg,) if audience == "lottery" else ()
+
+
+def _create(title: str, kind: str, payload: dict, audience: str, audience_arg, report_chat_id) -> Broadcast:
+    _, count_sql = _audience_query(audience)
+    conn = db._connect(row_factory=None)
+    try:
+        total = conn.execute(count_sql, _audience_args(audience, audience_arg)).fetchone()[0]
+        now = time.time()
+        cur = conn.execute(
+            "INSERT INTO broadcasts (title, kind, payload, audience, audience_arg, total, status, "
+            "report_chat_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'running', ?, ?, ?)",
+            (title, kind, json.dumps(payload, ensure_ascii=False), audience, audience_arg, total,
+             report_chat_id, now, now),
+        )
+        conn.commit()
+        row = conn.execute(f"SELECT {_COLUMNS} FROM broadcasts WHERE id = ?", (cur.lastrowid,)).fetchone()
+        return Broadcast(row)
+    finally:
+        conn.close()
+
+
+def _fetch_page(job: Broadcast) -> List[int]:
+    page_sql, _ = _audience_query(job.audience)
+    conn = db._connect(row_factory=None)
+    try:
+        args = _audience_args(job.audience, job.audience_arg) + (job.cursor, PAGE_SIZE)
+        return [row[0] for row in conn.execute(page_sql, args).fetchall()]
+    finally:
+        conn.close()
+
+
+def _save_progress(job: Broadcast, blocked_ids: List[int]):
+    """Сохранить курсор, счётчики и новых «заблокировавших» одной транзакцией."""
+    conn = db._connect(row_factory=None)
+    try:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT OR REPLACE INTO broadcast_blocked (user_id, blocked_at) VALUES (?, ?)",
+            [(user_id, now) for user_id in blocked_ids],
+        )
+        conn.execute(
+            "UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, blocked = ?, status = ?, "
+            "report_message_id = ?, updated_at = ? WHERE id = ?",
+            (job.cursor, job.sent, job.failed, job.blocked, job.status, job.report_message_id, now, job.id),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _load(where: str, args: tuple = (), limit: int = -1) -> List[Broadcast]:
+    conn = db._connect(row_factory=None)
+    try:
+        rows = conn.execute(
+            f"SELECT {_COLUMNS} FROM broadcasts WHERE {where} ORDER BY id DESC LIMIT ?", args + (limit,)
+        ).fetchall()
+        return [Broadcast(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def unblock(user_id: int):
+    """Снова включать пользователя в рассылки (он написал боту)."""
+    conn = db._connect(row_factory=None)
+    try:
+        conn.execute("DELETE FROM broadcast_blocked WHERE user_id = ?", (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ---------- Отправка ----------
+
+async def _send(job: Broadcast, user_id: int):
+    payload = job.payload
+    if job.kind == "text":
+        text = payload.get("personal", {}).get(str(user_id), payload["text"])
+        await _bot.send_message(user_id, text, parse_mode=payload.get("parse_mode"))
+    elif job.kind == "forward":
+        await _bot.forward_message(
+            chat_id=user_id, from_chat_id=payload["from_chat_id"], message_id=payload["message_id"]
+        )
+    else:
+        raise ValueError(f"неизвестный тип рассылки: {job.kind}")
+
+
+async def _deliver(job: Broadcast, user_id: int) -> str:
+    """Отправить сообщение одному получателю: "sent", "failed" или "blocked"."""
+    for attempt in range(MAX_ATTEMPTS):
+        await limiter.acquire(user_id)
+        try:
+            await _send(job, user_id)
+            return "sent"
+        except TelegramRetryAfter as e:
+            print(f"⏳ Рассылка #{job.id}: flood control, пауза {e.retry_after} с")
+            limiter.pause(e.retry_after)
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramBadRequest as e:
+            if any(error in str(e).lower() for error in _GONE_ERRORS):
+                return "blocked"
+            return "failed"
+        except TelegramNetworkError:
+            await asyncio.sleep(2 ** attempt)
+        except Exception:
+            return "failed"
+    return "failed"
+
+
+async def _send_page(job: Broadcast, page: List[int]) -> List[str]:
+    results = [None] * len(page)
+    queue = iter(enumerate(page))
+
+    async def worker():
+        # Воркеры разбирают общую очередь страницы, так одновременно идёт не больше CONCURRENCY отправок
+        for index, user_id in queue:
+            results[index] = await _deliver(job, user_id)
+
+    await asyncio.gather(*(worker() for _ in range(min(CONCURRENCY, len(page)))))
+    return results
+
+
+async def _report(job: Broadcast, force: bool = False):
+    now = time.monotonic()
+    if job.report_chat_id is None or (not force and now - job.reported_at < PROGRESS_INTERVAL):
+        return
+    job.reported_at = now
+    text = job.progress_text()
+    try:
+        if job.report_message_id:
+            await _bot.edit_message_text(text, chat_id=job.report_chat_id,
+                                         message_id=job.report_message_id, parse_mode="HTML")
+            return
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return
+    except Exception as e:
+        print(f"⚠️ Рассылка #{job.id}: не удалось обновить прогресс: {e}")
+        return
+    # Сообщения с прогрессом ещё нет (или его нельзя изменить) — отправляем новое
+    try:
+        sent = await _bot.send_message(job.report_chat_id, text, parse_mode="HTML")
+        job.report_message_id = sent.message_id
+    except Exception as e:
+        print(f"⚠️ Рассылка #{job.id}: не удалось отправить прогресс: {e}")
+
+
+async def _run(job: Broadcast):
+    try:
+        while not job.stop_requested:
+            page = await db_async.run(_fetch_page, job)
+            if not page:
+                job.status = "done"
+                break
+            results = await _send_page(job, page)
+            blocked_ids = [user_id for user_id, result in zip(page, results) if result == "blocked"]
+            job.sent += results.count("sent")
+            job.failed += results.count("failed")
+            job.blocked += len(blocked_ids)
+            job.cursor = page[-1]
+            await db_async.run(_save_progress, job, blocked_ids)
+            await _report(job)
+        else:
+            job.status = "cancelled"
+        await db_async.run(_save_progress, job, [])
+        print(f"✅ {job.title} #{job.id}: {job.status}, отправлено {job.sent}, ошибок {job.failed}, "
+              f"заблокировали {job.blocked}")
+        await _report(job, force=True)
+    except asyncio.CancelledError:
+        # Остановка бота: статус остаётся running, рассылка продолжится после перезапуска
+        raise
+    except Exception as e:
+        print(f"❌ {job.title} #{job.id}: {e}")
+        job.status = "error"
+        try:
+            await db_async.run(_save_progress, job, [])
+        except Exception:
+            pass
+        await _report(job, force=True)
+    finally:
+        _running.pop(job.id, None)
+        _tasks.pop(job.id, None)
+
+
+def _spawn(job: Broadcast):
+    _running[job.id] = job
+    _tasks[job.id] = asyncio.get_running_loop().create_task(_run(job))
+
+
+async def start(kind: str, payload: dict, audience: str = "users", audience_arg=None,
+                report_chat_id: Optional[int] = None, title: str = "Рассылка") -> Broadcast:
+    """Запустить рассылку в фоне и вернуть её.
+
+    kind="text": payload {"text", "parse_mode", "personal": {str(user_id): текст}};
+    kind="forward": payload {"from_chat_id", "message_id"}.
+    audience="users" — все пользователи, "lottery" — участники розыгрыша за дату audience_arg.
+    report_chat_id — куда показывать прогресс (None — только в консоль).
+    """
+    job = await db_async.run(_create, title, kind, payload, audience, audience_arg, report_chat_id)
+    await _report(job, force=True)
+    _spawn(job)
+    return job
+
+
+async def resume_all() -> int:
+    """Продолжить рассылки, прерванные остановкой бота (при старте)."""
+    jobs = await db_async.run(_load, "status = 'running'")
+    for job in jobs:
+        if job.id not in _running:
+            print(f"♻️ {job.title} #{job.id}: продолжаем с {job.sent + job.failed + job.blocked} из {job.total}")
+            _spawn(job)
+    return len(jobs)
+
+
+async def resume(broadcast_id: int) -> Optional[Broadcast]:
+    """Продолжить остановленную или прерванную ошибкой рассылку."""
+    if broadcast_id in _running:
+        return _running[broadcast_id]
+    jobs = await db_async.run(_load, "id = ? AND status != 'done'", (broadcast_id,))
+    if not jobs:
+        return None
+    job = jobs[0]
+    job.status = "running"
+    await db_async.run(_save_progress, job, [])
+    _spawn(job)
+    return job
+
+
+def cancel(broadcast_id: int) -> bool:
+    """Остановить рассылку после текущей страницы."""
+    job = _running.get(broadcast_id)
+    if job is None:
+        return False
+    job.stop_requested = True
+    return True
+
+
+async def recent(limit: int = 10) -> List[Broadcast]:
+    """Последние рассылки (для /broadcasts); у идущих — текущие счётчики."""
+    jobs = await db_async.run(_load, "1", (), limit)
+    return [_running.get(job.id, job) for job in jobs]
+
+
+def shutdown():
+    """Прервать идущие рассылки при остановке бота (прогресс уже сохранён)."""
+    for task in list(_tasks.values()):
+        task.cancel()
@@ -3,6 +3,13 @@ import sqlite3
 import time
 import threading
 import os
+from contextlib import contextmanager
+
+import migrations
+import sqlite_pool
+import render_cache
+import ttl_cache
+import write_behind
 
 # --- Дополнительные функции из main.py ---
 def create_tables(db_pool=None, DATABASE_FILE=None, MESSAGES_DB_FILE_FILE=None, _tasks=None):
@@ -27,22 +34,7 @@ def create_tables(db_pool=None, DATABASE_FILE=None, MESSAGES_DB_FILE_FILE=None,
                 )
             ''')
 
-            # Миграция: добавляем недостающие колонки для реферальной системы
-            try:
-                cols = db_pool.execute_query("PRAGMA table_info(users)")
-                existing = {row[1] for row in cols}
-                if "reg_date" not in existing:
-                    db_pool.execute_query("ALTER TABLE users ADD COLUMN reg_date TEXT")
-                if "bonus_requests" not in existing:
-                    db_pool.execute_query("ALTER TABLE users ADD COLUMN bonus_requests INTEGER DEFAULT 0")
-                if "used_bonus_requests" not in existing:
-                    db_pool.execute_query("ALTER TABLE users ADD COLUMN used_bonus_requests INTEGER DEFAULT 0")
-                if "used_referral_code" not in existing:
-                    db_pool.execute_query("ALTER TABLE users ADD COLUMN used_referral_code TEXT DEFAULT NULL")
-                if "adult_unlocks" not in existing:
-                    db_pool.execute_query("ALTER TABLE users ADD COLUMN adult_unlocks INTEGER DEFAULT 0")
-            except Exception as mig_e:
-                print(f"⚠️ Миграция users: {mig_e}")
+            # Недостающие колонки реферальной системы добавляет миграция 8 (один раз при запуске)
             
             # Таблица для кастомных имен пользователей
             db_pool.execute_query('''
@@ -70,7 +62,7 @@ def create_tables(db_pool=None, DATABASE_FILE=None, MESSAGES_DB_FILE_FILE=None,
         print(f"❌ Ошибка создания таблиц: {e}")
         # Попытка создать минимальную таблицу без DEFAULT значений
         try:
-            conn = sqlite3.connect(DATABASE_FILE)
+            conn = sqlite_pool.connect(DATABASE_FILE)
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -93,7 +85,7 @@ def create_tables(db_pool=None, DATABASE_FILE=None, MESSAGES_DB_FILE_FILE=None,
 
     # Ensure daily_claims table exists in messages DB for storing daily bonus claims
     try:
-        meta_conn = sqlite3.connect(MESSAGES_DB_FILE_FILE)
+        meta_conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
         meta_cur = meta_conn.cursor()
         meta_cur.execute('''
             CREATE TABLE IF NOT EXISTS daily_claims (
@@ -109,7 +101,7 @@ def create_tables(db_pool=None, DATABASE_FILE=None, MESSAGES_DB_FILE_FILE=None,
     except Exception as e:
         print(f"❌ Не удалось создать daily_claims в messages DB: {e}")
     try:
-        meta_conn = sqlite3.connect(MESSAGES_DB_FILE_FILE)
+        meta_conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
         meta_cur = meta_conn.cursor()
         meta_cur.execute('''
             CREATE TABLE IF NOT EXISTS daily_claim_logs (
@@ -150,18 +142,7 @@ async def add_user(user_id: int, username: str, db_pool=None, DATABASE_FILE=None
     is_new_user = False
     try:
         if db_pool:
-            columns = db_pool.execute_query("PRAGMA table_info(users)")
-            column_names = [row[1] for row in columns]
-            if "reg_date" not in column_names:
-                db_pool.execute_query("ALTER TABLE users ADD COLUMN reg_date TEXT")
-            if "bonus_requests" not in column_names:
-                db_pool.execute_query("ALTER TABLE users ADD COLUMN bonus_requests INTEGER DEFAULT 0")
-            if "used_bonus_requests" not in column_names:
-                db_pool.execute_query("ALTER TABLE users ADD COLUMN used_bonus_requests INTEGER DEFAULT 0")
-            if "used_referral_code" not in column_names:
-                db_pool.execute_query("ALTER TABLE users ADD COLUMN used_referral_code TEXT DEFAULT NULL")
-            if "adult_unlocks" not in column_names:
-                db_pool.execute_query("ALTER TABLE users ADD COLUMN adult_unlocks INTEGER DEFAULT 0")
+            # Колонки users гарантированы миграциями при запуске — здесь схему не проверяем
             result = db_pool.execute_one("SELECT reg_date FROM users WHERE user_id = ?", (user_id,))
             if not result:
                 is_new_user = True
@@ -173,7 +154,7 @@ async def add_user(user_id: int, username: str, db_pool=None, DATABASE_FILE=None
             else:
                 db_pool.execute_query("UPDATE users SET username = ? WHERE user_id = ?", (username or '', user_id))
         else:
-            conn = sqlite3.connect(DATABASE_FILE)
+            conn = sqlite_pool.connect(DATABASE_FILE)
             cursor = conn.cursor()
             cursor.execute("SELECT user_id, referrals_count FROM users WHERE user_id = ?", (user_id,))
             existing = cursor.fetchone()
@@ -195,7 +176,7 @@ async def add_user(user_id: int, username: str, db_pool=None, DATABASE_FILE=None
     except Exception as e:
         print(f"❌ Ошибка в add_user: {e}")
         try:
-            conn = sqlite3.connect(DATABASE_FILE)
+            conn = sqlite_pool.connect(DATABASE_FILE)
             cursor = conn.cursor()
             cursor.execute(
                 "INSERT OR REPLACE INTO users (user_id, username, referrals_count, bonus_requests, used_bonus_requests, used_referral_code, adult_unlocks, dan) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 
@@ -216,6 +197,8 @@ async def add_user(user_id: int, username: str, db_pool=None, DATABASE_FILE=None
             except:
                 pass
     
+    invalidate_user(user_id)
+    invalidate_name(user_id)
     return is_new_user
 
 async def set_referrer(user_id: int, referrer_id: int, db_pool=None, _tasks=None):
@@ -230,6 +213,7 @@ async def set_referrer(user_id: int, referrer_id: int, db_pool=None, _tasks=None
         await add_user(referrer_id, "Unknown", db_pool=db_pool)
         db_pool.execute_query("UPDATE users SET referrer_id = ? WHERE user_id = ?", (referrer_id, user_id))
         db_pool.execute_query("UPDATE users SET referrals_count = referrals_count + 1 WHERE user_id = ?", (referrer_id,))
+        invalidate_user(user_id, referrer_id)
         try:
             if _tasks:
                 _tasks.record_referral(referrer_id)
@@ -240,7 +224,7 @@ async def set_referrer(user_id: int, referrer_id: int, db_pool=None, _tasks=None
 
 # --- Inventory functions ---
 def create_inventory_table():
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cur = conn.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS inventory (
@@ -255,36 +239,45 @@ def create_inventory_table():
 
 def remove_item(user_id: int, item_id: str, count: int = 1):
     """Удаляет предметы из инвентаря, правильно обрабатывая дублированные записи"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+    with _user_locks.hold(user_id):
+        conn = _connect(row_factory=None)
+        cur = conn.cursor()
     
-    # Получаем общее количество предметов (с учетом дубликатов)
-    cur.execute("SELECT SUM(count) as total_count FROM inventory WHERE user_id=? AND item_id=? AND count > 0", (user_id, item_id))
-    row = cur.fetchone()
-    total_count = row[0] if row and row[0] else 0
+        # Получаем общее количество предметов (с учетом дубликатов)
+        cur.execute("SELECT SUM(count) as total_count FROM inventory WHERE user_id=? AND item_id=? AND count > 0", (user_id, item_id))
+        row = cur.fetchone()
+        total_count = row[0] if row and row[0] else 0
     
-    if total_count <= 0:
-        # Нет предметов для удаления
-        conn.close()
-        return
+        if total_count <= 0:
+            # Нет предметов для удаления
+            conn.close()
+            return
     
-    if total_count > count:
-        # Оставляем часть предметов
-        remaining = total_count - count
-        # Удаляем все записи для этого предмета
-        cur.execute("DELETE FROM inventory WHERE user_id=? AND item_id=?", (user_id, item_id))
-        # Добавляем одну запись с правильным количеством
-        cur.execute("INSERT INTO inventory (user_id, item_id, count) VALUES (?, ?, ?)", (user_id, item_id, remaining))
-    else:
-        # Удаляем все записи этого предмета
-        cur.execute("DELETE FROM inventory WHERE user_id=? AND item_id=?", (user_id, item_id))
+        if total_count > count:
+            # Оставляем часть предметов
+            remaining = total_count - count
+            # Удаляем все записи для этого предмета
+            cur.execute("DELETE FROM inventory WHERE user_id=? AND item_id=?", (user_id, item_id))
+            # Добавляем одну запись с правильным количеством
+            cur.execute("INSERT INTO inventory (user_id, item_id, count) VALUES (?, ?, ?)", (user_id, item_id, remaining))
+        else:
+            # Удаляем все записи этого предмета
+            cur.execute("DELETE FROM inventory WHERE user_id=? AND item_id=?", (user_id, item_id))
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+        conn.close()
+    invalidate_inventory_images(user_id)
+
+def invalidate_inventory_images(*user_ids):
+    """Инвентарь изменился: его картинки в render_cache больше не понадобятся.
+
+    Картинки адресуются содержимым, так что старую не отдадут и без этого вызова;
+    он лишь освобождает место в кеше раньше, чем дойдёт очередь LRU."""
+    render_cache.invalidate(*(f"inventory:{user_id}" for user_id in user_ids))
 
 def get_inventory(user_id: int):
     """Получает инвентарь пользователя. Возвращает список кортежей (item_id, count), агрегируя одинаковые предметы"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cur = conn.cursor()
     # Группируем по item_id и суммируем количество для устранения возможных дубликатов
     cur.execute("""
@@ -301,32 +294,34 @@ def get_inventory(user_id: int):
 
 def add_item(user_id: int, item_id: str, count: int = 1):
     """Добавляет предмет в инвентарь пользователя, очищая дублированные записи"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+    with _user_locks.hold(user_id):
+        conn = _connect(row_factory=None)
+        cur = conn.cursor()
     
-    # Получаем текущее общее количество (с учетом дубликатов)
-    cur.execute("SELECT SUM(count) as total_count FROM inventory WHERE user_id=? AND item_id=? AND count > 0", (user_id, item_id))
-    row = cur.fetchone()
-    current_total = row[0] if row and row[0] else 0
+        # Получаем текущее общее количество (с учетом дубликатов)
+        cur.execute("SELECT SUM(count) as total_count FROM inventory WHERE user_id=? AND item_id=? AND count > 0", (user_id, item_id))
+        row = cur.fetchone()
+        current_total = row[0] if row and row[0] else 0
     
-    # Новое общее количество
-    new_total = current_total + count
+        # Новое общее количество
+        new_total = current_total + count
     
-    # Удаляем все записи этого предмета (включая дубликаты)
-    cur.execute("DELETE FROM inventory WHERE user_id=? AND item_id=?", (user_id, item_id))
+        # Удаляем все записи этого предмета (включая дубликаты)
+        cur.execute("DELETE FROM inventory WHERE user_id=? AND item_id=?", (user_id, item_id))
     
-    # Добавляем одну запись с правильным количеством
-    if new_total > 0:
-        cur.execute("INSERT INTO inventory (user_id, item_id, count) VALUES (?, ?, ?)", (user_id, item_id, new_total))
+        # Добавляем одну запись с правильным количеством
+        if new_total > 0:
+            cur.execute("INSERT INTO inventory (user_id, item_id, count) VALUES (?, ?, ?)", (user_id, item_id, new_total))
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+        conn.close()
+    invalidate_inventory_images(user_id)
 
 def clean_inventory_duplicates():
     """Очищает дублированные записи в инвентаре для всех пользователей"""
     print("🧹 Начинаем очистку дублированных записей в инвентаре...")
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cur = conn.cursor()
     
     # Находим все дублированные записи
@@ -367,18 +362,20 @@ def clean_inventory_duplicates():
 
 def set_inventory_item(user_id: int, item_id: str, count: int):
     """Устанавливает точное количество предмета в инвентаре пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    if count > 0:
-        cur.execute("INSERT OR REPLACE INTO inventory (user_id, item_id, count) VALUES (?, ?, ?)", (user_id, item_id, count))
-    else:
-        cur.execute("DELETE FROM inventory WHERE user_id = ? AND item_id = ?", (user_id, item_id))
-    conn.commit()
-    conn.close()
+    with _user_locks.hold(user_id):
+        conn = _connect(row_factory=None)
+        cur = conn.cursor()
+        if count > 0:
+            cur.execute("INSERT OR REPLACE INTO inventory (user_id, item_id, count) VALUES (?, ?, ?)", (user_id, item_id, count))
+        else:
+            cur.execute("DELETE FROM inventory WHERE user_id = ? AND item_id = ?", (user_id, item_id))
+        conn.commit()
+        conn.close()
+    invalidate_inventory_images(user_id)
 
 def create_bets_table():
     """Создает таблицу для ставок"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cur = conn.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS bets (
@@ -395,7 +392,7 @@ def create_bets_table():
 
 def create_bans_table():
     """Создает таблицу для банов"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cur = conn.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS bans (
@@ -411,7 +408,7 @@ def create_bans_table():
 
 def create_user_effects_table():
     """Создает таблицу для активных эффектов пользователей"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cur = conn.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS user_effects (
@@ -429,15 +426,138 @@ def create_user_effects_table():
 
 
 # Always store DB in the 'database' folder in the project directory
-DB_FOLDER = os.path.join(os.path.dirname(__file__), "database")
+# (BOT_DB_FOLDER - другой каталог, например временный для тестов)
+DB_FOLDER = os.environ.get("BOT_DB_FOLDER") or os.path.join(os.path.dirname(__file__), "database")
 os.makedirs(DB_FOLDER, exist_ok=True)
 DB_PATH = os.path.join(DB_FOLDER, "game_bot.db")
+# Количество долгоживущих соединений к game_bot.db (общий файл для всех подсистем)
+DB_POOL_SIZE = 16
+
+# Старые отдельные файлы БД. Все данные теперь в DB_PATH (одна БД в режиме WAL),
+# эти файлы один раз вливаются в неё миграциями в конце модуля и дальше не используются
+LEGACY_DB_FILES = {
+    "messages": os.path.join(DB_FOLDER, "messages.db"),
+    "referral": os.path.join(DB_FOLDER, "referral_bot.db"),
+    "bank": os.path.join(DB_FOLDER, "bank.db"),
+    "arena": os.path.join(DB_FOLDER, "arena.db"),
+    "tasks": os.path.join(DB_FOLDER, "tasks.db"),
+    "root_messages": os.path.join(os.path.dirname(__file__), "MESSAGES_DB_FILE"),
+}
+
+class KeyedLock:
+    """Блокировки по ключу (обычно user_id) вместо одной глобальной.
+
+    Записи одного пользователя сериализуются, записи разных пользователей идут
+    параллельно. Чтение выполняется без блокировок: в режиме WAL каждый запрос
+    видит согласованный снимок БД. Операции над несколькими пользователями берут
+    ключи в едином порядке, поэтому взаимоблокировок не возникает.
+    Блокировки реентерабельны: функция, держащая ключ, может вызвать другую
+    функцию с тем же ключом. Неиспользуемые ключи удаляются из словаря.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}  # key -> [RLock, число держателей/ожидающих]
+
+    def _acquire(self, key):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = [threading.RLock(), 0]
+                self._locks[key] = entry
+            entry[1] += 1
+        entry[0].acquire()
+
+    def _release(self, key):
+        with self._guard:
+            entry = self._locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    @contextmanager
+    def hold(self, *keys):
+        """Захватить один или несколько ключей (в едином порядке, без дублей)."""
+        ordered = sorted({k for k in keys if k is not None}, key=repr)
+        taken = []
+        try:
+            for key in ordered:
+                self._acquire(key)
+                taken.append(key)
+            yield
+        finally:
+            for key in reversed(taken):
+                self._release(key)
+
+
+# Сериализация записей по пользователям (и по лотам аукциона / ставкам)
+_user_locks = KeyedLock()
+# DDL и миграции схемы выполняются под отдельной блокировкой
+_schema_lock = threading.RLock()
+
+# Кэш строк users для get_user (см. ttl_cache.py). Любая запись в users после
+# COMMIT вызывает invalidate_user, TTL — страховка от записей в обход этого модуля
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 60
+_user_cache = ttl_cache.TTLCache("users", maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+def invalidate_user(*user_ids):
+    """Сбросить закэшированные строки users (вызывать после COMMIT изменений users)."""
+    _user_cache.invalidate(*user_ids)
+
+def get_user_cache_stats():
+    return _user_cache.stats()
+
+# Кэш имён для отображения: user_id -> (custom_name, first_name, last_name, username).
+# Сбрасывается только при смене имён (ensure_user, add_user, кастомное имя в main.py)
+NAME_CACHE_SIZE = 16384
+NAME_CACHE_TTL = 600
+_name_cache = ttl_cache.TTLCache("names", maxsize=NAME_CACHE_SIZE, ttl=NAME_CACHE_TTL)
+# Ограничение SQLite на число параметров в запросе
+_NAME_QUERY_CHUNK = 500
+
+def invalidate_name(*user_ids):
+    """Сбросить закэшированные имена (после смены username/имени/кастомного имени)."""
+    _name_cache.invalidate(*user_ids)
+
+def get_name_cache_stats():
+    return _name_cache.stats()
+
+def _load_name_rows(user_ids):
+    result = {}
+    conn = _connect(row_factory=None)
+    try:
+        for start in range(0, len(user_ids), _NAME_QUERY_CHUNK):
+            chunk = user_ids[start:start + _NAME_QUERY_CHUNK]
+            values = ",".join("(?)" for _ in chunk)
+            rows = conn.execute(f"""
+                WITH ids(user_id) AS (VALUES {values})
+                SELECT ids.user_id, c.custom_name, u.first_name, u.last_name, u.username
+                FROM ids
+                LEFT JOIN users u ON u.user_id = ids.user_id
+                LEFT JOIN custom_names c ON c.user_id = ids.user_id
+            """, chunk).fetchall()
+            for user_id, *names in rows:
+                result[user_id] = tuple(names)
+    finally:
+        conn.close()
+    return result
+
+def get_name_rows(user_ids):
+    """Имена многих пользователей одним запросом (с кэшем).
+
+    Возвращает {user_id: (custom_name, first_name, last_name, username)};
+    у неизвестных пользователей все поля None.
+    """
+    return _name_cache.get_many_or_load(list(user_ids), _load_name_rows)
 
-_lock = threading.Lock()
+def _auction_key(auction_id: int):
+    return ("auction", auction_id)
 
 # Установить баланс ДАНЬ с округлением
 def set_dan(user_id: int, value):
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         # Округляем до двух знаков
@@ -445,30 +565,18 @@ def set_dan(user_id: int, value):
         cur.execute("UPDATE users SET dan = ? WHERE user_id = ?", (value, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
 
 
-def _connect():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=0.999)
-    conn.row_factory = sqlite3.Row
-    try:
-        # Стандартный режим DELETE (без WAL файлов)
-        conn.execute("PRAGMA journal_mode=DELETE;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        conn.execute("PRAGMA temp_store=MEMORY;")
-        # Небольшой page cache; отрицательное значение — в КБ
-        conn.execute("PRAGMA cache_size=-20000;")  # ~20MB
-        # Уменьшаем время блокировки
-        conn.execute("PRAGMA busy_timeout=999;")
-    except Exception:
-        # Если PRAGMA не применились — продолжаем без падения
-        pass
-    return conn
+def _connect(row_factory=sqlite3.Row):
+    """Соединение с game_bot.db из общего пула (PRAGMA уже применены при открытии).
+    conn.close() возвращает соединение в пул."""
+    return sqlite_pool.get_pool(DB_PATH, size=DB_POOL_SIZE).connect(row_factory)
 
 def create_lottery_tables():
-    """Создает таблицы для лотереи в общем файле game_bot.db и переносит данные из старого messages.db (если есть)."""
-    import os
+    """Создает таблицы для лотереи в общем файле game_bot.db (старый messages.db вливается миграцией 1)."""
     # Создаем таблицы лотереи в основном DB_PATH
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cursor = conn.cursor()
 
     # Таблица билетов
@@ -532,32 +640,12 @@ def create_lottery_tables():
     conn.commit()
     conn.close()
 
-    # Перенос данных из старого messages.db, если он существует
-    try:
-        old_path = os.path.join(os.path.dirname(__file__), "database", "messages.db")
-        if os.path.exists(old_path) and os.path.abspath(old_path) != os.path.abspath(DB_PATH):
-            _migrate_messages_db_into_main(old_path)
-    except Exception as e:
-        try:
-            print(f"⚠️ Ошибка миграции из messages.db: {e}")
-        except Exception:
-            pass
-
 def create_referral_tables():
-    """Создает дополнительные таблицы для реферальной системы в общем файле game_bot.db и переносит данные из старого referral_bot.db (если есть)."""
-    import os
+    """Создает дополнительные таблицы для реферальной системы в общем файле game_bot.db (старый referral_bot.db вливается миграцией 2)."""
     # Работает в основном DB_PATH
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cursor = conn.cursor()
 
-    # Гарантируем наличие необходимых колонок в основной таблице users
-    cursor.execute("PRAGMA table_info(users)")
-    user_cols = {row[1] for row in cursor.fetchall()}
-    if "referrer_id" not in user_cols:
-        cursor.execute("ALTER TABLE users ADD COLUMN referrer_id INTEGER DEFAULT NULL")
-    if "referrals_count" not in user_cols:
-        cursor.execute("ALTER TABLE users ADD COLUMN referrals_count INTEGER DEFAULT 0")
-
     # Таблица для кастомных имен пользователей
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS custom_names (
@@ -579,155 +667,60 @@ def create_referral_tables():
     conn.commit()
     conn.close()
 
-    # Перенос данных из старого referral_bot.db, если он существует
-    try:
-        ref_db_folder = os.path.join(os.path.dirname(__file__), "database")
-        old_ref_path = os.path.join(ref_db_folder, 'referral_bot.db')
-        if os.path.exists(old_ref_path) and os.path.abspath(old_ref_path) != os.path.abspath(DB_PATH):
-            _migrate_referral_db_into_main(old_ref_path)
-    except Exception as e:
-        try:
-            print(f"⚠️ Ошибка миграции из referral_bot.db: {e}")
-        except Exception:
-            pass
-
-def _migrate_messages_db_into_main(old_messages_path: str):
-    """Переносит таблицы из messages.db в основной game_bot.db (если в целевых таблицах ещё нет данных)."""
-    src = sqlite3.connect(old_messages_path)
-    dst = sqlite3.connect(DB_PATH)
-    try:
-        s_cur = src.cursor()
-        d_cur = dst.cursor()
-
-        # Список таблиц для переноса: (name, create_sql)
-        tables = {
-            'lottery_tickets': None,
-            'lottery_draws': None,
-            'lottery_meta': None,
-            'daily_claims': None,
-            'daily_claim_logs': None,
-            'daily_config': None,
-        }
-
-        # Переносим построчно, избегая конфликтов по PRIMARY KEY
-        for table in tables.keys():
-            # Если в целевой таблице уже есть данные — пропускаем перенос этой таблицы
-            d_cur.execute(f"SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (table,))
-            if not d_cur.fetchone()[0]:
-                # Таблицы должны существовать после create_lottery_tables()
-                continue
-            d_cur.execute(f"SELECT COUNT(*) FROM {table}")
-            if d_cur.fetchone()[0] > 0:
-                continue
-
-            # Проверим, есть ли таблица в источнике
-            s_cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (table,))
-            if not s_cur.fetchone()[0]:
-                continue
-
-            # Получаем список колонок для согласованной вставки
-            s_cur.execute(f"PRAGMA table_info({table})")
-            cols = [r[1] for r in s_cur.fetchall()]
-            col_list = ",".join(cols)
-            placeholders = ",".join(["?"] * len(cols))
-
-            s_cur.execute(f"SELECT {col_list} FROM {table}")
-            rows = s_cur.fetchall()
-            if not rows:
-                continue
-            d_cur.executemany(
-                f"INSERT OR IGNORE INTO {table} ({col_list}) VALUES ({placeholders})",
-                rows
-            )
-            dst.commit()
-
-        try:
-            print("✅ Миграция данных из messages.db завершена")
-        except Exception:
-            pass
-    finally:
-        try:
-            src.close()
-        finally:
-            dst.close()
-
-def _migrate_referral_db_into_main(old_ref_path: str):
-    """Переносит данные из referral_bot.db в основной game_bot.db.
+def _migrate_messages_db_into_main(cur, alias: str, attached):
+    """Переносит таблицы из messages.db (подключён как alias) в основной game_bot.db (если в целевых таблицах ещё нет данных)."""
+    migrations.merge_attached(
+        cur, alias, attached,
+        tables=['lottery_tickets', 'lottery_draws', 'lottery_meta',
+                'daily_claims', 'daily_claim_logs', 'daily_config'],
+        only_if_empty=True,
+    )
+
+def _migrate_referral_db_into_main(cur, alias: str, attached):
+    """Переносит данные из referral_bot.db (подключён как alias) в основной game_bot.db.
     Пользователей обновляем только по referrer_id/referrals_count/username/reg_date (без вмешательства в баланс).
     Таблицы custom_names и profile_privacy копируем полностью (если пусто).
     """
-    src = sqlite3.connect(old_ref_path)
-    dst = sqlite3.connect(DB_PATH)
-    try:
-        s_cur = src.cursor()
-        d_cur = dst.cursor()
-
-        # Обновляем users: переносим только поля реферальной системы
+    if alias not in attached:
+        return
+    cur.execute("SELECT COUNT(*) FROM main.sqlite_master WHERE type='table' AND name='users'")
+    main_has_users = cur.fetchone()[0]
+    cur.execute(f"SELECT COUNT(*) FROM {alias}.sqlite_master WHERE type='table' AND name='users'")
+    if main_has_users and cur.fetchone()[0]:
         # Убедимся, что нужные колонки есть
-        d_cur.execute("PRAGMA table_info(users)")
-        d_cols = {r[1] for r in d_cur.fetchall()}
+        cur.execute("PRAGMA main.table_info(users)")
+        d_cols = {r[1] for r in cur.fetchall()}
         if "referrer_id" not in d_cols:
-            d_cur.execute("ALTER TABLE users ADD COLUMN referrer_id INTEGER DEFAULT NULL")
+            cur.execute("ALTER TABLE main.users ADD COLUMN referrer_id INTEGER DEFAULT NULL")
         if "referrals_count" not in d_cols:
-            d_cur.execute("ALTER TABLE users ADD COLUMN referrals_count INTEGER DEFAULT 0")
-
-        # Если таблица users есть в источнике — переносим
-        s_cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='users'")
-        if s_cur.fetchone()[0]:
-            s_cur.execute("SELECT user_id, username, referrer_id, referrals_count, reg_date FROM users")
-            for user_id, username, referrer_id, referrals_count, reg_date in s_cur.fetchall():
-                # Обновляем существующие записи
-                d_cur.execute("SELECT user_id, referrer_id, referrals_count FROM users WHERE user_id = ?", (user_id,))
-                row = d_cur.fetchone()
-                if row:
-                    # Если в основной БД поля пустые — обновляем
-                    if row[1] is None and referrer_id is not None:
-                        d_cur.execute("UPDATE users SET referrer_id = ? WHERE user_id = ?", (referrer_id, user_id))
-                    if (row[2] is None or row[2] == 0) and (referrals_count is not None):
-                        d_cur.execute("UPDATE users SET referrals_count = ? WHERE user_id = ?", (referrals_count, user_id))
-                    # Обновим username при необходимости
-                    if username:
-                        d_cur.execute("UPDATE users SET username = ? WHERE user_id = ?", (username, user_id))
-                else:
-                    # Пользователя нет в основной БД — можно пропустить, т.к. будет создан при первом обращении.
-                    # Если очень нужно — раскомментировать вставку с безопасными дефолтами.
-                    pass
-
-        # Перенос custom_names, profile_privacy если в целевых таблицах пусто
-        for table in ("custom_names", "profile_privacy"):
-            d_cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (table,))
-            if not d_cur.fetchone()[0]:
-                continue
-            d_cur.execute(f"SELECT COUNT(*) FROM {table}")
-            if d_cur.fetchone()[0] > 0:
-                continue
-            s_cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (table,))
-            if not s_cur.fetchone()[0]:
-                continue
-            s_cur.execute(f"PRAGMA table_info({table})")
-            cols = [r[1] for r in s_cur.fetchall()]
-            col_list = ",".join(cols)
-            placeholders = ",".join(["?"] * len(cols))
-            s_cur.execute(f"SELECT {col_list} FROM {table}")
-            rows = s_cur.fetchall()
-            if rows:
-                d_cur.executemany(
-                    f"INSERT OR IGNORE INTO {table} ({col_list}) VALUES ({placeholders})",
-                    rows
-                )
-        dst.commit()
-        try:
-            print("✅ Миграция данных из referral_bot.db завершена")
-        except Exception:
-            pass
-    finally:
-        try:
-            src.close()
-        finally:
-            dst.close()
+            cur.execute("ALTER TABLE main.users ADD COLUMN referrals_count INTEGER DEFAULT 0")
+        # Если в основной БД поля пустые — обновляем; username берём из реферальной БД.
+        # Пользователей, которых нет в основной БД, пропускаем: они будут созданы при первом обращении.
+        cur.execute(f"""
+            UPDATE main.users SET referrer_id = (SELECT r.referrer_id FROM {alias}.users r WHERE r.user_id = main.users.user_id)
+            WHERE referrer_id IS NULL
+              AND EXISTS (SELECT 1 FROM {alias}.users r WHERE r.user_id = main.users.user_id AND r.referrer_id IS NOT NULL)
+        """)
+        cur.execute(f"""
+            UPDATE main.users SET referrals_count = (SELECT r.referrals_count FROM {alias}.users r WHERE r.user_id = main.users.user_id)
+            WHERE (referrals_count IS NULL OR referrals_count = 0)
+              AND EXISTS (SELECT 1 FROM {alias}.users r WHERE r.user_id = main.users.user_id AND r.referrals_count IS NOT NULL)
+        """)
+        cur.execute(f"""
+            UPDATE main.users SET username = (SELECT r.username FROM {alias}.users r WHERE r.user_id = main.users.user_id)
+            WHERE EXISTS (SELECT 1 FROM {alias}.users r WHERE r.user_id = main.users.user_id AND r.username IS NOT NULL AND r.username != '')
+        """)
+    # Перенос custom_names, profile_privacy если в целевых таблицах пусто
+    migrations.merge_attached(cur, alias, attached, tables=["custom_names", "profile_privacy"], only_if_empty=True)
 
 def init_db():
-    with _lock:
+    """Подготовить БД. Схема создаётся и дополняется миграциями один раз при импорте
+    модуля (run_store_migrations), повторный вызов лишь убеждается, что все шаги применены."""
+    run_store_migrations()
+
+def _create_schema():
+    """Создать все таблицы основной БД (CREATE ... IF NOT EXISTS). Вызывается миграцией 7."""
+    with _schema_lock:
         conn = _connect()
         cur = conn.cursor()
         cur.execute("""
@@ -749,32 +742,22 @@ def init_db():
             dan_win INTEGER DEFAULT 0,     -- Выиграно дань
             dan_lose INTEGER DEFAULT 0,    -- Проиграно дань
             win_count INTEGER DEFAULT 0,   -- Кол-во выигрышей
-            lose_count INTEGER DEFAULT 0   -- Кол-во проигрышей
+            lose_count INTEGER DEFAULT 0,  -- Кол-во проигрышей
+            reg_date TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            xp INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            pending_level_rewards INTEGER DEFAULT 0,
+            -- Реферальная система
+            referrer_id INTEGER DEFAULT NULL,
+            referrals_count INTEGER DEFAULT 0,
+            bonus_requests INTEGER DEFAULT 0,
+            used_bonus_requests INTEGER DEFAULT 0,
+            used_referral_code TEXT DEFAULT NULL,
+            adult_unlocks INTEGER DEFAULT 0
         )
         """)
-        # Автоматически добавляем win_count, lose_count, dan_win, dan_lose, reg_date, first_name для старых пользователей
-        cur.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cur.fetchall()]
-        if "win_count" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN win_count INTEGER DEFAULT 0")
-        if "lose_count" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN lose_count INTEGER DEFAULT 0")
-        if "dan_win" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN dan_win INTEGER DEFAULT 0")
-        if "dan_lose" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN dan_lose INTEGER DEFAULT 0")
-        if "reg_date" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN reg_date TEXT")
-        if "first_name" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN first_name TEXT")
-        if "last_name" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN last_name TEXT")
-        if "xp" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN xp INTEGER DEFAULT 0")
-        if "level" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN level INTEGER DEFAULT 1")
-        if "pending_level_rewards" not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN pending_level_rewards INTEGER DEFAULT 0")
         conn.commit()
         conn.close()
         
@@ -813,28 +796,48 @@ def init_db():
         create_referral_tables()
         print("✅ Таблицы referral системы созданы")
         
+        # Счетчик игр за день и сообщения (раньше создавались на каждый вызов в main.py)
+        conn = _connect(row_factory=None)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_games_count (
+                date TEXT PRIMARY KEY,
+                count INTEGER DEFAULT 0
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT,
+                ref_count INTEGER DEFAULT 0
+            )
+        """)
+        conn.commit()
+        conn.close()
+        
         print("🎉 Все таблицы базы данных успешно созданы!")
 
 # Увеличить счетчик выигранной дань и количество выигрышей
 def increment_dan_win(user_id: int, amount: int):
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("UPDATE users SET dan_win = dan_win + ?, win_count = win_count + 1 WHERE user_id = ?", (amount, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
 
 # Увеличить счетчик проигранной дань и количество проигрышей
 def increment_dan_lose(user_id: int, amount: int):
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("UPDATE users SET dan_lose = dan_lose + ?, lose_count = lose_count + 1 WHERE user_id = ?", (amount, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
 def save_bet(bet_id: str, chat_id: int, msg_id: int, text: str, created_by: int):
     import time
-    with _lock:
+    with _user_locks.hold(("bet", bet_id)):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("REPLACE INTO bets (bet_id, chat_id, msg_id, text, created_by, created_at) VALUES (?, ?, ?, ?, ?, ?)",
@@ -843,25 +846,23 @@ def save_bet(bet_id: str, chat_id: int, msg_id: int, text: str, created_by: int)
         conn.close()
 
 def get_bet(bet_id: str):
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM bets WHERE bet_id = ?", (bet_id,))
-        row = cur.fetchone()
-        conn.close()
-        return row
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM bets WHERE bet_id = ?", (bet_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row
 
 def get_all_bets():
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM bets ORDER BY created_at DESC")
-        rows = cur.fetchall()
-        conn.close()
-        return rows
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM bets ORDER BY created_at DESC")
+    rows = cur.fetchall()
+    conn.close()
+    return rows
 
 def delete_bet(bet_id: str):
-    with _lock:
+    with _user_locks.hold(("bet", bet_id)):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("DELETE FROM bets WHERE bet_id = ?", (bet_id,))
@@ -869,10 +870,10 @@ def delete_bet(bet_id: str):
         conn.close()
 
 def ensure_user(user_id: int, username: str = None, ref_by: int = None, first_name: str = None, last_name: str = None):
-    with _lock:
+    with _user_locks.hold(user_id, ref_by):
         conn = _connect()
         cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        cur.execute("SELECT username, first_name, last_name FROM users WHERE user_id = ?", (user_id,))
         row = cur.fetchone()
         if not row:
                 import datetime
@@ -889,56 +890,50 @@ def ensure_user(user_id: int, username: str = None, ref_by: int = None, first_na
                     cur.execute("UPDATE users SET ref_count = ref_count + 1, dan = dan + ? WHERE user_id = ?",
                                 (175, ref_by))
                     conn.commit()
+                invalidate_user(user_id, ref_by)
+                invalidate_name(user_id)
         else:
             # Обновляем информацию пользователя если она изменилась
             updates = []
             params = []
             
-            # Безопасная проверка с обработкой отсутствующих колонок
-            try:
-                if username and row["username"] != username:
-                    updates.append("username = ?")
-                    params.append(username)
-            except (KeyError, IndexError):
-                if username:
-                    updates.append("username = ?")
-                    params.append(username)
-            
-            try:
-                if first_name and row["first_name"] != first_name:
-                    updates.append("first_name = ?") 
-                    params.append(first_name)
-            except (KeyError, IndexError):
-                if first_name:
-                    updates.append("first_name = ?")
-                    params.append(first_name)
-            
-            try:
-                if last_name and row["last_name"] != last_name:
-                    updates.append("last_name = ?")
-                    params.append(last_name)
-            except (KeyError, IndexError):
-                if last_name:
-                    updates.append("last_name = ?")
-                    params.append(last_name)
+            # Колонки username/first_name/last_name гарантированы миграциями
+            if username and row["username"] != username:
+                updates.append("username = ?")
+                params.append(username)
+            if first_name and row["first_name"] != first_name:
+                updates.append("first_name = ?")
+                params.append(first_name)
+            if last_name and row["last_name"] != last_name:
+                updates.append("last_name = ?")
+                params.append(last_name)
             
             if updates:
                 params.append(user_id)
                 cur.execute(f"UPDATE users SET {', '.join(updates)} WHERE user_id = ?", params)
                 conn.commit()
+                invalidate_user(user_id)
+                invalidate_name(user_id)
         conn.close()
 
+def _load_user(user_id: int):
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
 def get_user(user_id: int):
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            # Преобразуем row в dict для удобства
-            return dict(row)
-        return None
+    # Строка и игры, которые ещё лежат в буфере отложенной записи, - согласованно:
+    # пачка, записанная между ними, не посчитается дважды
+    row, pending_games = _games_played_counter.read(user_id, lambda: _user_cache.get_or_load(user_id, _load_user))
+    if row:
+        # Копия: вызывающий код может менять dict, кэш от этого страдать не должен
+        user = dict(row)
+        user["games_played"] = (user.get("games_played") or 0) + pending_games
+        return user
+    return None
 
 def get_balance(user_id: int):
     row = get_user(user_id)
@@ -947,27 +942,28 @@ def get_balance(user_id: int):
     return None
 
 def add_dan(user_id: int, amount: int):
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("UPDATE users SET dan = dan + ? WHERE user_id = ?", (amount, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
 
 def add_kruz(user_id: int, amount: int):
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
-        cur = _connect()
         cur = conn.cursor()
         cur.execute("UPDATE users SET kruz = kruz + ? WHERE user_id = ?", (amount, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
 
 def add_xp(user_id: int, amount: int):
     """Добавляет опыт пользователю с автоматическим повышением уровня"""
     XP_PER_LEVEL = 5000
     
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         
@@ -1005,6 +1001,7 @@ def add_xp(user_id: int, amount: int):
         
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
         
         return {
             'xp': new_xp,
@@ -1016,25 +1013,24 @@ def add_xp(user_id: int, amount: int):
 
 def get_user_xp_data(user_id: int):
     """Получает данные об опыте и уровне пользователя"""
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("SELECT xp, level, pending_level_rewards FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT xp, level, pending_level_rewards FROM users WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    conn.close()
         
-        if not row:
-            return {'xp': 0, 'level': 1, 'pending_level_rewards': 0}
+    if not row:
+        return {'xp': 0, 'level': 1, 'pending_level_rewards': 0}
         
-        return {
-            'xp': row[0] if row[0] else 0,
-            'level': row[1] if row[1] else 1,
-            'pending_level_rewards': row[2] if row[2] else 0
-        }
+    return {
+        'xp': row[0] if row[0] else 0,
+        'level': row[1] if row[1] else 1,
+        'pending_level_rewards': row[2] if row[2] else 0
+    }
 
 def claim_level_reward(user_id: int):
     """Уменьшает счетчик наград на 1"""
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         
@@ -1051,23 +1047,46 @@ def claim_level_reward(user_id: int):
         cur.execute("UPDATE users SET pending_level_rewards = ? WHERE user_id = ?", (new_pending, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
         return True
 
 def set_first_bet(user_id: int, amount: int):
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("UPDATE users SET first_bet = ? WHERE user_id = ? AND first_bet = 0", (amount, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
+
+def _apply_games_played(cur, items):
+    cur.executemany("UPDATE users SET games_played = games_played + ? WHERE user_id = ?",
+                    [(delta, user_id) for user_id, delta in items.items()])
+
+def _apply_daily_games(cur, items):
+    cur.executemany("""
+        INSERT INTO daily_games_count (date, count) VALUES (?, ?)
+        ON CONFLICT(date) DO UPDATE SET count = count + excluded.count
+    """, list(items.items()))
+
+# Счётчики сыгранных игр пишутся пачками (см. write_behind.py): раньше каждый раунд
+# делал по отдельному коммиту на каждого игрока и на счётчик игр за день
+_games_played_counter = write_behind.CounterBuffer(
+    "games_played", lambda: _connect(row_factory=None), _apply_games_played,
+    on_applied=lambda items: invalidate_user(*items))
+_daily_games_counter = write_behind.CounterBuffer(
+    "daily_games", lambda: _connect(row_factory=None), _apply_daily_games)
 
 def increment_games(user_id: int):
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("UPDATE users SET games_played = games_played + 1 WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
+    _games_played_counter.add(user_id)
+
+def increment_daily_games(date: str):
+    """+1 к счётчику игр за день date (YYYY-MM-DD)"""
+    _daily_games_counter.add(date)
+
+def get_pending_daily_games(date: str) -> int:
+    """Игры за день date, ещё не записанные в daily_games_count"""
+    return _daily_games_counter.pending(date)
 
 def can_get_free(user_id: int, cooldown_seconds: int = 7 * 24 * 3600):
     row = get_user(user_id)
@@ -1078,16 +1097,17 @@ def can_get_free(user_id: int, cooldown_seconds: int = 7 * 24 * 3600):
     return (now - last) >= cooldown_seconds
 
 def grant_free(user_id: int, amount: int = 50):
-    with _lock:
+    with _user_locks.hold(user_id):
         now = int(time.time())
         conn = _connect()
         cur = conn.cursor()
         cur.execute("UPDATE users SET dan = dan + ?, last_free = ? WHERE user_id = ?", (amount, now, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
 
 def withdraw_dan(user_id: int, amount: int) -> bool:
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("SELECT dan FROM users WHERE user_id = ?", (user_id,))
@@ -1098,10 +1118,128 @@ def withdraw_dan(user_id: int, amount: int) -> bool:
         cur.execute("UPDATE users SET dan = dan - ? WHERE user_id = ?", (amount, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
         return True
 
+def transfer_dan(from_user_id: int, to_user_id: int, amount) -> bool:
+    """Перевести дань между пользователями одной транзакцией.
+
+    Оба пользователя блокируются вместе (порядок ключей единый), поэтому встречные
+    переводы A→B и B→A не дедлочатся, а проверка баланса и списание атомарны.
+    Возвращает False, если у отправителя не хватает дани.
+    """
+    with _user_locks.hold(from_user_id, to_user_id):
+        conn = _connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+        except Exception:
+            pass
+        cur.execute("SELECT dan FROM users WHERE user_id = ?", (from_user_id,))
+        row = cur.fetchone()
+        if not row or row["dan"] < amount:
+            conn.rollback()
+            conn.close()
+            return False
+        cur.execute("UPDATE users SET dan = dan - ? WHERE user_id = ?", (amount, from_user_id))
+        cur.execute("UPDATE users SET dan = dan + ? WHERE user_id = ?", (amount, to_user_id))
+        conn.commit()
+        conn.close()
+        invalidate_user(from_user_id, to_user_id)
+        return True
+
+# Счётчики users, которые меняет settle_round (остальные ключи stats_delta — ошибка)
+ROUND_STAT_COLUMNS = ("dan_win", "dan_lose", "win_count", "lose_count")
+
+def round_stats(win=None, lose=None, games: int = 1) -> dict:
+    """stats_delta для settle_round — то же, что increment_dan_win(win),
+    increment_dan_lose(lose) и increment_games() отдельными вызовами."""
+    delta = {"games_played": games} if games else {}
+    if win is not None:
+        delta["dan_win"] = win
+        delta["win_count"] = 1
+    if lose is not None:
+        delta["dan_lose"] = lose
+        delta["lose_count"] = 1
+    return delta
+
+def settle_rounds(entries, first_bet: bool = False):
+    """Рассчитать раунд для нескольких игроков одной транзакцией BEGIN IMMEDIATE.
+
+    entries — список (user_id, stake, payout, stats_delta): у каждого проверяется,
+    что хватает дани на stake, списывается stake, начисляется payout и
+    прибавляются счётчики stats_delta (ключи ROUND_STAT_COLUMNS и games_played).
+    Всё или ничего: если хоть одному не хватает дани (или его нет в БД),
+    ничего не меняется и возвращается None. Иначе — {user_id: новый баланс}.
+    first_bet=True запоминает ставку как первую (как set_first_bet).
+    games_played идёт через буфер отложенной записи, как increment_games.
+    """
+    updates = []
+    games = {}
+    for user_id, stake, payout, stats_delta in entries:
+        delta = dict(stats_delta or {})
+        if delta.get("games_played"):
+            games[user_id] = games.get(user_id, 0) + delta["games_played"]
+        delta.pop("games_played", None)
+        unknown = set(delta) - set(ROUND_STAT_COLUMNS)
+        if unknown:
+            raise ValueError(f"settle_rounds: неизвестные счётчики {sorted(unknown)}")
+        sets = ["dan = dan - ? + ?"]
+        params = [stake or 0, payout or 0]
+        for column in ROUND_STAT_COLUMNS:
+            if delta.get(column):
+                sets.append(f"{column} = {column} + ?")
+                params.append(delta[column])
+        if first_bet and stake:
+            sets.append("first_bet = CASE WHEN first_bet = 0 THEN ? ELSE first_bet END")
+            params.append(stake)
+        updates.append((user_id, stake or 0, payout or 0, ", ".join(sets), params))
+
+    user_ids = [u[0] for u in updates]
+    with _user_locks.hold(*user_ids):
+        conn = _connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            balances = {}
+            for user_id, stake, payout, sets, params in updates:
+                if user_id not in balances:
+                    cur.execute("SELECT dan FROM users WHERE user_id = ?", (user_id,))
+                    row = cur.fetchone()
+                    if not row:
+                        conn.rollback()
+                        return None
+                    balances[user_id] = row["dan"]
+                # Выплата без ставки проходит и при отрицательном балансе
+                if stake > 0 and balances[user_id] < stake:
+                    conn.rollback()
+                    return None
+                cur.execute(f"UPDATE users SET {sets} WHERE user_id = ?", params + [user_id])
+                balances[user_id] = balances[user_id] - stake + payout
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        invalidate_user(*user_ids)
+    for user_id, count in games.items():
+        _games_played_counter.add(user_id, count)
+    return balances
+
+def settle_round(user_id: int, stake, payout=0, stats_delta=None, first_bet: bool = False):
+    """Раунд одного игрока одной транзакцией: проверка баланса, списание stake,
+    начисление payout, счётчики stats_delta (см. round_stats).
+
+    Заменяет цепочку get_user → withdraw_dan → set_first_bet → increment_dan_* →
+    add_dan → increment_games → get_user. Возвращает новый баланс или None,
+    если дани не хватает (тогда ничего не списано).
+    """
+    balances = settle_rounds([(user_id, stake, payout, stats_delta)], first_bet=first_bet)
+    return None if balances is None else balances[user_id]
+
 def withdraw_kruz(user_id: int, amount: int) -> bool:
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("SELECT kruz FROM users WHERE user_id = ?", (user_id,))
@@ -1112,48 +1250,48 @@ def withdraw_kruz(user_id: int, amount: int) -> bool:
         cur.execute("UPDATE users SET kruz = kruz - ? WHERE user_id = ?", (amount, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
         return True
 
 # Функции для работы с наградами за уровень
 def get_all_level_rewards(user_level: int = None):
     """Получить все активные награды, доступные для указанного уровня"""
-    with _lock:
-        conn = _connect()
-        conn.row_factory = sqlite3.Row  # Позволяет обращаться к колонкам по имени
-        cur = conn.cursor()
-        
-        if user_level is not None:
-            cur.execute("""
-                SELECT * FROM level_rewards 
-                WHERE enabled = 1 
-                AND min_level <= ? 
-                AND max_level >= ?
-                ORDER BY slot, chance DESC
-            """, (user_level, user_level))
-        else:
-            cur.execute("SELECT * FROM level_rewards WHERE enabled = 1 ORDER BY slot, chance DESC")
+    conn = _connect()
+    conn.row_factory = sqlite3.Row  # Позволяет обращаться к колонкам по имени
+    cur = conn.cursor()
         
-        rows = cur.fetchall()
-        conn.close()
+    if user_level is not None:
+        cur.execute("""
+            SELECT * FROM level_rewards 
+            WHERE enabled = 1 
+            AND min_level <= ? 
+            AND max_level >= ?
+            ORDER BY slot, chance DESC
+        """, (user_level, user_level))
+    else:
+        cur.execute("SELECT * FROM level_rewards WHERE enabled = 1 ORDER BY slot, chance DESC")
         
-        rewards = []
-        for row in rows:
-            rewards.append({
-                'id': row['id'],
-                'reward_type': row['reward_type'],
-                'reward_id': row['reward_id'],
-                'reward_amount_min': row['reward_amount_min'],
-                'reward_amount_max': row['reward_amount_max'],
-                'reward_name': row['reward_name'],
-                'chance': row['chance'],
-                'slot': row['slot'],
-                'min_level': row['min_level'],
-                'max_level': row['max_level'],
-                'enabled': row['enabled'],
-                'description': row['description']
-            })
+    rows = cur.fetchall()
+    conn.close()
         
-        return rewards
+    rewards = []
+    for row in rows:
+        rewards.append({
+            'id': row['id'],
+            'reward_type': row['reward_type'],
+            'reward_id': row['reward_id'],
+            'reward_amount_min': row['reward_amount_min'],
+            'reward_amount_max': row['reward_amount_max'],
+            'reward_name': row['reward_name'],
+            'chance': row['chance'],
+            'slot': row['slot'],
+            'min_level': row['min_level'],
+            'max_level': row['max_level'],
+            'enabled': row['enabled'],
+            'description': row['description']
+        })
+        
+    return rewards
 
 def generate_random_level_rewards(user_level: int, count: int = 3):
     """Генерирует случайные награды из разных слотов на основе шансов из БД"""
@@ -1212,7 +1350,7 @@ def add_level_reward(reward_type: str, reward_id: str, reward_amount: int,
                      reward_name: str, chance: float, min_level: int = 1, 
                      max_level: int = 999, description: str = ""):
     """Добавить новую награду в базу"""
-    with _lock:
+    with _user_locks.hold("level_rewards"):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("""
@@ -1240,7 +1378,7 @@ def update_level_reward(reward_id_db: int, **kwargs):
     
     values.append(reward_id_db)
     
-    with _lock:
+    with _user_locks.hold("level_rewards"):
         conn = _connect()
         cur = conn.cursor()
         cur.execute(f"UPDATE level_rewards SET {', '.join(updates)} WHERE id = ?", values)
@@ -1249,7 +1387,7 @@ def update_level_reward(reward_id_db: int, **kwargs):
 
 def delete_level_reward(reward_id_db: int):
     """Удалить награду из базы"""
-    with _lock:
+    with _user_locks.hold("level_rewards"):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("DELETE FROM level_rewards WHERE id = ?", (reward_id_db,))
@@ -1259,7 +1397,7 @@ def delete_level_reward(reward_id_db: int):
 # Функции для работы с банами
 def add_ban(user_id: int, banned_until: int, banned_by: int, reason: str):
     """Добавить бан пользователю"""
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("INSERT OR REPLACE INTO bans (user_id, banned_until, banned_by, reason) VALUES (?, ?, ?, ?)", 
@@ -1270,26 +1408,25 @@ def add_ban(user_id: int, banned_until: int, banned_by: int, reason: str):
 def is_banned(user_id: int) -> bool:
     """Проверить забанен ли пользователь"""
     import time
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("SELECT banned_until FROM bans WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT banned_until FROM bans WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    conn.close()
         
-        if not row:
-            return False
+    if not row:
+        return False
         
-        # Если время бана истекло, удаляем запись
-        if row[0] <= int(time.time()):
-            remove_ban(user_id)
-            return False
+    # Если время бана истекло, удаляем запись
+    if row[0] <= int(time.time()):
+        remove_ban(user_id)
+        return False
         
-        return True
+    return True
 
 def remove_ban(user_id: int):
     """Удалить бан пользователя"""
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("DELETE FROM bans WHERE user_id = ?", (user_id,))
@@ -1301,7 +1438,7 @@ def add_user_effect(user_id: int, effect_type: str, effect_data: str, duration_h
     """Добавить эффект пользователю"""
     import time
     expires_at = int(time.time()) + (duration_hours * 3600)
-    with _lock:
+    with _user_locks.hold(user_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute("INSERT INTO user_effects (user_id, effect_type, effect_data, expires_at) VALUES (?, ?, ?, ?)", 
@@ -1312,39 +1449,37 @@ def add_user_effect(user_id: int, effect_type: str, effect_data: str, duration_h
 def get_user_effect(user_id: int, effect_type: str):
     """Получить активный эффект пользователя"""
     import time
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM user_effects WHERE user_id = ? AND effect_type = ? AND expires_at > ? ORDER BY expires_at DESC LIMIT 1", 
-                   (user_id, effect_type, int(time.time())))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            return {
-                "id": row[0],
-                "user_id": row[1],
-                "effect_type": row[2],
-                "effect_data": row[3],
-                "expires_at": row[4],
-                "created_at": row[5]
-            }
-        return None
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM user_effects WHERE user_id = ? AND effect_type = ? AND expires_at > ? ORDER BY expires_at DESC LIMIT 1", 
+               (user_id, effect_type, int(time.time())))
+    row = cur.fetchone()
+    conn.close()
+    if row:
+        return {
+            "id": row[0],
+            "user_id": row[1],
+            "effect_type": row[2],
+            "effect_data": row[3],
+            "expires_at": row[4],
+            "created_at": row[5]
+        }
+    return None
 
 def remove_expired_effects():
     """Удалить истекшие эффекты"""
     import time
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM user_effects WHERE expires_at <= ?", (int(time.time()),))
-        conn.commit()
-        conn.close()
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM user_effects WHERE expires_at <= ?", (int(time.time()),))
+    conn.commit()
+    conn.close()
 
 # --- AUCTION FUNCTIONS ---
 
 def create_auction_table():
     """Создать таблицу для аукционных лотов"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cur = conn.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS auction_items (
@@ -1370,24 +1505,12 @@ def create_auction_table():
     cur.execute("CREATE INDEX IF NOT EXISTS idx_auction_created ON auction_items(created_at)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_auction_id_status ON auction_items(id, status)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_auction_buyer ON auction_items(buyer_id)")
-    # Миграция для уже существующей таблицы: добавляем колонки, если их нет
-    try:
-        cur.execute("PRAGMA table_info(auction_items)")
-        cols = [row[1] for row in cur.fetchall()]
-        if 'owned_animal_id' not in cols:
-            cur.execute("ALTER TABLE auction_items ADD COLUMN owned_animal_id INTEGER DEFAULT NULL")
-        if 'base_animal_item_id' not in cols:
-            cur.execute("ALTER TABLE auction_items ADD COLUMN base_animal_item_id TEXT DEFAULT NULL")
-        if 'animal_last_fed_time' not in cols:
-            cur.execute("ALTER TABLE auction_items ADD COLUMN animal_last_fed_time INTEGER DEFAULT NULL")
-    except Exception as _mig_e:
-        pass
     conn.commit()
     conn.close()
 
 def create_level_rewards_table():
     """Создать таблицу для наград за уровень"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(row_factory=None)
     cur = conn.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS level_rewards (
@@ -1406,16 +1529,6 @@ def create_level_rewards_table():
     );
     """)
     
-    # Проверяем наличие колонки slot
-    cur.execute("PRAGMA table_info(level_rewards)")
-    columns = [row[1] for row in cur.fetchall()]
-    if 'slot' not in columns:
-        cur.execute("ALTER TABLE level_rewards ADD COLUMN slot INTEGER DEFAULT 1")
-    if 'reward_amount_min' not in columns:
-        cur.execute("ALTER TABLE level_rewards ADD COLUMN reward_amount_min INTEGER DEFAULT 1")
-    if 'reward_amount_max' not in columns:
-        cur.execute("ALTER TABLE level_rewards ADD COLUMN reward_amount_max INTEGER DEFAULT 1")
-    
     # Проверяем, есть ли уже данные в таблице
     cur.execute("SELECT COUNT(*) FROM level_rewards")
     count = cur.fetchone()[0]
@@ -1484,7 +1597,7 @@ def add_auction_item(seller_id: int, item_id: str, quantity: int, price_per_item
         if not ok:
             return {"error": "Не удалось зарезервировать животное"}
         expires_at = int(time.time()) + (hours * 3600)
-        with _lock:
+        with _user_locks.hold(seller_id):
             conn = _connect()
             cur = conn.cursor()
             cur.execute(
@@ -1515,7 +1628,7 @@ def add_auction_item(seller_id: int, item_id: str, quantity: int, price_per_item
     # Забираем предметы из инвентаря (они будут возвращены при покупке/истечении)
     remove_item(seller_id, item_id, quantity)
     expires_at = int(time.time()) + (hours * 3600)
-    with _lock:
+    with _user_locks.hold(seller_id):
         conn = _connect()
         cur = conn.cursor()
         cur.execute(
@@ -1535,41 +1648,40 @@ def get_auction_items(page: int = 1, per_page: int = 10, seller_id: int | None =
     import time
     offset = (page - 1) * per_page
     
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
+    conn = _connect()
+    cur = conn.cursor()
         
-        if seller_id:
-            # Лоты конкретного продавца
-            cur.execute("""
-                SELECT id, seller_id, item_id, quantity, price_per_item, created_at, expires_at, status
-                FROM auction_items 
-                WHERE seller_id = ? AND status = 'active' AND expires_at > ?
-                ORDER BY created_at DESC
-                LIMIT ? OFFSET ?
-            """, (seller_id, int(time.time()), per_page, offset))
-        else:
-            # Все активные лоты
-            cur.execute("""
-                SELECT id, seller_id, item_id, quantity, price_per_item, created_at, expires_at, status
-                FROM auction_items 
-                WHERE status = 'active' AND expires_at > ?
-                ORDER BY created_at DESC
-                LIMIT ? OFFSET ?
-            """, (int(time.time()), per_page, offset))
-        
-        items = cur.fetchall()
-        
-        # Считаем общее количество
-        if seller_id:
-            cur.execute("SELECT COUNT(*) FROM auction_items WHERE seller_id = ? AND status = 'active' AND expires_at > ?", 
-                       (seller_id, int(time.time())))
-        else:
-            cur.execute("SELECT COUNT(*) FROM auction_items WHERE status = 'active' AND expires_at > ?", 
-                       (int(time.time()),))
+    if seller_id:
+        # Лоты конкретного продавца
+        cur.execute("""
+            SELECT id, seller_id, item_id, quantity, price_per_item, created_at, expires_at, status
+            FROM auction_items 
+            WHERE seller_id = ? AND status = 'active' AND expires_at > ?
+            ORDER BY created_at DESC
+            LIMIT ? OFFSET ?
+        """, (seller_id, int(time.time()), per_page, offset))
+    else:
+        # Все активные лоты
+        cur.execute("""
+            SELECT id, seller_id, item_id, quantity, price_per_item, created_at, expires_at, status
+            FROM auction_items 
+            WHERE status = 'active' AND expires_at > ?
+            ORDER BY created_at DESC
+            LIMIT ? OFFSET ?
+        """, (int(time.time()), per_page, offset))
         
-        total = cur.fetchone()[0]
-        conn.close()
+    items = cur.fetchall()
+        
+    # Считаем общее количество
+    if seller_id:
+        cur.execute("SELECT COUNT(*) FROM auction_items WHERE seller_id = ? AND status = 'active' AND expires_at > ?", 
+                   (seller_id, int(time.time())))
+    else:
+        cur.execute("SELECT COUNT(*) FROM auction_items WHERE status = 'active' AND expires_at > ?", 
+                   (int(time.time()),))
+        
+    total = cur.fetchone()[0]
+    conn.close()
         
     return {
         "items": items,
@@ -1579,47 +1691,64 @@ def get_auction_items(page: int = 1, per_page: int = 10, seller_id: int | None =
         "total_pages": (total + per_page - 1) // per_page
     }
 
+def _auction_seller(auction_id: int):
+    """seller_id лота (без блокировки) — нужен, чтобы заранее знать, чьи ключи блокировать"""
+    conn = _connect(row_factory=None)
+    try:
+        row = conn.execute("SELECT seller_id FROM auction_items WHERE id = ?", (auction_id,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
 def buy_auction_item(buyer_id: int, auction_id: int):
     """Купить предмет с аукциона"""
+    seller_id = _auction_seller(auction_id)
+    if seller_id is None:
+        return {"error": "Лот не найден или уже неактивен"}
+    # Покупатель, продавец и лот блокируются вместе (в едином порядке — без дедлоков),
+    # поэтому между проверкой баланса и списанием никто не изменит ни деньги, ни лот
+    with _user_locks.hold(buyer_id, seller_id, _auction_key(auction_id)):
+        return _buy_auction_item_locked(buyer_id, auction_id)
+
+def _buy_auction_item_locked(buyer_id: int, auction_id: int):
     import time
     
-    # Сначала получаем данные и делаем проверки БЕЗ блокировки
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
+    # Сначала получаем данные и делаем проверки
+    conn = _connect()
+    cur = conn.cursor()
         
-        # Получаем всю информацию о лоте одним запросом
-        cur.execute("""
-            SELECT seller_id, item_id, quantity, price_per_item, status, expires_at,
-                   owned_animal_id, base_animal_item_id, animal_last_fed_time
-            FROM auction_items WHERE id = ? AND status = 'active'
-        """, (auction_id,))
+    # Получаем всю информацию о лоте одним запросом
+    cur.execute("""
+        SELECT seller_id, item_id, quantity, price_per_item, status, expires_at,
+               owned_animal_id, base_animal_item_id, animal_last_fed_time
+        FROM auction_items WHERE id = ? AND status = 'active'
+    """, (auction_id,))
         
-        auction = cur.fetchone()
-        if not auction:
-            conn.close()
-            return {"error": "Лот не найден или уже неактивен"}
+    auction = cur.fetchone()
+    if not auction:
+        conn.close()
+        return {"error": "Лот не найден или уже неактивен"}
         
-        seller_id, item_id, quantity, price_per_item, status, expires_at, owned_animal_id, base_animal_item_id, animal_last_fed_time = auction
+    seller_id, item_id, quantity, price_per_item, status, expires_at, owned_animal_id, base_animal_item_id, animal_last_fed_time = auction
         
-        if expires_at <= int(time.time()):
-            conn.close()
-            return {"error": "Срок лота истёк"}
+    if expires_at <= int(time.time()):
+        conn.close()
+        return {"error": "Срок лота истёк"}
         
-        if seller_id == buyer_id:
-            conn.close()
-            return {"error": "Нельзя покупать свои лоты"}
+    if seller_id == buyer_id:
+        conn.close()
+        return {"error": "Нельзя покупать свои лоты"}
         
-        total_price = quantity * price_per_item
-        
-        # Проверяем баланс покупателя
-        cur.execute("SELECT dan FROM users WHERE user_id = ?", (buyer_id,))
-        buyer_row = cur.fetchone()
-        if not buyer_row or buyer_row[0] < total_price:
-            conn.close()
-            return {"error": f"Недостаточно средств. Нужно: {total_price} дань"}
+    total_price = quantity * price_per_item
         
+    # Проверяем баланс покупателя
+    cur.execute("SELECT dan FROM users WHERE user_id = ?", (buyer_id,))
+    buyer_row = cur.fetchone()
+    if not buyer_row or buyer_row[0] < total_price:
         conn.close()
+        return {"error": f"Недостаточно средств. Нужно: {total_price} дань"}
+        
+    conn.close()
     
     # Определяем тип предмета
     is_animal = owned_animal_id is not None or base_animal_item_id is not None
@@ -1639,55 +1768,55 @@ def buy_auction_item(buyer_id: int, auction_id: int):
             return {"error": f"Ошибка передачи животного: {e}"}
     
     # Теперь быстрая транзакция для денег и статуса
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
+    conn = _connect()
+    cur = conn.cursor()
         
-        try:
-            cur.execute("BEGIN IMMEDIATE")
-        except Exception:
-            pass
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+    except Exception:
+        pass
         
-        # Проверяем что лот всё ещё активен (double-check)
-        cur.execute("SELECT status FROM auction_items WHERE id = ?", (auction_id,))
-        check = cur.fetchone()
-        if not check or check[0] != 'active':
-            conn.rollback()
-            conn.close()
-            # Если животное уже создано - откатываем (TODO: удалить животное)
-            return {"error": "Лот уже продан"}
+    # Проверяем что лот всё ещё активен (double-check)
+    cur.execute("SELECT status FROM auction_items WHERE id = ?", (auction_id,))
+    check = cur.fetchone()
+    if not check or check[0] != 'active':
+        conn.rollback()
+        conn.close()
+        # Если животное уже создано - откатываем (TODO: удалить животное)
+        return {"error": "Лот уже продан"}
         
-        # Списываем/начисляем деньги
-        cur.execute("UPDATE users SET dan = dan - ? WHERE user_id = ?", (total_price, buyer_id))
-        cur.execute("UPDATE users SET dan = dan + ? WHERE user_id = ?", (total_price, seller_id))
+    # Списываем/начисляем деньги
+    cur.execute("UPDATE users SET dan = dan - ? WHERE user_id = ?", (total_price, buyer_id))
+    cur.execute("UPDATE users SET dan = dan + ? WHERE user_id = ?", (total_price, seller_id))
         
-        # Для обычных предметов добавляем в инвентарь
-        if not is_animal:
-            cur.execute("INSERT OR IGNORE INTO inventory (user_id, item_id, count) VALUES (?, ?, 0)", (buyer_id, item_id))
-            cur.execute("UPDATE inventory SET count = count + ? WHERE user_id = ? AND item_id = ?", 
-                       (quantity, buyer_id, item_id))
+    # Для обычных предметов добавляем в инвентарь
+    if not is_animal:
+        cur.execute("INSERT OR IGNORE INTO inventory (user_id, item_id, count) VALUES (?, ?, 0)", (buyer_id, item_id))
+        cur.execute("UPDATE inventory SET count = count + ? WHERE user_id = ? AND item_id = ?", 
+                   (quantity, buyer_id, item_id))
         
-        # Помечаем лот как проданный
-        cur.execute("""
-            UPDATE auction_items 
-            SET status = 'sold', buyer_id = ?, sold_at = ?
-            WHERE id = ?
-        """, (buyer_id, int(time.time()), auction_id))
+    # Помечаем лот как проданный
+    cur.execute("""
+        UPDATE auction_items 
+        SET status = 'sold', buyer_id = ?, sold_at = ?
+        WHERE id = ?
+    """, (buyer_id, int(time.time()), auction_id))
         
-        conn.commit()
-        conn.close()
+    conn.commit()
+    conn.close()
+    invalidate_user(buyer_id, seller_id)
         
-        return {
-            "success": True,
-            "item_id": item_id,
-            "quantity": quantity,
-            "total_price": total_price,
-            "seller_id": seller_id
-        }
+    return {
+        "success": True,
+        "item_id": item_id,
+        "quantity": quantity,
+        "total_price": total_price,
+        "seller_id": seller_id
+    }
 
 def remove_auction_item(seller_id: int, auction_id: int):
     """Снять лот с аукциона (только свой)"""
-    with _lock:
+    with _user_locks.hold(seller_id, _auction_key(auction_id)):
         conn = _connect()
         cur = conn.cursor()
         
@@ -1746,16 +1875,31 @@ def cleanup_expired_auctions():
     """Очистить истёкшие аукционы и вернуть предметы продавцам"""
     import time
     
-    with _lock:
+    now = int(time.time())
+    # Сначала без блокировки узнаём, какие лоты истекли и чьи они
+    conn = _connect(row_factory=None)
+    candidates = conn.execute(
+        "SELECT id, seller_id FROM auction_items WHERE status = 'active' AND expires_at <= ?", (now,)
+    ).fetchall()
+    conn.close()
+    if not candidates:
+        return 0
+    
+    keys = set()
+    for auction_id, seller_id in candidates:
+        keys.add(seller_id)
+        keys.add(_auction_key(auction_id))
+    with _user_locks.hold(*keys):
         conn = _connect()
         cur = conn.cursor()
         
-        # Находим истёкшие активные лоты
-        cur.execute("""
+        # Перечитываем под блокировкой только найденные лоты: часть могли купить или снять
+        placeholders = ",".join("?" * len(candidates))
+        cur.execute(f"""
             SELECT id, seller_id, item_id, quantity 
             FROM auction_items 
-            WHERE status = 'active' AND expires_at <= ?
-        """, (int(time.time()),))
+            WHERE status = 'active' AND expires_at <= ? AND id IN ({placeholders})
+        """, (now, *[c[0] for c in candidates]))
         
         expired_auctions = cur.fetchall()
         
@@ -1793,107 +1937,310 @@ def cleanup_expired_auctions():
 
 def buy_auction_item_partial(buyer_id: int, auction_id: int, buy_quantity: int):
     """Купить определенное количество предметов с аукциона (частичная покупка)"""
+    seller_id = _auction_seller(auction_id)
+    if seller_id is None:
+        return {"error": "Лот не найден"}
+    with _user_locks.hold(buyer_id, seller_id, _auction_key(auction_id)):
+        return _buy_auction_item_partial_locked(buyer_id, auction_id, buy_quantity)
+
+def _buy_auction_item_partial_locked(buyer_id: int, auction_id: int, buy_quantity: int):
     import time
     
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
+    conn = _connect()
+    cur = conn.cursor()
         
-        # Явно начинаем транзакцию
-        try:
-            cur.execute("BEGIN IMMEDIATE")
-        except Exception:
-            pass
+    # Явно начинаем транзакцию
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+    except Exception:
+        pass
 
-        # Получаем информацию о лоте
-        cur.execute("""
-            SELECT seller_id, item_id, quantity, price_per_item, status, expires_at
-            FROM auction_items WHERE id = ?
-        """, (auction_id,))
+    # Получаем информацию о лоте
+    cur.execute("""
+        SELECT seller_id, item_id, quantity, price_per_item, status, expires_at
+        FROM auction_items WHERE id = ?
+    """, (auction_id,))
         
-        auction = cur.fetchone()
-        if not auction:
-            conn.close()
-            return {"error": "Лот не найден"}
+    auction = cur.fetchone()
+    if not auction:
+        conn.close()
+        return {"error": "Лот не найден"}
         
-        seller_id, item_id, quantity, price_per_item, status, expires_at = auction
+    seller_id, item_id, quantity, price_per_item, status, expires_at = auction
         
-        if status != 'active':
-            conn.close()
-            return {"error": "Лот уже продан или неактивен"}
+    if status != 'active':
+        conn.close()
+        return {"error": "Лот уже продан или неактивен"}
         
-        if expires_at <= int(time.time()):
-            conn.close()
-            return {"error": "Срок лота истёк"}
+    if expires_at <= int(time.time()):
+        conn.close()
+        return {"error": "Срок лота истёк"}
         
-        if seller_id == buyer_id:
-            conn.close()
-            return {"error": "Нельзя покупать свои лоты"}
+    if seller_id == buyer_id:
+        conn.close()
+        return {"error": "Нельзя покупать свои лоты"}
         
-        # Проверяем, что запрошенное количество не больше доступного
-        if buy_quantity > quantity:
-            conn.close()
-            return {"error": f"В лоте только {quantity} предметов"}
+    # Проверяем, что запрошенное количество не больше доступного
+    if buy_quantity > quantity:
+        conn.close()
+        return {"error": f"В лоте только {quantity} предметов"}
         
-        if buy_quantity <= 0:
-            conn.close()
-            return {"error": "Количество должно быть больше 0"}
+    if buy_quantity <= 0:
+        conn.close()
+        return {"error": "Количество должно быть больше 0"}
         
-        total_price = buy_quantity * price_per_item
+    total_price = buy_quantity * price_per_item
         
-        # Проверяем баланс покупателя
-        cur.execute("SELECT dan FROM users WHERE user_id = ?", (buyer_id,))
-        buyer_row = cur.fetchone()
-        if not buyer_row or buyer_row[0] < total_price:
-            conn.close()
-            return {"error": f"Недостаточно средств. Нужно: {total_price} дань"}
+    # Проверяем баланс покупателя
+    cur.execute("SELECT dan FROM users WHERE user_id = ?", (buyer_id,))
+    buyer_row = cur.fetchone()
+    if not buyer_row or buyer_row[0] < total_price:
+        conn.close()
+        return {"error": f"Недостаточно средств. Нужно: {total_price} дань"}
         
-        # Выполняем транзакцию
-        # Списываем деньги с покупателя
-        cur.execute("UPDATE users SET dan = dan - ? WHERE user_id = ?", (total_price, buyer_id))
+    # Выполняем транзакцию
+    # Списываем деньги с покупателя
+    cur.execute("UPDATE users SET dan = dan - ? WHERE user_id = ?", (total_price, buyer_id))
         
-        # Начисляем деньги продавцу
-        cur.execute("UPDATE users SET dan = dan + ? WHERE user_id = ?", (total_price, seller_id))
+    # Начисляем деньги продавцу
+    cur.execute("UPDATE users SET dan = dan + ? WHERE user_id = ?", (total_price, seller_id))
         
-        # Передаём предметы покупателю
-        cur.execute("SELECT count FROM inventory WHERE user_id = ? AND item_id = ?", (buyer_id, item_id))
-        existing_row = cur.fetchone()
+    # Передаём предметы покупателю
+    cur.execute("SELECT count FROM inventory WHERE user_id = ? AND item_id = ?", (buyer_id, item_id))
+    existing_row = cur.fetchone()
         
-        if existing_row:
-            # Обновляем количество существующего предмета
-            cur.execute("UPDATE inventory SET count = count + ? WHERE user_id = ? AND item_id = ?", 
-                       (buy_quantity, buyer_id, item_id))
-        else:
-            # Добавляем новый предмет
-            cur.execute("INSERT INTO inventory (user_id, item_id, count) VALUES (?, ?, ?)", 
-                       (buyer_id, item_id, buy_quantity))
-        
-        # Обновляем количество в лоте
-        remaining_quantity = quantity - buy_quantity
-        
-        if remaining_quantity <= 0:
-            # Лот полностью распродан
-            cur.execute("""
-                UPDATE auction_items 
-                SET status = 'sold', buyer_id = ?, sold_at = ?, quantity = 0
-                WHERE id = ?
-            """, (buyer_id, int(time.time()), auction_id))
-        else:
-            # Уменьшаем количество в лоте
-            cur.execute("""
-                UPDATE auction_items 
-                SET quantity = ?
-                WHERE id = ?
-            """, (remaining_quantity, auction_id))
+    if existing_row:
+        # Обновляем количество существующего предмета
+        cur.execute("UPDATE inventory SET count = count + ? WHERE user_id = ? AND item_id = ?", 
+                   (buy_quantity, buyer_id, item_id))
+    else:
+        # Добавляем новый предмет
+        cur.execute("INSERT INTO inventory (user_id, item_id, count) VALUES (?, ?, ?)", 
+                   (buyer_id, item_id, buy_quantity))
         
-        conn.commit()
-        conn.close()
+    # Обновляем количество в лоте
+    remaining_quantity = quantity - buy_quantity
         
-        return {
-            "success": True,
-            "item_id": item_id,
-            "quantity": buy_quantity,
-            "total_price": total_price,
-            "seller_id": seller_id,
-            "remaining_in_lot": remaining_quantity
-        }
+    if remaining_quantity <= 0:
+        # Лот полностью распродан
+        cur.execute("""
+            UPDATE auction_items 
+            SET status = 'sold', buyer_id = ?, sold_at = ?, quantity = 0
+            WHERE id = ?
+        """, (buyer_id, int(time.time()), auction_id))
+    else:
+        # Уменьшаем количество в лоте
+        cur.execute("""
+            UPDATE auction_items 
+            SET quantity = ?
+            WHERE id = ?
+        """, (remaining_quantity, auction_id))
+        
+    conn.commit()
+    conn.close()
+    invalidate_user(buyer_id, seller_id)
+        
+    return {
+        "success": True,
+        "item_id": item_id,
+        "quantity": buy_quantity,
+        "total_price": total_price,
+        "seller_id": seller_id,
+        "remaining_in_lot": remaining_quantity
+    }
+
+# === ЕДИНОЕ ХРАНИЛИЩЕ: МИГРАЦИИ СТАРЫХ ФАЙЛОВ ===
+# Каждый шаг выполняется один раз (номер пишется в schema_version), см. migrations.py
+
+@migrations.migration(1, "merge messages.db", attach={"legacy": LEGACY_DB_FILES["messages"]})
+def _migration_merge_messages(cur, attached):
+    _migrate_messages_db_into_main(cur, "legacy", attached)
+
+@migrations.migration(2, "merge referral_bot.db", attach={"legacy": LEGACY_DB_FILES["referral"]})
+def _migration_merge_referral(cur, attached):
+    _migrate_referral_db_into_main(cur, "legacy", attached)
+
+@migrations.migration(3, "merge bank.db", attach={"legacy": LEGACY_DB_FILES["bank"]})
+def _migration_merge_bank(cur, attached):
+    migrations.merge_attached(cur, "legacy", attached)
+
+@migrations.migration(4, "merge arena.db", attach={"legacy": LEGACY_DB_FILES["arena"]})
+def _migration_merge_arena(cur, attached):
+    migrations.merge_attached(cur, "legacy", attached)
+
+@migrations.migration(5, "merge tasks.db", attach={"legacy": LEGACY_DB_FILES["tasks"]})
+def _migration_merge_tasks(cur, attached):
+    # write_behind_state из tasks.db тоже переносим: по нему проигрывается журнал заданий
+    migrations.merge_attached(cur, "legacy", attached)
+
+@migrations.migration(6, "merge MESSAGES_DB_FILE", attach={"legacy": LEGACY_DB_FILES["root_messages"]})
+def _migration_merge_root_messages(cur, attached):
+    migrations.merge_attached(cur, "legacy", attached, tables=["messages"])
+
+@migrations.migration(7, "baseline schema", transactional=False)
+def _migration_baseline_schema(cur, attached):
+    # create_* открывают свои соединения, поэтому шаг без общей транзакции (DDL идемпотентен)
+    _create_schema()
+
+# Колонки, которые в разное время добавлялись к уже существующим таблицам.
+# У новых БД они есть в CREATE TABLE, у старых добавляются шагом 8 один раз.
+_LATE_COLUMNS = [
+    ("users", "win_count", "INTEGER DEFAULT 0"),
+    ("users", "lose_count", "INTEGER DEFAULT 0"),
+    ("users", "dan_win", "INTEGER DEFAULT 0"),
+    ("users", "dan_lose", "INTEGER DEFAULT 0"),
+    ("users", "reg_date", "TEXT"),
+    ("users", "first_name", "TEXT"),
+    ("users", "last_name", "TEXT"),
+    ("users", "xp", "INTEGER DEFAULT 0"),
+    ("users", "level", "INTEGER DEFAULT 1"),
+    ("users", "pending_level_rewards", "INTEGER DEFAULT 0"),
+    ("users", "referrer_id", "INTEGER DEFAULT NULL"),
+    ("users", "referrals_count", "INTEGER DEFAULT 0"),
+    ("users", "bonus_requests", "INTEGER DEFAULT 0"),
+    ("users", "used_bonus_requests", "INTEGER DEFAULT 0"),
+    ("users", "used_referral_code", "TEXT DEFAULT NULL"),
+    ("users", "adult_unlocks", "INTEGER DEFAULT 0"),
+    ("auction_items", "owned_animal_id", "INTEGER DEFAULT NULL"),
+    ("auction_items", "base_animal_item_id", "TEXT DEFAULT NULL"),
+    ("auction_items", "animal_last_fed_time", "INTEGER DEFAULT NULL"),
+    ("level_rewards", "slot", "INTEGER DEFAULT 1"),
+    ("level_rewards", "reward_amount_min", "INTEGER DEFAULT 1"),
+    ("level_rewards", "reward_amount_max", "INTEGER DEFAULT 1"),
+    ("arena_ratings", "xp", "INTEGER DEFAULT 0"),
+    ("arena_ratings", "level", "INTEGER DEFAULT 1"),
+    ("arena_ratings", "last_bonus_win_date", "TEXT"),
+    ("arena_ratings", "pending_level_rewards", "INTEGER DEFAULT 0"),
+    ("farm_animals", "feed_buffer_hours", "INTEGER DEFAULT 0"),
+    ("messages", "ref_count", "INTEGER DEFAULT 0"),
+]
+
+@migrations.migration(8, "add late columns")
+def _migration_late_columns(cur, attached):
+    # Очень старая farm_animals (animal_type вместо animal_item_id) несовместима —
+    # удаляем, ferma.init_animals_table создаст её заново
+    cur.execute("PRAGMA main.table_info(farm_animals)")
+    farm_cols = {row[1] for row in cur.fetchall()}
+    if 'animal_type' in farm_cols and 'animal_item_id' not in farm_cols:
+        cur.execute("DROP TABLE main.farm_animals")
+    for table, column, decl in _LATE_COLUMNS:
+        migrations.add_column(cur, table, column, decl)
+
+@migrations.migration(9, "leaderboard indexes")
+def _migration_leaderboard_indexes(cur, attached):
+    # Покрывающие индексы для топов (leaderboard.py): топ и список значений
+    # читаются по индексу без сортировки и без обращения к строкам таблицы
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_dan ON users(dan, games_played, username)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_games_played ON users(games_played, username)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_farm_income ON users(farm_income, username)")
+
+@migrations.migration(10, "media file ids")
+def _migration_media_files(cur, attached):
+    # file_id загруженных в Telegram фото (media_cache.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS media_files (
+            path TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at INTEGER
+        )
+    """)
+
+@migrations.migration(11, "game sessions")
+def _migration_game_sessions(cur, attached):
+    # Снимки активных игровых сессий (session_store.py, persist=True)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS game_sessions (
+            namespace TEXT NOT NULL,
+            key BLOB NOT NULL,
+            value BLOB NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )
+    """)
+
+@migrations.migration(12, "scheduler runs")
+def _migration_scheduler_runs(cur, attached):
+    # Последние запуски периодических задач (scheduler.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_runs (
+            job TEXT PRIMARY KEY,
+            last_run REAL,
+            last_status TEXT,
+            last_error TEXT,
+            runs INTEGER DEFAULT 0
+        )
+    """)
+
+@migrations.migration(13, "broadcasts")
+def _migration_broadcasts(cur, attached):
+    # Рассылки и их прогресс (broadcast.py): курсор по user_id позволяет продолжить после перезапуска
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            audience TEXT NOT NULL,
+            audience_arg TEXT,
+            cursor INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            status TEXT NOT NULL,
+            report_chat_id INTEGER,
+            report_message_id INTEGER,
+            created_at REAL,
+            updated_at REAL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status)")
+    # Пользователи, заблокировавшие бота: в рассылки не включаются до следующего /start
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_blocked (
+            user_id INTEGER PRIMARY KEY,
+            blocked_at REAL
+        )
+    """)
+
+@migrations.migration(14, "shared game sessions")
+def _migration_shared_sessions(cur, attached):
+    # Версия записи: воркеры webhook.py сверяют её со своей копией сессии (session_store.enable_shared)
+    migrations.add_column(cur, "game_sessions", "version", "TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_game_sessions_expires ON game_sessions(expires_at)")
+
+@migrations.migration(15, "fsm states")
+def _migration_fsm_states(cur, attached):
+    # Состояния FSM aiogram (fsm_storage.py): ключ bot:chat:thread:user:destiny, данные - компактный JSON
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_expires ON fsm_states(expires_at)")
+
+@migrations.migration(16, "game session changes")
+def _migration_game_session_changes(cur, attached):
+    # Лента изменений game_sessions: каждая запись общего режима получает следующий номер seq,
+    # воркеры webhook.py подтягивают строки с seq больше последнего прочитанного (версия больше не сверяется)
+    migrations.add_column(cur, "game_sessions", "seq", "INTEGER")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_game_sessions_seq ON game_sessions(seq)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS game_session_seq (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO game_session_seq (id, seq) VALUES (1, 0)")
+
+def run_store_migrations():
+    """Применить миграции единого хранилища (вызывается при импорте модуля)."""
+    with _schema_lock:
+        return migrations.run_migrations(lambda: _connect(row_factory=None))
+
+# До того как bank/arena/tasks создадут свои таблицы в DB_PATH
+run_store_migrations()
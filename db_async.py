@@ -0,0 +1,82 @@
+"""
+Асинхронный доступ к базе данных.
+
+Все функции database.py, ferma.py, bank.py, tasks.py и arena_database.py
+синхронные (sqlite3). Вызов их прямо из хендлера блокирует event loop aiogram,
+и один медленный запрос или блокировка тормозит апдейты всех пользователей.
+Здесь они выполняются в отдельном пуле потоков БД, а хендлеры их ожидают:
+
+    import db_async
+    user = await db_async.db.get_user(user_id)
+    await db_async.ferma.collect_dan(user_id)
+    deposits = await db_async.bank.get_user_deposits(user_id)
+    ok, msg = await db_async.run(buy_lottery_ticket, user_id, username)
+"""
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+import arena_database as _arena_database
+import database as _database
+import ferma as _ferma
+import tasks as _tasks
+from bank import bank_system as _bank_system
+
+# Количество потоков БД. Записи в один файл SQLite всё равно сериализуются,
+# несколько потоков позволяют параллельно читать и работать с разными файлами.
+DB_EXECUTOR_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run(func, *args, **kwargs):
+    """Выполнить синхронную функцию БД в потоке БД и дождаться результата."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+class AsyncModule:
+    """Прокси над модулем/объектом: каждый синхронный вызов превращается в awaitable.
+
+    Уже асинхронные функции (например database.add_user) возвращаются как есть,
+    не вызываемые атрибуты (константы, конфиги) — тоже.
+    """
+
+    def __init__(self, target):
+        self._target = target
+        self._wrappers = {}
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        attr = getattr(self._target, name)
+        if not callable(attr) or inspect.iscoroutinefunction(attr) or inspect.isclass(attr):
+            return attr
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            target = self._target
+
+            async def wrapper(*args, **kwargs):
+                # Атрибут берём заново на каждый вызов, чтобы не терять подмены функций модуля
+                return await run(getattr(target, name), *args, **kwargs)
+
+            wrapper.__name__ = name
+            wrapper.__doc__ = getattr(attr, "__doc__", None)
+            self._wrappers[name] = wrapper
+        return wrapper
+
+    def __repr__(self):
+        return f"<AsyncModule {self._target!r}>"
+
+
+db = AsyncModule(_database)
+ferma = AsyncModule(_ferma)
+bank = AsyncModule(_bank_system)
+tasks = AsyncModule(_tasks)
+arena_db = AsyncModule(_arena_database)
+
+
+def shutdown(wait: bool = True):
+    """Дождаться завершения запросов в потоках БД (вызывается при остановке бота)."""
+    _executor.shutdown(wait=wait)
@@ -2,16 +2,17 @@ from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import datetime
 import random
-import sqlite3
 import os
 
+import sqlite_pool
+
 ADMIN_ID = 1425069841  # твой Telegram user_id
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "database", "game_bot.db")
 
 # === инициализация базы ===
 def init_draws_table():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite_pool.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute('''
         CREATE TABLE IF NOT EXISTS draws (
@@ -36,7 +37,7 @@ init_draws_table()
 
 # === функции базы ===
 def add_draw(date, conditions):
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite_pool.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute('INSERT INTO draws (date, conditions) VALUES (?, ?)', (date, conditions))
     draw_id = cur.lastrowid
@@ -45,7 +46,7 @@ def add_draw(date, conditions):
     return draw_id
 
 def get_draws():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite_pool.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute('SELECT id, date, conditions, tickets FROM draws ORDER BY id DESC')
     data = cur.fetchall()
@@ -53,7 +54,7 @@ def get_draws():
     return data
 
 def get_draw(draw_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite_pool.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute('SELECT id, date, conditions, tickets FROM draws WHERE id=?', (draw_id,))
     data = cur.fetchone()
@@ -64,14 +65,14 @@ def get_draw(draw_id):
 pending_condition = {}  # admin_id -> draw_id
 
 def add_draw_participant(draw_id, user_id, username):
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite_pool.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute('INSERT OR IGNORE INTO draw_participants (draw_id, user_id, username) VALUES (?, ?, ?)', (draw_id, user_id, username))
     conn.commit()
     conn.close()
 
 def get_draw_participants(draw_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite_pool.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute('SELECT user_id, username FROM draw_participants WHERE draw_id=?', (draw_id,))
     data = cur.fetchall()
@@ -220,7 +221,7 @@ async def add_draw_condition(message: types.Message, draw_id: int, condition_tex
         conds = [c.strip() for c in condition_text.split(",") if c.strip()]
         await message.reply(f"✅ Условия для #{draw_id}: {', '.join(conds)}")
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite_pool.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute('UPDATE draws SET conditions=? WHERE id=?', (condition_text, draw_id))
     conn.commit()
@@ -228,7 +229,7 @@ async def add_draw_condition(message: types.Message, draw_id: int, condition_tex
 
 # === удалить конкурс ===
 async def delete_draw(message: types.Message, draw_id: int):
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite_pool.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute('DELETE FROM draws WHERE id=?', (draw_id,))
     cur.execute('DELETE FROM draw_participants WHERE draw_id=?', (draw_id,))
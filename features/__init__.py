@@ -0,0 +1,113 @@
+"""
+Роутеры фич бота: банк, ферма, аукцион, магазин, лотерея, арена, игры и
+команды администратора. Каждая фича — свой aiogram.Router со своими
+таблицами колбэков и текстовых команд (routing.py).
+
+Модуль фичи не импортирует main на уровне модуля: общие помощники main (bot,
+safe_edit_message, format_clickable_name, ...) хендлеры берут через
+`from main import ...` при вызове, тяжёлые модули — через lazy_modules.
+Поэтому фичу можно загрузить отдельно, без остального бота:
+
+    lazy_modules.load_feature("bank")
+
+main подключает роутеры через setup(). Колбэки разных фич не пересекаются,
+поэтому их роутеры подключаются в порядке ORDER, fallback («*») — последним.
+
+Текстовые команды фич пересекаются («клад» в «имя Клад7», «дать» и «+dan»,
+ввод суммы вклада или цены лота, который принимает любой текст), поэтому их
+таблицы проверяются одной цепочкой routing.TextChain в порядке TEXT_ORDER —
+том же, в котором хендлеры стояли в main.py до разделения на фичи.
+"""
+import importlib
+from typing import List, Tuple
+
+from aiogram import Dispatcher, Router
+
+import routing
+
+# Порядок подключения роутеров колбэков; "main" - роутер самого main.py
+ORDER: List[str] = ["auction", "shop", "main", "farm", "games", "bank", "lottery", "arena", "admin"]
+
+# Порядок проверки текстовых команд (фича, хендлер): первым срабатывает подходящий раньше всех
+TEXT_ORDER: List[Tuple[str, str]] = [
+    ("lottery", "cmd_lottery_history"),
+    ("auction", "handle_auction_quantity_reply"),
+    ("auction", "auction_process_custom_quantity"),
+    ("auction", "auction_process_price"),
+    ("shop", "successful_payment_handler"),
+    ("games", "saper_message_handler_with_last_stake"),
+    ("games", "battle_accept_message"),
+    ("games", "battle_decline_message"),
+    ("games", "cmd_clad_start"),
+    ("main", "cmd_ref"),
+    ("main", "cmd_ref_alias"),
+    ("farm", "cmd_ferma"),
+    ("farm", "cmd_ferma_command"),
+    ("shop", "cmd_shop"),
+    ("auction", "cmd_auction"),
+    ("main", "cmd_inventory"),
+    ("main", "cmd_tops"),
+    ("admin", "admin_dan"),
+    ("farm", "cmd_ferma_en"),
+    ("farm", "cmd_farm_collect"),
+    ("games", "tic_tac_toe_challenge_handler"),
+    ("games", "tic_tac_toe_cross_challenge_handler"),
+    ("games", "dice_battle_handler"),
+    ("games", "universal_bet_handler"),
+    ("bank", "bank_handler"),
+    ("bank", "deposit_command_handler"),
+    ("main", "cmd_bal"),
+    ("main", "text_menu_handler"),
+    ("bank", "process_direct_deposit_amount"),
+    ("main", "cmd_dodep"),
+    ("main", "cmd_donat"),
+    ("lottery", "ticket_handler"),
+    ("lottery", "text_ticket_handler"),
+    ("arena", "arena_handler"),
+    ("main", "cmd_set_name"),
+    ("main", "text_set_name"),
+    ("games", "cmd_game"),
+    ("games", "cmd_games_text"),
+    ("games", "cmd_bowling_start"),
+    ("games", "cmd_darts_start"),
+    ("games", "basketball_stub"),
+    ("games", "cmd_soccer_start"),
+    ("lottery", "text_lottery_handler"),
+    ("admin", "admin_dbstats_handler"),
+    ("admin", "admin_jobs_handler"),
+    ("admin", "admin_tell_handler"),
+    ("admin", "admin_broadcasts_handler"),
+    ("lottery", "test_lottery_handler"),
+    ("lottery", "admin_lottery_draw_command"),
+    ("admin", "admin_add_xp_command"),
+    ("lottery", "lottery_results_command"),
+    ("admin", "admin_give_item"),
+    ("admin", "admin_ban"),
+    ("main", "give_money_reply"),
+    ("main", "give_money_request"),
+]
+
+
+def load(feature: str) -> Router:
+    """Роутер фичи (модуль features.<фича> импортируется при первом вызове)."""
+    return importlib.import_module(f"{__name__}.{feature}").router
+
+
+def text_chain(main_texts: routing.TextRouter) -> routing.TextChain:
+    """Таблицы текстовых команд main и фич одной цепочкой в порядке TEXT_ORDER."""
+    tables = {"main": main_texts}
+    for feature in ORDER:
+        if feature != "main":
+            tables[feature] = importlib.import_module(f"{__name__}.{feature}").texts
+    handlers = {(feature, route.handler.__name__): route.handler
+                for feature, table in tables.items() for route in table.routes()}
+    return routing.TextChain(tables.values(), [handlers[key] for key in TEXT_ORDER if key in handlers])
+
+
+def setup(dp: Dispatcher, main_router: Router, main_texts: routing.TextRouter, fallback_router: Router) -> None:
+    """Подключить к диспетчеру цепочку текстовых команд и роутеры фич в порядке ORDER, fallback — последним."""
+    chain = text_chain(main_texts)
+    dp.message.register(chain.dispatch, chain.filter)
+    for feature in ORDER:
+        dp.include_router(main_router if feature == "main" else load(feature))
+    dp.include_router(fallback_router)
@@ -0,0 +1,379 @@
+"""
+Команды администратора: +dan/-dan, +опыт, +item/-item, +ban, /dbstats,
+/jobs, /tell, /broadcasts.
+"""
+import time
+import html
+from aiogram import Router, types
+from aiogram.filters import Command
+import session_store
+import database as db
+from database import add_xp
+import sqlite_pool
+import broadcast
+import leaderboard
+import media_cache
+import render_cache
+import scheduler
+import timers
+import write_behind
+import routing
+
+
+router = Router(name="admin")
+texts = routing.TextRouter()
+
+
+def parse_command_with_value(text: str, commands: list) -> tuple:
+    """Парсит команды типа +dan 100, -don 50"""
+    for prefix in commands:
+        if text.startswith(prefix):
+            try:
+                value = int(text[len(prefix):].strip())
+                operation = "add" if prefix.startswith("+") else "remove"
+                return operation, value
+            except ValueError:
+                break
+    return None, None
+
+
+# Админ-команды: +dan/-dan, +don/-don в ответ на сообщение — выдать/отобрать дань у пользователя
+@texts.prefix("+dan", "-dan", "+дань", "-дань", reply=True, ignore_case=False)
+async def admin_dan(message: types.Message):
+    from main import ADMIN_ID, safe_ensure_user
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("Нет доступа.")
+        return
+    
+    text = message.text.strip()
+    try:
+        operation, val = parse_command_with_value(text, ["+dan", "+дань", "-dan", "-дань"])
+        if operation is None:
+            raise ValueError("Invalid format")
+    except Exception:
+        await message.reply("Формат: +dan N или -dan N (или +дань/-дань)")
+        return
+        
+    if not message.reply_to_message or not message.reply_to_message.from_user:
+        await message.reply("Нужно ответить на сообщение пользователя.")
+        return
+        
+    target = message.reply_to_message.from_user
+    username = getattr(target, 'username', None)
+    safe_ensure_user(target.id, username)
+    display_name = getattr(target, 'full_name', None) or (f"@{username}" if username else str(getattr(target, 'id', 'unknown')))
+    
+    if operation == "add":
+        db.add_dan(target.id, val)
+        user_row = db.get_user(target.id) or {}
+        dan_bal = user_row.get('dan', 0)
+        await message.reply(f"Пользователю {display_name} выдано {val} дань. Баланс: {dan_bal:.2f}")
+    else:
+        if db.withdraw_dan(target.id, val):
+            user_row = db.get_user(target.id) or {}
+            dan_bal = user_row.get('dan', 0)
+            await message.reply(f"У пользователя {display_name} изъято {val} дань. Баланс: {dan_bal:.2f}")
+        else:
+            await message.reply("Недостаточно дань для изъятия у пользователя.")
+
+
+@texts.on(Command("dbstats"))
+async def admin_dbstats_handler(message: types.Message):
+    """Админ команда: метрики пулов соединений SQLite (ожидание соединения и время запросов)"""
+    from main import ADMIN_ID
+    if not getattr(message, 'from_user', None):
+        return
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для использования этой команды")
+        return
+    buffers = "\n".join(
+        f"{name}: в буфере ключей {s['pending_keys']}, сбросов {s['flushes']}, операций {s['flushed_ops']}"
+        for name, s in sorted(write_behind.get_stats().items())
+    ) or "нет"
+    cache = db.get_user_cache_stats()
+    names_cache = db.get_name_cache_stats()
+    media = media_cache.get_stats()
+    renders = render_cache.get_stats()
+    timer_stats = timers.get_stats()
+    sessions = ", ".join(
+        f"{name} {s['size']}" + (f" (истекло {s['expired']}, вытеснено {s['evicted']})" if s['expired'] or s['evicted'] else "")
+        for name, s in sorted(session_store.get_stats().items())
+    )
+    await message.answer(
+        f"📊 Пулы соединений БД:\n\n{sqlite_pool.format_stats()}\n\n"
+        f"📝 Отложенная запись счётчиков:\n{buffers}\n\n"
+        f"🗂 Кэш пользователей: {cache['size']}/{cache['maxsize']}, "
+        f"попаданий {cache['hits']}, промахов {cache['misses']} ({cache['hit_rate']:.0%}), "
+        f"вытеснено {cache['evictions']}, сброшено {cache['invalidations']}\n"
+        f"🏷 Кэш имён: {names_cache['size']}, попаданий {names_cache['hits']}, промахов {names_cache['misses']}\n"
+        f"🖼 Фото по file_id: {media['reused']}, загрузок {media['uploads']}, устаревших id {media['stale']}\n"
+        f"🧩 Сетки: в памяти {renders['memory_items']} ({renders['memory_bytes'] // 1024} КБ), на диске {renders['disk_items']}, "
+        f"попаданий {renders['memory_hits'] + renders['disk_hits']}, отрисовано {renders['renders']}, "
+        f"вытеснено {renders['evictions']}, сброшено {renders['invalidations']}\n\n"
+        f"🏆 Топы: " + ", ".join(
+            f"{name} {s['players']} игроков (обновлений {s['refreshes']})"
+            for name, s in leaderboard.get_stats().items() if name != "text_cache"
+        ) + f"\n\n🎮 Игровые сессии: {sessions}"
+        + f"\n⏱ Таймеры: ожидают {timer_stats['pending']}, сработало {timer_stats['fired']}, снято {timer_stats['cancelled']}"
+    )
+
+
+@texts.on(Command("jobs"))
+async def admin_jobs_handler(message: types.Message):
+    """Админ команда: периодические задачи планировщика (/jobs run <имя> - выполнить сейчас)"""
+    from main import ADMIN_ID
+    if not getattr(message, 'from_user', None):
+        return
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для использования этой команды")
+        return
+    parts = (message.text or "").split()
+    if len(parts) >= 3 and parts[1] == "run":
+        if await scheduler.run_now(parts[2]):
+            await message.answer(f"✅ Задача {parts[2]} выполнена")
+        else:
+            await message.answer(f"❌ Задача {parts[2]} не найдена")
+        return
+    lines = []
+    for job in scheduler.list_jobs():
+        last = job['last_run'].strftime('%d.%m %H:%M') if job['last_run'] else "ещё не запускалась"
+        next_run = job['next_run'].strftime('%d.%m %H:%M') if job['next_run'] else "—"
+        status = "⏳" if job['running'] else ("❌" if job['last_status'] == "error" else "✅")
+        line = f"{status} <b>{job['name']}</b> — {job['schedule']}\n    последний: {last}, следующий: {next_run}, запусков: {job['runs']}"
+        if job['last_status'] == "error" and job['last_error']:
+            line += f"\n    ошибка: {html.escape(job['last_error'][:200])}"
+        lines.append(line)
+    await message.answer("🗓 Задачи планировщика:\n\n" + ("\n".join(lines) or "нет"), parse_mode="HTML")
+
+
+@texts.on(Command("tell"))
+async def admin_tell_handler(message: types.Message):
+    """Админ команда для рассылки сообщения всем пользователям"""
+    from main import ADMIN_ID
+    if not getattr(message, 'from_user', None):
+        return
+    
+    user_id = message.from_user.id
+    
+    # Проверяем права админа
+    if user_id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для использования этой команды")
+        return
+    
+    # Ответ на сообщение - пересылаем его (с сохранением премиум эмодзи), иначе - текст после команды
+    if message.reply_to_message:
+        kind, title = "forward", "Пересылка"
+        payload = {"from_chat_id": message.reply_to_message.chat.id,
+                   "message_id": message.reply_to_message.message_id}
+    else:
+        command_text = message.text or ""
+        if len(command_text.split(maxsplit=1)) < 2:
+            await message.answer(
+                "📝 <b>Использование команды /tell:</b>\n\n"
+                "1️⃣ <b>Текстовая рассылка:</b>\n"
+                "/tell <сообщение>\n"
+                "Пример: /tell Привет всем! Обновление бота!\n\n"
+                "2️⃣ <b>Пересылка сообщения:</b>\n"
+                "Ответьте на любое сообщение командой /tell\n"
+                "Сообщение будет скопировано всем пользователям с сохранением премиум эмодзи и форматирования",
+                parse_mode='HTML'
+            )
+            return
+        kind, title = "text", "Рассылка"
+        payload = {"text": command_text.split(maxsplit=1)[1], "parse_mode": "HTML"}
+    
+    # Рассылка идёт в фоне, прогресс обновляется в отдельном сообщении (/broadcasts - список)
+    try:
+        job = await broadcast.start(kind, payload, report_chat_id=message.chat.id, title=title)
+        if not job.total:
+            await message.answer("❌ Нет пользователей в базе данных")
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при рассылке: {e}")
+
+
+@texts.on(Command("broadcasts"))
+async def admin_broadcasts_handler(message: types.Message):
+    """Админ команда: последние рассылки (/broadcasts stop|resume <id>)"""
+    from main import ADMIN_ID
+    if not getattr(message, 'from_user', None):
+        return
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для использования этой команды")
+        return
+    parts = (message.text or "").split()
+    if len(parts) >= 3 and parts[1] in ("stop", "resume") and parts[2].isdigit():
+        broadcast_id = int(parts[2])
+        if parts[1] == "stop":
+            ok = broadcast.cancel(broadcast_id)
+            await message.answer(f"⛔ Рассылка #{broadcast_id} будет остановлена" if ok else "❌ Такая рассылка сейчас не идёт")
+        else:
+            job = await broadcast.resume(broadcast_id)
+            await message.answer(f"▶️ Рассылка #{broadcast_id} продолжена" if job else "❌ Нечего продолжать")
+        return
+    jobs = await broadcast.recent()
+    text = "\n\n".join(job.progress_text() for job in jobs) or "Рассылок ещё не было"
+    await message.answer(text, parse_mode="HTML")
+
+
+@texts.prefix("+опыт")
+async def admin_add_xp_command(message: types.Message):
+    """Админская команда для выдачи опыта. Формат: +опыт <количество>"""
+    from main import ADMIN_ID
+    if not message.from_user:
+        return
+    
+    user_id = message.from_user.id
+    
+    # Проверяем права администратора
+    if user_id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды!")
+        return
+    
+    try:
+        # Парсим количество опыта
+        text = message.text.strip()
+        parts = text.split()
+        
+        if len(parts) < 2:
+            await message.answer("❌ Укажите количество опыта!\nФормат: +опыт <количество>\nПример: +опыт 5000")
+            return
+        
+        xp_amount = int(parts[1])
+        
+        if xp_amount <= 0:
+            await message.answer("❌ Количество опыта должно быть положительным числом!")
+            return
+        
+        # Добавляем опыт через основную БД
+        result = add_xp(user_id, xp_amount)
+        
+        # Формируем ответ
+        result_text = f"✅ <b>Опыт добавлен!</b>\n\n"
+        result_text += f"➕ Получено опыта: <b>{xp_amount}</b>\n"
+        result_text += f"📊 Текущий опыт: <b>{result['xp']}/5000</b>\n"
+        result_text += f"⭐ Уровень: <b>{result['level']}</b>"
+        
+        if result['leveled_up']:
+            result_text += f"\n\n🎉 <b>ПОВЫШЕНИЕ УРОВНЯ!</b>"
+            result_text += f"\nПолучено уровней: <b>+{result['levels_gained']}</b>"
+            result_text += f"\n🎁 Наград к получению: <b>{result['pending_rewards']}</b>"
+        
+        await message.answer(result_text, parse_mode='HTML')
+        
+    except ValueError:
+        await message.answer("❌ Неверный формат!\nФормат: +опыт <число>\nПример: +опыт 5000")
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при добавлении опыта: {e}")
+
+
+# Админ-команды: +item/-item в ответ на сообщение — выдать/отобрать предмет у пользователя
+@texts.prefix("+item", "-item", reply=True, ignore_case=False)
+async def admin_give_item(message: types.Message):
+    from main import ADMIN_ID, DATABASE_FILE, ITEMS_CONFIG
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("Нет доступа.")
+        return
+
+    parts = message.text.split()
+    if len(parts) < 3:
+        await message.reply("Формат: +item item_id count или -item item_id count")
+        return
+
+    operation = "add" if parts[0] == "+item" else "remove"
+    item_id = parts[1]
+    try:
+        count = int(parts[2])
+    except Exception:
+        await message.reply("Количество должно быть числом.")
+        return
+
+    if item_id not in ITEMS_CONFIG:
+        await message.reply("❌ Такого предмета нет в конфиге")
+        return
+
+    if not message.reply_to_message or not message.reply_to_message.from_user:
+        await message.reply("Нужно ответить на сообщение пользователя.")
+        return
+
+    target = message.reply_to_message.from_user
+    display = getattr(target, 'full_name', None) or (f"@{getattr(target, 'username', None)}" if getattr(target, 'username', None) else str(getattr(target, 'id', 'unknown')))
+    
+    # Для животных — работаем с owned_animals как с индивидуальными сущностями
+    if ITEMS_CONFIG[item_id].get('category') == 'animal':
+        from ferma import add_owned_animal
+        if operation == "add":
+            for _ in range(max(0, count)):
+                add_owned_animal(target.id, item_id, last_fed_time=0)
+            await message.reply(f"✅ Пользователю {display} добавлено {count} индивидуальных: {ITEMS_CONFIG[item_id]['name']}")
+        else:
+            # Удаляем указанное количество из owned_animals (первые по id)
+            try:
+                import sqlite3
+                conn = sqlite_pool.connect(DATABASE_FILE)
+                cur = conn.cursor()
+                cur.execute('SELECT id FROM owned_animals WHERE user_id=? AND animal_item_id=? ORDER BY id ASC LIMIT ?', (target.id, item_id, count))
+                ids = [row[0] for row in cur.fetchall()]
+                for oid in ids:
+                    cur.execute('DELETE FROM owned_animals WHERE id=?', (oid,))
+                conn.commit()
+                conn.close()
+                removed = len(ids)
+            except Exception:
+                removed = 0
+            await message.reply(f"🗑️ У пользователя {display} изъято {removed} индивидуальных: {ITEMS_CONFIG[item_id]['name']}")
+    else:
+        if operation == "add":
+            db.add_item(target.id, item_id, count)
+            await message.reply(f"✅ Пользователю {display} выдано {count} x {ITEMS_CONFIG[item_id]['name']}")
+        else:
+            # Для удаления предмета
+            db.remove_item(target.id, item_id, count)
+            await message.reply(f"🗑️ У пользователя {display} изъято {count} x {ITEMS_CONFIG[item_id]['name']}")
+
+
+# Админ-команда: +ban N в ответ на сообщение — дать мут в игре на N минут (макс 7 дней)
+@texts.prefix("+ban", reply=True, ignore_case=False)
+async def admin_ban(message: types.Message):
+    from main import ADMIN_ID
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("Нет доступа.")
+        return
+
+    parts = message.text.split()
+    if len(parts) < 2:
+        await message.reply("Формат: +ban N (где N - минуты)")
+        return
+
+    try:
+        minutes = int(parts[1])
+    except Exception:
+        await message.reply("Количество минут должно быть числом.")
+        return
+
+    # Максимум 7 дней (10080 минут)
+    if minutes > 10080:
+        await message.reply("Максимальный бан: 7 дней (10080 минут)")
+        return
+
+    if not message.reply_to_message or not message.reply_to_message.from_user:
+        await message.reply("Нужно ответить на сообщение пользователя.")
+        return
+
+    target = message.reply_to_message.from_user
+    display = getattr(target, 'full_name', None) or (f"@{getattr(target, 'username', None)}" if getattr(target, 'username', None) else str(getattr(target, 'id', 'unknown')))
+    
+    # Устанавливаем время окончания бана
+    import time
+    ban_until = int(time.time()) + (minutes * 60)
+    
+    # Добавляем запись о бане в базу данных
+    try:
+        db.add_ban(target.id, ban_until, message.from_user.id, f"Мут на {minutes} минут")
+        
+        hours = minutes // 60
+        mins = minutes % 60
+        time_str = f"{hours} ч {mins} мин" if hours > 0 else f"{minutes} мин"
+        
+        await message.reply(f"🔇 Пользователю {display} выдан мут на {time_str}")
+    except Exception as e:
+        await message.reply(f"❌ Ошибка при выдаче бана: {e}")
@@ -0,0 +1,1224 @@
+"""
+PvP-арена: поиск соперника, раунды и таймауты ходов, результаты, награды за
+уровни, таблица лидеров. Игровая логика — plugins/games/arena.py.
+"""
+import os
+import asyncio
+import random
+from aiogram import Router, types
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile, InputMediaPhoto
+from database import get_user_xp_data, claim_level_reward, generate_random_level_rewards, add_dan, add_kruz
+import tasks as _tasks
+import db_async
+import leaderboard
+import lazy_modules
+import routing
+
+
+router = Router(name="arena")
+callbacks = routing.CallbackRouter()
+router.callback_query.register(callbacks.dispatch, callbacks.filter)
+texts = routing.TextRouter()
+
+arena = lazy_modules.lazy('plugins.games.arena')
+
+
+# Обработчик кнопки "Играть с ботом"
+@callbacks.on("arena_play_with_bot")
+async def arena_play_with_bot_callback(callback: types.CallbackQuery):
+    """Немедленно начать игру с ботом"""
+    from main import bot, safe_edit_text_or_caption
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    username = getattr(callback.from_user, 'username', None) or f"ID:{user_id}"
+    
+    # Удаляем из очереди если есть
+    arena.remove_from_arena_queue(user_id)
+    
+    # Создаем бота-противника
+    import random
+    bot_names = ["БотВоин", "КиберБоец", "Арена-Бот", "СталБот", "МехВоин"]
+    bot_name = random.choice(bot_names)
+    
+    # Создаем игру с ботом
+    player_data = {'user_id': user_id, 'username': username}
+    bot_data = {
+        'user_id': -abs(user_id),  # Отрицательный ID для бота
+        'username': bot_name
+    }
+    
+    game_id = arena.create_arena_game(player_data, bot_data, 0)
+    game = arena.get_arena_game(game_id)
+    
+    # ВАЖНО: Сохраняем информацию о чате для результата
+    if callback.message and callback.message.chat:
+        game.source_chat_id = callback.message.chat.id
+        game.source_message_id = callback.message.message_id
+    
+    # Уведомляем в чате что бой с ботом начался
+    await safe_edit_text_or_caption(
+        callback.message, 
+        f"🤖 <b>БОЙ С БОТОМ НАЧАЛСЯ!</b>\n\n👤 {username} VS 🤖 {bot_name}\n\n🔄 Бой проходит в личных сообщениях\n📢 Результат будет показан здесь", 
+        reply_markup=None, 
+        parse_mode="HTML"
+    )
+    
+    # Отправляем интерфейс игры в ЛС игроку
+    try:
+        text = f"🤖 <b>БОЙ С БОТОМ!</b>\n\n"
+        text += f"🎯 Противник: {bot_name}\n\n"
+        text += game.get_arena_display(user_id)
+        
+        keyboard = game.get_keyboard(user_id)
+        
+        msg = await bot.send_message(
+            chat_id=user_id,
+            text=text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+        
+        game.message_ids[user_id] = msg.message_id
+        
+        # Запускаем ИИ бота
+        import asyncio
+        asyncio.create_task(arena.bot_arena_ai(game_id, bot_data['user_id']))
+        
+    except Exception as e:
+        print(f"Ошибка создания игры с ботом: {e}")
+        await callback.answer("❌ Ошибка создания игры", show_alert=True)
+        return
+    
+    # Обновляем интерфейс в меню
+    text = f"🤖 <b>БОЙ С БОТОМ НАЧАЛСЯ!</b>\n\n"
+    text += f"⚔️ Противник: {bot_name}\n"
+    text += f"📱 Бой проходит в личных сообщениях\n\n"
+    text += "💡 Перейдите в ЛС с ботом для игры!"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ В меню", callback_data=f"open_game_menu:{user_id}")]
+    ])
+    
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer("🤖 Бой с ботом начался!")
+
+
+# --- АРЕНА PvP ---
+
+@texts.exact("арена", "arena")
+async def arena_handler(message: types.Message):
+    """Основное меню арены"""
+    from main import increment_games_count, safe_ensure_user
+    increment_games_count()
+    if not getattr(message, 'from_user', None):
+        return
+    
+    user_id = message.from_user.id
+    username = getattr(message.from_user, 'username', None) or f"ID:{user_id}"
+    safe_ensure_user(user_id, username)
+    
+    # Получаем рейтинг игрока
+    rating_data = arena.get_arena_rating(user_id)
+    
+    # Определяем лигу
+    rating = rating_data['rating']
+    if rating < 1000:
+        league = "🥉 Новичок"
+    elif rating < 1500:
+        league = "🥈 Боец"
+    elif rating < 2000:
+        league = "🥇 Воин"
+    elif rating < 2500:
+        league = "💎 Мастер"
+    else:
+        league = "👑 Легенда"
+    
+    text = f"🏟️ <b>АРЕНА KRUZCHAT</b> 🏟️\n\n"
+    text += f"⚔️ <b>Тактические PvP бои!</b>\n"
+    text += f"Сражайтесь в пошаговых боях, используя атаку, защиту и лечение. Каждое решение влияет на исход битвы!\n\n"
+    text += f"🏆 <b>Ваш профиль:</b>\n"
+    text += f"📊 Рейтинг: <b>{rating} PTS</b> ({league})\n"
+    text += f"🏆 Побед: <b>{rating_data['wins']}</b>\n"
+    text += f"💔 Поражений: <b>{rating_data['losses']}</b>\n"
+    
+    if rating_data['win_streak'] > 0:
+        text += f"🔥 Серия побед: <b>{rating_data['win_streak']}</b>\n"
+    
+    text += f"\n🎯 <b>Как играть:</b>\n"
+    text += f"• Каждый ход выбирайте действие\n"
+    text += f"• ⚔️ <b>Атака</b>: наносит урон (15-25)\n"
+    text += f"• 🛡️ <b>Защита</b>: дает броню и шанс уклонения\n"
+    text += f"• 💚 <b>Лечение</b>: восстанавливает HP (5-10%)\n"
+    text += f"• 💥 <b>Комбо</b>: 3 одинаковых действия = спецэффект!\n\n"
+    text += f"⏱️ Время боя: 10 минут\n"
+    text += f"❤️ HP: 100 | Критические удары: 15%"
+    
+    # Проверяем, не в очереди ли уже игрок
+    in_queue = user_id in arena.arena_queue
+    in_game = any(game.fighter1.user_id == user_id or game.fighter2.user_id == user_id 
+                  for game in arena.active_arenas.values() if game.is_active)
+    
+    keyboard = []
+    
+    if in_game:
+        keyboard.append([InlineKeyboardButton(text="⚔️ Вернуться в бой", callback_data="arena_return_to_game")])
+        keyboard.append([InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot")])
+    elif in_queue:
+        keyboard.append([InlineKeyboardButton(text="⏳ Отменить поиск", callback_data="arena_cancel_search")])
+        keyboard.append([InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot")])
+    else:
+        keyboard.append([
+            InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot"),
+            InlineKeyboardButton(text="🔍 Найти бой", callback_data="arena_find_match")
+        ])
+    
+    keyboard.extend([
+        [InlineKeyboardButton(text="🎁 Забрать приз (скоро)", callback_data="arena_claim_level_reward")],
+        [InlineKeyboardButton(text="📊 Рейтинг-таблица", callback_data="arena_leaderboard")],
+        [InlineKeyboardButton(text="📋 Статистика", callback_data="arena_my_stats"), InlineKeyboardButton(text="❓ Справка", callback_data="arena_help")]
+    ])
+    
+    await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="HTML")
+
+
+# Обработчики callback арены
+async def start_arena_match(player: dict, opponent: dict):
+    """Начать бой двух игроков, найденных подбором из очереди.
+    player - вошедший в очередь позже, его экран поиска превращается в сообщение о бое."""
+    from main import bot
+    player1_data = {'user_id': player['user_id'], 'username': player['username']}
+    player2_data = {'user_id': opponent['user_id'], 'username': opponent['username']}
+    
+    game_id = arena.create_arena_game(player1_data, player2_data, player.get('bet', 0))
+    game = arena.get_arena_game(game_id)
+    
+    # ВАЖНО: Сохраняем информацию о чате для результата
+    if player.get('chat_id') and player.get('message_id'):
+        game.source_chat_id = player['chat_id']
+        game.source_message_id = player['message_id']
+    
+    # Уведомляем в чате что бой начался (экраны поиска обоих игроков)
+    started_text = f"⚔️ <b>БОЙ НАЧАЛСЯ!</b>\n\n👤 {player['username']} VS 👤 {opponent['username']}\n\n🔄 Бой проходит в личных сообщениях игроков\n📢 Результат будет показан здесь"
+    for searcher in (player, opponent):
+        if not (searcher.get('chat_id') and searcher.get('message_id')):
+            continue
+        try:
+            await bot.edit_message_text(started_text, chat_id=searcher['chat_id'], message_id=searcher['message_id'], parse_mode="HTML")
+        except Exception:
+            try:
+                await bot.edit_message_caption(chat_id=searcher['chat_id'], message_id=searcher['message_id'], caption=started_text, parse_mode="HTML")
+            except Exception:
+                pass
+    
+    # Отправляем интерфейс игры в ЛС каждому игроку
+    for fighter in [game.fighter1, game.fighter2]:
+        try:
+            text = game.get_arena_display(fighter.user_id)
+            keyboard = game.get_keyboard(fighter.user_id)
+            
+            # Отправляем в ЛС игрока
+            msg = await bot.send_message(
+                chat_id=fighter.user_id,
+                text=f"⚔️ <b>АРЕНА - БОЙ НАЧАЛСЯ!</b>\n\n{text}",
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
+            
+            # Сохраняем ID сообщения для обновлений
+            game.message_ids[fighter.user_id] = msg.message_id
+            
+        except Exception as e:
+            print(f"Ошибка отправки сообщения в ЛС игроку {fighter.user_id}: {e}")
+            # Если не удалось отправить в ЛС - уведомляем игрока
+            try:
+                await bot.send_message(
+                    chat_id=fighter.user_id,
+                    text="❌ Не удалось начать бой. Убедитесь что у бота есть доступ к личным сообщениям!"
+                )
+            except:
+                pass
+
+
+@callbacks.on("arena_find_match")
+async def arena_find_match_callback(callback: types.CallbackQuery):
+    """Начать поиск матча (пару подбирает фоновая задача arena_matchmaker)"""
+    from main import safe_edit_text_or_caption
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    username = getattr(callback.from_user, 'username', None) or f"ID:{user_id}"
+    
+    # Проверяем, не в игре ли уже
+    in_game = any(game.fighter1.user_id == user_id or game.fighter2.user_id == user_id 
+                  for game in arena.active_arenas.values() if game.is_active)
+    
+    if in_game:
+        await callback.answer("❌ Вы уже в игре!", show_alert=True)
+        return
+    
+    chat_id = callback.message.chat.id if callback.message and callback.message.chat else None
+    message_id = callback.message.message_id if callback.message else None
+    
+    # Добавляем в очередь
+    if arena.add_to_arena_queue(user_id, username, 0, chat_id=chat_id, message_id=message_id):  # Пока без ставок
+        # Показываем экран поиска
+        text = "🔍 <b>ПОИСК ПРОТИВНИКА</b>\n\n"
+        text += "⏳ Ищем достойного соперника...\n"
+        text += f"🎯 Ваш рейтинг: {arena.arena_queue.get(user_id)['rating']} PTS\n\n"
+        text += "⚡ Поиск может занять до 30 минут\n"
+        text += "🤖 После этого начнется бой с ботом"
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отменить поиск", callback_data="arena_cancel_search")]
+        ])
+        
+        await safe_edit_text_or_caption(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+        await callback.answer("🔍 Поиск начат!")
+    else:
+        await callback.answer("❌ Вы уже в очереди!", show_alert=True)
+
+
+@callbacks.on("arena_cancel_search")
+async def arena_cancel_search_callback(callback: types.CallbackQuery):
+    """Отменить поиск"""
+    from main import safe_edit_text_or_caption, safe_ensure_user
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    
+    if arena.remove_from_arena_queue(user_id):
+        # Сразу возвращаем в меню арены
+        username = getattr(callback.from_user, 'username', None) or f"ID:{user_id}"
+        safe_ensure_user(user_id, username)
+        
+        # Получаем рейтинг игрока
+        rating_data = arena.get_arena_rating(user_id)
+        
+        # Определяем лигу
+        rating = rating_data['rating']
+        if rating < 1000:
+            league = "🥉 Новичок"
+        elif rating < 1500:
+            league = "🥈 Боец"
+        elif rating < 2000:
+            league = "🥇 Воин"
+        elif rating < 2500:
+            league = "💎 Мастер"
+        else:
+            league = "👑 Легенда"
+
+        text = f"🏟️ <b>АРЕНА KRUZCHAT</b> 🏟️\n\n"
+        text += f"⚔️ <b>Тактические PvP бои!</b>\n"
+        text += f"Сражайтесь в пошаговых боях, используя атаку, защиту и лечение. Каждое решение влияет на исход битвы!\n\n"
+        text += f"🏆 <b>Ваш профиль:</b>\n"
+        text += f"📊 Рейтинг: <b>{rating} PTS</b> ({league})\n"
+        text += f"🏆 Побед: <b>{rating_data['wins']}</b>\n"
+        text += f"💔 Поражений: <b>{rating_data['losses']}</b>\n"
+        
+        if rating_data['win_streak'] > 0:
+            text += f"🔥 Серия побед: <b>{rating_data['win_streak']}</b>\n"
+        
+        text += f"\n🎯 <b>Как играть:</b>\n"
+        text += f"• Каждый ход выбирайте действие\n"
+        text += f"• ⚔️ <b>Атака</b>: наносит урон (15-25)\n"
+        text += f"• 🛡️ <b>Защита</b>: дает броню и шанс уклонения\n"
+        text += f"• 💚 <b>Лечение</b>: восстанавливает HP (5-10%)\n"
+        text += f"• 💥 <b>Комбо</b>: 3 одинаковых действия = спецэффект!\n\n"
+        text += f"⏱️ Время боя: 10 минут\n"
+        text += f"❤️ HP: 100 | Критические удары: 15%"
+        
+        keyboard = []
+        
+        # Проверяем, не в игре ли уже
+        in_game = any(game.fighter1.user_id == user_id or game.fighter2.user_id == user_id 
+                      for game in arena.active_arenas.values() if game.is_active)
+        
+        if in_game:
+            keyboard.append([InlineKeyboardButton(text="⚔️ Вернуться к бою", callback_data="arena_return_to_game")])
+            keyboard.append([InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot")])
+        else:
+            keyboard.append([
+                InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot"),
+                InlineKeyboardButton(text="🔍 Найти бой", callback_data="arena_find_match")
+            ])
+        
+        keyboard.extend([
+            [InlineKeyboardButton(text="📊 Рейтинг-таблица", callback_data="arena_leaderboard")],
+            [InlineKeyboardButton(text="📋 Статистика", callback_data="arena_my_stats"), InlineKeyboardButton(text="❓ Справка", callback_data="arena_help")]
+        ])
+        
+        await safe_edit_text_or_caption(callback.message, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="HTML")
+        await callback.answer("❌ Поиск отменен")
+    else:
+        try:
+            await callback.answer("❌ Вы не в очереди", show_alert=True)
+        except Exception:
+            pass  # Игнорируем устаревшие callback'и
+
+
+async def finish_arena_round(game_id: str):
+    """Обработать раунд, если оба игрока выбрали действие: завершить бой или обновить интерфейсы"""
+    from main import bot
+    game = arena.get_arena_game(game_id)
+    # Раунд мог уже обработать другой обработчик (например, таймаут хода во время паузы)
+    if not game or not game.is_active or not game.both_players_ready():
+        return
+    
+    round_result, game_ended = game.process_round()
+    if game_ended:
+        game.is_active = False
+        result_data = arena.end_arena_game(game_id)
+        if result_data:
+            await send_arena_game_result(result_data)
+        return
+    
+    # Обновляем интерфейс у ОБОИХ игроков после раунда
+    for fighter in [game.fighter1, game.fighter2]:
+        if fighter and fighter.user_id in game.message_ids:
+            try:
+                text = game.get_arena_display(fighter.user_id)
+                keyboard = game.get_keyboard(fighter.user_id)
+                
+                await bot.edit_message_text(
+                    chat_id=fighter.user_id,
+                    message_id=game.message_ids[fighter.user_id],
+                    text=text,
+                    reply_markup=keyboard,
+                    parse_mode="HTML"
+                )
+                print(f"🎮 Интерфейс обновлен для игрока {fighter.user_id}")
+            except Exception as e:
+                print(f"🎮 Ошибка обновления интерфейса для игрока {fighter.user_id}: {e}")
+    
+    # После раунда снова проверяем нужно ли запустить бота
+    for fighter in [game.fighter1, game.fighter2]:
+        if fighter.user_id < 0 and game.waiting_for.get(fighter.user_id) is None:
+            asyncio.create_task(arena.bot_arena_ai(game_id, fighter.user_id))
+
+
+async def arena_turn_timed_out(game_id: str):
+    """Игрок не выбрал действие за TURN_TIMEOUT секунд - за него выбирается защита"""
+    game = arena.get_arena_game(game_id)
+    if not game or not game.is_active:
+        return
+    if game.is_expired():
+        # Время боя вышло - бой завершит таймер боя
+        return
+    for fighter in [game.fighter1, game.fighter2]:
+        if game.waiting_for.get(fighter.user_id) is None:
+            if fighter.user_id < 0:
+                # Бот ходит сам
+                asyncio.create_task(arena.bot_arena_ai(game_id, fighter.user_id))
+                continue
+            arena.process_arena_action(game_id, fighter.user_id, "defend")
+            print(f"⏰ Арена {game_id}: игрок {fighter.user_id} не успел сходить, выбрана защита")
+    if game.both_players_ready():
+        await finish_arena_round(game_id)
+    else:
+        arena.start_turn_timer(game_id)
+
+
+@callbacks.on("arena_action:*")
+async def arena_action_callback(callback: types.CallbackQuery):
+    """Обработка действий в арене"""
+    from main import safe_edit_text_or_caption
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    parts = callback.data.split(":")
+    game_id = parts[1]
+    action = parts[2]
+    user_id = callback.from_user.id
+    
+    print(f"🎮 Arena action: user={user_id}, game={game_id}, action={action}")
+    
+    success, result = arena.process_arena_action(game_id, user_id, action)
+    
+    if not success:
+        await callback.answer(f"❌ {result}", show_alert=True)
+        return
+    
+    game = arena.get_arena_game(game_id)
+    if not game:
+        await callback.answer("❌ Игра не найдена", show_alert=True)
+        return
+    
+    # Сохраняем message_id для дальнейших обновлений
+    if callback.message and callback.message.message_id:
+        game.message_ids[user_id] = callback.message.message_id
+    
+    # Сразу обновляем интерфейс с новым статусом
+    text = game.get_arena_display(user_id)
+    keyboard = game.get_keyboard(user_id)
+    
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+    
+    print(f"🎮 Проверяем готовность игроков: {game.both_players_ready()}")
+    
+    # Проверяем есть ли бот в игре и нужно ли его запустить
+    opponent = game.get_opponent(user_id)
+    if opponent:
+        print(f"🎮 Противник найден: ID={opponent.user_id}, username={opponent.username}")
+        if opponent.user_id < 0:  # Это бот
+            # Если бот еще не выбрал действие - запускаем его ИИ
+            if game.waiting_for.get(opponent.user_id) is None:
+                print(f"🎮 Запускаем ИИ бота {opponent.user_id} для игры {game_id}")
+                asyncio.create_task(arena.bot_arena_ai(game_id, opponent.user_id))
+            else:
+                print(f"🎮 Бот {opponent.user_id} уже выбрал действие")
+        else:
+            print(f"🎮 Противник это игрок (ID={opponent.user_id}), не бот")
+    else:
+        print(f"🎮 Противник не найден")
+    
+    # Если оба игрока выбрали действие - мгновенно обрабатываем раунд  
+    if game.both_players_ready():
+        print(f"🎮 Оба игрока готовы в игре {game_id}, обрабатываем раунд")
+        # Небольшая пауза чтобы игрок увидел выборы
+        await asyncio.sleep(1)
+        await finish_arena_round(game_id)
+    
+    try:
+        await callback.answer()
+    except Exception:
+        pass  # Игнорируем устаревшие callback'и
+
+
+async def send_arena_game_result(result_data):
+    """Отправить результат игры в арену - в ЛС и в исходный чат"""
+    from main import bot
+    game = result_data['game']
+    
+    # Удаляем интерфейс игры у обоих игроков
+    for fighter in [game.fighter1, game.fighter2]:
+        if fighter and fighter.user_id in game.message_ids:
+            try:
+                await bot.delete_message(
+                    chat_id=fighter.user_id,
+                    message_id=game.message_ids[fighter.user_id]
+                )
+                print(f"✅ Удалено сообщение с интерфейсом арены у игрока {fighter.user_id}")
+            except Exception as e:
+                print(f"❌ Не удалось удалить сообщение у игрока {fighter.user_id}: {e}")
+    
+    if result_data['is_draw']:
+        # Текст для ЛС игроков
+        result_text_dm = f"🤝 <b>НИЧЬЯ В АРЕНЕ!</b>\n\n"
+        result_text_dm += f"👤 {game.fighter1.username}: {game.fighter1.get_hp_bar()}\n"
+        result_text_dm += f"👤 {game.fighter2.username}: {game.fighter2.get_hp_bar()}\n\n"
+        result_text_dm += f"⏰ Время истекло! Бой завершен ничьей.\n"
+        result_text_dm += f"🏆 Рейтинг игроков не изменился"
+        
+        # Отправляем в ЛС каждому игроку
+        for fighter in [game.fighter1, game.fighter2]:
+            try:
+                await bot.send_message(
+                    chat_id=fighter.user_id,
+                    text=result_text_dm,
+                    parse_mode="HTML"
+                )
+            except Exception as e:
+                print(f"Ошибка отправки результата игроку {fighter.user_id}: {e}")
+        
+        # Текст для исходного чата
+        chat_result_text = f"🤝 <b>НИЧЬЯ В АРЕНЕ!</b>\n\n👤 {game.fighter1.username} VS 👤 {game.fighter2.username}\n\n⏰ Время истекло!"
+        
+    else:
+        winner = result_data['winner']
+        loser = result_data['loser']
+        winner_pts = result_data['winner_pts']
+        loser_pts = result_data['loser_pts']
+        
+        # Отслеживаем победу для заданий (проверяем, что оба игрока - люди)
+        is_pvp = winner.user_id > 0 and loser.user_id > 0
+        if winner.user_id > 0:
+            try:
+                _tasks.record_arena_win(winner.user_id, vs_real=is_pvp)
+            except Exception as e:
+                print(f"❌ Ошибка записи победы в арене для {winner.user_id}: {e}")
+        
+        # Текст для ЛС победителя
+        winner_text = f"🏆 <b>ПОБЕДА В АРЕНЕ!</b>\n\n"
+        winner_text += f"⚔️ Вы победили {loser.username}!\n\n"
+        winner_text += f"📊 <b>Результат боя:</b>\n"
+        winner_text += f"🟢 Вы: {winner.get_hp_bar()}\n"
+        winner_text += f"🔴 Противник: {loser.get_hp_bar()}\n\n"
+        winner_text += f"🏆 <b>Рейтинг:</b> +{winner_pts} PTS\n"
+        
+        # Начисляем опыт за победу (ежедневный бонус 1 раз в день)
+        try:
+            from arena_database import register_win_xp as _arena_win_xp
+            xp_info = _arena_win_xp(winner.user_id)
+            winner_text += f"📘 <b>Опыт:</b> +{xp_info['xp_gain']} XP\n"
+            winner_text += f"🎚️ <b>Уровень:</b> {xp_info['level']} | Прогресс: {xp_info['xp']}/5000\n"
+            if xp_info.get('leveled_up'):
+                winner_text += "🎉 <b>Уровень повышен!</b> Доступна награда в меню арены.\n"
+        except Exception as e:
+            print(f"⚠️ Ошибка начисления опыта в арене: {e}")
+        
+        # Текст для ЛС проигравшего
+        loser_text = f"💔 <b>ПОРАЖЕНИЕ В АРЕНЕ</b>\n\n"
+        loser_text += f"⚔️ Вы проиграли {winner.username}\n\n"
+        loser_text += f"📊 <b>Результат боя:</b>\n"
+        loser_text += f"🔴 Вы: {loser.get_hp_bar()}\n"
+        loser_text += f"🟢 Противник: {winner.get_hp_bar()}\n\n"
+        loser_text += f"📉 <b>Рейтинг:</b> {loser_pts} PTS\n"
+        loser_text += f"💪 Не сдавайтесь! Реванш всегда возможен!"
+        
+        # Кнопка возврата в меню арены
+        arena_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🎁 Забрать приз (скоро)", callback_data="arena_claim_level_reward")],
+            [InlineKeyboardButton(text="⬅️ В меню арены", callback_data="arena_back_to_menu")]
+        ])
+        
+        # Отправляем в ЛС игрокам
+        try:
+            await bot.send_message(
+                chat_id=winner.user_id,
+                text=winner_text,
+                reply_markup=arena_keyboard,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"Ошибка отправки результата победителю {winner.user_id}: {e}")
+            
+        try:
+            await bot.send_message(
+                chat_id=loser.user_id,
+                text=loser_text,
+                reply_markup=arena_keyboard,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"Ошибка отправки результата проигравшему {loser.user_id}: {e}")
+        
+        # Текст для исходного чата
+        chat_result_text = f"🏆 <b>ПОБЕДА В АРЕНЕ!</b>\n\n👤 **{winner.username}** победил 👤 {loser.username}\n\n🎉 Поздравляем победителя!"
+    
+    # Отправляем результат в исходный чат (если есть информация о нем)
+    if hasattr(game, 'source_chat_id') and game.source_chat_id and hasattr(game, 'source_message_id') and game.source_message_id:
+        try:
+            await bot.edit_message_text(
+                chat_id=game.source_chat_id,
+                message_id=game.source_message_id,
+                text=chat_result_text,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"Ошибка отправки результата в исходный чат {game.source_chat_id}: {e}")
+            # Если не удалось отредактировать, отправляем новое сообщение
+            try:
+                await bot.send_message(
+                    chat_id=game.source_chat_id,
+                    text=chat_result_text,
+                    parse_mode="HTML"
+                )
+            except Exception as e2:
+                print(f"Ошибка отправки нового сообщения в чат {game.source_chat_id}: {e2}")
+
+
+@callbacks.on("arena_leaderboard")
+async def arena_leaderboard_callback(callback: types.CallbackQuery):
+    """Показать таблицу лидеров"""
+    from main import format_clickable_name, get_display_names, safe_edit_text_or_caption
+    leaderboard = await db_async.run(arena.get_arena_leaderboard, 10)
+    
+    text = "🏆 <b>ТОП-10 АРЕНЫ</b>\n\n"
+    
+    names = get_display_names([entry.get('user_id', 0) for entry in leaderboard],
+                              {entry.get('user_id', 0): entry.get('username') for entry in leaderboard})
+    for entry in leaderboard:
+        rank_emoji = {1: "🥇", 2: "🥈", 3: "🥉"}.get(entry['rank'], f"{entry['rank']}.")
+        
+        # Определяем лигу
+        rating = entry['rating']
+        if rating < 1000:
+            league = "🥉"
+        elif rating < 1500:
+            league = "🥈"
+        elif rating < 2000:
+            league = "🥇"
+        elif rating < 2500:
+            league = "💎"
+        else:
+            league = "👑"
+        
+        # Получаем отображаемое имя с учетом новой системы
+        user_id = entry.get('user_id', 0)
+        
+        # Используем новую систему отображения имен с приватностью
+        display_name = names[user_id]
+        clickable_name = format_clickable_name(user_id, display_name)
+        text += f"{rank_emoji} {league} {clickable_name}\n"
+        text += f"📊 {entry['rating']} PTS | 🏆{entry['wins']}-💔{entry['losses']}"
+        
+        if entry['win_streak'] > 0:
+            text += f" | 🔥{entry['win_streak']}"
+        
+        text += "\n\n"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🎁 Забрать приз (скоро)", callback_data="arena_claim_level_reward")],
+        [InlineKeyboardButton(text="⬅️ В меню арены", callback_data="arena_back_to_menu")]
+    ])
+    
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+# Временное хранилище для сгенерированных наград (user_id: [item1, item2, item3]) # ГЕНЕРАЦИЯ ПРИЗОВ
+pending_level_rewards_choices = {}
+
+
+def generate_level_reward_image(user_id: int, items: list) -> str:
+    """Генерирует изображение с тремя призами для выбора"""
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+        import os
+        
+        print(f"🔧 [DEBUG] Генерация изображения для user_id={user_id}, items={items}")
+        
+        base_path = "C:/BotKruz/ChatBotKruz/photo/ItemWin.jpg"
+        out_path = f"C:/BotKruz/ChatBotKruz/cache/reward_{user_id}.png"
+        
+        print(f"🔧 [DEBUG] Базовое изображение: {base_path}, существует: {os.path.exists(base_path)}")
+        
+        # Открываем базовое изображение
+        img = Image.open(base_path).convert("RGBA")
+        print(f"🔧 [DEBUG] Базовое изображение открыто, размер: {img.size}")
+        width, height = img.size  # 498x233
+        
+        # Размеры и позиции для 3 слотов (черные квадраты на ItemWin.jpg)
+        slot_size = 130  # Увеличенный размер изображения в слоте
+        slot_width = 140  # Ширина черного квадрата
+        slot_y = 18  # Вертикальная позиция от верха (выше на 12)
+        
+        # Позиции 3 черных квадратов (координаты левого верхнего угла квадрата)
+        slot_positions = [
+            (19, slot_y),           # Слот 1 (левый, идеально)
+            (181, slot_y),          # Слот 2 (центральный, на 1 пиксель влево)
+            (351, slot_y)           # Слот 3 (правый, +3 вправо)
+        ]
+        
+        # Отрисовываем каждый приз
+        for i, item in enumerate(items[:3]):
+            if i >= len(slot_positions):
+                break
+            
+            x, y = slot_positions[i]
+            reward_type = item.get('reward_type', 'currency')
+            reward_id = item.get('reward_id', 'dan')
+            
+            # Определяем путь к изображению награды
+            item_image_path = None
+            
+            if reward_type == 'currency':
+                if reward_id == 'dan':
+                    item_image_path = "C:/BotKruz/ChatBotKruz/photo/dan_get.png"
+                elif reward_id == 'pts':
+                    item_image_path = "C:/BotKruz/ChatBotKruz/photo/pts_get.png"
+            elif reward_type == 'item':
+                # Маппинг item_id на изображения
+                item_mappings = {
+                    'case_1': "C:/BotKruz/ChatBotKruz/photo/inv/03.jpg",
+                    'case_2': "C:/BotKruz/ChatBotKruz/photo/inv/02.jpg",
+                    'case_3': "C:/BotKruz/ChatBotKruz/photo/inv/01.jpg",
+                    'пшеница': "C:/BotKruz/ChatBotKruz/photo/inv/bone.jpg",
+                    'кукурудза': "C:/BotKruz/ChatBotKruz/photo/inv/meat.jpg",
+                    'СкладБесконечный': "C:/BotKruz/ChatBotKruz/photo/inv/05.jpg",
+                }
+                item_image_path = item_mappings.get(reward_id, f"C:/BotKruz/ChatBotKruz/photo/inv/{reward_id}.png")
+            elif reward_type == 'special':
+                item_image_path = f"C:/BotKruz/ChatBotKruz/photo/inv/{reward_id}.png"
+            
+            # Если изображение существует, накладываем его
+            if item_image_path and os.path.exists(item_image_path):
+                print(f"🔧 [DEBUG] Слот {i+1}: Загрузка изображения {item_image_path}")
+                try:
+                    item_img = Image.open(item_image_path).convert("RGBA")
+                    
+                    # Масштабируем изображение до увеличенного размера
+                    item_img.thumbnail((slot_size, slot_size), Image.Resampling.LANCZOS)
+                    
+                    # Центрируем изображение внутри черного квадрата
+                    paste_x = x + (slot_width - item_img.width) // 2
+                    paste_y = y + (slot_width - item_img.height) // 2
+                    
+                    print(f"🔧 [DEBUG] Слот {i+1}: Вставка изображения в позицию ({paste_x}, {paste_y}), размер: {item_img.size}")
+                    
+                    # Накладываем на базу
+                    img.paste(item_img, (paste_x, paste_y), item_img)
+                    item_img.close()
+                except Exception as e:
+                    print(f"⚠️ Ошибка загрузки изображения {item_image_path}: {e}")
+        
+        # Каталог раньше создавался при импорте main вместе с кешем картинок
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        img.save(out_path, "PNG")
+        img.close()
+        print(f"✅ [DEBUG] Изображение сохранено: {out_path}, существует: {os.path.exists(out_path)}")
+        return out_path
+    except Exception as e:
+        print(f"⚠️ Ошибка генерации изображения наград: {e}")
+        import traceback
+        traceback.print_exc()
+        # Если ошибка, возвращаем базовое изображение
+        return "C:/BotKruz/ChatBotKruz/photo/ItemWin.jpg"
+
+
+def generate_random_rewards() -> list:
+    """Генерирует 3 случайных награды из базы данных"""
+    # Получаем уровень пользователя (пока используем 1, можно передавать параметром)
+    user_level = 1
+    try:
+        rewards = generate_random_level_rewards(user_level, count=3)
+        return rewards
+    except Exception as e:
+        print(f"⚠️ Ошибка генерации наград: {e}")
+        # Заглушка на случай ошибки
+        return [
+            {"reward_type": "currency", "reward_id": "dan", "reward_amount": 1000, "reward_name": "Дань"},
+            {"reward_type": "currency", "reward_id": "dan", "reward_amount": 2000, "reward_name": "Дань"},
+            {"reward_type": "currency", "reward_id": "dan", "reward_amount": 5000, "reward_name": "Дань"}
+        ]
+
+
+@callbacks.on("arena_claim_level_reward:*")
+async def arena_claim_level_reward_callback(callback: types.CallbackQuery):
+    """Показывает выбор награды за уровень"""
+    try:
+        user_id = int(callback.data.split(":")[1])
+        
+        print(f"🎁 [DEBUG] arena_claim_level_reward_callback вызван для user_id={user_id}")
+        
+        # Проверяем наличие наград
+        xp_data = get_user_xp_data(user_id)
+        pending_rewards = xp_data.get('pending_level_rewards', 0)
+        user_level = xp_data.get('level', 1)
+        
+        print(f"🎁 [DEBUG] XP данные: level={user_level}, pending_rewards={pending_rewards}")
+        
+        if pending_rewards <= 0:
+            await callback.answer("У вас нет наград для получения!", show_alert=True)
+            return
+        
+        # Генерируем 3 случайных награды на основе уровня игрока
+        rewards = generate_random_level_rewards(user_level, count=3)
+        pending_level_rewards_choices[user_id] = rewards
+        
+        print(f"🎁 [DEBUG] Сгенерированы награды: {rewards}")
+        
+        # Создаем изображение
+        image_path = generate_level_reward_image(user_id, rewards)
+        
+        print(f"🎁 [DEBUG] Путь к сгенерированному изображению: {image_path}")
+        
+        # Создаем клавиатуру
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text="1", callback_data=f"arena_select_reward:0:{user_id}"),
+                InlineKeyboardButton(text="2", callback_data=f"arena_select_reward:1:{user_id}"),
+                InlineKeyboardButton(text="3", callback_data=f"arena_select_reward:2:{user_id}")
+            ],
+            [
+                InlineKeyboardButton(text="◀️ Назад в меню", callback_data="main_menu")
+            ]
+        ])
+        
+        # Отправляем сообщение с выбором
+        caption = f"🎁 Награда за повышение уровня!\n\nВыберите один из трёх призов:"
+        
+        try:
+            await callback.message.edit_media(
+                media=InputMediaPhoto(media=FSInputFile(image_path), caption=caption),
+                reply_markup=keyboard
+            )
+        except Exception:
+            await callback.message.answer_photo(
+                photo=FSInputFile(image_path),
+                caption=caption,
+                reply_markup=keyboard
+            )
+        
+        await callback.answer()
+        
+    except Exception as e:
+        await callback.answer("Произошла ошибка при получении награды", show_alert=True)
+
+
+@callbacks.on("arena_select_reward:*")
+async def arena_select_reward_callback(callback: types.CallbackQuery):
+    """Обрабатывает выбор конкретной награды"""
+    from main import show_main_menu
+    try:
+        parts = callback.data.split(":")
+        choice = parts[1]  # "0", "1", "2" или "random"
+        user_id = int(parts[2])
+        
+        # Проверяем, что выбор делает тот же пользователь
+        if callback.from_user.id != user_id:
+            await callback.answer("Это не ваша награда!", show_alert=True)
+            return
+        
+        # Проверяем наличие сохраненных наград
+        if user_id not in pending_level_rewards_choices:
+            await callback.answer("Награды не найдены. Попробуйте снова.", show_alert=True)
+            return
+        
+        rewards = pending_level_rewards_choices[user_id]
+        
+        # Выбираем награду
+        if choice == "random":
+            import random
+            selected_reward = random.choice(rewards)
+            choice_text = "🎲 рандомный выбор"
+        else:
+            idx = int(choice)
+            selected_reward = rewards[idx]
+            choice_text = f"#{idx + 1}"
+        
+        # Выдаем награду в зависимости от типа
+        reward_text = f"Вы получили: {selected_reward['reward_name']}"
+        
+        if selected_reward['reward_type'] == 'currency':
+            # Выдаем валюту
+            amount = selected_reward['reward_amount']
+            currency_id = selected_reward['reward_id']
+            
+            if currency_id == 'dan':
+                add_dan(user_id, amount)
+                reward_text = f"🪙 Дань x{amount}"
+            elif currency_id == 'kruz':
+                add_kruz(user_id, amount)
+                reward_text = f"⭐ Stars x{amount}"
+            elif currency_id == 'pts':
+                # Добавляем PTS в арену
+                try:
+                    import arena_database
+                    current_rating = arena_database.get_player_rating(user_id)
+                    new_rating = current_rating['rating'] + amount
+                    arena_database.update_player_rating(user_id, new_rating)
+                    reward_text = f"🏆 PTS x{amount}"
+                except Exception as e:
+                    print(f"⚠️ Ошибка добавления PTS: {e}")
+                    reward_text = f"🏆 PTS x{amount} (ошибка)"
+            
+        elif selected_reward['reward_type'] == 'item':
+            # Выдаем предмет в инвентарь
+            item_id = selected_reward['reward_id']
+            amount = selected_reward['reward_amount']
+            
+            try:
+                from inv_py.inventory import add_item_to_json_db
+                add_item_to_json_db(item_id, amount)
+                reward_text = f"📦 {selected_reward['reward_name']} x{amount}"
+            except Exception as e:
+                print(f"⚠️ Ошибка выдачи предмета {item_id}: {e}")
+                reward_text = f"📦 {selected_reward['reward_name']} x{amount} (ошибка)"
+                
+        elif selected_reward['reward_type'] == 'special':
+            # Специальные награды (бесконечная ферма и т.д.)
+            special_id = selected_reward['reward_id']
+            
+            if special_id == 'infinite_farm':
+                # Здесь будет код для бесконечной фермы
+                reward_text = f"🌟 {selected_reward['reward_name']} (скоро)"
+            else:
+                reward_text = f"✨ {selected_reward['reward_name']}"
+        
+        # Уменьшаем счетчик наград в БД (используем основную БД, не арену)
+        claim_level_reward(user_id)
+        
+        # Удаляем из временного хранилища
+        del pending_level_rewards_choices[user_id]
+        
+        # Показываем результат и возвращаем в главное меню
+        await callback.answer(f"✅ {reward_text}", show_alert=True)
+        await show_main_menu(callback, user_id)
+        
+    except Exception as e:
+        await callback.answer("Произошла ошибка при выборе награды", show_alert=True)
+
+
+@callbacks.on("arena_return_to_game")
+async def arena_return_to_game_callback(callback: types.CallbackQuery):
+    """Вернуться в активный бой"""
+    from main import bot
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    
+    # Ищем активную игру пользователя
+    user_game = None
+    for game in arena.active_arenas.values():
+        if game.is_active and (game.fighter1.user_id == user_id or game.fighter2.user_id == user_id):
+            user_game = game
+            break
+    
+    if not user_game:
+        await callback.answer("❌ Активная игра не найдена", show_alert=True)
+        return
+    
+    # Отправляем текущее состояние игры в ЛС
+    try:
+        text = user_game.get_arena_display(user_id)
+        keyboard = user_game.get_keyboard(user_id)
+        
+        msg = await bot.send_message(
+            chat_id=user_id,
+            text=text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+        
+        # Обновляем ID сообщения
+        user_game.message_ids[user_id] = msg.message_id
+        
+        await callback.answer("⚔️ Возвращаемся в бой!")
+        
+    except Exception as e:
+        print(f"Ошибка возврата в игру: {e}")
+        await callback.answer("❌ Ошибка возврата в игру", show_alert=True)
+
+
+@callbacks.on("arena_back_to_menu")
+async def arena_back_to_menu_callback(callback: types.CallbackQuery):
+    """Вернуться в меню арены"""
+    from main import safe_edit_text_or_caption
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    
+    # Получаем рейтинг игрока  
+    rating_data = arena.get_arena_rating(user_id)
+    
+    # Определяем лигу
+    rating = rating_data['rating']
+    if rating < 1000:
+        league = "🥉 Новичок"
+    elif rating < 1500:
+        league = "🥈 Боец"
+    elif rating < 2000:
+        league = "🥇 Воин"
+    elif rating < 2500:
+        league = "💎 Мастер"
+    else:
+        league = "👑 Легенда"
+
+    # Создаем меню арены (заменяем текущее сообщение)
+    text = f"🏟️ <b>АРЕНА KRUZCHAT</b> 🏟️\n\n"
+    text += f"⚔️ <b>Тактические PvP бои!</b>\n"
+    text += f"Сражайтесь в пошаговых боях, используя атаку, защиту и лечение. Каждое решение влияет на исход битвы!\n\n"
+    text += f"🏆 <b>Ваш профиль:</b>\n"
+    text += f"📊 Рейтинг: <b>{rating} PTS</b> ({league})\n"
+    text += f"🏆 Побед: <b>{rating_data['wins']}</b>\n"
+    text += f"💔 Поражений: <b>{rating_data['losses']}</b>\n"
+    
+    if rating_data['win_streak'] > 0:
+        text += f"🔥 Серия побед: <b>{rating_data['win_streak']}</b>\n"
+    
+    text += f"\n🎯 <b>Как играть:</b>\n"
+    text += f"• Каждый ход выбирайте действие\n"
+    text += f"• ⚔️ <b>Атака</b>: наносит урон (15-25)\n"
+    text += f"• 🛡️ <b>Защита</b>: дает броню и шанс уклонения\n"
+    text += f"• 💚 <b>Лечение</b>: восстанавливает HP (5-10%)\n"
+    text += f"• 💥 <b>Комбо</b>: 3 одинаковых действия = спецэффект!\n\n"
+    text += f"⏱️ Время боя: 10 минут\n"
+    text += f"❤️ HP: 100 | Критические удары: 15%"
+    
+    keyboard = []
+    
+    # Проверяем, не в игре ли уже
+    in_game = any(game.fighter1.user_id == user_id or game.fighter2.user_id == user_id 
+                  for game in arena.active_arenas.values() if game.is_active)
+    
+    if in_game:
+        keyboard.append([InlineKeyboardButton(text="⚔️ Вернуться к бою", callback_data="arena_return_to_game")])
+        keyboard.append([InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot")])
+    else:
+        keyboard.append([
+            InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot"),
+            InlineKeyboardButton(text="🔍 Найти бой", callback_data="arena_find_match")
+        ])
+    
+    keyboard.extend([
+        [InlineKeyboardButton(text="📊 Рейтинг-таблица", callback_data="arena_leaderboard")],
+        [InlineKeyboardButton(text="📋 Статистика", callback_data="arena_my_stats"), InlineKeyboardButton(text="❓ Справка", callback_data="arena_help")]
+    ])
+    
+    # Заменяем текущее сообщение на меню арены
+    await safe_edit_text_or_caption(
+        callback.message,
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+        parse_mode="HTML"
+    )
+    
+    try:
+        await callback.answer()
+    except Exception:
+        pass
+
+
+@callbacks.on("arena_my_stats")
+async def arena_my_stats_callback(callback: types.CallbackQuery):
+    """Показать статистику игрока в арене"""
+    from main import format_clickable_name, get_display_name, safe_edit_text_or_caption, safe_ensure_user
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    username = getattr(callback.from_user, 'username', None) or f"ID:{user_id}"
+    safe_ensure_user(user_id, username)
+    
+    # Получаем статистику игрока
+    rating_data = arena.get_arena_rating(user_id)
+    player_rank = await db_async.run(arena.get_player_rank, user_id)
+    
+    # Определяем лигу
+    rating = rating_data['rating']
+    if rating < 1000:
+        league = "🥉 Новичок"
+    elif rating < 1500:
+        league = "🥈 Боец"
+    elif rating < 2000:
+        league = "🥇 Воин"
+    elif rating < 2500:
+        league = "💎 Мастер"
+    else:
+        league = "👑 Легенда"
+    
+    # Получаем отображаемое имя с учетом новой системы
+    display_name = get_display_name(user_id, username)
+    clickable_name = format_clickable_name(user_id, display_name)
+    
+    text = f"📊 <b>СТАТИСТИКА АРЕНЫ</b>\n\n"
+    text += f"👤 <b>Игрок:</b> {clickable_name}\n"
+    text += f"🏆 <b>Рейтинг:</b> {rating} PTS\n"
+    text += f"🎯 <b>Лига:</b> {league}\n"
+    text += f"📈 <b>Место:</b> #{player_rank}\n\n"
+    
+    text += f"📈 <b>Результаты:</b>\n"
+    text += f"🟢 Побед: <b>{rating_data['wins']}</b>\n"
+    text += f"🔴 Поражений: <b>{rating_data['losses']}</b>\n"
+    try:
+        level = rating_data.get('level', 1)
+        xp = rating_data.get('xp', 0)
+        text += f"🎚️ Уровень: <b>{level}</b>\n"
+        text += f"📘 Опыт: <b>{xp}/5000</b>\n"
+    except Exception:
+        pass
+    
+    if rating_data['wins'] + rating_data['losses'] > 0:
+        winrate = (rating_data['wins'] / (rating_data['wins'] + rating_data['losses'])) * 100
+        text += f"📊 Винрейт: <b>{winrate:.1f}%</b>\n"
+    
+    if rating_data['win_streak'] > 0:
+        text += f"🔥 <b>Текущая серия:</b> {rating_data['win_streak']} побед\n"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ В меню арены", callback_data="arena_back_to_menu")]
+    ])
+    
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+
+@callbacks.on("arena_help")
+async def arena_help_callback(callback: types.CallbackQuery):
+    """Показать справку по арене"""
+    from main import safe_edit_text_or_caption
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    text = f"❓ <b>СПРАВКА ПО АРЕНЕ</b>\n\n"
+    text += f"🏟️ <b>Как играть:</b>\n"
+    text += f"• Каждый ход выбирайте одно из трех действий\n"
+    text += f"• ⚔️ <b>Атака</b>: наносит 15-30 урона\n"
+    text += f"• 🛡️ <b>Защита</b>: блокирует 75%/50% урона\n"
+    text += f"• 💚 <b>Лечение</b>: восстанавливает 10-20 HP\n\n"
+    
+    text += f"💥 <b>Система комбо:</b>\n"
+    text += f"• Используйте 3 одинаковых действия подряд\n"
+    text += f"• ⚔️⚔️⚔️ = <b>БЕРСЕРК</b>: +50% урон + кровотечение\n"
+    text += f"• 💚💚💚 = <b>МОЩ.ИСЦЕЛЕНИЕ</b>: 25-35 HP + регенерация\n\n"
+    
+    text += f"🎯 <b>Статусные эффекты:</b>\n"
+    text += f"🩸 <b>Кровотечение</b>: -3 HP в начале хода\n"
+    text += f"💚 <b>Регенерация</b>: +5 HP в начале хода\n\n"
+    
+    text += f"🏆 <b>Рейтинговая система:</b>\n"
+    text += f"• Победа: +10-50 очков (зависит от противника)\n"
+    text += f"• Поражение: -5-25 очков\n"
+    text += f"• Лиги: Новичок → Боец → Воин → Мастер → Легенда\n\n"
+    
+    text += f"⏱️ <b>Прочее:</b>\n"
+    text += f"• Время боя: 10 минут\n"
+    text += f"• Максимум раундов: 15\n"
+    text += f"• HP: 100 для всех\n"
+    text += f"• Критические удары: 15% шанс"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ В меню арены", callback_data="arena_back_to_menu")]
+    ])
+    
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+
+# Таймауты арены срабатывают по таймерам (timers.py), а не опросом раз в 30 секунд
+async def arena_search_timed_out(player_data: dict):
+    """Поиск не удался за SEARCH_TIMEOUT - игрок уже убран из очереди"""
+    from main import bot
+    user_id = player_data['user_id']
+    try:
+        # Отправляем сообщение о неудачном поиске
+        text = arena.get_search_failed_message()
+
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔍 Попробовать снова", callback_data="arena_find_match")],
+            [InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot")],
+            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu")]
+        ])
+
+        await bot.send_message(
+            chat_id=user_id,
+            text=text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        print(f"Ошибка обработки таймаута поиска для {user_id}: {e}")
+
+
+async def arena_game_timed_out(game_id: str):
+    """Истекло время боя (GAME_DURATION)"""
+    try:
+        # Завершаем игру по таймауту
+        result_data = arena.end_arena_game(game_id)
+        if result_data:
+            await send_arena_game_result(result_data)
+            print(f"🕐 Игра {game_id} завершена по таймауту")
+    except Exception as e:
+        print(f"Ошибка завершения истекшей игры {game_id}: {e}")
+
+
+async def arena_matchmaker():
+    """Пакетный подбор пар из очереди арены раз в MATCH_INTERVAL секунд"""
+    while True:
+        await asyncio.sleep(arena.ARENA_CONFIG['MATCH_INTERVAL'])
+        try:
+            pairs = arena.pair_arena_queue()
+        except Exception as e:
+            print(f"Ошибка в arena_matchmaker: {e}")
+            continue
+        for player, opponent in pairs:
+            try:
+                await start_arena_match(player, opponent)
+            except Exception as e:
+                print(f"Ошибка запуска боя {player['user_id']} vs {opponent['user_id']}: {e}")
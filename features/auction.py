@@ -0,0 +1,1527 @@
+"""
+Аукцион: выставление предмета из инвентаря (AuctionStates — количество и
+цена), просмотр и покупка лотов, свои лоты и снятие с продажи.
+"""
+import asyncio
+import time
+import datetime
+from aiogram import Router, types
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile, InputMediaPhoto
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+import lazy_modules
+import database as db
+import sqlite_pool
+import media_cache
+import routing
+
+
+router = Router(name="auction")
+callbacks = routing.CallbackRouter()
+router.callback_query.register(callbacks.dispatch, callbacks.filter)
+texts = routing.TextRouter()
+
+
+# Auction UI helpers (рендер аукциона загружается при первом открытии)
+auction_ui = lazy_modules.lazy('inv_py.auction')
+
+
+# --- SELL ITEM FSM ---
+# State, StatesGroup уже импортированы выше
+class SellItemStates(StatesGroup):
+    waiting_for_price = State()
+    waiting_for_amount = State()
+
+
+# --- AUCTION FSM ---
+class AuctionStates(StatesGroup):
+    waiting_for_quantity = State()
+    waiting_for_currency = State()
+    waiting_for_price = State()
+    confirm_listing = State()
+
+
+@callbacks.on("sell:*")
+async def callback_sell_item(callback: types.CallbackQuery, state: FSMContext):
+    from main import ITEMS_CONFIG, get_user_inventory, safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Безопасное разделение данных callback
+    parts = callback.data.split(":")
+    if len(parts) < 3:
+        await callback.answer("Ошибка формата данных")
+        return
+    
+    _, item_id, page = parts[0], parts[1], parts[2]
+    if item_id == "empty":
+        await callback.answer("Нельзя продать пустую ячейку")
+        return
+    
+    user_id = callback.from_user.id
+
+    # Спец-ветка: индивидуальное животное (формат base@owned_id) — продаём через АУКЦИОН
+    if "@" in item_id:
+        base_id, owned_id = item_id.split("@", 1)
+        cfg = ITEMS_CONFIG.get(base_id)
+        if not cfg:
+            await callback.answer("❌ Животное не найдено", show_alert=True)
+            return
+        # Проверим, что такая особь есть у пользователя (и не на ферме)
+        try:
+            from ferma import get_owned_animal
+            owned = get_owned_animal(user_id, int(owned_id))
+        except Exception:
+            owned = None
+        if not owned:
+            await callback.answer("❌ Эта особь не найдена", show_alert=True)
+            return
+
+        # Начинаем процесс аукциона: количество всегда 1, валюта дань
+        chat_id = callback.message.chat.id if callback.message and callback.message.chat else None
+        message_id = callback.message.message_id if callback.message else None
+        item_name = cfg.get('name', 'Животное')
+        await state.update_data(
+            item_id=item_id,  # храним base@owned_id, база разберёт
+            item_name=item_name,
+            max_count=1,
+            quantity=1,
+            page=page,
+            chat_id=chat_id,
+            message_id=message_id,
+            user_id=user_id,
+            currency="dan"
+        )
+
+        # Сразу просим цену
+        text = (
+            f"💰 <b>Укажите цену</b>\n\n"
+            f"🎯 Предмет: <b>{item_name}</b> (индивидуальное животное)\n"
+            f"📦 Количество: <b>1 шт.</b>\n"
+            f"💱 Валюта: <b>💰 Дань</b> (фиксировано)\n\n"
+            f"⚠️ <b>Минимальная цена: 1000 дань</b> за штуку\n"
+            f"💬 Введите цену за 1 штуку (минимум 1 000):"
+        )
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⬅️ Назад", callback_data="auction_back_to_qty")],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")]
+        ])
+        await callback.answer()
+        await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+        await state.set_state(AuctionStates.waiting_for_price)
+        return
+
+    # Обычная ветка: переходим к продаже на аукцион
+    # Проверяем, есть ли предмет в инвентаре (используем существующую функцию)
+    items, _, _ = get_user_inventory(user_id, int(page))
+
+    # Найти количество для этого item_id
+    quantity = 0
+    for iid, cnt in items:
+        if iid == item_id:
+            quantity = cnt
+            break
+    if quantity <= 0:
+        await callback.answer("❌ У вас нет этого предмета", show_alert=True)
+        return
+
+    # Получаем информацию о предмете
+    item = ITEMS_CONFIG.get(item_id)
+    if not item:
+        await callback.answer("❌ Предмет не найден", show_alert=True)
+        return
+    item_name = item.get('name', item_id)
+    
+    # Начинаем процесс продажи на аукцион
+    chat_id = callback.message.chat.id if callback.message and callback.message.chat else None
+    message_id = callback.message.message_id if callback.message else None
+    
+    await state.update_data(
+        item_id=item_id, 
+        item_name=item_name, 
+        max_count=quantity,
+        page=page,
+        chat_id=chat_id,
+        message_id=message_id,
+        user_id=user_id  # Добавляем ID пользователя для проверки владельца
+    )
+    
+    # Показываем выбор количества для аукциона кнопками
+    text = f"📦 <b>Выбор количества</b>\n\n"
+    text += f"🎯 Предмет: <b>{item_name}</b>\n"
+    text += f"📊 Доступно: <b>{quantity} шт.</b>\n\n"
+    text += f"❓ Сколько штук выставить на продажу?"
+    
+    # Создаем кнопки быстрого выбора количества
+    kb_buttons = []
+    quick_amounts = [1, 5, 10]
+    amount_row = []
+    
+    for amount in quick_amounts:
+        if amount <= quantity:  # Показываем только доступные количества
+            amount_row.append(InlineKeyboardButton(
+                text=str(amount), 
+                callback_data=f"auction_qty:{amount}"
+            ))
+    
+    if amount_row:
+        kb_buttons.append(amount_row)
+    
+    # Всегда добавляем кнопку "Все" для выставления всего количества
+    kb_buttons.append([InlineKeyboardButton(
+        text=f"Все ({quantity})", 
+        callback_data=f"auction_qty:{quantity}"
+    )])
+    
+    kb_buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data=f"menu_inventory:{user_id}")])
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+    
+    await callback.answer()
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+    await state.set_state(AuctionStates.waiting_for_quantity)
+
+
+# --- FSM: Выставить на аукцион ---
+@callbacks.on("old_auction:*")
+async def callback_old_auction_item(callback: types.CallbackQuery, state: FSMContext):
+    """УСТАРЕВШИЙ обработчик - оставлен для совместимости"""
+    # Перенаправляем на новый обработчик
+    if not getattr(callback, 'data', None):
+        return
+    # Заменяем old_auction: на auction_start:  
+    new_data = callback.data.replace("old_auction:", "auction_start:")
+    callback.data = new_data
+    # Вызываем новый обработчик
+    return await callback_auction_start(callback, state)
+
+
+"""Старые обработчики SellItemStates отключены (устаревшая логика выставления)."""
+# (Логика перенесена в AuctionStates)
+
+
+# --- AUCTION SYSTEM ---
+@callbacks.on("menu_auction", "menu_auction:*")
+async def menu_auction_callback(callback: types.CallbackQuery):
+    """Главное меню аукциона с красивым визуальным интерфейсом"""
+    from main import ITEMS_CONFIG, can_edit_media, safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец меню (для приватных кнопок)
+    if ":" in callback.data:
+        try:
+            _, owner_user_id = callback.data.split(":")
+            owner_user_id = int(owner_user_id)
+            current_user_id = callback.from_user.id
+            if owner_user_id != current_user_id:
+                await callback.answer("❌ Это не ваше меню!", show_alert=True)
+                return
+        except (ValueError, IndexError):
+            await callback.answer("❌ Ошибка данных кнопки", show_alert=True)
+            return
+    
+    user_id = callback.from_user.id
+    
+    try:
+        # Получаем данные аукциона (уже отсортированы по created_at DESC - новые первые)
+        auction_data = auction_ui.get_auction_display_data(page=1, per_page=9)
+        items = auction_data["items"]
+        
+        if not items:
+            # Показываем пустой аукцион
+            text = "🏛️ <b>АУКЦИОН</b> 🏛️\n\n❌ Активных лотов нет\n\n💡 Выставьте свои предметы на продажу!"
+            kb_buttons = [
+                [InlineKeyboardButton(text="📤 Мои лоты", callback_data="auction_my_lots")],
+                [InlineKeyboardButton(text="⬅️ Назад в меню", callback_data=f"open_game_menu:{user_id}")]
+            ]
+            kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+            await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+            return
+        
+        # Генерируем/берём из кеша изображение с лотами (в отдельном потоке)
+        auction_image_path = await asyncio.to_thread(auction_ui.render_auction_grid_cached, items)
+        
+        # Создаем подпись для изображения
+        caption = auction_ui.format_auction_caption(auction_data, current_page=1)
+        
+        # Создаем кнопки навигации
+        kb_buttons = []
+        
+        # Кнопки для просмотра лотов (1-9)
+        lot_buttons = []
+        for i in range(min(9, len(items))):
+            lot_num = i + 1
+            lot_buttons.append(InlineKeyboardButton(text=f"{lot_num}", callback_data=f"auction_view:{lot_num}"))
+            if len(lot_buttons) == 3:  # По 3 кнопки в ряд
+                kb_buttons.append(lot_buttons)
+                lot_buttons = []
+        if lot_buttons:  # Добавляем оставшиеся кнопки
+            kb_buttons.append(lot_buttons)
+        
+        # Навигация по страницам (если есть несколько страниц)
+        total_pages = auction_data["total_pages"]
+        if total_pages > 1:
+            nav_row = []
+            nav_row.append(InlineKeyboardButton(text="⬅️", callback_data="auction_page:1"))
+            nav_row.append(InlineKeyboardButton(text=f"1/{total_pages}", callback_data="auction_info"))
+            nav_row.append(InlineKeyboardButton(text="➡️", callback_data="auction_page:2"))
+            kb_buttons.append(nav_row)
+        
+        # Основные кнопки
+        kb_buttons.extend([
+            [InlineKeyboardButton(text="📤 Мои лоты", callback_data="auction_my_lots")],
+            [InlineKeyboardButton(text="⬅️ Назад в меню", callback_data=f"open_game_menu:{user_id}")]
+        ])
+        
+        kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+        
+        # Отправляем изображение с подписью
+        try:
+            from aiogram.types import InputMediaPhoto, FSInputFile
+            user_id = callback.from_user.id
+            if not can_edit_media(user_id):
+                await callback.answer("⏳ Подождите немного", show_alert=False)
+                return
+                
+            await callback.message.edit_media(
+                media=InputMediaPhoto(media=FSInputFile(auction_image_path), caption=caption, parse_mode="HTML"),
+                reply_markup=kb
+            )
+        except Exception:
+            # Fallback если не получается отредактировать
+            await callback.message.answer_photo(
+                FSInputFile(auction_image_path), 
+                caption=caption, 
+                reply_markup=kb,
+                parse_mode="HTML"
+            )
+        
+        # Файл кешируется и переиспользуется — не удаляем
+            
+        try:
+            await callback.answer()
+        except Exception:
+            pass
+            
+    except Exception as e:
+        # Fallback к старому текстовому интерфейсу при ошибке
+        print(f"Ошибка в auction render: {e}")
+        
+        from database import get_auction_items, cleanup_expired_auctions
+        cleanup_expired_auctions()
+        auction_data = get_auction_items(page=1, per_page=5)
+        items = auction_data["items"]
+        total_pages = auction_data["total_pages"]
+        
+        if not items:
+            text = "🏛️ <b>АУКЦИОН</b> 🏛️\n\n❌ Активных лотов нет\n\n💡 Выставьте свои предметы на продажу!"
+        else:
+            text = f"🏛️ <b>АУКЦИОН</b> 🏛️\n\nСтраница 1/{total_pages}\n\n"
+            for i, (auction_id, seller_id, item_id, quantity, price_per_item, created_at, expires_at, status) in enumerate(items, 1):
+                item_name = ITEMS_CONFIG.get(item_id, {}).get('name', item_id)
+                total_price = quantity * price_per_item
+                import time
+                remaining_time = expires_at - int(time.time())
+                hours_left = remaining_time // 3600
+                text += f"{i}. <b>{item_name}</b> x{quantity}\n"
+                text += f"   💰 {price_per_item} дань/шт (всего: {total_price})\n"
+                text += f"   ⏰ Осталось: {hours_left}ч\n\n"
+        
+        kb_buttons = [
+            [InlineKeyboardButton(text="📤 Мои лоты", callback_data="auction_my_lots")],
+            [InlineKeyboardButton(text="⬅️ Назад в меню", callback_data=f"open_game_menu:{user_id}")]
+        ]
+        kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+        await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+
+
+@callbacks.on("auction_view:*")
+async def auction_view_callback(callback: types.CallbackQuery):
+    """Просмотр конкретного лота"""
+    from main import (
+        ITEMS_CONFIG, can_edit_media, format_clickable_name, get_display_name, safe_edit_text_or_caption
+    )
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    _, lot_number = callback.data.split(":")
+    lot_number = int(lot_number)
+    
+    from database import get_auction_items
+    
+    # Получаем лоты
+    auction_data = get_auction_items(page=1, per_page=10)
+    items = auction_data["items"]
+    
+    if lot_number > len(items):
+        await callback.answer("Лот не найден", show_alert=True)
+        return
+    
+    auction_id, seller_id, item_id, quantity, price_per_item, created_at, expires_at, status = items[lot_number - 1]
+    
+    # Получаем информацию о предмете из уже загруженной конфигурации
+    
+    item_config = ITEMS_CONFIG.get(item_id, {})
+    item_name = item_config.get('name', item_id)
+    item_desc = item_config.get('desc', 'Описание отсутствует')
+    
+    total_price = quantity * price_per_item
+    
+    # Время до окончания
+    import time
+    remaining_time = expires_at - int(time.time())
+    hours_left = remaining_time // 3600
+    minutes_left = (remaining_time % 3600) // 60
+    
+    # Получаем имя продавца с использованием новой системы имен
+    # username продавца get_display_name берёт из той же строки имён — отдельный get_user не нужен
+    seller_display_name = get_display_name(seller_id)
+    # Обрезаем до 12 символов если нужно
+    if len(seller_display_name) > 12:
+        seller_display_name = seller_display_name[:12] + "..."
+    seller_clickable_name = format_clickable_name(seller_id, seller_display_name)
+    
+    text = f"🏛️ <b>ЛОТ #{auction_id}</b>\n\n"
+    text += f"📦 <b>{item_name}</b> x{quantity}\n"
+    text += f"📝 {item_desc}\n\n"
+    text += f"💰 Цена: {price_per_item} дань/шт\n"
+    text += f"💎 Общая стоимость: {total_price} дань\n"
+    text += f"👤 Продавец: {seller_clickable_name}\n"
+    text += f"⏰ Времени осталось: {hours_left}ч {minutes_left}м"
+    
+    user_id = callback.from_user.id
+    
+    # Кнопки
+    kb_buttons = []
+    
+    if seller_id != user_id:
+        # Можно купить, если не свой лот
+        if quantity > 1:
+            # Если количество больше 1, показываем варианты
+            buy_row = []
+            buy_row.append(InlineKeyboardButton(text="🛒 1 шт", callback_data=f"auction_buy_qty:{auction_id}:1"))
+            if quantity >= 5:
+                buy_row.append(InlineKeyboardButton(text="🛒 5 шт", callback_data=f"auction_buy_qty:{auction_id}:5"))
+            buy_row.append(InlineKeyboardButton(text="🛒 Все", callback_data=f"auction_buy:{auction_id}"))
+            kb_buttons.append(buy_row)
+            
+            # Кнопка для ввода своего количества
+            kb_buttons.append([
+                InlineKeyboardButton(text="✏️ Указать количество", callback_data=f"auction_custom_qty:{auction_id}")
+            ])
+        else:
+            # Если только 1 предмет
+            kb_buttons.append([
+                InlineKeyboardButton(text="💳 Купить", callback_data=f"auction_buy:{auction_id}")
+            ])
+    else:
+        # Свой лот - можно снять
+        kb_buttons.append([
+            InlineKeyboardButton(text="❌ Снять с продажи", callback_data=f"auction_remove:{auction_id}")
+        ])
+    
+    kb_buttons.append([
+        InlineKeyboardButton(text="⬅️ Назад", callback_data=f"menu_auction:{callback.from_user.id}")
+    ])
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+    
+    # Показываем с изображением предмета, если есть
+    try:
+        photo_path = item_config.get('photo_square')
+        if photo_path:
+            if not can_edit_media(user_id):
+                await callback.answer("⏳ Подождите немного", show_alert=False)
+                return
+                
+            await media_cache.edit_photo(callback.message.edit_media, photo_path, caption=text,
+                                         parse_mode="HTML", reply_markup=kb)
+        else:
+            await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+    except Exception:
+        await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+
+
+@callbacks.on("auction_buy:*")
+async def auction_buy_callback(callback: types.CallbackQuery):
+    """Покупка лота с аукциона"""
+    from main import ITEMS_CONFIG, bot
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    _, auction_id = callback.data.split(":")
+    auction_id = int(auction_id)
+    user_id = callback.from_user.id
+    
+    from database import buy_auction_item
+    
+    # Выполняем покупку с увеличенным таймаутом для животных (2.5 секунды)
+    try:
+        result = await asyncio.wait_for(
+            asyncio.to_thread(buy_auction_item, user_id, auction_id),
+            timeout=2.5
+        )
+    except asyncio.TimeoutError:
+        # Отвечаем напрямую, не через callback.answer (может быть просрочен)
+        try:
+            await callback.message.reply("⏱️ Операция заняла слишком много времени. Попробуйте позже.")
+        except Exception:
+            pass
+        return
+    
+    if "error" in result:
+        try:
+            await callback.answer(result["error"], show_alert=True)
+        except Exception:
+            # Если callback просрочен, отправляем обычным сообщением
+            await callback.message.reply(f"❌ {result['error']}")
+        return
+    
+    # Успешная покупка - используем уже загруженную конфигурацию ITEMS_CONFIG из начала файла
+    item_name = ITEMS_CONFIG.get(result["item_id"], {}).get('name', result["item_id"])
+    
+    try:
+        await callback.answer(f"✅ Куплено: {item_name} x{result['quantity']} за {result['total_price']} дань!")
+    except Exception:
+        # Если callback просрочен, отправляем обычным сообщением
+        await callback.message.reply(f"✅ Куплено: {item_name} x{result['quantity']} за {result['total_price']} дань!")
+    
+    # Уведомляем продавца
+    try:
+        seller_user = db.get_user(result["seller_id"])
+        seller_name = seller_user.get('username', 'Неизвестный') if seller_user else 'Неизвестный'
+        await bot.send_message(
+            result["seller_id"],
+            f"💰 Ваш лот продан!\n\n"
+            f"📦 {item_name} x{result['quantity']}\n"
+            f"💎 Получено: {result['total_price']} дань"
+        )
+    except Exception:
+        pass  # Если не удалось отправить уведомление, игнорируем
+    
+    # Возвращаемся в аукцион
+    await menu_auction_callback(callback)
+
+
+@callbacks.on("auction_buy_qty:*")
+async def auction_buy_qty_callback(callback: types.CallbackQuery):
+    """Покупка определенного количества предметов с аукциона"""
+    from main import ITEMS_CONFIG, bot, get_display_name
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    parts = callback.data.split(":")
+    if len(parts) != 3:
+        await callback.answer("❌ Ошибка данных", show_alert=True)
+        return
+    
+    _, auction_id_str, qty_str = parts
+    auction_id = int(auction_id_str)
+    buy_quantity = int(qty_str)
+    user_id = callback.from_user.id
+    
+    from database import buy_auction_item_partial
+    
+    try:
+        # Покупаем указанное количество предметов с таймаутом 999 мс
+        result = await asyncio.wait_for(
+            asyncio.to_thread(buy_auction_item_partial, user_id, auction_id, buy_quantity),
+            timeout=0.999
+        )
+    except asyncio.TimeoutError:
+        await callback.answer("⏱️ Операция заняла слишком много времени. Попробуйте позже.", show_alert=True)
+        return
+    except Exception as e:
+        await callback.answer(f"❌ Ошибка покупки: {e}", show_alert=True)
+        return
+        
+    try:
+        
+        if "error" in result:
+            await callback.answer(result["error"], show_alert=True)
+            return
+        
+        # Успешная покупка
+        item_name = ITEMS_CONFIG.get(result["item_id"], {}).get('name', result["item_id"])
+        actual_quantity = result.get('quantity', buy_quantity)
+        
+        await callback.answer(f"✅ Куплено: {item_name} x{actual_quantity} за {result['total_price']} дань!")
+        
+        # Уведомляем продавца
+        try:
+            seller_id = int(result["seller_id"]) if isinstance(result["seller_id"], str) else result["seller_id"]
+            seller_display_name = get_display_name(seller_id)
+            
+            await bot.send_message(
+                result["seller_id"],
+                f"💰 Ваш лот продан!\n\n"
+                f"📦 {item_name} x{actual_quantity}\n"
+                f"💎 Получено: {result['total_price']} дань"
+            )
+        except Exception:
+            pass
+    
+    except Exception as e:
+        await callback.answer(f"❌ Ошибка: {e}", show_alert=True)
+        return
+    
+    # Возвращаемся в аукцион
+    await menu_auction_callback(callback)
+
+
+@callbacks.on("auction_custom_qty:*")
+async def auction_custom_qty_callback(callback: types.CallbackQuery):
+    """Запрос пользовательского количества для покупки"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    _, auction_id = callback.data.split(":")
+    
+    # Сохраняем auction_id в контексте пользователя для последующего использования
+    user_id = callback.from_user.id
+    
+    await callback.answer(
+        "✏️ Ответьте на это сообщение и напишите нужное количество предметов для покупки",
+        show_alert=True
+    )
+    
+    # Отправляем сообщение для ответа
+    reply_msg = await callback.message.reply(
+        f"🛒 Укажите количество предметов для покупки с лота #{auction_id}:\n\n"
+        f"💡 Ответьте на это сообщение числом"
+    )
+    
+    # Сохраняем связь сообщения с лотом (простое решение)
+    if not hasattr(auction_custom_qty_callback, 'pending_purchases'):
+        auction_custom_qty_callback.pending_purchases = {}
+    
+    auction_custom_qty_callback.pending_purchases[reply_msg.message_id] = {
+        'auction_id': int(auction_id),
+        'user_id': user_id
+    }
+
+
+# Обработчик ответов на сообщения для указания количества в аукционе
+@texts.on(lambda m: m.reply_to_message and m.text and m.text.strip().isdigit())
+async def handle_auction_quantity_reply(message: types.Message):
+    """Обработчик ввода количества для покупки с аукциона"""
+    from main import ITEMS_CONFIG, MESSAGES_DB_FILE_FILE, bot, get_display_name
+    if not message.from_user or not message.reply_to_message:
+        return
+    
+    # Проверяем, есть ли ожидающая покупка для этого сообщения
+    if not hasattr(auction_custom_qty_callback, 'pending_purchases'):
+        return
+    
+    reply_to_id = message.reply_to_message.message_id
+    if reply_to_id not in auction_custom_qty_callback.pending_purchases:
+        return
+    
+    purchase_data = auction_custom_qty_callback.pending_purchases[reply_to_id]
+    
+    # Проверяем, что отвечает правильный пользователь
+    if message.from_user.id != purchase_data['user_id']:
+        return
+    
+    try:
+        quantity = int(message.text.strip())
+        if quantity <= 0:
+            await message.reply("❌ Количество должно быть больше 0!")
+            return
+        
+        auction_id = purchase_data['auction_id']
+        user_id = message.from_user.id
+        
+        # Удаляем из ожидающих покупок
+        del auction_custom_qty_callback.pending_purchases[reply_to_id]
+        
+        from database import buy_auction_item
+        
+        # Сначала проверяем информацию о лоте
+        try:
+            import sqlite3
+            conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+            cur = conn.cursor()
+            
+            cur.execute("""
+                SELECT quantity, price_per_item, status
+                FROM auction_items WHERE id = ?
+            """, (auction_id,))
+            
+            auction_info = cur.fetchone()
+            conn.close()
+            
+            if not auction_info:
+                await message.reply("❌ Лот не найден")
+                return
+                
+            available_quantity, price_per_item, status = auction_info
+            
+            if status != 'active':
+                await message.reply("❌ Лот уже продан или неактивен")
+                return
+            
+            # Проверяем, что запрошенное количество не больше доступного
+            if available_quantity < quantity:
+                await message.reply(f"❌ В лоте только {available_quantity} предметов!")
+                return
+            
+            # Покупаем весь лот (пока нет поддержки частичной покупки) с таймаутом
+            try:
+                result = await asyncio.wait_for(
+                    asyncio.to_thread(buy_auction_item, user_id, auction_id),
+                    timeout=0.999
+                )
+            except asyncio.TimeoutError:
+                await message.reply("⏱️ Операция заняла слишком много времени. Попробуйте позже.")
+                return
+            
+            if "error" in result:
+                await message.reply(f"❌ {result['error']}")
+                return
+            
+            # Успешная покупка
+            item_name = ITEMS_CONFIG.get(result["item_id"], {}).get('name', result["item_id"])
+            actual_quantity = result.get('quantity', quantity)
+            
+            await message.reply(f"✅ Куплено: {item_name} x{actual_quantity} за {result['total_price']} дань!")
+            
+            # Уведомляем продавца
+            try:
+                seller_id = int(result["seller_id"]) if isinstance(result["seller_id"], str) else result["seller_id"]
+                seller_display_name = get_display_name(seller_id)
+                
+                await bot.send_message(
+                    result["seller_id"],
+                    f"💰 Ваш лот продан!\n\n"
+                    f"📦 {item_name} x{actual_quantity}\n"
+                    f"💎 Получено: {result['total_price']} дань"
+                )
+            except Exception:
+                pass
+        
+        except Exception as db_error:
+            await message.reply(f"❌ Ошибка проверки лота: {db_error}")
+            return
+        
+    except ValueError:
+        await message.reply("❌ Введите корректное число!")
+    except Exception as e:
+        await message.reply(f"❌ Ошибка: {e}")
+        # Удаляем из ожидающих покупок в случае ошибки
+        if reply_to_id in auction_custom_qty_callback.pending_purchases:
+            del auction_custom_qty_callback.pending_purchases[reply_to_id]
+
+
+@callbacks.on("auction_remove:*")
+async def auction_remove_callback(callback: types.CallbackQuery):
+    """Снятие лота с аукциона"""
+    from main import ITEMS_CONFIG
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    _, auction_id = callback.data.split(":")
+    auction_id = int(auction_id)
+    user_id = callback.from_user.id
+    
+    from database import remove_auction_item
+    
+    try:
+        result = await asyncio.wait_for(
+            asyncio.to_thread(remove_auction_item, user_id, auction_id),
+            timeout=0.999
+        )
+    except asyncio.TimeoutError:
+        await callback.answer("⏱️ Операция заняла слишком много времени. Попробуйте позже.", show_alert=True)
+        return
+    
+    if "error" in result:
+        await callback.answer(result["error"], show_alert=True)
+        return
+    
+    # Успешное снятие
+    # Используем уже загруженную конфигурацию ITEMS_CONFIG из начала файла
+    item_name = ITEMS_CONFIG.get(result["item_id"], {}).get('name', result["item_id"])
+    
+    await callback.answer(f"✅ Лот снят: {item_name} x{result['quantity']} возвращено в инвентарь")
+    
+    # Возвращаемся в аукцион
+    await menu_auction_callback(callback)
+
+
+@callbacks.on("my_lot_remove:*")
+async def my_lot_remove_confirm_callback(callback: types.CallbackQuery):
+    """Подтверждение снятия лота из 'Мои лоты'"""
+    from main import ITEMS_CONFIG, safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    _, auction_id = callback.data.split(":")
+    auction_id = int(auction_id)
+    user_id = callback.from_user.id
+    
+    # Получаем информацию о лоте для подтверждения
+    from database import get_auction_items
+    auction_data = get_auction_items(page=1, per_page=100, seller_id=user_id)
+    
+    # Находим нужный лот
+    target_lot = None
+    for lot in auction_data["items"]:
+        if lot[0] == auction_id:  # lot[0] = auction_id
+            target_lot = lot
+            break
+    
+    if not target_lot:
+        await callback.answer("❌ Лот не найден", show_alert=True)
+        return
+    
+    auction_id, seller_id, item_id, quantity, price_per_item, created_at, expires_at, status = target_lot
+    item_name = ITEMS_CONFIG.get(item_id, {}).get('name', item_id)
+    total_price = quantity * price_per_item
+    
+    text = f"❌ <b>СНЯТИЕ ЛОТА</b>\n\n"
+    text += f"📦 <b>{item_name}</b> x{quantity}\n"
+    text += f"💰 Цена: {price_per_item} дань/шт\n"
+    text += f"💎 Общая стоимость: {total_price} дань\n\n"
+    text += "⚠️ Вы действительно хотите снять лот с продажи?\n"
+    text += "Предметы вернутся в инвентарь."
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Да, снять", callback_data=f"auction_remove:{auction_id}"),
+            InlineKeyboardButton(text="❌ Отмена", callback_data="auction_my_lots")
+        ]
+    ])
+    
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+
+
+@callbacks.on("auction_my_lots")
+async def auction_my_lots_callback(callback: types.CallbackQuery):
+    """Мои лоты на аукционе"""
+    from main import ITEMS_CONFIG, safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    
+    from database import get_auction_items
+    
+    # Получаем лоты пользователя
+    auction_data = get_auction_items(page=1, per_page=10, seller_id=user_id)
+    items = auction_data["items"]
+    
+    if not items:
+        text = "📤 <b>МОИ ЛОТЫ</b>\n\n❌ У вас нет активных лотов"
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"menu_auction:{user_id}")]
+        ])
+    else:
+        text = f"📤 <b>МОИ ЛОТЫ</b> ({len(items)})\n\n"
+        
+        # Импортируем конфигурацию
+        # Используем уже загруженную конфигурацию ITEMS_CONFIG из начала файла
+        text += f"💡 Нажмите на номер лота чтобы снять его с продажи\n\n"
+        
+        for i, (auction_id, seller_id, item_id, quantity, price_per_item, created_at, expires_at, status) in enumerate(items, 1):
+            item_name = ITEMS_CONFIG.get(item_id, {}).get('name', item_id)
+            total_price = quantity * price_per_item
+            
+            # Время до окончания
+            import time
+            remaining_time = expires_at - int(time.time())
+            hours_left = remaining_time // 3600
+            
+            text += f"{i}. <b>{item_name}</b> x{quantity}\n"
+            text += f"   💰 {total_price} дань\n"
+            text += f"   ⏰ {hours_left}ч\n"
+            text += f"   🆔 #{auction_id}\n\n"
+        
+        # Кнопки с цифрами лотов
+        kb_buttons = []
+        
+        # Кнопки для снятия лотов (1-9)
+        lot_buttons = []
+        for i in range(min(9, len(items))):
+            lot_num = i + 1
+            auction_id = items[i][0]  # Получаем auction_id из данных
+            lot_buttons.append(InlineKeyboardButton(text=f"{lot_num}", callback_data=f"my_lot_remove:{auction_id}"))
+            if len(lot_buttons) == 3:  # По 3 кнопки в ряд
+                kb_buttons.append(lot_buttons)
+                lot_buttons = []
+        if lot_buttons:  # Добавляем оставшиеся кнопки
+            kb_buttons.append(lot_buttons)
+        
+        kb_buttons.append([
+            InlineKeyboardButton(text="⬅️ Назад", callback_data=f"menu_auction:{user_id}")
+        ])
+        
+        kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+    
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+
+
+# Новый обработчик для выставления на аукцион из инвентаря
+@callbacks.on("auction_start:*")
+async def callback_auction_start(callback: types.CallbackQuery, state: FSMContext):
+    """Начало выставления на аукцион - шаг 1: выбор количества"""
+    from main import ITEMS_CONFIG, get_user_inventory, safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    _, item_id, page = callback.data.split(":")
+    user_id = callback.from_user.id
+    
+    # Получаем количество предметов
+    items, _, _ = get_user_inventory(user_id, int(page))
+    count = 0
+    for iid, cnt in items:
+        if iid == item_id:
+            count = cnt
+            break
+    
+    if count == 0:
+        await callback.answer("У вас нет этого предмета", show_alert=True)
+        return
+    
+    # Получаем информацию о предмете
+    # Используем уже загруженную конфигурацию ITEMS_CONFIG из начала файла
+    
+    item_config = ITEMS_CONFIG.get(item_id, {})
+    item_name = item_config.get('name', item_id)
+    
+    # Сохраняем данные в состоянии
+    message_id = callback.message.message_id if callback.message else None
+    await state.update_data(
+        item_id=item_id, 
+        page=page, 
+        max_count=count, 
+        item_name=item_name,
+        message_id=message_id  # Сохраняем ID сообщения
+    )
+    
+    # Создаем кнопки для быстрого выбора количества
+    kb_buttons = []
+    
+    # Кнопки быстрого выбора количества
+    quick_amounts = []
+    if count >= 1:
+        quick_amounts.append(1)
+    if count >= 5:
+        quick_amounts.append(5)
+    if count >= 10:
+        quick_amounts.append(10)
+    if count >= count and count not in quick_amounts:
+        quick_amounts.append(count)  # Все доступное количество
+    
+    # Создаем ряды кнопок
+    if quick_amounts:
+        row = []
+        for amount in quick_amounts:
+            row.append(InlineKeyboardButton(text=f"{amount} шт.", callback_data=f"auction_qty:{amount}"))
+            if len(row) == 3:  # Максимум 3 кнопки в ряду
+                kb_buttons.append(row)
+                row = []
+        if row:  # Добавляем оставшиеся кнопки
+            kb_buttons.append(row)
+    
+    # Кнопка "Другое количество" и "Назад"
+    kb_buttons.append([
+        InlineKeyboardButton(text="✍️ Другое количество", callback_data="auction_qty:custom")
+    ])
+    kb_buttons.append([
+        InlineKeyboardButton(text="⬅️ Назад", callback_data=f"inv_item:{items.index((item_id, count))+1}:{page}")
+    ])
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+    
+    text = f"🏪 <b>Выставление на аукцион</b>\n\n"
+    text += f"🎯 Предмет: <b>{item_name}</b>\n"
+    text += f"📊 У вас: <b>{count} шт.</b>\n\n"
+    text += f"❓ Сколько штук хотите продать?"
+    
+    await callback.answer()
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+    await state.set_state(AuctionStates.waiting_for_quantity)
+
+
+@callbacks.on("auction_qty:*")
+async def callback_auction_quantity(callback: types.CallbackQuery, state: FSMContext):
+    """Обработчик выбора количества для аукциона"""
+    from main import safe_edit_by_id
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец аукциона
+    data = await state.get_data()
+    owner_user_id = data.get("user_id")
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("❌ Это не ваш аукцион!", show_alert=True)
+        return
+    
+    _, qty_str = callback.data.split(":")
+    max_count = data.get("max_count", 1)
+    item_name = data.get("item_name", "Предмет")
+    
+    if qty_str == "custom":
+        # Пользователь выбрал "Другое количество"
+        text = f"✍️ <b>Укажите количество</b>\n\n"
+        text += f"🎯 Предмет: <b>{item_name}</b>\n"
+        text += f"📊 Доступно: <b>{max_count} шт.</b>\n\n"
+        text += f"💬 Введите количество (от 1 до {max_count}):"
+        
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")]
+        ])
+        
+        # Редактируем исходное сообщение используя сохраненные данные
+        chat_id = data.get("chat_id")
+        message_id = data.get("message_id")
+        
+        if chat_id and message_id:
+            try:
+                await safe_edit_by_id(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=text,
+                    reply_markup=kb,
+                    parse_mode="HTML"
+                )
+            except Exception as e:
+                print(f"Ошибка редактирования сообщения пользовательского количества: {e}")
+        
+        await state.set_state(AuctionStates.waiting_for_quantity)
+        return
+    
+    try:
+        quantity = int(qty_str)
+        if quantity < 1 or quantity > max_count:
+            await callback.answer(f"Неверное количество! Доступно: {max_count}", show_alert=True)
+            return
+    except ValueError:
+        await callback.answer("Ошибка в количестве", show_alert=True)
+        return
+    
+    # Сохраняем количество и сразу переходим к вводу цены (только дань)
+    await state.update_data(quantity=quantity, currency="dan")
+    
+    # Показываем ввод цены (без выбора валюты)
+    text = f"💰 <b>Укажите цену</b>\n\n"
+    text += f"🎯 Предмет: <b>{item_name}</b>\n"
+    text += f"📦 Количество: <b>{quantity} шт.</b>\n"
+    text += f"💱 Валюта: <b>💰 Дань</b> (фиксировано)\n\n"
+    text += f"⚠️ <b>Минимальная цена: 1000 дань</b> за штуку\n"
+    text += f"💬 Введите цену за 1 штуку (минимум 1 000):"
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="auction_back_to_qty")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")]
+    ])
+    
+    await callback.answer()
+    
+    # Редактируем исходное сообщение используя сохраненные данные
+    chat_id = data.get("chat_id")
+    message_id = data.get("message_id")
+    
+    if chat_id and message_id:
+        try:
+            await safe_edit_by_id(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=text,
+                reply_markup=kb,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"Ошибка редактирования сообщения цены: {e}")
+    
+    await state.set_state(AuctionStates.waiting_for_price)  # Сразу переходим к ожиданию цены
+
+
+@texts.on(AuctionStates.waiting_for_quantity)
+async def auction_process_custom_quantity(message: types.Message, state: FSMContext):
+    """Простой ввод количества без reply."""
+    from main import safe_edit_by_id
+    data = await state.get_data()
+    
+    # Проверяем, что сообщение от владельца аукциона
+    owner_user_id = data.get("user_id")
+    if not owner_user_id or owner_user_id != message.from_user.id:
+        # Это не владелец состояния - игнорируем
+        return
+    
+    message_id = data.get("message_id")
+    chat_id = data.get("chat_id", message.chat.id)
+    item_name = data.get("item_name", "Предмет")
+    max_count = data.get("max_count", 1)
+
+    # Парсим число
+    try:
+        quantity = int(message.text.strip())
+        if quantity < 1 or quantity > max_count:
+            raise ValueError("bad range")
+    except Exception:
+        await message.delete()
+        if message_id:
+            err = (f"❌ <b>Ошибка ввода!</b>\n\n🎯 Предмет: <b>{item_name}</b>\n📊 Доступно: <b>{max_count} шт.</b>\n\n"
+                   f"⚠️ Введите число от 1 до {max_count}.\nВведите количество:" )
+            try:
+                await safe_edit_by_id(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=err,
+                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                        [InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")]
+                    ]),
+                    parse_mode="HTML"
+                )
+            except Exception:
+                pass
+        return
+
+    # OK
+    await state.update_data(quantity=quantity, currency="dan")
+    await message.delete()
+
+    text = (f"💰 <b>Укажите цену</b>\n\n"
+            f"🎯 Предмет: <b>{item_name}</b>\n"
+            f"📦 Количество: <b>{quantity} шт.</b>\n"
+            f"💱 Валюта: <b>💰 Дань</b> (фиксировано)\n\n"
+            f"⚠️ <b>Минимальная цена: 1000 дань</b> за штуку\n"
+            f"✏️ Введите цену за 1 штуку числом (минимум 1000):")
+
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="auction_back_to_qty")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")]
+    ])
+    if message_id:
+        try:
+            await safe_edit_by_id(chat_id=chat_id, message_id=message_id, text=text, reply_markup=kb, parse_mode="HTML")
+        except Exception:
+            pass
+    await state.set_state(AuctionStates.waiting_for_price)
+
+
+# УСТАРЕЛ: Обработчик выбора валюты больше не используется (всегда дань)
+@callbacks.on("old_auction_currency:*")
+async def callback_old_auction_currency(callback: types.CallbackQuery, state: FSMContext):
+    """УСТАРЕВШИЙ обработчик выбора валюты - теперь всегда только дань"""
+    await callback.answer("Выбор валюты убран - используется только дань", show_alert=True)
+
+
+@texts.on(AuctionStates.waiting_for_price)
+async def auction_process_price(message: types.Message, state: FSMContext):
+    """Обработка цены: принимает числовой ввод в состоянии ожидания цены."""
+    from main import ITEMS_CONFIG, safe_edit_by_id
+    data = await state.get_data()
+    
+    # Проверяем, что сообщение от владельца аукциона
+    owner_user_id = data.get("user_id")
+    if not owner_user_id or owner_user_id != message.from_user.id:
+        # Это не владелец состояния - игнорируем
+        return
+    
+    item_name = data.get("item_name", "Предмет")
+    quantity = data.get("quantity", 1)
+    message_id = data.get("message_id")
+    chat_id = data.get("chat_id", message.chat.id)
+    currency_unit = "дань"
+
+    # Проверяем, что содержит ТОЛЬКО цифры (никаких букв, символов)
+    if not message.text or not message.text.strip().isdigit():
+        return
+
+    # Парсим цену
+    try:
+        price = int(message.text.strip())
+        if price < 1000:
+            raise ValueError
+    except Exception:
+        # Некорректно: удаляем ответ пользователя и подсвечиваем форму
+        try:
+            await message.delete()
+        except Exception:
+            pass
+        if message_id:
+            err = (f"❌ <b>Ошибка цены!</b>\n\n🎯 Предмет: <b>{item_name}</b>\n"
+                   f"📦 Количество: <b>{quantity} шт.</b>\n"
+                   f"⚠️ Минимальная цена: <b>1000 {currency_unit}</b> за штуку.\n"
+                   f"✏️ Ответьте числом (мин. 1000):")
+            try:
+                await safe_edit_by_id(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=err,
+                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                        [InlineKeyboardButton(text="⬅️ Назад", callback_data="auction_back_to_qty")],
+                        [InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")]
+                    ]),
+                    parse_mode="HTML"
+                )
+            except Exception:
+                pass
+        return
+
+    # OK
+    await state.update_data(price=price)
+    await message.delete()
+
+    item_id = data.get("item_id")
+    # Поддержка животных с форматом base@owned_id в состоянии FSM
+    if item_id and "@" in item_id:
+        base_id = item_id.split("@", 1)[0]
+    else:
+        base_id = item_id
+    item_emoji = ITEMS_CONFIG.get(base_id, {}).get("emoji", "🎁")
+    total_cost = quantity * price
+
+    import time
+    from datetime import datetime
+    expires_timestamp = int(time.time()) + (14 * 24 * 3600)
+    expires_str = datetime.fromtimestamp(expires_timestamp).strftime("%d.%m.%Y %H:%M")
+
+    text = (f"✅ <b>Подтверждение выставления</b>\n\n"
+            f"🎯 Предмет: {item_emoji} <b>{item_name}</b>\n"
+            f"📦 Количество: <b>{quantity} шт.</b>\n"
+            f"💰 Цена за штуку: <b>{price:,} {currency_unit}</b>\n"
+            f"💵 Общая стоимость: <b>{total_cost:,} {currency_unit}</b>\n"
+            f"⏰ Время: до <b>{expires_str}</b>\n\n"
+            f"❓ Подтвердить выставление на аукцион?")
+
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Подтвердить", callback_data="auction_confirm")],
+        [InlineKeyboardButton(text="⬅️ Изменить", callback_data="auction_back_to_price")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")]
+    ])
+    if message_id:
+        try:
+            await safe_edit_by_id(chat_id=chat_id, message_id=message_id, text=text, reply_markup=kb, parse_mode="HTML")
+        except Exception:
+            pass
+    await state.set_state(AuctionStates.confirm_listing)
+
+
+# Кнопки "Назад"
+@callbacks.on("auction_back_to_qty")
+async def callback_auction_back_to_qty(callback: types.CallbackQuery, state: FSMContext):
+    """Возврат к выбору количества"""
+    from main import safe_edit_by_id
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец аукциона
+    data = await state.get_data()
+    owner_user_id = data.get("user_id")
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("❌ Это не ваш аукцион!", show_alert=True)
+        return
+    
+    item_name = data.get("item_name", "Предмет")
+    max_count = data.get("max_count", 1)
+    
+    text = f"📦 <b>Выбор количества</b>\n\n"
+    text += f"🎯 Предмет: <b>{item_name}</b>\n"
+    text += f"📊 Доступно: <b>{max_count} шт.</b>\n\n"
+    text += f"❓ Сколько штук выставить на продажу?"
+    
+    # Создаем кнопки для быстрого выбора количества
+    buttons = []
+    quick_amounts = []
+    
+    if max_count >= 1:
+        quick_amounts.append(1)
+    if max_count >= 5:
+        quick_amounts.append(5)
+    if max_count >= 10:
+        quick_amounts.append(10)
+    if max_count >= 50:
+        quick_amounts.append(50)
+    
+    # Если у нас максимум предметов не входит в быстрые кнопки, добавляем его
+    if max_count not in quick_amounts and max_count <= 100:
+        quick_amounts.append(max_count)
+    
+    # Создаем строки кнопок по 2-3 кнопки в ряд
+    for i in range(0, len(quick_amounts), 3):
+        row = [InlineKeyboardButton(text=f"{amt}", callback_data=f"auction_qty:{amt}") 
+               for amt in quick_amounts[i:i+3]]
+        buttons.append(row)
+    
+    # Добавляем кнопку "Другое количество" если нужно
+    if max_count > 100 or (max_count > 1 and max_count not in quick_amounts):
+        buttons.append([InlineKeyboardButton(text="✏️ Другое количество", callback_data="auction_qty:custom")])
+    
+    # Кнопка отмены
+    buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")])
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
+    
+    await callback.answer()
+    
+    # Редактируем исходное сообщение используя сохраненные данные
+    chat_id = data.get("chat_id")
+    message_id = data.get("message_id")
+    
+    if chat_id and message_id:
+        try:
+            await safe_edit_by_id(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=text,
+                reply_markup=kb,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"Ошибка редактирования сообщения возврата к количеству: {e}")
+    
+    await state.set_state(AuctionStates.waiting_for_quantity)
+
+
+@callbacks.on("auction_back_to_currency")
+async def callback_auction_back_to_currency(callback: types.CallbackQuery, state: FSMContext):
+    """Возврат к выбору валюты"""
+    from main import safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    data = await state.get_data()
+    item_name = data.get("item_name", "Предмет")
+    quantity = data.get("quantity", 1)
+    
+    # Показываем меню выбора валюты
+    text = f"💱 <b>Выбор валюты</b>\n\n"
+    text += f"🎯 Предмет: <b>{item_name}</b>\n"
+    text += f"📦 Количество: <b>{quantity} шт.</b>\n\n"
+    text += f"❓ В какой валюте устанавливать цену?"
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="💰 Дань", callback_data="auction_currency:dan"),
+            InlineKeyboardButton(text="💎 Золото", callback_data="auction_currency:kruz")
+        ],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="auction_back_to_qty")]
+    ])
+    
+    await callback.answer()
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=kb)
+    await state.set_state(AuctionStates.waiting_for_currency)
+
+
+@callbacks.on("auction_back_to_price")
+async def callback_auction_back_to_price(callback: types.CallbackQuery, state: FSMContext):
+    """Возврат к вводу цены"""
+    from main import safe_edit_by_id
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец аукциона
+    data = await state.get_data()
+    owner_user_id = data.get("user_id")
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("❌ Это не ваш аукцион!", show_alert=True)
+        return
+    
+    item_name = data.get("item_name", "Предмет")
+    quantity = data.get("quantity", 1)
+    
+    # Показываем ввод цены
+    text = f"💰 <b>Укажите цену</b>\n\n"
+    text += f"🎯 Предмет: <b>{item_name}</b>\n"
+    text += f"📦 Количество: <b>{quantity} шт.</b>\n\n"
+    text += f"⚠️ <b>Минимальная цена: 1000 дань</b> за штуку\n"
+    text += f"💬 Введите цену за 1 штуку (минимум 1 000):"
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="auction_back_to_qty")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="auction_cancel")]
+    ])
+    
+    await callback.answer()
+    
+    # Редактируем исходное сообщение используя сохраненные данные
+    chat_id = data.get("chat_id")
+    message_id = data.get("message_id")
+    
+    if chat_id and message_id:
+        try:
+            await safe_edit_by_id(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=text,
+                reply_markup=kb,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"Ошибка редактирования сообщения возврата к цене: {e}")
+    
+    await state.set_state(AuctionStates.waiting_for_price)
+
+
+@callbacks.on("auction_confirm")
+async def callback_auction_confirm(callback: types.CallbackQuery, state: FSMContext):
+    """Подтверждение выставления на аукцион"""
+    from main import ITEMS_CONFIG, safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец аукциона
+    data = await state.get_data()
+    owner_user_id = data.get("user_id")
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("❌ Это не ваш аукцион!", show_alert=True)
+        return
+    
+    user_id = callback.from_user.id
+    item_id = data.get("item_id")
+    quantity = data.get("quantity", 1)
+    price = data.get("price", 1)
+    currency = data.get("currency", "dan")
+    
+    # Пока поддерживаем только дань, в будущем добавим золото
+    if currency != "dan":
+        await callback.answer("❌ Пока поддерживается только дань", show_alert=True)
+        return
+    
+    # Выставляем на аукцион с фиксированным временем 14 дней с таймаутом
+    from database import add_auction_item
+    
+    try:
+        result = await asyncio.wait_for(
+            asyncio.to_thread(add_auction_item, user_id, item_id, quantity, price, 14 * 24),
+            timeout=0.999
+        )
+    except asyncio.TimeoutError:
+        await callback.answer("⏱️ Операция заняла слишком много времени. Попробуйте позже.", show_alert=True)
+        await state.clear()
+        return
+    
+    if "error" in result:
+        await callback.answer(f"❌ {result['error']}", show_alert=True)
+        await state.clear()
+        return
+    
+    # Успешно выставлено
+    # Используем уже загруженную конфигурацию ITEMS_CONFIG из начала файла
+    # Поддержка pseudo-ID в состоянии FSM
+    base_id = item_id.split("@", 1)[0] if item_id and "@" in item_id else item_id
+    item_name = ITEMS_CONFIG.get(base_id, {}).get('name', base_id)
+    item_emoji = ITEMS_CONFIG.get(base_id, {}).get("emoji", "🎁")
+    # Форматирование валюты
+    currency_name = "Дань 🪙" if currency == "dan" else "⭐ Stars"
+    total_cost = quantity * price
+    
+    # Вычисляем время окончания аукциона
+    import time
+    from datetime import datetime, timedelta
+    
+    expires_timestamp = int(time.time()) + (14 * 24 * 3600)  # 14 дней в секундах
+    expires_date = datetime.fromtimestamp(expires_timestamp)
+    expires_str = expires_date.strftime("%d.%m.%Y %H:%M")
+    
+    # Красивое форматирование чисел
+    def fmt(n: int):
+        return f"{n:,}".replace(",", " ")
+
+    text = (
+        "✅ <b>Лот выставлен на аукцион!</b>\n"
+        "____________________________\n"
+        f"🎯 Предмет: {item_emoji} <b>{item_name}</b>\n"
+        f"📦 Количество: <b>{fmt(quantity)} шт.</b>\n"
+        f"💰 Цена за штуку: <b>{fmt(price)} {currency_name}</b>\n"
+        f"💵 Общая стоимость: <b>{fmt(total_cost)} {currency_name}</b>\n"
+        f"⏰ До окончания: <b>{expires_str}</b> (14 дней)\n"
+        f"🆔 Лот ID: <b>#{result['auction_id']}</b>\n"
+        "____________________________\n"
+        "📤 Лот теперь доступен в разделе 'Мои лоты'"
+    )
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📤 Мои лоты", callback_data="auction_my_lots")],
+        [InlineKeyboardButton(text="🎒 Инвентарь", callback_data=f"menu_inventory:{user_id}")]
+    ])
+    
+    await callback.answer("✅ Лот выставлен!")
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=kb, parse_mode="HTML")
+    await state.clear()
+
+
+@callbacks.on("auction_cancel")
+async def callback_auction_cancel(callback: types.CallbackQuery, state: FSMContext):
+    """Отмена выставления на аукцион"""
+    from main import ITEMS_CONFIG, NULL_ITEM, build_inventory_markup, get_cached_image, get_user_inventory
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец аукциона
+    data = await state.get_data()
+    owner_user_id = data.get("user_id")
+    if owner_user_id and owner_user_id != callback.from_user.id:
+        await callback.answer("❌ Это не ваш аукцион!", show_alert=True)
+        return
+    
+    await callback.answer("❌ Выставление отменено")
+    await state.clear()
+    
+    # Возвращаемся в инвентарь с обновлённой картинкой
+    user_id = callback.from_user.id
+    items, total, max_page = get_user_inventory(user_id, page=1, force_sync=True)
+    
+    # Рендерим картинку инвентаря с поддержкой животных
+    grid_items = []
+    item_images = {}
+    for item_id, count in items:
+        if item_id == "empty":
+            name = "Пусто"
+            icon_path = NULL_ITEM["photo_square"]
+        else:
+            # Поддержка индивидуальных животных с форматом ID вида 08@123
+            if "@" in item_id:
+                base_id, owned_id = item_id.split("@", 1)
+            else:
+                base_id, owned_id = item_id, None
+            cfg = ITEMS_CONFIG.get(base_id)
+            if not cfg:
+                name = "Неизвестно"
+                icon_path = NULL_ITEM["photo_square"]
+            else:
+                name = cfg["name"] if not owned_id else f"{cfg['name']}"
+                icon_path = cfg["photo_square"]
+        grid_items.append((item_id, count, name))
+        item_images[item_id] = icon_path
+    
+    # Используем кешированное изображение
+    photo_path = get_cached_image(grid_items, item_images, owner=user_id)
+    text = f"🎒 Ваш инвентарь\nВсего предметов: {total}"
+    kb = build_inventory_markup(page=1, max_page=max_page, owner_user_id=user_id)
+    
+    try:
+        await media_cache.edit_photo(callback.message.edit_media, photo_path, caption=text, reply_markup=kb)
+    except Exception as e:
+        await callback.message.edit_text(text, reply_markup=kb)
+
+
+@texts.exact("аук", "аукцион")
+async def cmd_auction(message: types.Message):
+    """Команда /аук - открывает аукцион"""
+    from main import safe_ensure_user_from_obj
+    if not getattr(message, 'from_user', None):
+        return
+    user_id = message.from_user.id
+    safe_ensure_user_from_obj(message.from_user)
+    
+    text = f"🏛️ <b>АУКЦИОН</b>\n\n" \
+           f"💰 Место где можно купить и продать редкие предметы\n" \
+           f"🔥 Торгуйтесь с другими игроками\n" \
+           f"⏰ Следите за временем окончания лотов\n\n" \
+           f"💡 Используйте кнопки ниже для навигации"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📝 Создать лот", callback_data=f"auction_create:{user_id}")],
+        [InlineKeyboardButton(text="👀 Активные лоты", callback_data=f"auction_list:{user_id}")],
+        [InlineKeyboardButton(text="📊 Мои лоты", callback_data=f"auction_my:{user_id}")],
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data=f"open_game_menu:{user_id}")]
+    ])
+    
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
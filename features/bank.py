@@ -0,0 +1,1149 @@
+"""
+Банк: вклады по планам, быстрые суммы, история операций и прямой ввод суммы
+вклада (BankStates). Расчёты — bank.py.
+"""
+from aiogram import Router, types
+from aiogram.filters import Command
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+import database as db
+from bank import (
+    bank_system, format_amount, format_full_amount, DEPOSIT_PLANS, get_deposit_plan_text,
+    format_deposit_button_text, get_deposit_action_emoji, paginate_deposits
+)
+import db_async
+import routing
+
+
+router = Router(name="bank")
+callbacks = routing.CallbackRouter()
+router.callback_query.register(callbacks.dispatch, callbacks.filter)
+texts = routing.TextRouter()
+
+
+# FSM для банковской системы
+class BankStates(StatesGroup):
+    waiting_for_direct_deposit_amount = State()  # Состояние для ввода суммы после выбора плана
+    confirming_deposit = State()  # Состояние для подтверждения депозита
+
+
+# --- Банковская система ---
+@texts.exact("банк")
+async def bank_handler(message: types.Message):
+    from main import safe_ensure_user
+    if not getattr(message, 'from_user', None):
+        return
+    
+    user_id = message.from_user.id
+    username = getattr(message.from_user, 'username', None) or "NoUsername"
+    
+    # Обеспечиваем пользователя в базе данных
+    safe_ensure_user(user_id, username)
+    
+    # Получаем данные о банке и депозитах пользователя
+    total_deposits_count = bank_system.get_total_deposits_count()
+    total_bank_deposits = bank_system.get_total_bank_deposits()
+    user_deposits_count = bank_system.get_user_deposits_count(user_id)
+    user_total_deposits = bank_system.get_user_total_deposits(user_id)
+    
+    # Форматируем текст
+    total_amount_text = format_full_amount(total_bank_deposits)
+    user_amount_text = format_amount(user_total_deposits)
+    
+    text = (
+        f"🏦 <b>БАНК KRUZCHAT</b> 🏦\n\n"
+        f"📝 <b>Описание:</b>\n"
+        f"Банк KruzChat — это безопасный способ заработать дань с гарантированной доходностью! Выбирайте срок депозита и получайте стабильную прибыль без рисков.\n\n"
+        f"📊 <b>Статистика:</b>\n"
+        f"🌍 Всего {total_deposits_count} депозитов в мире\n"
+        f"💰 на сумму {total_amount_text} дань\n\n"
+        f"👤 У вас {user_deposits_count} депозитов на {user_amount_text} дань\n\n"
+        f"💎 <b>Тарифы:</b> (макс. 1,000,000 дань)\n"
+        f"• 3 дня — 4% прибыли 📈\n"
+        f"• 7 дней — 8% прибыли 📈\n"
+        f"• 14 дней — 13% прибыли 📈\n"
+        f"• 31 день — 31% прибыли 📈\n\n"
+        f"🎯 <b>Выберите план депозита ниже:</b>"
+    )
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        # Кнопки планов депозитов (первый ряд)
+        [
+            InlineKeyboardButton(text="3", callback_data=f"bank_deposit_plan:3:4:{user_id}"),
+            InlineKeyboardButton(text="7", callback_data=f"bank_deposit_plan:7:8:{user_id}"),
+            InlineKeyboardButton(text="14", callback_data=f"bank_deposit_plan:14:13:{user_id}"),
+            InlineKeyboardButton(text="31", callback_data=f"bank_deposit_plan:31:31:{user_id}")
+        ],
+        [InlineKeyboardButton(text="мои депозиты", callback_data=f"bank_my_deposits:{user_id}")]
+    ])
+    
+    # Отправляем сообщение с банком
+    await message.answer(text, reply_markup=keyboard, parse_mode='HTML')
+
+
+@texts.on(Command("deposit"))
+async def deposit_command_handler(message: types.Message):
+    """Обработчик команды /deposit"""
+    await bank_handler(message)
+
+
+@callbacks.on("bank_menu:*")
+async def bank_menu_callback(callback: types.CallbackQuery):
+    """Обработчик кнопки возврата в банк"""
+    from main import safe_edit_message
+    if not callback.from_user:
+        return
+    
+    parts = callback.data.split(":")
+    if len(parts) < 2:
+        return
+        
+    owner_user_id = int(parts[1])
+    
+    # Проверяем права доступа
+    if callback.from_user.id != owner_user_id:
+        await callback.answer("❌ Это не ваше меню!", show_alert=True)
+        return
+    
+    # Создаем фейковое сообщение для вызова основного обработчика банка
+    fake_message = type('FakeMessage', (), {
+        'from_user': callback.from_user,
+        'answer': callback.message.edit_text
+    })()
+    
+    # Получаем данные о банке и депозитах пользователя
+    user_id = callback.from_user.id
+    total_deposits_count = bank_system.get_total_deposits_count()
+    total_bank_deposits = bank_system.get_total_bank_deposits()
+    user_deposits_count = bank_system.get_user_deposits_count(user_id)
+    user_total_deposits = bank_system.get_user_total_deposits(user_id)
+    
+    # Форматируем текст
+    total_amount_text = format_full_amount(total_bank_deposits)
+    user_amount_text = format_amount(user_total_deposits)
+    
+    text = (
+        f"🏦 <b>БАНК KRUZCHAT</b> 🏦\n\n"
+        f"📝 <b>Описание:</b>\n"
+        f"Банк KruzChat — это безопасный способ заработать дань с гарантированной доходностью! Выбирайте срок депозита и получайте стабильную прибыль без рисков.\n\n"
+        f"📊 <b>Статистика:</b>\n"
+        f"🌍 Всего {total_deposits_count} депозитов в мире\n"
+        f"💰 на сумму {total_amount_text} дань\n\n"
+        f"👤 У вас {user_deposits_count} депозитов на {user_amount_text} дань\n\n"
+        f"💎 <b>Тарифы:</b> (макс. 1,000,000 дань)\n"
+        f"• 3 дня — 4% прибыли 📈\n"
+        f"• 7 дней — 8% прибыли 📈\n"
+        f"• 14 дней — 13% прибыли 📈\n"
+        f"• 31 день — 31% прибыли 📈\n\n"
+        f"🎯 <b>Выберите план депозита ниже:</b>"
+    )
+
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        # Кнопки планов депозитов (первый ряд)
+        [
+            InlineKeyboardButton(text="3", callback_data=f"bank_deposit_plan:3:4:{user_id}"),
+            InlineKeyboardButton(text="7", callback_data=f"bank_deposit_plan:7:8:{user_id}"),
+            InlineKeyboardButton(text="14", callback_data=f"bank_deposit_plan:14:13:{user_id}"),
+            InlineKeyboardButton(text="31", callback_data=f"bank_deposit_plan:31:31:{user_id}")
+        ],
+        [InlineKeyboardButton(text="мои депозиты", callback_data=f"bank_my_deposits:{user_id}")]
+    ])
+    
+    await safe_edit_message(callback, text, keyboard, parse_mode='HTML')
+
+
+@callbacks.on("bank_deposit_plan:*")
+async def bank_deposit_plan_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Обработчик выбора плана для ввода собственной суммы"""
+    if not callback.from_user:
+        return
+    
+    parts = callback.data.split(":")
+    if len(parts) < 4:
+        return
+        
+    days = int(parts[1])
+    interest_rate = int(parts[2])
+    owner_user_id = int(parts[3])
+    
+    # Проверяем права доступа
+    if callback.from_user.id != owner_user_id:
+        await callback.answer("❌ Это не ваш депозит!", show_alert=True)
+        return
+    
+    # Переходим к состоянию ввода суммы для выбранного плана
+    await state.set_state(BankStates.waiting_for_direct_deposit_amount)
+    await state.update_data(
+        user_id=owner_user_id, 
+        days=days, 
+        interest_rate=interest_rate,
+        message_id=callback.message.message_id
+    )
+    
+    # Получаем баланс пользователя
+    user = db.get_user(owner_user_id)
+    dan_balance = float(user.get("dan", 0)) if user else 0
+    
+    text = (
+        f"💳 Депозит на {days} дней ({interest_rate}%)\n"
+        f"-~-~-~-~-~-~-~-\n"
+        f"💰 Ваш баланс: {format_amount(dan_balance)} дань\n\n"
+        f"💵 Напишите сумму депозита <b><u>в ответ на это сообщение</u></b>:\n"
+        f"💡 Минимум: 1000 дань\n"
+        f"💎 Максимум: 1,000,000 дань"
+    )
+    
+    # Создаем кнопки быстрого выбора сумм
+    quick_amount_buttons = []
+    
+    # Первый ряд - кнопка "все X дань" или "всего 1м дань" для больших балансов (только если есть дань)
+    if dan_balance > 0:
+        if dan_balance >= 2000000:
+            # Для больших балансов показываем кнопку "всего 1м дань"
+            quick_amount_buttons.append([InlineKeyboardButton(text="всего 1м дань", callback_data=f"bank_quick_amount:1000000:{days}:{interest_rate}:{owner_user_id}")])
+        else:
+            # Для обычных балансов показываем кнопку "все X дань"
+            quick_amount_buttons.append([InlineKeyboardButton(text=f"все {format_amount(dan_balance)} дань", callback_data=f"bank_quick_amount:{dan_balance}:{days}:{interest_rate}:{owner_user_id}")])
+    
+    # Второй ряд - стандартные суммы: 1к, 5к, 10к дань
+    standard_amounts = [1000, 5000, 10000]
+    
+    # Создаем кнопки для стандартных сумм
+    standard_buttons = []
+    for amount in standard_amounts:
+        if amount == 1000:
+            text_btn = "1к дань"
+        elif amount == 5000:
+            text_btn = "5к дань"
+        elif amount == 10000:
+            text_btn = "10к дань"
+        standard_buttons.append(InlineKeyboardButton(text=text_btn, callback_data=f"bank_quick_amount:{amount}:{days}:{interest_rate}:{owner_user_id}"))
+    
+    # Добавляем ряд со стандартными суммами (всегда показываем)
+    quick_amount_buttons.append(standard_buttons)
+    
+    # Создаем клавиатуру с кнопками быстрого выбора сумм и отменой
+    keyboard_rows = quick_amount_buttons + [
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=f"bank_cancel:{owner_user_id}")]
+    ]
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+    
+    # Редактируем сообщение вместо создания нового
+    # Сохраняем ID сообщения для проверки reply
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        # Сохраняем ID этого сообщения в state для проверки reply
+        await state.update_data(prompt_message_id=callback.message.message_id)
+        await callback.answer()
+    except Exception as e:
+        print(f"Ошибка редактирования сообщения с запросом суммы: {e}")
+        await callback.answer("❌ Ошибка", show_alert=True)
+
+
+@callbacks.on("bank_quick_amount:*")
+async def bank_quick_amount_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Обработчик кнопок быстрого выбора суммы депозита"""
+    from main import safe_edit_message
+    if not callback.from_user:
+        return
+    
+    parts = callback.data.split(":")
+    if len(parts) < 5:
+        return
+        
+    amount_str = parts[1]
+    days = int(parts[2])
+    interest_rate = int(parts[3])
+    owner_user_id = int(parts[4])
+    
+    # Проверяем права доступа
+    if callback.from_user.id != owner_user_id:
+        await callback.answer("❌ Это не ваше меню!", show_alert=True)
+        return
+    
+    try:
+        amount = float(amount_str)
+    except ValueError:
+        await callback.answer("❌ Неверная сумма", show_alert=True)
+        return
+    
+    # Проверяем минимальную сумму
+    if amount < 1000:
+        await callback.answer("❌ Минимальная сумма депозита: 1000 дань", show_alert=True)
+        return
+    
+    # Проверяем максимальную сумму
+    if amount > 1000000:
+        await callback.answer("❌ Максимальная сумма депозита: 1,000,000 дань", show_alert=True)
+        return
+    
+    # Проверяем баланс пользователя
+    user = db.get_user(owner_user_id)
+    if not user:
+        await callback.answer("❌ Пользователь не найден", show_alert=True)
+        return
+    
+    dan_balance = float(user.get("dan", 0))
+    if amount > dan_balance:
+        await callback.answer(f"❌ Недостаточно средств. Ваш баланс: {format_amount(dan_balance)} дань", show_alert=True)
+        return
+    
+    # Создаем депозит сразу
+    from bank import BankSystem
+    bank = BankSystem()
+    
+    # Получаем имя пользователя
+    username = callback.from_user.username or f"User_{owner_user_id}"
+    
+    success = bank.add_deposit(owner_user_id, username, amount, days, interest_rate / 100)
+    
+    if success:
+        # Списываем средства
+        from database import set_dan
+        set_dan(owner_user_id, dan_balance - amount)
+        
+        profit = amount * (interest_rate / 100)
+        total_return = amount + profit
+        
+        text = (
+            f"✅ Депозит успешно создан!\n\n"
+            f"💰 Сумма: {format_amount(amount)} дань\n"
+            f"⏰ Срок: {days} дней\n"
+            f"📈 Процент: {interest_rate}%\n"
+            f"💎 Прибыль: +{format_amount(profit)} дань\n"
+            f"💵 К выплате: {format_amount(total_return)} дань\n\n"
+            f"💰 Ваш баланс: {format_amount(dan_balance - amount)} дань"
+        )
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🏦 В банк", callback_data=f"bank_menu:{owner_user_id}")]
+        ])
+        
+        await safe_edit_message(callback, text, keyboard)
+    else:
+        await callback.answer("❌ Ошибка создания депозита", show_alert=True)
+
+
+@callbacks.on("bank_my_deposits:*")
+async def bank_my_deposits_callback(callback: types.CallbackQuery):
+    """Обработчик кнопки 'мои депозиты'"""
+    if not callback.from_user:
+        return
+    
+    # Используем существующий обработчик bank_history_callback
+    parts = callback.data.split(":")
+    owner_user_id = int(parts[1])
+    
+    # Проверяем права доступа
+    if callback.from_user.id != owner_user_id:
+        await callback.answer("❌ Это не ваши депозиты!", show_alert=True)
+        return
+    
+    # Создаем фейковый callback для bank_history с первой страницей
+    fake_callback = type('FakeCallback', (), {
+        'from_user': callback.from_user,
+        'message': callback.message,
+        'data': f"bank_history:{owner_user_id}:1"
+    })()
+    
+    await bank_history_callback(fake_callback)
+
+
+@callbacks.on("bank_cancel:*")
+async def bank_cancel_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Обработчик отмены депозита"""
+    if not callback.from_user:
+        return
+    
+    parts = callback.data.split(":")
+    owner_user_id = int(parts[1])
+    
+    # Проверяем права доступа
+    if callback.from_user.id != owner_user_id:
+        await callback.answer("❌ Нет доступа!", show_alert=True)
+        return
+    
+    await state.clear()
+    
+    # Возвращаемся к главному меню банка, редактируя текущее сообщение
+    fake_callback = type('FakeCallback', (), {
+        'from_user': callback.from_user,
+        'message': callback.message,
+        'data': f"bank_menu:{owner_user_id}",
+        'answer': callback.answer
+    })()
+    
+    await bank_menu_callback(fake_callback)
+
+
+# --- Обработчики банковских callback ---
+
+@callbacks.on("bank_history:*")
+async def bank_history_callback(callback: types.CallbackQuery):
+    """Обработчик кнопки истории операций - показ списка депозитов"""
+    from main import safe_edit_message
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    # Проверяем, что кнопку нажал владелец
+    try:
+        parts = callback.data.split(":")
+        owner_user_id = int(parts[1])
+        page = int(parts[2]) if len(parts) > 2 else 1
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    # Получаем все депозиты пользователя
+    all_deposits = await db_async.bank.get_user_deposits(callback.from_user.id)
+    
+    if not all_deposits:
+        text = (
+            f"📋 Все ваши депозиты:\n\n"
+            f"🤷‍♂️ Пока что здесь пусто...\n\n"
+            f"💡 Самое время создать первый депозит!\n"
+            f"🚀 Начните зарабатывать пассивный доход уже сегодня!"
+        )
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"bank_back:{owner_user_id}")]
+        ])
+        
+        await safe_edit_message(callback, text, keyboard)
+        return
+    
+    # Разбиваем на страницы
+    page_deposits, current_page, max_page = paginate_deposits(all_deposits, page, per_page=6)
+    
+    text = (
+        f"📋 Все ваши депозиты:\n\n"
+        f"💎 Здесь собраны все ваши инвестиции! 🏆\n"
+        f"✅ Готовые к сбору | ❓ Активные | ❓ Закрытые\n\n"
+        f"👆 Нажмите на депозит для подробной информации\n"
+    )
+    
+    # Создаем кнопки депозитов
+    keyboard_rows = []
+    
+    for deposit in page_deposits:
+        deposit_text = format_deposit_button_text(deposit)
+        action_emoji = get_deposit_action_emoji(deposit['status'])
+        
+        # Кнопка с информацией о депозите и кнопка действия
+        keyboard_rows.append([
+            InlineKeyboardButton(
+                text=f"{deposit_text}",
+                callback_data=f"deposit_info:{deposit['id']}:{owner_user_id}"
+            ),
+            InlineKeyboardButton(
+                text=f"{action_emoji}",
+                callback_data=f"deposit_action:{deposit['id']}:{owner_user_id}"
+            )
+        ])
+    
+    # Навигация по страницам
+    if max_page > 1:
+        nav_buttons = []
+        if current_page > 1:
+            nav_buttons.append(InlineKeyboardButton(text="<", callback_data=f"bank_history:{owner_user_id}:{current_page-1}"))
+        
+        nav_buttons.append(InlineKeyboardButton(text=f"{current_page}/{max_page}", callback_data="noop"))
+        
+        if current_page < max_page:
+            nav_buttons.append(InlineKeyboardButton(text=">", callback_data=f"bank_history:{owner_user_id}:{current_page+1}"))
+        
+        keyboard_rows.append(nav_buttons)
+    
+    # Кнопка назад
+    keyboard_rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"bank_back:{owner_user_id}")])
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+    
+    await safe_edit_message(callback, text, keyboard)
+
+
+# Обработчик информации о депозите
+@callbacks.on("deposit_info:*")
+async def deposit_info_callback(callback: types.CallbackQuery):
+    """Показать подробную информацию о депозите"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, deposit_id, owner_user_id = callback.data.split(":")
+        deposit_id = int(deposit_id)
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    # Получаем информацию о депозите
+    deposit = bank_system.get_deposit_info(callback.from_user.id, deposit_id)
+    if not deposit:
+        await callback.answer("Депозит не найден", show_alert=True)
+        return
+    
+    amount = deposit['amount']
+    days = deposit['duration_days']
+    rate = deposit['interest_rate']
+    remaining_days = deposit.get('remaining_days', 0)
+    profit = amount * rate
+    total_return = amount + profit
+    status = deposit['status']
+    
+    # Определяем статус для отображения
+    if status in ['closed_early', 'withdrawn_early', 'completed']:
+        status_text = "❓ ДЕПОЗИТ ЗАКРЫТ!"
+    else:
+        status_text = f"❓ Осталось {remaining_days} дней."
+    
+    text = (
+        f"💰 Сумма депозита: {amount:.0f} Дань\n"
+        f"📅 Срок: {days} дней\n"
+        f"📈 Процентная ставка: {int(rate*100)}%\n"
+        f"💵 Прибыль: {profit:.0f} Дань\n"
+        f"🎯 Итого к получению: {total_return:.0f} Дань\n"
+        f"{status_text}"
+    )
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"bank_history:{owner_user_id}:1")]
+    ])
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+
+# Обработчик действий с депозитом
+@callbacks.on("deposit_action:*")
+async def deposit_action_callback(callback: types.CallbackQuery):
+    """Обработка действий с депозитом (X, ✅, 📋)"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, deposit_id, owner_user_id = callback.data.split(":")
+        deposit_id = int(deposit_id)
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    # Получаем информацию о депозите
+    deposit = bank_system.get_deposit_info(callback.from_user.id, deposit_id)
+    if not deposit:
+        await callback.answer("Депозит не найден", show_alert=True)
+        return
+    
+    status = deposit['status']
+    
+    if status == 'active':
+        # Показываем меню подтверждения закрытия
+        amount = deposit['amount']
+        rate = deposit['interest_rate']
+        remaining_days = deposit.get('remaining_days', 0)
+        profit = amount * rate
+        
+        text = (
+            f"💰 Сумма депозита: {amount:.0f} Дань\n"
+            f"📈 Процентная ставка: {int(rate*100)}%\n"
+            f"💵 Прибыль: {profit:.0f} Дань\n"
+            f"📅 Осталько дней к получению: {remaining_days} дней\n\n"
+            f"❓ Подтвердить ЗАКРЫТИЕ депозита?"
+        )
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"confirm_close:{deposit_id}:{owner_user_id}")],
+            [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"bank_history:{owner_user_id}:1")]
+        ])
+        
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        
+    elif status == 'matured':
+        # Собираем доходы
+        success,  message_text, amount = bank_system.collect_completed_deposit(callback.from_user.id, deposit_id)
+        
+        if success:
+            # Добавляем деньги на баланс
+            db.add_dan(callback.from_user.id, int(amount))
+            await callback.answer(f"✅ {message_text}", show_alert=True)
+        else:
+            await callback.answer(f"❌ {message_text}", show_alert=True)
+        
+        # Возвращаемся к списку депозитов
+        fake_callback = types.CallbackQuery(
+            id=callback.id,
+            from_user=callback.from_user,
+            chat_instance=callback.chat_instance,
+            data=f"bank_history:{owner_user_id}:1",
+            message=callback.message
+        )
+        await bank_history_callback(fake_callback)
+        
+    else:
+        # Архивный депозит - просто показываем информацию
+        await callback.answer("📋 Этот депозит уже закрыт", show_alert=True)
+
+
+# Обработчик подтверждения закрытия депозита
+@callbacks.on("confirm_close:*")
+async def confirm_close_callback(callback: types.CallbackQuery):
+    """Подтверждение закрытия депозита"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, deposit_id, owner_user_id = callback.data.split(":")
+        deposit_id = int(deposit_id)
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    # Закрываем депозит
+    success, message_text = bank_system.close_deposit_early(callback.from_user.id, deposit_id)
+    
+    if success:
+        # Получаем информацию о депозите для возврата суммы
+        deposit = bank_system.get_deposit_info(callback.from_user.id, deposit_id)
+        if deposit:
+            amount = deposit['amount']
+            db.add_dan(callback.from_user.id, int(amount))
+        
+        await callback.answer(f"✅ {message_text}", show_alert=True)
+    else:
+        await callback.answer(f"❌ {message_text}", show_alert=True)
+    
+    # Возвращаемся к списку депозитов
+    fake_callback = types.CallbackQuery(
+        id=callback.id,
+        from_user=callback.from_user,
+        chat_instance=callback.chat_instance,
+        data=f"bank_history:{owner_user_id}:1",
+        message=callback.message
+    )
+    await bank_history_callback(fake_callback)
+
+
+@callbacks.on("bank_back:*")
+async def bank_back_callback(callback: types.CallbackQuery):
+    """Возврат в главное меню банка"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, owner_user_id = callback.data.split(":")
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    # Используем новое меню банка через bank_menu_callback
+    fake_callback = type('FakeCallback', (), {
+        'from_user': callback.from_user,
+        'message': callback.message,
+        'data': f"bank_menu:{owner_user_id}",
+        'answer': callback.answer
+    })()
+    
+    await bank_menu_callback(fake_callback)
+
+
+# Обработчик FSM для прямого ввода суммы депозита (когда план уже выбран)
+@texts.on(BankStates.waiting_for_direct_deposit_amount)
+async def process_direct_deposit_amount(message: types.Message, state: FSMContext):
+    """Обработка ввода суммы для уже выбранного плана депозита"""
+    if not getattr(message, 'from_user', None) or not getattr(message, 'text', None):
+        return
+    
+    data = await state.get_data()
+    user_id = data.get('user_id')
+    days = data.get('days')
+    interest_rate = data.get('interest_rate')
+    
+    if user_id != message.from_user.id:
+        await state.clear()
+        return
+    
+    # Проверяем что это reply на сообщение от бота (необязательно конкретное)
+    # Это защитит от реакции на обычные сообщения с числами
+    if not message.reply_to_message or not message.reply_to_message.from_user.is_bot:
+        # Игнорируем обычные сообщения, реагируем только на reply на сообщения бота
+        return
+    
+    try:
+        amount = float(message.text.strip())
+    except (ValueError, TypeError):
+        await message.reply("❌ Введите корректную сумму числом")
+        return
+    
+    if amount < 1000:
+        await message.reply("❌ Минимальная сумма депозита: 1000 Дань")
+        return
+    
+    if amount > 1000000:
+        await message.reply("❌ Максимальная сумма депозита: 1,000,000 Дань")
+        return
+    
+    # Проверяем баланс
+    user = db.get_user(user_id)
+    if not user:
+        await message.reply("❌ Пользователь не найден")
+        await state.clear()
+        return
+    
+    dan_balance = float(user.get("dan", 0))
+    if amount > dan_balance:
+        await message.reply(f"❌ У вас недостаточно средств. Ваш баланс: {format_amount(dan_balance)} дань")
+        return
+    
+    # Вычисляем прибыль (ставка в процентах, нужно перевести в десятичную)
+    rate_decimal = interest_rate / 100
+    profit = amount * rate_decimal
+    total_return = amount + profit
+    
+    text = (
+        f"💳 Подтверждение депозита\n"
+        f"-~-~-~-~-~-~-~-\n\n"
+        f"💰 Сумма депозита: {format_amount(amount)} дань\n"
+        f"📅 Срок: {days} дней\n"
+        f"📈 Процентная ставка: {interest_rate}%\n"
+        f"💵 Прибыль: {format_amount(profit)} дань\n"
+        f"🎯 Итого к получению: {format_amount(total_return)} дань\n\n"
+        f"❓ Подтвердить создание депозита?"
+    )
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"confirm_direct_deposit:{user_id}")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=f"bank_cancel:{user_id}")]
+    ])
+    
+    # Сохраняем данные для подтверждения
+    await state.update_data(amount=amount, rate_decimal=rate_decimal)
+    await state.set_state(BankStates.confirming_deposit)
+    
+    await message.answer(text, reply_markup=keyboard, parse_mode='HTML')
+
+
+@callbacks.on("deposit_plan:*")
+async def deposit_plan_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Шаг 4: Обработка выбора плана и подтверждение"""
+    from main import safe_edit_message
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, days_str, rate_str, owner_user_id = callback.data.split(":")
+        days = int(days_str)
+        rate = float(rate_str)
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    amount = data.get('amount', 0)
+    
+    if not amount:
+        await callback.answer("Ошибка: сумма не найдена", show_alert=True)
+        await state.clear()
+        return
+    
+    # Вычисляем потенциальную прибыль
+    profit = amount * rate
+    total_return = amount + profit
+    
+    text = (
+        f"💳 Подтверждение депозита\n"
+        f"-~-~-~-~-~-~-~-\n\n"
+        f"💰 Сумма депозита: {amount:.0f} Дань\n"
+        f"📅 Срок: {days} дней\n"
+        f"📈 Процентная ставка: {int(rate*100)}%\n"
+        f"💵 Прибыль: {profit:.0f} Дань\n"
+        f"🎯 Итого к получению: {total_return:.0f} Дань\n\n"
+        f"❓ Подтвердить создание депозита?"
+    )
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"confirm_deposit:{days}:{rate}:{owner_user_id}")],
+        [InlineKeyboardButton(text="⬅️ Назад к выбору", callback_data=f"back_to_plans:{owner_user_id}")]
+    ])
+    
+    await state.set_state(BankStates.confirming_deposit)
+    await state.update_data(days=days, rate=rate)
+    
+    await safe_edit_message(callback, text, keyboard)
+
+
+@callbacks.on("confirm_deposit:*")
+async def confirm_deposit_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Шаг 5: Финальное подтверждение и создание депозита"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, days_str, rate_str, owner_user_id = callback.data.split(":")
+        days = int(days_str)
+        rate = float(rate_str)
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    amount = data.get('amount', 0)
+    
+    if not amount:
+        await callback.answer("Ошибка: данные депозита не найдены", show_alert=True)
+        await state.clear()
+        return
+    
+    # Проверяем баланс еще раз
+    user = db.get_user(callback.from_user.id)
+    if not user:
+        await callback.answer("Пользователь не найден", show_alert=True)
+        await state.clear()
+        return
+    
+    current_balance = float(user.get("dan", 0))
+    if current_balance < amount:
+        await callback.answer("❌ Недостаточно средств на балансе", show_alert=True)
+        await state.clear()
+        return
+    
+    # Списываем с баланса
+    db.add_dan(callback.from_user.id, -int(amount))
+    
+    # Создаем депозит
+    username = getattr(callback.from_user, 'username', None) or "NoUsername"
+    success = bank_system.add_deposit(callback.from_user.id, username, amount, days, rate)
+    
+    if success:
+        profit = amount * rate
+        total_return = amount + profit
+        
+        text = (
+            f"✅ Депозит успешно создан!\n\n"
+            f"� Сумма: {amount:.0f} Дань\n"
+            f"� Срок: {days} дней\n"
+            f"📈 Ставка: {int(rate*100)}%\n"
+            f"🎯 К получению: {total_return:.0f} Дань\n\n"
+            f"💰 Деньги списаны с баланса.\n"
+            f"📋 Депозит добавлен в ваши акты."
+        )
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🏦 Вернуться в банк", callback_data=f"bank_back:{owner_user_id}")]
+        ])
+        
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer("🎉 Депозит создан!", show_alert=True)
+    else:
+        # Возвращаем деньги в случае ошибки
+        db.add_dan(callback.from_user.id, int(amount))
+        await callback.answer("❌ Ошибка создания депозита. Деньги возвращены.", show_alert=True)
+    
+    await state.clear()
+
+
+@callbacks.on("back_to_plans:*")
+async def back_to_plans_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Возврат к выбору планов депозита"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, owner_user_id = callback.data.split(":")
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    amount = data.get('amount', 0)
+    
+    if not amount:
+        await callback.answer("Ошибка: сумма не найдена", show_alert=True)
+        await state.clear()
+        return
+    
+    # Возвращаемся к выбору плана
+    text = (
+        f"💳 Депозит\n"
+        f"-~-~-~-~-~-~-~-\n"
+        f"Открывая депозит вы соглашаетесь с этими правилами... Подробнее...\n\n"
+        f"Вы хотите открыть депозит на {amount:.0f} Дань."
+    )
+    
+    # Создаем кнопки для планов депозита
+    plan_buttons = []
+    for days, rate in DEPOSIT_PLANS:
+        plan_text = get_deposit_plan_text(days, rate)
+        plan_buttons.append(InlineKeyboardButton(
+            text=plan_text, 
+            callback_data=f"deposit_plan:{days}:{rate}:{owner_user_id}"
+        ))
+    
+    # Разбиваем кнопки по 3 в ряд
+    keyboard_rows = [plan_buttons[i:i+3] for i in range(0, len(plan_buttons), 3)]
+    keyboard_rows.append([InlineKeyboardButton(text="⬅️ Вернуться", callback_data=f"bank_open:{owner_user_id}")])
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+
+@callbacks.on("confirm_direct_deposit:*")
+async def confirm_direct_deposit_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Подтверждение создания депозита для прямого выбора плана"""
+    from main import safe_edit_message
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, owner_user_id = callback.data.split(":")
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    amount = data.get('amount')
+    days = data.get('days')
+    interest_rate = data.get('interest_rate')
+    rate_decimal = data.get('rate_decimal')
+    
+    if not all([amount, days, interest_rate, rate_decimal]):
+        await callback.answer("Ошибка: данные депозита не найдены", show_alert=True)
+        await state.clear()
+        return
+    
+    # Проверяем баланс еще раз
+    user = db.get_user(callback.from_user.id)
+    if not user:
+        await callback.answer("Пользователь не найден", show_alert=True)
+        await state.clear()
+        return
+    
+    current_balance = float(user.get("dan", 0))
+    if current_balance < amount:
+        await callback.answer("❌ Недостаточно средств на балансе", show_alert=True)
+        await state.clear()
+        return
+    
+    # Списываем деньги с баланса
+    db.add_dan(callback.from_user.id, -amount)
+    
+    # Создаем депозит
+    username = getattr(callback.from_user, 'username', None) or "NoUsername"
+    deposit_success = bank_system.add_deposit(
+        callback.from_user.id, 
+        username, 
+        amount, 
+        days, 
+        rate_decimal
+    )
+    
+    await state.clear()
+    
+    if deposit_success:
+        profit = amount * rate_decimal
+        total_return = amount + profit
+        
+        text = (
+            f"✅ Депозит создан успешно!\n\n"
+            f"💰 Сумма: {format_amount(amount)} дань\n"
+            f"📅 Срок: {days} дней\n"
+            f"📈 Ставка: {interest_rate}%\n"
+            f"💵 Прибыль: {format_amount(profit)} дань\n"
+            f"🎯 К получению: {format_amount(total_return)} дань\n\n"
+            f"📋 Депозит добавлен в ваши акты."
+        )
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🏦 Вернуться в банк", callback_data=f"bank_back:{owner_user_id}")]
+        ])
+        
+        await safe_edit_message(callback, text, keyboard)
+        await callback.answer("🎉 Депозит создан!", show_alert=True)
+    else:
+        # Возвращаем деньги в случае ошибки
+        db.add_dan(callback.from_user.id, amount)
+        await callback.answer("❌ Ошибка создания депозита. Средства возвращены.", show_alert=True)
+
+
+@callbacks.on("bank_quick_confirm:*")
+async def bank_quick_confirm_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Подтверждение создания депозита для быстрого выбора суммы"""
+    from main import safe_edit_message
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, amount_str, days_str, rate_str, owner_user_id = callback.data.split(":")
+        amount = float(amount_str)
+        days = int(days_str)
+        rate = int(rate_str)
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    # Еще раз проверяем баланс
+    user = db.get_user(callback.from_user.id)
+    if not user:
+        await callback.answer("Пользователь не найден", show_alert=True)
+        return
+    
+    current_balance = float(user.get("dan", 0))
+    if current_balance < amount:
+        await callback.answer("❌ Недостаточно средств на балансе", show_alert=True)
+        return
+    
+    # Вычисляем прибыль
+    rate_decimal = rate / 100
+    profit = amount * rate_decimal
+    total_return = amount + profit
+    
+    # Показываем окончательное подтверждение
+    text = (
+        f"💳 Подтверждение депозита\n"
+        f"-~-~-~-~-~-~-~-\n\n"
+        f"💰 Сумма: {format_amount(amount)} дань\n"
+        f"📅 Срок: {days} дней\n"
+        f"📈 Ставка: {rate}%\n"
+        f"💵 Прибыль: {format_amount(profit)} дань\n"
+        f"🎯 К получению: {format_amount(total_return)} дань\n\n"
+        f"❓ Создать депозит?"
+    )
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Создать депозит", callback_data=f"bank_final_confirm:{amount}:{days}:{rate}:{owner_user_id}")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=f"bank_cancel:{owner_user_id}")]
+    ])
+    
+    await safe_edit_message(callback, text, keyboard)
+
+
+@callbacks.on("bank_final_confirm:*")
+async def bank_final_confirm_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Финальное создание депозита для быстрого потока"""
+    from main import safe_edit_message
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        await callback.answer("Ошибка: данные недоступны", show_alert=True)
+        return
+    
+    try:
+        _, amount_str, days_str, rate_str, owner_user_id = callback.data.split(":")
+        amount = float(amount_str)
+        days = int(days_str)
+        rate = int(rate_str)
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка в данных", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("Это не ваше меню!", show_alert=True)
+        return
+    
+    # Финальная проверка баланса
+    user = db.get_user(callback.from_user.id)
+    if not user:
+        await callback.answer("Пользователь не найден", show_alert=True)
+        return
+    
+    current_balance = float(user.get("dan", 0))
+    if current_balance < amount:
+        await callback.answer("❌ Недостаточно средств на балансе", show_alert=True)
+        return
+    
+    # Списываем деньги и создаем депозит
+    db.add_dan(callback.from_user.id, -int(amount))
+    
+    username = getattr(callback.from_user, 'username', None) or "NoUsername"
+    rate_decimal = rate / 100
+    deposit_success = bank_system.add_deposit(
+        callback.from_user.id, 
+        username, 
+        amount, 
+        days, 
+        rate_decimal
+    )
+    
+    if deposit_success:
+        profit = amount * rate_decimal
+        total_return = amount + profit
+        
+        text = (
+            f"✅ Депозит создан успешно!\n\n"
+            f"💰 Сумма: {format_amount(amount)} дань\n"
+            f"📅 Срок: {days} дней\n"
+            f"📈 Ставка: {rate}%\n"
+            f"💵 Прибыль: {format_amount(profit)} дань\n"
+            f"🎯 К получению: {format_amount(total_return)} дань\n\n"
+            f"📋 Депозит добавлен в ваши акты."
+        )
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🏦 Вернуться в банк", callback_data=f"bank_back:{owner_user_id}")],
+            [InlineKeyboardButton(text="📋 Мои депозиты", callback_data=f"bank_my_deposits:{owner_user_id}")]
+        ])
+        
+        await safe_edit_message(callback, text, keyboard)
+        await callback.answer("🎉 Депозит создан!", show_alert=True)
+    else:
+        # Возвращаем деньги в случае ошибки
+        db.add_dan(callback.from_user.id, int(amount))
+        await callback.answer("❌ Ошибка создания депозита. Средства возвращены.", show_alert=True)
@@ -0,0 +1,798 @@
+"""
+Ферма: меню фермы, улучшение, животные и кормление, сбор дани
+(«ферма», «фарм», /ferma). Данные фермы — ferma.py.
+"""
+import asyncio
+import time
+import datetime
+from aiogram import Router, types
+from aiogram.filters import Command
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from ferma import get_farm
+import database as db
+import db_async
+import media_cache
+import routing
+
+
+router = Router(name="farm")
+callbacks = routing.CallbackRouter()
+router.callback_query.register(callbacks.dispatch, callbacks.filter)
+texts = routing.TextRouter()
+
+
+# --- Callback для кнопки "ферма" (menu_ferma) ---
+@callbacks.on("menu_ferma")
+async def menu_ferma_callback(callback: types.CallbackQuery):
+    # Guard: ensure callback.message and callback.from_user are present
+    from main import format_number_beautiful, safe_ensure_user
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    user_id = callback.from_user.id
+    
+    # ✅ АВТОМАТИЧЕСКИ СОБИРАЕМ ДАНЬ НА СКЛАД ПРИ ОТКРЫТИИ МЕНЮ
+    await db_async.run(safe_ensure_user, user_id, getattr(callback.from_user, 'username', None))
+    
+    # Автоматически собираем накопившуюся дань на склад
+    await db_async.ferma.collect_dan(user_id)
+    
+    # Получаем обновленные данные фермы после автосбора
+    farm = await db_async.ferma.get_farm(user_id)
+    place = await db_async.ferma.get_farm_leaderboard_position(user_id)
+    user_row = await db_async.db.get_user(user_id)
+    if not user_row:
+        bal = 0.0
+    else:
+        bal = user_row.get("dan", 0)
+        try:
+            bal = float(bal)
+        except Exception:
+            bal = 0.0
+    bal = 0.00 if abs(bal) < 0.005 else round(bal, 2)
+    bal = format_number_beautiful(bal)
+    
+    # Данные склада (после автоматического сбора)
+    stored_dan = farm['stored_dan'] if 'stored_dan' in farm else 0
+    stored_dan = float(stored_dan)
+    stored_dan = 0.00 if abs(stored_dan) < 0.005 else round(stored_dan, 2)
+    stored_dan_text = f"{stored_dan:.2f}"
+    
+    # Просто показываем сколько на складе (без промежуточных расчетов)
+    farm_status = f"🌱 Дань на складе фермы: {stored_dan_text}"
+    
+    hour = datetime.datetime.now().hour
+    greeting = "Доброе утро, фермер!" if 6 <= hour < 18 else "Доброй ночи, фермер!"
+    photo_path = "C:/BotKruz/ChatBotKruz/photo/fermaday.png" if 6 <= hour < 18 else "C:/BotKruz/ChatBotKruz/photo/fermanight.png"
+    # Доход и иконки животных
+    from ferma import is_animal_active, ANIMALS_CONFIG
+    animals = await db_async.ferma.get_user_farm_animals(user_id)
+    animals_income = 0
+    count_by_type = {}
+    for slot_number, animal_data in animals.items():
+        a_type = animal_data['type']
+        count_by_type[a_type] = count_by_type.get(a_type, 0) + 1
+        if is_animal_active(animal_data):
+            cfg = ANIMALS_CONFIG.get(a_type, {})
+            animals_income += cfg.get('income_per_hour', 0)
+    # Иконки по количеству размещенных животных
+    icon_map = { 'cow': '🐮', 'chicken': '🐔' }
+    icons_str = ''.join(icon_map.get(t, '') * n for t, n in count_by_type.items())
+    income_text = (
+        f"🌾 Доход в час: {farm['income_per_hour']} (+{animals_income} {icons_str})"
+        if icons_str else
+        f"🌾 Доход в час: {farm['income_per_hour']} (+0)"
+    )
+
+    
+    # Проверяем активен ли бесконечный склад
+    infinite_storage = await db_async.db.get_user_effect(user_id, "infinite_storage")
+    if infinite_storage:
+        import time
+        remaining_time = infinite_storage['expires_at'] - int(time.time())
+        if remaining_time > 0:
+            days = remaining_time // 86400
+            hours = (remaining_time % 86400) // 3600
+            minutes = (remaining_time % 3600) // 60
+            storage_info = f"📮 Бесконечный склад активен: {days}д {hours}ч {minutes}м"
+        else:
+            storage_info = f"📮 Вместимость склада: {farm['warehouse_capacity']}"
+
+    else:
+        storage_info = f"📮 Вместимость склада: {farm['warehouse_capacity']}"
+    
+    reply = (
+        f"👨‍🌾 🌾 {greeting}\n\n"
+        f"🏡 Уровень фермы: {farm['level']}\n"
+    f"{income_text}\n"
+        f"{storage_info}\n"
+        f"📊 Место в топе по доходу: {place}\n\n"
+        f"{farm_status}\n"
+        f"🪙 Дань на балансе: {bal}"
+    )
+    
+    # Получаем стоимость следующего улучшения
+    next_cost = await db_async.ferma.get_next_upgrade_cost(user_id)
+    
+    if next_cost is not None:
+        # Форматируем стоимость красиво
+        cost_formatted = format_number_beautiful(next_cost)
+        upgrade_text = f"📈 Улучшить ({cost_formatted})"
+    else:
+        upgrade_text = "📈 Макс. уровень"
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=upgrade_text, callback_data="upgrade_ferma"),
+            InlineKeyboardButton(text="🐄 Животные", callback_data="farm_animals")
+        ],
+        [InlineKeyboardButton(text="📥 Собрать дань", callback_data="collect_ferma")],
+        [InlineKeyboardButton(text="⬅️ В МЕНЮ", callback_data="open_game_menu")]
+    ])
+    try:
+        await media_cache.edit_photo(callback.message.edit_media, photo_path, caption=reply, reply_markup=kb)
+    except Exception as e:
+        await callback.message.edit_text(reply, reply_markup=kb)
+
+
+# Обработчик для приватных кнопок фермы с проверкой владельца
+@callbacks.on("menu_ferma:*")
+async def menu_ferma_private_callback(callback: types.CallbackQuery):
+    """Обработчик приватных кнопок фермы с проверкой владельца"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец меню
+    try:
+        _, owner_user_id = callback.data.split(":")
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("❌ Ошибка данных кнопки", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        await callback.answer("❌ Это не ваше место!", show_alert=True)
+        return
+    
+    # Вызываем основной обработчик фермы
+    await menu_ferma_callback(callback)
+
+# --- Хранилище id сообщений для удаления ---
+farm_message_ids = {}
+
+
+# --- Функция автоудаления сообщений через 10 минут ---
+async def schedule_delete_message(chat_id, message_id, text=None):
+    # Сохраняем id сообщения для команды /del
+    from main import bot
+    if chat_id not in farm_message_ids:
+        farm_message_ids[chat_id] = []
+    farm_message_ids[chat_id].append((message_id, text))
+    # Не удаляем реферальные сообщения
+    if text and ("реферал" in text.lower() or "реферальная" in text.lower()):
+        return
+    await asyncio.sleep(600)
+    try:
+        await bot.delete_message(chat_id, message_id)
+    except Exception:
+        pass
+
+
+# --- Обработка кнопки 'Улуч. Ферму' ---
+
+@callbacks.on("upgrade_ferma")
+async def callback_upgrade_ferma(callback: types.CallbackQuery):
+    from main import bot, format_number_beautiful
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    user_id = callback.from_user.id
+    from ferma import upgrade_farm, get_farm
+    result = upgrade_farm(user_id)
+    await callback.answer(result['msg'], show_alert=True)
+    # Обновить сообщение с фермой, если апгрейд успешен
+    if result['status'] == 'ok':
+        farm = get_farm(user_id)
+        place = await db_async.ferma.get_farm_leaderboard_position(user_id)
+        bal = float(db.get_user(user_id)["dan"])
+        bal = format_number_beautiful(bal)
+        # Гарантируем, что stored_dan определён
+        stored_dan = farm['stored_dan'] if 'stored_dan' in farm else 0
+        stored_dan = float(stored_dan)
+        stored_dan = 0.00 if abs(stored_dan) < 0.005 else round(stored_dan, 2)
+        stored_dan = f"{stored_dan:.2f}"
+
+        # Вычисляем доход от животных
+        from ferma import calculate_animals_income
+        animals_income, _ = calculate_animals_income(user_id)
+        total_income = farm['income_per_hour'] + animals_income
+        income_text = f"💰 Доход в час: {total_income:.2f}"
+
+        # Получаем стоимость следующего улучшения
+        from ferma import get_next_upgrade_cost
+        next_cost = get_next_upgrade_cost(user_id)
+
+        if next_cost is not None:
+            # Форматируем стоимость красиво
+            cost_formatted = format_number_beautiful(next_cost)
+            upgrade_text = f"📈 Улучшить ({cost_formatted})"
+        else:
+            upgrade_text = "📈 Макс. уровень"
+
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text=upgrade_text, callback_data="upgrade_ferma"),
+                InlineKeyboardButton(text="🐄 Животные", callback_data="farm_animals")
+            ],
+            [InlineKeyboardButton(text="📥 Собрать дань", callback_data="collect_ferma")],
+            [InlineKeyboardButton(text="⬅️ В МЕНЮ", callback_data="open_game_menu")]
+        ])
+        hour = datetime.datetime.now().hour
+        if 6 <= hour < 18:
+            greeting = "Доброе утро, фермер!"
+            photo_path = "C:/BotKruz/ChatBotKruz/photo/fermaday.png"
+        else:
+            greeting = "Доброй ночи, фермер!"
+            photo_path = "C:/BotKruz/ChatBotKruz/photo/fermanight.png"
+
+        # Проверяем активен ли бесконечный склад
+        infinite_storage = db.get_user_effect(user_id, "infinite_storage")
+        if infinite_storage:
+            import time
+            remaining_time = infinite_storage['expires_at'] - int(time.time())
+            if remaining_time > 0:
+                days = remaining_time // 86400
+                hours = (remaining_time % 86400) // 3600
+                minutes = (remaining_time % 3600) // 60
+                storage_info = f"📮 Бесконечный склад активен: {days}д {hours}ч {minutes}м"
+            else:
+                storage_info = f"📮 Вместимость склада: {farm['warehouse_capacity']}"
+        else:
+            storage_info = f"📮 Вместимость склада: {farm['warehouse_capacity']}"
+
+        reply = (
+            f"👨‍🌾 🌾 {greeting}\n\n"
+            f"🏡 Уровень фермы: {farm['level']}\n"
+            f"{income_text}\n"
+            f"{storage_info}\n"
+            f"📊 Место в топе по доходу: {place}\n\n"
+            f"🌱 Дань на складе фермы: {stored_dan}\n"
+            f"🪙 Дань на балансе: {bal}"
+        )
+
+        # Редактируем существующее сообщение вместо удаления и создания нового
+        try:
+            await media_cache.edit_photo(callback.message.edit_media, photo_path, caption=reply, reply_markup=kb)
+        except Exception:
+            # Fallback: редактируем только текст, если с медиа проблемы
+            try:
+                await callback.message.edit_text(reply, reply_markup=kb)
+            except Exception:
+                # Последний fallback: удаляем и создаем заново
+                await callback.message.delete()
+                await bot.send_message(callback.message.chat.id, reply, reply_markup=kb)
+    else:
+        # Если апгрейд не удался, просто возвращаем ответ и ничего не обновляем
+        return
+
+
+# --- Обработчик меню животных на ферме ---
+
+@callbacks.on("farm_animals")
+async def callback_farm_animals(callback: types.CallbackQuery):
+    """Показывает меню управления животными на ферме"""
+    from main import bot
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    from ferma import get_farm, get_available_animal_slots, get_user_farm_animals, is_animal_active, ANIMALS_CONFIG
+    
+    farm = get_farm(user_id)
+    max_slots = get_available_animal_slots(farm['level'])
+    
+    if max_slots == 0:
+        await callback.answer("❌ У вас нет слотов для животных! Улучшите ферму до уровня 3.", show_alert=True)
+        return
+    
+    # Получаем размещённых животных
+    placed_animals = get_user_farm_animals(user_id)
+    
+    # Получаем животных из хранилища owned + из инвентаря (легаси)
+    from ferma import get_unassigned_animals_counts
+    owned_counts = get_unassigned_animals_counts(user_id)
+    inv_list = db.get_inventory(user_id)  # [(item_id, count), ...]
+    inventory = {item_id: count for item_id, count in inv_list}
+    chicken_count = owned_counts.get('08', 0) + inventory.get('08', 0)
+    cow_count = owned_counts.get('09', 0) + inventory.get('09', 0)
+    
+    # Формируем текст с информацией о слотах
+    reply = "🐄 **Животные на ферме**\n\n"
+    reply += f"📦 Доступно слотов: {max_slots}\n"
+    reply += f"✅ Занято: {len(placed_animals)}\n\n"
+    
+    # Показываем каждый слот
+    for slot in range(1, max_slots + 1):
+        if slot in placed_animals:
+            animal = placed_animals[slot]
+            animal_type = animal['type']
+            config = ANIMALS_CONFIG.get(animal_type, {})
+            animal_name = config.get('name', 'Неизвестное животное')
+            income = config.get('income_per_hour', 0)
+            
+            # Проверяем активность
+            import time
+            hours_since_fed = (time.time() - animal['last_fed_time']) / 3600
+            hours_left = 12 - hours_since_fed
+            
+            if is_animal_active(animal):
+                status = f"🟢 Активно ({int(hours_left)} ч до кормления)"
+                income_text = f"{income} дань/час"
+            else:
+                status = "💤 Голодает (покорми меня!)"
+                income_text = "0 дань/час"
+            
+            reply += f"**Слот #{slot}:** {animal_name}\n"
+            reply += f"  └ Доход: {income_text}\n"
+            reply += f"  └ Статус: {status}\n\n"
+        else:
+            reply += f"**Слот #{slot}:** Пусто\n\n"
+    
+    # Создаем кнопки
+    kb_buttons = []
+    
+    # Кнопки для размещения животных из инвентаря
+    if chicken_count > 0 and len(placed_animals) < max_slots:
+        kb_buttons.append([
+            InlineKeyboardButton(text=f"🐔 Использовать Курицу ({chicken_count} шт)", callback_data="place_animal:08")
+        ])
+    
+    if cow_count > 0 and len(placed_animals) < max_slots:
+        kb_buttons.append([
+            InlineKeyboardButton(text=f"🐄 Использовать Корову ({cow_count} шт)", callback_data="place_animal:09")
+        ])
+    
+    # Кнопки для каждого занятого слота
+    for slot in range(1, max_slots + 1):
+        if slot in placed_animals:
+            animal = placed_animals[slot]
+            animal_type = animal['type']
+            config = ANIMALS_CONFIG.get(animal_type, {})
+            
+            # Кнопка кормления
+            if is_animal_active(animal):
+                feed_text = f"🍖 Покормить #{slot}"
+            else:
+                feed_text = f"🍖 Покормить #{slot} 💤"
+            
+            kb_buttons.append([
+                InlineKeyboardButton(text=feed_text, callback_data=f"feed_animal:{slot}"),
+                InlineKeyboardButton(text=f"📤 Убрать #{slot}", callback_data=f"remove_animal:{slot}")
+            ])
+    
+    kb_buttons.append([InlineKeyboardButton(text="⬅️ К ферме", callback_data="menu_ferma")])
+    kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+    
+    # Редактируем существующее сообщение
+    try:
+        await callback.message.edit_text(reply, reply_markup=kb, parse_mode="Markdown")
+    except Exception:
+        # Если это было сообщение с медиа, удаляем и создаём новое
+        try:
+            await callback.message.delete()
+            await bot.send_message(callback.message.chat.id, reply, reply_markup=kb, parse_mode="Markdown")
+        except Exception:
+            pass
+
+
+# --- Обработчик размещения животного из инвентаря ---
+
+@callbacks.on("place_animal:*")
+async def callback_place_animal(callback: types.CallbackQuery):
+    """Размещает животное из инвентаря/owned_animals на ферму"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    parts = callback.data.split(":")
+    if len(parts) < 2:
+        await callback.answer("Ошибка формата данных", show_alert=True)
+        return
+    
+    animal_item_id = parts[1]  # "08" или "09"
+    
+    from ferma import place_animal_on_farm
+    
+    # Функция place_animal_on_farm сама проверит наличие в owned_animals и инвентаре
+    result = place_animal_on_farm(user_id, animal_item_id)
+    
+    if result['status'] == 'ok':
+        await callback.answer(f"✅ {result['msg']}", show_alert=True)
+        # Обновляем меню
+        await callback_farm_animals(callback)
+    else:
+        await callback.answer(f"❌ {result['msg']}", show_alert=True)
+
+
+# --- Обработчик кормления животного ---
+
+@callbacks.on("feed_animal:*")
+async def callback_feed_animal(callback: types.CallbackQuery):
+    """Кормит животное в указанном слоте"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    parts = callback.data.split(":")
+    if len(parts) < 2:
+        await callback.answer("Ошибка формата данных", show_alert=True)
+        return
+    
+    slot_number = int(parts[1])
+    
+    # Определяем доступные виды корма для животного в слоте и показываем количества
+    from ferma import get_user_farm_animals, ANIMALS_CONFIG
+    placed = get_user_farm_animals(user_id)
+    if slot_number not in placed:
+        await callback.answer("В этом слоте нет животного", show_alert=True)
+        return
+    a = placed[slot_number]
+    allowed_foods = ANIMALS_CONFIG.get(a['type'], {}).get('food_items', ['06', '07'])
+    # Считаем количество корма у пользователя
+    inv_map = {i: c for i, c in db.get_inventory(user_id)}
+    wheat_qty = inv_map.get('06', 0)
+    corn_qty = inv_map.get('07', 0)
+    
+    row = []
+    if '06' in allowed_foods:
+        row.append(InlineKeyboardButton(text=f"🌾 Пшеница ({wheat_qty} шт)", callback_data=f"feed_with:06:{slot_number}"))
+    if '07' in allowed_foods:
+        row.append(InlineKeyboardButton(text=f"🌽 Кукуруза ({corn_qty} шт)", callback_data=f"feed_with:07:{slot_number}"))
+    kb = InlineKeyboardMarkup(inline_keyboard=[row, [InlineKeyboardButton(text="⬅️ Назад", callback_data="farm_animals")]])
+    
+    await callback.message.edit_text(
+        f"Выберите чем покормить животное в слоте #{slot_number}:",
+        reply_markup=kb
+    )
+
+
+# --- Обработчик выбора еды для кормления ---
+
+@callbacks.on("feed_with:*")
+async def callback_feed_with(callback: types.CallbackQuery):
+    """Кормит животное выбранной едой"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    parts = callback.data.split(":")
+    if len(parts) < 3:
+        await callback.answer("Ошибка формата данных", show_alert=True)
+        return
+    
+    food_item_id = parts[1]  # 06 или 07
+    slot_number = int(parts[2])
+    
+    from ferma import feed_animal
+    result = feed_animal(user_id, slot_number, food_item_id)
+    
+    await callback.answer(result['msg'], show_alert=True)
+    
+    if result['status'] == 'ok':
+        # Возвращаемся в меню животных
+        await callback_farm_animals(callback)
+
+
+# --- Обработчик снятия животного с фермы ---
+
+@callbacks.on("remove_animal:*")
+async def callback_remove_animal(callback: types.CallbackQuery):
+    """Убирает животное с фермы обратно в инвентарь"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    parts = callback.data.split(":")
+    if len(parts) < 2:
+        await callback.answer("Ошибка формата данных", show_alert=True)
+        return
+    
+    slot_number = int(parts[1])
+    
+    from ferma import remove_animal_from_farm
+    result = remove_animal_from_farm(user_id, slot_number)
+    
+    await callback.answer(result['msg'], show_alert=True)
+    
+    if result['status'] == 'ok':
+        # Возвращаемся в меню животных
+        await callback_farm_animals(callback)
+
+
+# --- Обработчик склада удален - теперь склад улучшается вместе с фермой ---
+
+@texts.exact("ферма")
+async def cmd_ferma(message: types.Message):
+    """Открывает меню фермы (доступно в чате и в лс)"""
+    from main import create_back_to_menu_keyboard, format_number_beautiful, safe_ensure_user_from_obj
+    if not getattr(message, 'from_user', None):
+        return
+    user_id = message.from_user.id
+    # Ensure user exists
+    await db_async.run(safe_ensure_user_from_obj, message.from_user)
+
+    try:
+        # Reuse the same logic as menu_ferma_callback but send a message instead of editing media
+        # Автосбор дань на склад
+        await db_async.ferma.collect_dan(user_id)
+
+        farm = await db_async.ferma.get_farm(user_id)
+        place = await db_async.ferma.get_farm_leaderboard_position(user_id)
+        user_row = await db_async.db.get_user(user_id)
+        bal = user_row.get("dan", 0) if user_row else 0
+        try:
+            bal = float(bal)
+        except Exception:
+            bal = 0.0
+        bal = 0.00 if abs(bal) < 0.005 else round(bal, 2)
+        bal = format_number_beautiful(bal)
+
+        stored_dan = farm.get('stored_dan', 0)
+        try:
+            stored_dan = float(stored_dan)
+        except Exception:
+            stored_dan = 0.0
+        stored_dan = 0.00 if abs(stored_dan) < 0.005 else round(stored_dan, 2)
+        stored_dan_text = f"{stored_dan:.2f}"
+        # Полностью синхронизируем подпись со вкладкой из меню
+        farm_status = f"🌱 Дань на складе фермы: {stored_dan_text}"
+
+        hour = datetime.datetime.now().hour
+        greeting = "Доброе утро, фермер!" if 6 <= hour < 18 else "Доброй ночи, фермер!"
+        photo_path = "C:/BotKruz/ChatBotKruz/photo/fermaday.png" if 6 <= hour < 18 else "C:/BotKruz/ChatBotKruz/photo/fermanight.png"
+
+        # Проверяем активен ли бесконечный склад
+        infinite_storage = await db_async.db.get_user_effect(user_id, "infinite_storage")
+        if infinite_storage:
+            import time
+            remaining_time = infinite_storage['expires_at'] - int(time.time())
+            if remaining_time > 0:
+                days = remaining_time // 86400
+                hours = (remaining_time % 86400) // 3600
+                minutes = (remaining_time % 3600) // 60
+                storage_info = f"📮 Бесконечный склад активен: {days}д {hours}ч {minutes}м"
+            else:
+                storage_info = f"📮 Вместимость склада: {farm['warehouse_capacity']}"
+        else:
+            storage_info = f"📮 Вместимость склада: {farm['warehouse_capacity']}"
+
+        # Доход и иконки животных
+        from ferma import is_animal_active, ANIMALS_CONFIG
+        animals = await db_async.ferma.get_user_farm_animals(user_id)
+        animals_income = 0
+        counts = {}
+        for _, a in animals.items():
+            a_type = a['type']
+            counts[a_type] = counts.get(a_type, 0) + 1
+            if is_animal_active(a):
+                cfg = ANIMALS_CONFIG.get(a_type, {})
+                animals_income += cfg.get('income_per_hour', 0)
+        icons_map = { 'cow': '🐮', 'chicken': '🐔' }
+        icons = ''.join(icons_map.get(t, '') * n for t, n in counts.items())
+        income_text = (
+            f"🌾 Доход в час: {farm['income_per_hour']} (+{animals_income} {icons})"
+            if icons else f"🌾 Доход в час: {farm['income_per_hour']} (+0)"
+        )
+
+        reply = (
+            f"👨‍🌾 🌾 {greeting}\n\n"
+            f"🏡 Уровень фермы: {farm['level']}\n"
+            f"{income_text}\n"
+            f"{storage_info}\n"
+            f"📊 Место в топе по доходу: {place}\n\n"
+            f"{farm_status}\n"
+            f"🪙 Дань на балансе: {bal}"
+        )
+
+        # Стоимость апгрейда
+        next_cost = await db_async.ferma.get_next_upgrade_cost(user_id)
+        if next_cost is not None:
+            upgrade_text = f"📈 Улучшить ({format_number_beautiful(next_cost)})"
+        else:
+            upgrade_text = "📈 Макс. уровень"
+
+        # Приводим клавиатуру к тому же виду, что и при нажатии "Ферма" в меню
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text=upgrade_text, callback_data="upgrade_ferma"),
+                InlineKeyboardButton(text="🐄 Животные", callback_data="farm_animals")
+            ],
+            [InlineKeyboardButton(text="📥 Собрать дань", callback_data="collect_ferma")],
+            [InlineKeyboardButton(text="⬅️ В МЕНЮ", callback_data="open_game_menu")]
+        ])
+
+        try:
+            await media_cache.send_photo(message.answer_photo, photo_path, caption=reply, reply_markup=kb)
+        except Exception:
+            await message.answer(reply, reply_markup=kb)
+
+    except Exception as e:
+        # Фолбек: показать сообщение без фото
+        await message.reply(f"🌾 Ферма\n\nВременно недоступна.", reply_markup=create_back_to_menu_keyboard(user_id))
+
+
+@texts.on(Command("ferma"))
+async def cmd_ferma_command(message: types.Message):
+    """Alias for English /ferma command — behaves the same as Russian 'ферма' and works in chats."""
+    await cmd_ferma(message)
+
+ferma_public_cooldowns = dict()
+
+
+@texts.on(Command("ferma"))
+async def cmd_ferma_en(message: types.Message):
+    from main import bot, format_number_beautiful, safe_ensure_user_from_obj
+    import time
+    if not getattr(message, 'chat', None):
+        return
+    if message.chat.type != "private":
+        await bot.send_message(message.chat.id, "Команда доступна только в личных сообщениях бота \n \n Тыкаю сЮды ➡️ @KruzChatBot")
+        return
+    now = datetime.datetime.now()
+    hour = now.hour
+    greeting = "Доброе утро, фермер!" if 6 <= hour < 18 else "Доброй ночи, фермер!"
+    user_id = message.from_user.id
+    await db_async.run(safe_ensure_user_from_obj, message.from_user)
+    await db_async.ferma.collect_dan(user_id)  # Автоматически начисляем накопленную дань
+    farm = await db_async.ferma.get_farm(user_id)
+    place = await db_async.ferma.get_farm_leaderboard_position(user_id)
+    bal = (await db_async.db.get_user(user_id))["dan"]
+    bal = float(bal)
+    bal = 0.00 if abs(bal) < 0.005 else round(bal, 2)
+    bal = format_number_beautiful(bal)
+    # Гарантируем, что stored_dan определён
+    stored_dan = farm['stored_dan'] if 'stored_dan' in farm else 0
+    stored_dan = float(stored_dan)
+    stored_dan = 0.00 if abs(stored_dan) < 0.005 else round(stored_dan, 2)
+    stored_dan = f"{stored_dan:.2f}"
+    # Доход и иконки животных
+    from ferma import is_animal_active, ANIMALS_CONFIG
+    animals = await db_async.ferma.get_user_farm_animals(user_id)
+    animals_income = 0
+    counts = {}
+    for _, a in animals.items():
+        a_type = a['type']
+        counts[a_type] = counts.get(a_type, 0) + 1
+        if is_animal_active(a):
+            cfg = ANIMALS_CONFIG.get(a_type, {})
+            animals_income += cfg.get('income_per_hour', 0)
+    icons_map = { 'cow': '🐮', 'chicken': '🐔' }
+    icons = ''.join(icons_map.get(t, '') * n for t, n in counts.items())
+    income_text = (
+        f"🌾 Доход в час: {farm['income_per_hour']} (+{animals_income} {icons})"
+        if icons else f"🌾 Доход в час: {farm['income_per_hour']} (+0)"
+    )
+    reply = (
+        f"👨‍🌾 🌾 {greeting}\n\n"
+        f"🏡 Уровень фермы: {farm['level']}\n"
+        f"{income_text}\n"
+        f"📮 Вместимость склада: {farm['warehouse_capacity']}\n"
+        f"📊 Место в топе по доходу: {place}\n\n"
+        f"🌱 Дань на складе фермы: {stored_dan}\n"
+        f"🪙 Дань на балансе: {bal}"
+    )
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📈Улуч. Ферму", callback_data="upgrade_ferma"),
+            InlineKeyboardButton(text="🧱Улуч. склад", callback_data="upgrade_warehouse")
+        ],
+        [InlineKeyboardButton(text="🐄 Животные", callback_data="farm_animals")],
+        [InlineKeyboardButton(text="Собрать дань", callback_data="collect_ferma")]
+    ])
+    try:
+        photo_path = "C:/BotKruz/ChatBotKruz/photo/fermaday.png" if 6 <= hour < 18 else "C:/BotKruz/ChatBotKruz/photo/fermanight.png"
+        await media_cache.send_photo(message.answer_photo, photo_path, caption=reply, reply_markup=kb)
+    except Exception as e:
+        await message.reply(f"[Ошибка фото: {e}]\n" + reply, reply_markup=kb)
+    # Удалено автоудаление
+    return
+
+
+# --- КОМАНДА ФАРМ ---
+async def check_channel_subscription(user_id: int, channel_username: str = "DanuloKruz") -> bool:
+    """Проверяет подписку пользователя на канал"""
+    from main import bot
+    try:
+        member = await bot.get_chat_member(f"@{channel_username}", user_id)
+        return member.status in ["member", "administrator", "creator"]
+    except Exception as e:
+        # Если канал недоступен для проверки участников, показываем сообщение о подписке
+        print(f"Ошибка проверки подписки: {e}")
+        return False  # Показываем сообщение о подписке
+
+
+@texts.exact("фарм", "/farm", "afhv")
+async def cmd_farm_collect(message: types.Message):
+    """Команда 'фарм' и '/farm' - сбор дани с проверкой подписки на канал"""
+    from main import safe_ensure_user_from_obj
+    if not getattr(message, 'from_user', None):
+        return
+    
+    user_id = message.from_user.id
+    
+    # Проверяем подписку на канал
+    is_subscribed = await check_channel_subscription(user_id)
+    
+    if not is_subscribed:
+        await message.reply(
+            '❌ Команда <b>"фарм"</b> работает после подписки на канал разработчика! \n\n✅ - - - > @DanuloKruz',
+            parse_mode='HTML'
+        )
+        return
+    
+    # Если подписан - собираем дань с фермы
+    # Получаем баланс до сбора
+    user = await db_async.db.get_user(user_id)
+    if not user:
+        await db_async.run(safe_ensure_user_from_obj, message.from_user)
+        user = await db_async.db.get_user(user_id)
+    
+    balance_before = float(user.get("dan", 0)) if user else 0.0
+    
+    # Собираем дань (сначала начисляем на склад)
+    collect_result = await db_async.ferma.collect_dan(user_id)
+    
+    # Переводим дань со склада на баланс
+    collected_amount = await db_async.ferma.transfer_dan_to_balance(user_id)
+    
+    # Получаем баланс после сбора
+    user_after = await db_async.db.get_user(user_id)
+    balance_after = float(user_after.get("dan", 0)) if user_after else 0.0
+    
+    # Форматируем числа с пробелами
+    def format_balance(amount):
+        return f"{amount:,.2f}".replace(",", " ")
+    
+    if collected_amount > 0:
+        await message.reply(
+            f"💰 Вы собрали дань!\n\n"
+            f"💸 Получено: {format_balance(collected_amount)} дань\n"
+            f"👤 Баланс до: {format_balance(balance_before)} дань\n"
+            f"💰 Баланс сейчас: {format_balance(balance_after)} дань"
+        )
+    else:
+        await message.reply(
+            f"📦 Склад пуст!\n\n"
+            f"💰 Ваш баланс: {format_balance(balance_after)} дань\n"
+            f"⏰ Подождите немного, дань накопится на складе"
+        )
+
+
+# Callback для проверки подписки
+@callbacks.on("check_subscription:*")
+async def check_subscription_callback(callback: types.CallbackQuery):
+    """Проверка подписки на канал по кнопке"""
+    if not getattr(callback, 'from_user', None):
+        return
+    
+    try:
+        _, user_id = callback.data.split(":")
+        user_id = int(user_id)
+    except (ValueError, IndexError):
+        await callback.answer("❌ Ошибка данных", show_alert=True)
+        return
+    
+    # Проверяем, что кнопку нажал владелец
+    if callback.from_user.id != user_id:
+        await callback.answer("❌ Это не ваша кнопка!", show_alert=True)
+        return
+    
+    # Проверяем подписку
+    is_subscribed = await check_channel_subscription(user_id)
+    
+    if is_subscribed:
+        await callback.answer("✅ Отлично! Теперь можете использовать команду 'фарм'", show_alert=True)
+        try:
+            await callback.message.delete()
+        except Exception:
+            pass
+    else:
+        await callback.answer("❌ Подписка не найдена. Убедитесь, что подписались на канал!", show_alert=True)
@@ -0,0 +1,1882 @@
+"""
+Мини-игры: сапёр, клад, крестики-нолики, кости, бет, боулинг, дартс, футбол,
+список игр и кнопки вызовов на кости и батл.
+"""
+import asyncio
+import time
+import random
+import re
+from aiogram import Router, types
+from aiogram.filters import Command
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+import session_store
+import lazy_modules
+import database as db
+import db_async
+import tasks
+import routing
+
+
+router = Router(name="games")
+callbacks = routing.CallbackRouter()
+router.callback_query.register(callbacks.dispatch, callbacks.filter)
+texts = routing.TextRouter()
+
+arena = lazy_modules.lazy('plugins.games.arena')
+
+
+# === LAZY IMPORTS (будут загружены при первом использовании) ===
+# Игровые модули: импорт при первом обращении к атрибуту
+clad = lazy_modules.lazy('plugins.games.clad')
+saper = lazy_modules.lazy('plugins.games.saper')
+battles = lazy_modules.lazy('plugins.games.battles')
+betcosty = lazy_modules.lazy('plugins.games.betcosty')
+
+
+def import_game_modules():
+    """Загрузить игровые модули сейчас (False - модули недоступны)"""
+    try:
+        lazy_modules.load_feature("games")
+        return True
+    except ImportError as e:
+        print(f"❌ Ошибка импорта игровых модулей: {e}")
+        return False
+
+# --- Store last saper, bet, and clad stakes per user ---
+last_saper_stake = session_store.SessionStore("last_saper_stake", ttl=86400, maxsize=50000)
+last_bet_stake = session_store.SessionStore("last_bet_stake", ttl=86400, maxsize=50000)
+last_clad_bet = session_store.SessionStore("last_clad_bet", ttl=86400, maxsize=50000)
+active_bowling_games = session_store.SessionStore("bowling", ttl=1800, maxsize=5000, persist=True)  # Активные игры в боулинг
+active_darts_games = session_store.SessionStore("darts", ttl=1800, maxsize=5000, persist=True)      # Активные игры в дартс
+active_soccer_games = session_store.SessionStore("soccer", ttl=1800, maxsize=5000, persist=True)    # Активные игры в футбол
+
+
+# === РАННЯЯ РЕГИСТРАЦИЯ ОБРАБОТЧИКА REPEAT BET ===
+@callbacks.on("repeat_bet:*")
+async def early_repeat_bet_handler(callback: types.CallbackQuery):
+    from main import increment_games_count
+    try:
+        increment_games_count()
+        # Импортируем battles только когда нужно (через plugins.games)
+        try:
+            from plugins.games import battles as _battles  # type: ignore
+        except Exception:
+            # Пытаемся загрузить игровые модули и повторить импорт
+            if not import_game_modules():
+                await callback.answer("Игра недоступна", show_alert=True)
+                return
+            try:
+                from plugins.games import battles as _battles  # type: ignore
+            except Exception:
+                await callback.answer("Игра недоступна", show_alert=True)
+                return
+        await _battles.repeat_bet_callback(callback)
+    except Exception as e:
+        await callback.answer("Ошибка игры", show_alert=True)
+
+
+# --- Callback для кнопки "ИГРАТЬ" ---
+@callbacks.on("open_game_menu:*")
+async def open_game_menu_callback(callback: types.CallbackQuery):
+    from main import show_main_menu
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец меню
+    try:
+        _, owner_user_id = callback.data.split(":")
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("❌ Ошибка данных кнопки", show_alert=True)
+        return
+    
+    current_user_id = callback.from_user.id if callback.from_user else None
+    username = callback.from_user.username if callback.from_user else "unknown"
+    print(f"DEBUG: open_game_menu - user: @{username}, owner_id: {owner_user_id}, current_id: {current_user_id}")
+    
+    if not current_user_id or owner_user_id != current_user_id:
+        print(f"DEBUG: BLOCKING ACCESS - owner: {owner_user_id}, current: {current_user_id}")
+        await callback.answer("❌ Это не ваше меню!", show_alert=True)
+        return
+    
+    await callback.answer()
+    await show_main_menu(callback, owner_user_id)
+
+
+# Обработчик для кнопки "Назад в меню" без параметров
+@callbacks.on("open_game_menu")
+async def open_game_menu_simple_callback(callback: types.CallbackQuery):
+    from main import show_main_menu
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    user_id = callback.from_user.id
+    await callback.answer()
+    await show_main_menu(callback, user_id)
+
+
+# --- Callback для кнопки "ИГРАТЬ" - поиск игры в арене ---
+@callbacks.on("play_games:*")
+async def play_games_callback(callback: types.CallbackQuery):
+    """Обработчик кнопки ИГРАТЬ - меню арены"""
+    from main import safe_edit_text_or_caption, safe_ensure_user
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Проверяем, что кнопку нажал владелец меню
+    try:
+        _, owner_user_id = callback.data.split(":")
+        owner_user_id = int(owner_user_id)
+    except (ValueError, IndexError):
+        await callback.answer("❌ Ошибка данных кнопки", show_alert=True)
+        return
+    
+    current_user_id = callback.from_user.id if callback.from_user else None
+    
+    if not current_user_id or owner_user_id != current_user_id:
+        await callback.answer("❌ Это не ваше меню!", show_alert=True)
+        return
+    
+    user_id = callback.from_user.id
+    username = getattr(callback.from_user, 'username', None) or f"ID:{user_id}"
+    safe_ensure_user(user_id, username)
+    
+    # Получаем рейтинг игрока
+    rating_data = arena.get_arena_rating(user_id)
+    
+    # Определяем лигу
+    rating = rating_data['rating']
+    if rating < 1000:
+        league = "🥉 Новичок"
+    elif rating < 1500:
+        league = "🥈 Боец"
+    elif rating < 2000:
+        league = "🥇 Воин"
+    elif rating < 2500:
+        league = "💎 Мастер"
+    else:
+        league = "👑 Легенда"
+
+    text = f"🏟️ <b>АРЕНА KRUZCHAT</b> 🏟️\n\n"
+    text += f"⚔️ <b>Тактические PvP бои!</b>\n"
+    text += f"Сражайтесь в пошаговых боях, используя атаку, защиту и лечение. Каждое решение влияет на исход битвы!\n\n"
+    text += f"🏆 <b>Ваш профиль:</b>\n"
+    text += f"📊 Рейтинг: <b>{rating} PTS</b> ({league})\n"
+    text += f"🏆 Побед: <b>{rating_data['wins']}</b>\n"
+    text += f"💔 Поражений: <b>{rating_data['losses']}</b>\n"
+    try:
+        level = rating_data.get('level', 1)
+        xp = rating_data.get('xp', 0)
+        text += f"🎚️ Уровень: <b>{level}</b>\n"
+        text += f"📘 Опыт: <b>{xp}/5000</b>\n"
+    except Exception:
+        pass
+    
+    if rating_data['win_streak'] > 0:
+        text += f"🔥 Серия побед: <b>{rating_data['win_streak']}</b>\n"
+    
+    text += f"\n🎯 <b>Как играть:</b>\n"
+    text += f"• Каждый ход выбирайте действие\n"
+    text += f"• ⚔️ <b>Атака</b>: наносит урон (15-25)\n"
+    text += f"• 🛡️ <b>Защита</b>: дает броню и шанс уклонения\n"
+    text += f"• 💚 <b>Лечение</b>: восстанавливает HP (5-10%)\n"
+    text += f"• 💥 <b>Комбо</b>: 3 одинаковых действия = спецэффект!\n\n"
+    text += f"⏱️ Время боя: 10 минут\n"
+    text += f"❤️ HP: 100 | Критические удары: 15%"
+    
+    keyboard = []
+    
+    # Проверяем, не в игре ли уже
+    in_game = any(game.fighter1.user_id == user_id or game.fighter2.user_id == user_id 
+                  for game in arena.active_arenas.values() if game.is_active)
+    
+    if in_game:
+        keyboard.append([InlineKeyboardButton(text="⚔️ Вернуться к бою", callback_data="arena_return_to_game")])
+        keyboard.append([InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot")])
+    else:
+        keyboard.append([
+            InlineKeyboardButton(text="🤖 Бой с ботом", callback_data="arena_play_with_bot"),
+            InlineKeyboardButton(text="🔍 Найти бой", callback_data="arena_find_match")
+        ])
+    
+    keyboard.extend([
+        [InlineKeyboardButton(text="🎁 Забрать приз (скоро)", callback_data="arena_claim_level_reward")],
+        [InlineKeyboardButton(text="💎 Рейтинг-таблица", callback_data="arena_leaderboard")],
+        [InlineKeyboardButton(text="📋 Статистика", callback_data="arena_my_stats"), InlineKeyboardButton(text="⚔️ Справка", callback_data="arena_help")],
+        [InlineKeyboardButton(text="⬅️ В меню", callback_data=f"open_game_menu:{user_id}")]
+    ])
+    
+    await safe_edit_text_or_caption(callback.message, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="HTML")
+    await callback.answer("🏟️ Добро пожаловать в арену!")
+
+
+async def saper_message_handler_with_last_stake(message):
+    """Wrapper для обработчика сапёра с сохранением последней ставки"""
+    from main import increment_games_count
+    increment_games_count()
+    # Call original handler and store last stake
+    import re
+    text = message.text.strip().lower() if message.text else ""
+    if "сапер" in text:
+        parts = text.split()
+        if len(parts) >= 2:
+            try:
+                stake = int(parts[1])
+                last_saper_stake[message.from_user.id] = stake
+            except Exception:
+                pass
+    # Call the original handler
+    await saper.saper_message_handler(message)
+
+texts.prefix("сапер")(saper_message_handler_with_last_stake)
+
+# Регистрируем callback обработчик сапера рано для надежности (модуль загрузится при первом нажатии)
+callbacks.on("saper_*")(lazy_modules.handler("plugins.games.saper", "saper_callback_handler"))
+
+
+# --- Новый обработчик для кнопки "Повторить" в сапёре ---
+@callbacks.on("saper_repeat")
+async def saper_repeat_callback(callback: types.CallbackQuery):
+    from main import increment_games_count
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    # Ранний ответ на callback для предотвращения timeout
+    await callback.answer()
+    
+    increment_games_count()
+    # Извлекаем game_id и ставку из callback.data (формат: "saper_repeat:game_id:stake")
+    try:
+        parts = callback.data.split(":") if callback.data else []
+        if len(parts) >= 3:
+            game_id = parts[1]
+            stake = int(parts[2])
+        elif len(parts) == 2:
+            # Старый формат - пытаемся найти игру
+            game_id = parts[1]
+            game = saper.active_saper_games.get(game_id)
+            if game:
+                stake = game.stake if game.stake >= 10 else 10
+                # Проверяем владельца игры
+                if callback.from_user.id != game.owner_id:
+                    await callback.answer("Только владелец игры может повторить", show_alert=True)
+                    return
+                # Удаляем старую игру
+                del saper.active_saper_games[game_id]
+            else:
+                await callback.answer("Игра не найдена", show_alert=True)
+                return
+        else:
+            await callback.answer("Ошибка в данных игры", show_alert=True)
+            return
+    except (IndexError, ValueError):
+        await callback.answer("Ошибка в данных игры", show_alert=True)
+        return
+    
+    user_id = callback.from_user.id
+    
+    # Проверяем минимальную ставку
+    if stake < 10:
+        stake = 10
+    
+    # Создаем новую игру с той же ставкой
+    from plugins.games.saper import generate_unique_game_id, SimpleSaper
+    import database as db
+    
+    # Проверка баланса и списание ставки — одной транзакцией
+    if await db_async.db.settle_round(user_id, stake) is None:
+        user = await db_async.db.get_user(user_id)
+        await callback.answer(f"Недостаточно Дань! Ваш баланс: {user['dan'] if user else 0}", show_alert=True)
+        return
+    
+    # Создаем новую игру с уникальным ID и той же ставкой
+    new_game_id = generate_unique_game_id(user_id)
+    saper.active_saper_games[new_game_id] = SimpleSaper(stake=stake, owner_id=user_id, game_id=new_game_id)
+    # Засчитываем как игру дня (любая игра)
+    try:
+        import tasks
+        tasks.record_any_game(user_id)
+    except Exception:
+        pass
+    
+    # Обновляем сообщение с новой игрой
+    from main import safe_edit_text
+    await safe_edit_text(
+        callback.message,
+        saper.active_saper_games[new_game_id].status_text(),
+        reply_markup=saper.active_saper_games[new_game_id].keyboard()
+    )
+    await callback.answer(f"Новая игра запущена! Ставка: {stake} ДАНЬ")
+
+
+# --- Текстовые команды для батла: "принять" и "отменить" ---
+@texts.exact("принять")
+async def battle_accept_message(message: types.Message):
+    if not getattr(message, 'from_user', None) or not getattr(message, 'chat', None):
+        return
+    await battles.handle_accept_message(message)
+
+
+@texts.exact("отменить")
+async def battle_decline_message(message: types.Message):
+    if not getattr(message, 'from_user', None) or not getattr(message, 'chat', None):
+        return
+    await battles.handle_decline_message(message)
+
+
+# --- Холдер для callback repeat_clad (клад) ---
+@callbacks.on("repeat_clad:*")
+async def repeat_clad_callback(callback: types.CallbackQuery):
+    from main import format_clickable_name, increment_games_count
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    increment_games_count()
+    user_id = callback.from_user.id
+    
+    # Получаем ставку из callback data
+    try:
+        bet = int(callback.data.split(":")[1])
+    except (IndexError, ValueError):
+        bet = last_clad_bet.get(user_id, 100)  # Используем последнюю ставку или 100 по умолчанию
+    
+    # Проверяем баланс и списываем ставку одной транзакцией
+    import database as db
+    balance = await db_async.db.settle_round(user_id, bet)
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        if not user:
+            await callback.answer("Пользователь не найден.", show_alert=True)
+            return
+        await callback.answer(f"Недостаточно средств! У вас {user['dan']} ДАНЬ, нужно {bet} ДАНЬ.", show_alert=True)
+        return
+    
+    # Обновляем баланс
+    try:
+        bal = float(balance)
+        bal = 0.00 if abs(bal) < 0.005 else round(bal, 2)
+        await db_async.db.set_dan(user_id, bal)
+    except Exception:
+        pass
+    
+    # Сохраняем последнюю ставку
+    last_clad_bet[user_id] = bet
+    # Регистрируем прогресс заданий по игре Клад
+    try:
+        print(f"[DEBUG] record_clad_play called: user_id={user_id}, bet={bet}, source='Клад' (should NOT be called for 'бет')")
+        tasks.record_clad_play(user_id, bet)
+    except Exception as e:
+        print(f"[ERROR] record_clad_play failed: {e}")
+    
+    # Стараемся ответить callback как можно раньше, чтобы избежать timeout
+    try:
+        await callback.answer()
+    except Exception:
+        pass
+
+    try:
+        game = clad.start_clad_game(user_id, bet)
+        username = format_clickable_name(callback.from_user) if callback.from_user else "Игрок"
+        kb = clad.get_keyboard(game)
+        new_msg = f"💎 Клад! Игрок: {username}\nСтавка: {bet}\nВыберите клетку:"
+        try:
+            await callback.message.edit_text(new_msg, reply_markup=kb, parse_mode="HTML")  # type: ignore
+        except Exception:
+            # если не удалось отредактировать — просто отправим новое
+            try:
+                await callback.message.answer(new_msg, reply_markup=kb, parse_mode="HTML")  # type: ignore
+            except Exception:
+                pass
+    except Exception:
+        # Возврат ставки и финальное уведомление (если можно)
+        await db_async.db.add_dan(user_id, bet)
+        try:
+            await callback.answer("Ошибка запуска игры Клад.", show_alert=False)
+        except Exception:
+            pass
+
+
+# Команда 'клад X' — запуск игры
+
+
+@texts.contains("клад", digits=True)
+async def cmd_clad_start(message: types.Message):
+    from main import format_clickable_name, increment_games_count
+    increment_games_count()
+    # Save last clad bet
+    user_id = message.from_user.id
+    user_id = message.from_user.id
+    text = message.text.strip().lower()
+    # Проверяем, что команда начинается с "клад" и далее число
+    parts = text.split()
+    if not parts or parts[0] != "клад" or len(parts) < 2:
+        await message.reply("Формат: клад X (X — сумма)")
+        return
+    try:
+        bet = int(parts[1])
+        last_clad_bet[user_id] = bet
+    except Exception:
+        await message.reply("Ставка должна быть числом.")
+        return
+    if bet < 10:
+        await message.reply("Минимальная ставка — 10 Дань.")
+        return
+    # Проверка баланса и списание ставки — одной транзакцией
+    try:
+        balance = await db_async.db.settle_round(user_id, bet)
+    except Exception:
+        await message.reply("Ошибка списания ставки.")
+        return
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        await message.reply(f"Недостаточно Дань! Ваш баланс: {user['dan'] if user else 0}")
+        return
+    # Обновляем баланс
+    try:
+        bal = float(balance)
+        bal = 0.00 if abs(bal) < 0.005 else round(bal, 2)
+        await db_async.db.set_dan(user_id, bal)
+    except Exception:
+        pass
+    try:
+        # Регистрируем прогресс заданий по игре Клад
+        try:
+            print(f"[DEBUG] record_clad_play called: user_id={user_id}, bet={bet}, source='Клад' (should NOT be called for 'бет')")
+            tasks.record_clad_play(user_id, bet)
+        except Exception as e:
+            print(f"[ERROR] record_clad_play failed: {e}")
+        game = clad.start_clad_game(user_id, bet)
+        username = format_clickable_name(message.from_user) if message.from_user else "Игрок"
+        kb = clad.get_keyboard(game)
+        await message.reply(f"💎 Клад! Игрок: {username}\nСтавка: {bet}\nВыберите клетку:", reply_markup=kb, parse_mode="HTML")
+    except Exception:
+        await message.reply("Ошибка запуска игры Клад.")
+
+
+# --- Регистрация обработчика повторить бет (будет зарегистрирован после загрузки battles) ---
+
+
+# Callback для шагов и забора выигрыша
+@callbacks.on("clad:*")
+async def callback_clad_step(callback: types.CallbackQuery):
+    from main import format_clickable_name, safe_edit_reply_markup, safe_edit_text
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    user_id = callback.from_user.id
+    data = callback.data.split(":")
+    if len(data) < 3:
+        await callback.answer("Неверный формат данных!", show_alert=True)
+        return
+    
+    game_id = data[1]
+    action = data[2]
+    
+    # Проверяем, что игра существует
+    game = clad.active_clads.get(game_id)
+    if not game:
+        await callback.answer("Игра не найдена!", show_alert=True)
+        return
+    
+    # Проверяем, что игрок — владелец игры
+    if game['user_id'] != user_id:
+        await callback.answer("Это не ваша игра! Только владелец может играть.", show_alert=True)
+        return
+    
+    if action == "take":
+        # Выигрыш выплачивает take_clad_game вместе со статистикой (settle_round)
+        result = await clad.take_clad_game(game_id)
+        if result['status'] != 'take':
+            await callback.answer(result['msg'], show_alert=True)
+            return
+        # Формируем красивое сообщение с именем игрока
+        if game:
+            # Импортируем MULTS из clad модуля
+            try:
+                from plugins.games.clad import MULTS
+            except ImportError:
+                MULTS = [1.25, 1.65, 2.00, 3.60, 6.50, 25.0]  # fallback
+            
+            username = format_clickable_name(callback.from_user)
+            last_level = max(0, game['level'] - 1)
+            mult = MULTS[last_level] if last_level < len(MULTS) else MULTS[-1]
+            bet = game['bet']
+            win = bet * (float(mult) if isinstance(mult, (float, int)) else float(str(mult).replace('х','')))
+            # Получаем баланс пользователя (если есть функция)
+            try:
+                bal = (await db_async.db.get_user(user_id))["dan"]
+            except Exception:
+                bal = "?"
+            
+            # Добавляем кнопку "Повторить игру" после забора выигрыша
+            repeat_kb = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🎮 Повторить игру", callback_data=f"repeat_clad:{bet}")]
+            ])
+            
+            safe_edit_text(callback.message,
+                f"💎 Клад забран!\nИгрок: {username}\nСтавка была: {bet}\n"
+                f"Достигнутый множитель: {mult}\n"
+                f"Ваш баланс: {bal} (+{win:.2f} ДАНЬ)",
+                reply_markup=repeat_kb,
+                parse_mode="HTML"
+            )
+        else:
+            safe_edit_reply_markup(callback.message, reply_markup=None)
+        await callback.answer()
+        return
+    
+    # Если не "take", то это индекс ячейки
+    try:
+        cell_idx = int(action)
+    except ValueError:
+        await callback.answer("Неверный формат действия!", show_alert=True)
+        return
+    
+    result = await clad.step_clad_game(game_id, cell_idx)
+    if result['status'] == 'lose':
+        # Ответить callback (игра закончена) — если уже просрочен, игнорируем
+        try:
+            await callback.answer(result['msg'], show_alert=True)
+        except Exception:
+            pass
+        game = clad.active_clads.get(game_id)
+        if game:
+            # Импорт нужных сущностей из clad
+            try:
+                from plugins.games.clad import MULTS, MINES_PER_ROW, generate_row
+            except Exception:
+                # Fallback значения если импорт не удался
+                MULTS = [1.25, 1.65, 2.00, 3.60, 6.50, 25.0]
+                MINES_PER_ROW = [1, 2, 3, 4, 4, 4]
+            # Используем функцию format_clickable_name для кликабельного отображения имени
+            username = format_clickable_name(callback.from_user)
+            lost = game['bet']
+            max_row = max(0, game['level'] - 1)
+            # Собираем/догенерируем ряды для отображения
+            display_rows = []
+            total_levels = len(game.get('rows', []))
+            for i in range(total_levels):
+                row = game['rows'][i]
+                if row is None:
+                    # Генерируем для показа (не влияет на исход уже проигранной игры)
+                    try:
+                        from plugins.games.clad import generate_row, MINES_PER_ROW
+                        row = generate_row(MINES_PER_ROW[i])
+                        game['rows'][i] = row
+                    except Exception:
+                        row = [0,0,0,0,0]
+                bombs_line = ''.join('💣' if c==1 else '💵' for c in row)
+                mult = MULTS[i] if i < len(MULTS) else MULTS[-1]
+                mult_text = f"x{mult}" if not isinstance(mult, str) else mult
+                display_rows.append(f"{mult_text} {bombs_line}")
+            field_text = '\n'.join(display_rows)
+            
+            # Добавляем кнопку "Повторить игру" после проигрыша
+            repeat_kb = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🎮 Повторить игру", callback_data=f"repeat_clad:{lost}")]
+            ])
+            
+            try:
+                safe_edit_text(callback.message,
+                    f"💥 Проигрыш! Ставка: {lost}\nИгрок: {username}\nДостигнут уровень: {max_row}\n\nПоле:\n{field_text}",
+                    reply_markup=repeat_kb,
+                    parse_mode="HTML")
+            except Exception:
+                try:
+                    await callback.message.answer(
+                        f"💥 Проигрыш! Ставка: {lost}\nИгрок: {username}\nДостигнут уровень: {max_row}",
+                        reply_markup=repeat_kb,
+                        parse_mode="HTML")
+                except Exception:
+                    pass
+        else:
+            safe_edit_reply_markup(callback.message, reply_markup=None)
+        return
+    elif result['status'] == 'win':
+        await callback.answer(result['msg'], show_alert=True)
+        # Добавляем кнопку "Повторить игру" после выигрыша с именем игрока
+        game = clad.active_clads.get(game_id)
+        if game:
+            username = format_clickable_name(callback.from_user)
+            win_amount = game['bet'] * 25.0  # Финальный множитель
+            last_bet = game['bet']
+            
+            repeat_kb = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🎮 Повторить игру", callback_data=f"repeat_clad:{last_bet}")]
+            ])
+            
+            # Показываем красивое сообщение о победе с именем игрока
+            try:
+                safe_edit_text(callback.message,
+                    f"🎉 Победа! Поздравляем!\nИгрок: {username}\nСтавка: {last_bet}\nВыигрыш: {win_amount:.0f} ДАНЬ\n\nВы прошли все уровни клада!",
+                    reply_markup=repeat_kb,
+                    parse_mode="HTML")
+            except Exception:
+                if callback.message:
+                    await callback.message.edit_reply_markup(reply_markup=repeat_kb)
+        else:
+            repeat_kb = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🎮 Повторить игру", callback_data=f"repeat_clad:100")]
+            ])
+            if callback.message:
+                await callback.message.edit_reply_markup(reply_markup=repeat_kb)
+    elif result['status'] == 'next':
+        game = clad.active_clads.get(game_id)
+        if not game:
+            await callback.answer("Игра не найдена!", show_alert=True)
+            return
+        kb = clad.get_keyboard(game)
+        # Import MULTS from clad module
+        try:
+            from plugins.games.clad import MULTS
+        except ImportError:
+            MULTS = [1.35, 1.75, 2.40, 3.60, 6.50, 25.0]  # fallback
+        current_mult = MULTS[game['level']] if game['level'] < len(MULTS) else MULTS[-1]
+        if isinstance(current_mult, (float, int)):
+            mult_text = f"{current_mult}х"
+        else:
+            mult_text = str(current_mult)
+        username = format_clickable_name(callback.from_user) if callback.from_user else "Игрок"
+        status_text = f"💎 Клад! Игрок: {username}\nСтавка: {game['bet']} ДАНЬ\nУровень {game['level'] + 1}, множитель {mult_text}\n\nВыберите клетку:"
+        safe_edit_text(callback.message, status_text, reply_markup=kb, parse_mode="HTML")
+        await callback.answer(result['msg'])
+
+
+# --- КРЕСТИКИ-НОЛИКИ ---
+@texts.prefix("нолик")
+async def tic_tac_toe_challenge_handler(message: types.Message):
+    """Обработчик команды 'нолик СУММА' - вызов на крестики-нолики за нолики"""
+    from main import increment_games_count, is_bot_user, safe_ensure_user
+    increment_games_count()
+    
+    if not message.from_user or not message.text:
+        return
+        
+    # Проверяем что это ответ на сообщение
+    if not message.reply_to_message or not message.reply_to_message.from_user:
+        await message.reply("❌ Ответьте на сообщение пользователя которого хотите вызвать!\nПример: нолик 100")
+        return
+        
+    user_id = message.from_user.id
+    opponent_id = message.reply_to_message.from_user.id
+    
+    # Проверяем что не вызывают бота
+    if is_bot_user(opponent_id):
+        await message.reply("❌ Ой, бот не играет в такое!")
+        return
+        
+    if user_id == opponent_id:
+        await message.reply("❌ Нельзя играть самому с собой!")
+        return
+        
+    safe_ensure_user(user_id, getattr(message.from_user, 'username', None))
+    safe_ensure_user(opponent_id, getattr(message.reply_to_message.from_user, 'username', None))
+    
+    # Парсим ставку
+    text = message.text.strip()
+    parts = text.split()
+    if len(parts) < 2:
+        await message.reply("❌ Укажите ставку!\nПример: нолик 100")
+        return
+        
+    try:
+        bet_amount = int(parts[1])
+    except ValueError:
+        await message.reply("❌ Ставка должна быть числом!")
+        return
+        
+    if bet_amount < 10:
+        await message.reply("❌ Минимальная ставка 10 дань!")
+        return
+        
+    # Проверяем баланс вызывающего (он будет играть за нолики - игрок 2)
+    challenger_balance = await db_async.db.get_user(user_id)
+    if not challenger_balance or challenger_balance["dan"] < bet_amount:
+        await message.reply(f"❌ У вас недостаточно дани! Нужно: {bet_amount}, у вас: {challenger_balance['dan'] if challenger_balance else 0}")
+        return
+        
+    # Проверяем баланс противника
+    opponent_balance = await db_async.db.get_user(opponent_id)
+    if not opponent_balance or opponent_balance["dan"] < bet_amount:
+        opponent_name_short = message.reply_to_message.from_user.full_name or f"@{message.reply_to_message.from_user.username}" if message.reply_to_message.from_user.username else f"ID{opponent_id}"
+        await message.reply(f"❌ У {opponent_name_short} недостаточно дани! Нужно: {bet_amount}, у него: {opponent_balance['dan'] if opponent_balance else 0}")
+        return
+        
+    # Создаем вызов (вызывающий будет игроком 2 - нолики)
+    from plugins.games.tic_tac_toe import start_tic_tac_toe_challenge
+    
+    challenger_name = message.from_user.full_name or f"@{message.from_user.username}" if message.from_user.username else f"ID{user_id}"
+    opponent_name = message.reply_to_message.from_user.full_name or f"@{message.reply_to_message.from_user.username}" if message.reply_to_message.from_user.username else f"ID{opponent_id}"
+    
+    # Вызывающий хочет играть за нолики (player2), значит противник будет играть за крестики (player1)
+    game = start_tic_tac_toe_challenge(opponent_id, opponent_name, user_id, challenger_name, bet_amount)
+    # Регистрируем прогресс баттлов для обоих игроков
+    try:
+        tasks.record_battle_play(user_id)
+        tasks.record_battle_play(opponent_id)
+    except Exception:
+        pass
+    
+    challenge_text = (
+        f"⭕ <b>Вызов на крестики-нолики!</b>\n\n"
+        f"🎯 {challenger_name} вызывает {opponent_name}\n"
+        f"⭕ {challenger_name} играет за <b>нолики</b>\n"
+        f"❌ {opponent_name} играет за <b>крестики</b>\n"
+        f"💰 Ставка: {bet_amount} дань каждый\n"
+        f"💸 Комиссия: 10% (при ничьей по 10% с каждого)\n\n"
+        f"❓ {opponent_name}, принимаете вызов?"
+    )
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Принять", callback_data=f"ttt_accept:{game.game_id}"),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"ttt_decline:{game.game_id}")
+        ]
+    ])
+    
+    await message.reply(challenge_text, reply_markup=keyboard, parse_mode='HTML')
+
+
+@texts.prefix("хрестик", "крестик")
+async def tic_tac_toe_cross_challenge_handler(message: types.Message):
+    """Обработчик команд 'хрестик/крестик/крестики СУММА' - вызов на крестики-нолики за крестики"""
+    from main import increment_games_count, is_bot_user, safe_ensure_user
+    increment_games_count()
+    
+    if not message.from_user or not message.text:
+        return
+        
+    # Проверяем что это ответ на сообщение
+    if not message.reply_to_message or not message.reply_to_message.from_user:
+        await message.reply("❌ Ответьте на сообщение пользователя которого хотите вызвать!\nПример: хрестик 100")
+        return
+        
+    user_id = message.from_user.id
+    opponent_id = message.reply_to_message.from_user.id
+    
+    # Проверяем что не вызывают бота
+    if is_bot_user(opponent_id):
+        await message.reply("❌ Ой, бот не играет в такое!")
+        return
+        
+    if user_id == opponent_id:
+        await message.reply("❌ Нельзя играть самому с собой!")
+        return
+        
+    safe_ensure_user(user_id, getattr(message.from_user, 'username', None))
+    safe_ensure_user(opponent_id, getattr(message.reply_to_message.from_user, 'username', None))
+    
+    # Парсим ставку
+    text = message.text.strip()
+    parts = text.split()
+    if len(parts) < 2:
+        await message.reply("❌ Укажите ставку!\nПример: хрестик 100")
+        return
+        
+    try:
+        bet_amount = int(parts[1])
+    except ValueError:
+        await message.reply("❌ Ставка должна быть числом!")
+        return
+        
+    if bet_amount < 10:
+        await message.reply("❌ Минимальная ставка 10 дань!")
+        return
+        
+    # Проверяем баланс вызывающего (он будет играть за крестики - игрок 1)
+    challenger_balance = await db_async.db.get_user(user_id)
+    if not challenger_balance or challenger_balance["dan"] < bet_amount:
+        await message.reply(f"❌ У вас недостаточно дани! Нужно: {bet_amount}, у вас: {challenger_balance['dan'] if challenger_balance else 0}")
+        return
+        
+    # Проверяем баланс противника
+    opponent_balance = await db_async.db.get_user(opponent_id)
+    if not opponent_balance or opponent_balance["dan"] < bet_amount:
+        opponent_name_short = message.reply_to_message.from_user.full_name or f"@{message.reply_to_message.from_user.username}" if message.reply_to_message.from_user.username else f"ID{opponent_id}"
+        await message.reply(f"❌ У {opponent_name_short} недостаточно дани! Нужно: {bet_amount}, у него: {opponent_balance['dan'] if opponent_balance else 0}")
+        return
+        
+    # Создаем вызов (вызывающий будет игроком 1 - крестики)
+    from plugins.games.tic_tac_toe import start_tic_tac_toe_challenge
+    
+    challenger_name = message.from_user.full_name or f"@{message.from_user.username}" if message.from_user.username else f"ID{user_id}"
+    opponent_name = message.reply_to_message.from_user.full_name or f"@{message.reply_to_message.from_user.username}" if message.reply_to_message.from_user.username else f"ID{opponent_id}"
+    
+    # Вызывающий хочет играть за крестики (player1), значит противник будет играть за нолики (player2)
+    game = start_tic_tac_toe_challenge(user_id, challenger_name, opponent_id, opponent_name, bet_amount)
+    # Регистрируем прогресс баттлов для обоих игроков
+    try:
+        tasks.record_battle_play(user_id)
+        tasks.record_battle_play(opponent_id)
+    except Exception:
+        pass
+    
+    challenge_text = (
+        f"❌ <b>Вызов на крестики-нолики!</b>\n\n"
+        f"🎯 {challenger_name} вызывает {opponent_name}\n"
+        f"❌ {challenger_name} играет за <b>крестики</b>\n"
+        f"⭕ {opponent_name} играет за <b>нолики</b>\n"
+        f"💰 Ставка: {bet_amount} дань каждый\n"
+        f"💸 Комиссия: 10% (при ничьей по 10% с каждого)\n\n"
+        f"❓ {opponent_name}, принимаете вызов?"
+    )
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Принять", callback_data=f"ttt_accept:{game.game_id}"),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"ttt_decline:{game.game_id}")
+        ]
+    ])
+    
+    await message.reply(challenge_text, reply_markup=keyboard, parse_mode='HTML')
+
+
+# Callback обработчики для крестиков-ноликов
+@callbacks.on("ttt_accept:*")
+async def tic_tac_toe_accept_callback(callback: types.CallbackQuery):
+    """Принять вызов на крестики-нолики"""
+    from main import increment_games_count
+    if not callback.from_user or not callback.data:
+        return
+        
+    game_id = callback.data.split(":")[1]
+    user_id = callback.from_user.id
+    
+    from plugins.games.tic_tac_toe import accept_tic_tac_toe_challenge
+    
+    result = accept_tic_tac_toe_challenge(game_id, user_id)
+    
+    if not result["success"]:
+        await callback.answer(f"❌ {result['error']}", show_alert=True)
+        return
+        
+    game = result["game"]
+    
+    # Обновляем сообщение с игровым полем
+    from plugins.games.tic_tac_toe import safe_edit_text
+    await safe_edit_text(
+        callback.message,
+        game.get_status_text(),
+        reply_markup=game.get_keyboard(),
+        parse_mode='HTML'
+    )
+    
+    # Увеличиваем счетчик игр
+    increment_games_count()
+    
+    await callback.answer("✅ Игра началась!")
+
+
+@callbacks.on("ttt_decline:*")
+async def tic_tac_toe_decline_callback(callback: types.CallbackQuery):
+    """Отклонить вызов на крестики-нолики"""
+    if not callback.from_user or not callback.data:
+        return
+        
+    game_id = callback.data.split(":")[1]
+    user_id = callback.from_user.id
+    
+    from plugins.games.tic_tac_toe import decline_tic_tac_toe_challenge
+    
+    result = decline_tic_tac_toe_challenge(game_id, user_id)
+    
+    if not result["success"]:
+        await callback.answer(f"❌ {result['error']}", show_alert=True)
+        return
+    
+    from plugins.games.tic_tac_toe import safe_edit_text
+    await safe_edit_text(callback.message, "❌ Вызов отклонен")
+    await callback.answer("❌ Вызов отклонен")
+
+
+@callbacks.on("ttt_move:*")
+async def tic_tac_toe_move_callback(callback: types.CallbackQuery):
+    """Сделать ход в крестиках-ноликах"""
+    if not callback.from_user or not callback.data:
+        return
+        
+    parts = callback.data.split(":")
+    if len(parts) < 4:
+        await callback.answer("❌ Ошибка данных", show_alert=True)
+        return
+        
+    game_id = parts[1]
+    row = int(parts[2])
+    col = int(parts[3])
+    user_id = callback.from_user.id
+    
+    from plugins.games.tic_tac_toe import make_tic_tac_toe_move
+    
+    result = make_tic_tac_toe_move(game_id, user_id, row, col)
+    
+    if not result["success"]:
+        await callback.answer(f"❌ {result['error']}", show_alert=True)
+        return
+        
+    from plugins.games.tic_tac_toe import active_tic_tac_toe_games
+    game = active_tic_tac_toe_games.get(game_id)
+    
+    if not game:
+        await callback.answer("❌ Игра не найдена", show_alert=True)
+        return
+    
+    # Обновляем сообщение
+    from plugins.games.tic_tac_toe import safe_edit_text
+    await safe_edit_text(
+        callback.message,
+        game.get_status_text(),
+        reply_markup=game.get_keyboard(),
+        parse_mode='HTML'
+    )
+    
+    if result.get("game_over"):
+        if game.winner == "draw":
+            await callback.answer("🤝 Ничья! Комиссия списана", show_alert=True)
+        else:
+            winner_name = game.player1_name if game.winner == game.player1_id else game.player2_name
+            await callback.answer(f"🏆 Победа: {winner_name}!", show_alert=True)
+    else:
+        await callback.answer("✅ Ход сделан!")
+
+
+@callbacks.on("ttt_noop")
+async def tic_tac_toe_noop_callback(callback: types.CallbackQuery):
+    """Пустой callback для занятых клеток"""
+    await callback.answer("Эта клетка занята", show_alert=False)
+
+
+# --- КОСТИ PvP ---
+@texts.prefix("кости")
+async def dice_battle_handler(message: types.Message):
+    from main import increment_games_count, is_bot_user, safe_ensure_user
+    increment_games_count()
+    if not getattr(message, 'from_user', None) or not getattr(message, 'text', None):
+        return
+    user_id = message.from_user.id
+    now = time.time()
+    # Проверка блокировки
+    # ...existing code...
+    user_id = message.from_user.id
+    safe_ensure_user(user_id, getattr(message.from_user, 'username', None))
+    text = message.text.strip()
+    parts = text.split()
+    if len(parts) < 2:
+        await message.answer("Формат: кости N (N — целое число >= 10)", show_alert=True)
+        return
+    try:
+        bet = int(parts[1])
+    except Exception:
+        await message.answer("Ставка должна быть числом.", show_alert=True)
+        return
+    if bet < 10:
+        await message.answer("Минимальная ставка — 10 Дань.", show_alert=True)
+        return
+    if message.reply_to_message and message.reply_to_message.from_user:
+        # Проверяем что не вызывают бота
+        if is_bot_user(message.reply_to_message.from_user.id):
+            await message.reply("❌ Ой, бот не играет в такое!")
+            return
+        # Регистрируем прогресс баттлов для обоих игроков
+        try:
+            tasks.record_battle_play(user_id)
+            tasks.record_battle_play(message.reply_to_message.from_user.id)
+        except Exception:
+            pass
+        await betcosty.initiate_dice_battle(message, user_id, bet)
+    else:
+        await message.answer("Чтобы вызвать на кости, ответь на сообщение игрока и напиши 'кости N'.", show_alert=True)
+
+
+# --- Обычные ставки ---
+@texts.prefix("бет")
+async def universal_bet_handler(message: types.Message):
+    from main import increment_games_count, is_bot_user, safe_ensure_user_from_obj
+    increment_games_count()
+    if not getattr(message, 'from_user', None) or not getattr(message, 'text', None):
+        return
+    user_id = message.from_user.id
+    safe_ensure_user_from_obj(message.from_user)
+    text = message.text.strip()
+    parts = text.split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        await message.reply("Пожалуйста, укажите ставку, например: бет 10")
+        return
+    bet = int(parts[1])
+    if bet < 10:
+        await message.reply("Минимальная ставка — 10 Дань.")
+        return
+    last_bet_stake[user_id] = bet
+    # Регистрируем прогресс по ставкам
+    try:
+        tasks.record_bet_play(user_id, bet)
+    except Exception:
+        pass
+    # Если это ответ на сообщение — PvP баттл
+    if message.reply_to_message and message.reply_to_message.from_user:
+        # Проверяем что не вызывают бота
+        if is_bot_user(message.reply_to_message.from_user.id):
+            await message.reply("❌ Ой, бот не играет в такое!")
+            return
+        # Регистрируем прогресс баттлов для обоих игроков
+        try:
+            tasks.record_battle_play(user_id)
+            tasks.record_battle_play(message.reply_to_message.from_user.id)
+        except Exception:
+            pass
+        await battles.initiate_battle(message, user_id, bet)
+    else:
+        await battles.solo_bet(message, user_id, bet)
+
+
+# --- КОМАНДА /GAME ИЛИ ИГРЫ ---
+
+def get_games_list():
+    """Возвращает полный список всех игр в боте"""
+    games = [
+        {
+            "emoji": "🤵⚔️",
+            "name": "БЕТ",
+            "commands": "<code>бет</code> число",
+            "type": "both"
+        },
+        {
+            "emoji": "🤵",
+            "name": "Клад",
+            "commands": "<code>клад</code> число",
+            "type": "solo"
+        },
+        {
+            "emoji": "🤵",
+            "name": "Сапёр",
+            "commands": "<code>сапер</code> число",
+            "type": "solo"
+        },
+        {
+            "emoji": "⚔️",
+            "name": "Кости",
+            "commands": "<code>кости</code> число",
+            "type": "battle"
+        },
+        {
+            "emoji": "⚔️",
+            "name": "Крестики-нолики",
+            "commands": "<code>крестик</code>, <code>крестики</code>, <code>нолик</code> число",
+            "type": "battle"
+        },
+        {
+            "emoji": "🏟️⚔️",
+            "name": "Арена",
+            "commands": "<code>арена</code>, <code>arena</code>",
+            "type": "battle"
+        },
+        # Новые боулинг-стайл игры
+        {
+            "emoji": "🎳",
+            "name": "Боулинг",
+            "commands": "Напиши: <code>боулинг</code> число",
+            "type": "solo"
+        },
+        {
+            "emoji": "⚽",
+            "name": "Футбол",
+            "commands": "Напиши: <code>футбол</code> число",
+            "type": "solo"
+        },
+        {
+            "emoji": "🎯",
+            "name": "Дартс",
+            "commands": "Напиши: <code>дартс</code> число",
+            "type": "solo"
+        }
+    ]
+    return games
+
+
+def format_games_page(page: int = 1):
+    """Форматирует страницу со списком игр"""
+    games = get_games_list()
+    per_page = 3  # По 3 игры на страницу  
+    total_pages = (len(games) + per_page - 1) // per_page
+    
+    start_idx = (page - 1) * per_page
+    end_idx = start_idx + per_page
+    page_games = games[start_idx:end_idx]
+    
+    text = f"🎮 <b>СПИСОК ИГР</b> 🎮\n\n"
+    
+    # Добавляем легенду
+    text += f"<b>⚔️ - игры для батлов, ответом на сообщение</b>\n"
+    text += f"<b>🤵 - Можно играть в соло</b>\n\n"
+    
+    for i, game in enumerate(page_games, 1):
+        game_num = start_idx + i
+        
+        text += f"{game_num}. {game['emoji']} <b>{game['name']}</b>\n"
+        text += f"   💬 Команды: {game['commands']}\n\n"
+    
+    return text, total_pages
+
+
+def build_games_keyboard(current_page: int, total_pages: int):
+    """Создает клавиатуру для навигации по играм"""
+    buttons = []
+    
+    # Навигация по страницам
+    if total_pages > 1:
+        nav_row = []
+        if current_page > 1:
+            nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"games_page:{current_page-1}"))
+        
+        nav_row.append(InlineKeyboardButton(text=f"{current_page}/{total_pages}", callback_data="games_info"))
+        
+        if current_page < total_pages:
+            nav_row.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"games_page:{current_page+1}"))
+        
+        buttons.append(nav_row)
+    
+    # Кнопка помощи
+    buttons.append([InlineKeyboardButton(text="❓ Помощь по играм", callback_data="games_help")])
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@texts.on(Command("game"))
+async def cmd_game(message: types.Message):
+    """Команда /game - показывает список всех игр"""
+    if not getattr(message, 'from_user', None):
+        return
+    
+    text, total_pages = format_games_page(page=1)
+    keyboard = build_games_keyboard(current_page=1, total_pages=total_pages)
+    
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@texts.exact("игры")
+async def cmd_games_text(message: types.Message):
+    """Обработчик текстового сообщения 'игры'"""
+    await cmd_game(message)
+
+
+@callbacks.on("games_page:*")
+async def games_page_callback(callback: types.CallbackQuery):
+    """Навигация по страницам игр"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    try:
+        page = int(callback.data.split(":")[1])
+        text, total_pages = format_games_page(page=page)
+        keyboard = build_games_keyboard(current_page=page, total_pages=total_pages)
+        
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        await callback.answer()
+    except Exception as e:
+        await callback.answer("Ошибка навигации", show_alert=True)
+
+
+@callbacks.on("games_info")
+async def games_info_callback(callback: types.CallbackQuery):
+    """Информация о списке игр"""
+    await callback.answer("📋 Список всех доступных игр в боте", show_alert=False)
+
+
+@callbacks.on("games_help")
+async def games_help_callback(callback: types.CallbackQuery):
+    """Помощь по играм"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    help_text = (
+        "❓ <b>ПОМОЩЬ ПО ИГРАМ</b> ❓\n\n"
+        
+        "🤵 <b>Соло игры:</b>\n"
+        "• Играете против бота\n"
+        "• Просто напишите команду с числом\n"
+        "• Пример: <code>клад 100</code>\n\n"
+        
+        "⚔️ <b>Батл игры:</b>\n"
+        "• Играете против других игроков\n"
+        "• Ответьте на сообщение игрока командой\n"
+        "• Пример: ответить на сообщение <code>кости 50</code>\n"
+        "• Игрок может принять или отклонить вызов\n\n"
+        
+        "🤵⚔️ <b>Универсальные игры:</b>\n"
+        "• Можно играть И соло, И в PvP режиме\n"
+        "• Соло: просто команда <code>бет 100</code>\n"
+        "• PvP: ответить на сообщение <code>бет 100</code>\n\n"
+        
+        "💡 <b>Как играть в батлы:</b>\n"
+        "1. Найдите сообщение игрока\n"
+        "2. Ответьте на него командой игры\n"
+        "3. Дождитесь принятия вызова\n"
+        "4. Играйте и побеждайте!\n\n"
+        
+        "� <b>Минимальные ставки:</b>\n"
+        "• Большинство игр: от 10 дань\n"
+        "• Лотерея: 100 дань за билет\n\n"
+        
+        "📞 Нужна помощь? Напишите /help"
+    )
+    
+    back_kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Назад к играм", callback_data="games_page:1")]
+    ])
+    
+    await callback.message.edit_text(help_text, reply_markup=back_kb, parse_mode="HTML")
+    await callback.answer()
+
+
+# ===========================
+# === БОУЛИНГ ИГРА ===
+# ===========================
+
+@texts.contains("боулинг", "bowling", digits=True)
+async def cmd_bowling_start(message: types.Message):
+    """Запуск игры боулинг"""
+    from main import format_clickable_name, increment_games_count
+    increment_games_count()
+    
+    if not message.from_user:
+        return
+    
+    user_id = message.from_user.id
+    
+    # ЗАЩИТА: Проверяем, нет ли уже активной игры у этого игрока
+    if user_id in active_bowling_games:
+        await message.reply("❌ У вас уже есть активная игра в боулинг! Завершите её сначала.")
+        return
+    
+    text = message.text.strip().lower()
+    
+    # Парсим ставку из сообщения
+    import re
+    match = re.search(r'\d+', text)
+    if not match:
+        await message.reply("Формат: боулинг X (X — ставка в дань, минимум 10)")
+        return
+    
+    try:
+        bet = int(match.group())
+    except Exception:
+        await message.reply("Ставка должна быть числом!")
+        return
+    
+    if bet < 10:
+        await message.reply("❌ Минимальная ставка — 10 дань!")
+        return
+    
+    # Проверка баланса и списание ставки — одной транзакцией
+    try:
+        balance = await db_async.db.settle_round(user_id, bet)
+    except Exception:
+        await message.reply("❌ Ошибка при списании ставки!")
+        return
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        balance = user["dan"] if user else 0
+        await message.reply(f"❌ Недостаточно дань!\n💰 Ваш баланс: {balance}")
+        return
+    
+    # Создаём игру
+    from plugins.games.bowling import BowlingGame, build_choice_keyboard
+    username = format_clickable_name(message.from_user) if message.from_user else "Игрок"
+    game = BowlingGame(user_id, username, bet)
+    active_bowling_games[user_id] = game
+    
+    # Отправляем сообщение с выбором
+    choice_text = (
+        f"🎳 <b>Боулинг - выбери исход!</b>\n\n"
+        f"💰 <b>Ставка:</b> {bet} Дань\n"
+    )
+    
+    await message.reply(choice_text, reply_markup=build_choice_keyboard(), parse_mode="HTML")
+
+
+@callbacks.on("bowling_choice:*")
+async def bowling_choice_callback(callback: types.CallbackQuery):
+    """Обработчик выбора исхода в боулинге"""
+    from main import format_number_beautiful
+    if not callback.from_user or not callback.message:
+        return
+    
+    user_id = callback.from_user.id
+    choice = callback.data.split(":")[1]
+    
+    # Проверяем, есть ли активная игра
+    game = active_bowling_games.get(user_id)
+    if not game:
+        await callback.answer("❌ Игра не найдена! Начните новую!", show_alert=True)
+        return
+    
+    # ЗАЩИТА: Проверяем, что нажимает владелец игры
+    if game.user_id != user_id:
+        await callback.answer("❌ Это не ваша игра!", show_alert=True)
+        return
+    
+    # Сохраняем выбор
+    game.user_choice = choice
+    
+    # Удаляем сообщение с выбором
+    try:
+        await callback.message.delete()
+    except Exception:
+        pass
+    
+    # Отправляем анимацию кегль (dice) 🎳
+    dice_value = None
+    try:
+        # Кидаем dice с боулингом - Telegram вернёт значение от 1 до 6
+        dice_msg = await callback.message.answer_dice(emoji="🎳")
+        # Даём время на анимацию (~3-4 секунды)
+        await asyncio.sleep(3)
+        # Получаем реальное значение dice
+        dice_value = dice_msg.dice.value
+    except Exception as e:
+        # Если dice не поддерживается, используем случайное значение
+        await callback.message.answer("🎳" * 5 + " → " + "💥" * 5)
+        await asyncio.sleep(1)
+        dice_value = random.randint(1, 6)
+    
+    # ВАЖНО: Устанавливаем результат игры на основе РЕАЛЬНОГО значения dice
+    # Telegram dice для боулинга: 1-6 (количество сбитых кегель)
+    game.pins_fallen = dice_value
+    
+    # Теперь проверяем выигрыш на основе реального результата
+    game.check_win()
+    
+    # Обновляем баланс если выиграли (выигрыш и счётчики — одной транзакцией)
+    if game.winnings > 0:
+        stats = db.round_stats(win=game.winnings - game.bet, lose=game.bet, games=0)
+    else:
+        stats = db.round_stats(lose=game.bet, games=0)
+    try:
+        await db_async.db.settle_round(user_id, 0, max(game.winnings, 0), stats)
+    except Exception:
+        pass
+    
+    # Показываем результат
+    result_text = game.get_status_text()
+    # Если проигрыш — добавим строку с текущим балансом
+    if game.winnings <= 0:
+        try:
+            user = await db_async.db.get_user(user_id)
+            if user and 'dan' in user:
+                bal_txt = format_number_beautiful(user['dan']).replace('.', ',')
+                result_text += f"\n\n⚡️ Баланс: {bal_txt}"
+        except Exception:
+            pass
+    # Если проигрыш — добавим строку с текущим балансом
+    if game.winnings <= 0:
+        try:
+            user = await db_async.db.get_user(user_id)
+            if user and 'dan' in user:
+                bal_txt = format_number_beautiful(user['dan']).replace('.', ',')
+                result_text += f"\n\n⚡️ Баланс: {bal_txt}"
+        except Exception:
+            pass
+    
+    # Кнопка для повтора
+    repeat_kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🎳 Играть ещё раз", callback_data=f"bowling_repeat:{game.bet}")]
+    ])
+    
+    # Отправляем результат как новое сообщение (после анимации)
+    await callback.message.answer(result_text, reply_markup=repeat_kb, parse_mode="HTML")
+    
+    # Удаляем игру из активных
+    if user_id in active_bowling_games:
+        del active_bowling_games[user_id]
+    
+    await callback.answer()
+
+
+@callbacks.on("bowling_cancel")
+async def bowling_cancel_callback(callback: types.CallbackQuery):
+    """Отмена игры в боулинг"""
+    if not callback.from_user or not callback.message:
+        return
+    
+    user_id = callback.from_user.id
+    
+    # Проверяем, есть ли активная игра
+    game = active_bowling_games.get(user_id)
+    if not game:
+        await callback.answer("❌ Игра не найдена!", show_alert=True)
+        return
+    
+    # Проверяем, что отменяет владелец игры
+    if game.user_id != user_id:
+        await callback.answer("❌ Это не ваша игра!", show_alert=True)
+        return
+    
+    # Удаляем игру из активных
+    del active_bowling_games[user_id]
+    
+    # Редактируем сообщение
+    await callback.message.edit_text("🎳 Игра отменена", reply_markup=None)
+    await callback.answer()
+
+
+@callbacks.on("bowling_repeat:*")
+async def bowling_repeat_callback(callback: types.CallbackQuery):
+    """Повтор боулинга с той же ставкой"""
+    from main import format_clickable_name
+    if not callback.from_user:
+        return
+    
+    user_id = callback.from_user.id
+    bet_str = callback.data.split(":")[1]
+    
+    # Проверяем, нет ли уже активной игры
+    if user_id in active_bowling_games:
+        await callback.answer("❌ У вас уже есть активная игра в боулинг!", show_alert=True)
+        return
+    
+    try:
+        bet = int(bet_str)
+    except Exception:
+        await callback.answer("❌ Ошибка при повторе игры!", show_alert=True)
+        return
+    
+    # Проверка баланса и списание ставки — одной транзакцией
+    try:
+        balance = await db_async.db.settle_round(user_id, bet)
+    except Exception:
+        await callback.answer("❌ Ошибка при списании ставки!", show_alert=True)
+        return
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        balance = user["dan"] if user else 0
+        await callback.answer(f"❌ Недостаточно дань!\n💰 Баланс: {balance}", show_alert=True)
+        return
+    
+    # Создаём новую игру
+    from plugins.games.bowling import BowlingGame, build_choice_keyboard
+    username = format_clickable_name(callback.from_user) if callback.from_user else "Игрок"
+    game = BowlingGame(user_id, username, bet)
+    active_bowling_games[user_id] = game
+    # Засчитываем как игру дня (любая игра)
+    try:
+        import tasks
+        tasks.record_any_game(user_id)
+    except Exception:
+        pass
+    
+    # Отправляем сообщение с выбором через answer (новое сообщение)
+    choice_text = (
+        f"🎳 <b>Боулинг - выбери исход!</b>\n\n"
+        f"💰 <b>Ставка:</b> {bet} Дань\n"
+    )
+    
+    await callback.message.answer(choice_text, reply_markup=build_choice_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+
+# ===========================
+# === ДАРТС (🎯) ===
+# ===========================
+
+@texts.contains("дартс", "darts", "🎯", digits=True)
+async def cmd_darts_start(message: types.Message):
+    """Запуск игры дартс"""
+    from main import format_clickable_name, increment_games_count
+    increment_games_count()
+    if not message.from_user:
+        return
+    user_id = message.from_user.id
+
+    # Защита от дубликатов
+    if user_id in active_darts_games:
+        await message.reply("❌ У вас уже есть активный дартс! Завершите его сначала.")
+        return
+
+    text = message.text.strip().lower()
+    match = re.search(r"\d+", text)
+    if not match:
+        await message.reply("Формат: дартс X (минимум 10)")
+        return
+    try:
+        bet = int(match.group())
+    except Exception:
+        await message.reply("Ставка должна быть числом!")
+        return
+    if bet < 10:
+        await message.reply("❌ Минимальная ставка — 10 дань!")
+        return
+
+    # Проверка баланса и списание ставки — одной транзакцией
+    try:
+        balance = await db_async.db.settle_round(user_id, bet)
+    except Exception:
+        await message.reply("❌ Ошибка при списании ставки!")
+        return
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        balance = user["dan"] if user else 0
+        await message.reply(f"❌ Недостаточно дань!\n💰 Ваш баланс: {balance}")
+        return
+
+    # Создание игры
+    from plugins.games.darts import DartsGame, build_choice_keyboard as darts_keyboard
+    username = format_clickable_name(message.from_user) if message.from_user else "Игрок"
+    game = DartsGame(user_id, username, bet)
+    active_darts_games[user_id] = game
+    try:
+        import tasks
+        tasks.record_any_game(user_id)
+    except Exception:
+        pass
+
+    text = (
+        f"🎯 <b>Дартс - выбери попадание!</b>\n\n"
+        f"💰 <b>Ставка:</b> {bet} Дань\n"
+    )
+    await message.reply(text, reply_markup=darts_keyboard(), parse_mode="HTML")
+
+
+@callbacks.on("darts_choice:*")
+async def darts_choice_callback(callback: types.CallbackQuery):
+    if not callback.from_user or not callback.message:
+        return
+    user_id = callback.from_user.id
+    choice = callback.data.split(":")[1]
+    game = active_darts_games.get(user_id)
+    if not game:
+        await callback.answer("❌ Игра не найдена!", show_alert=True)
+        return
+    if game.user_id != user_id:
+        await callback.answer("❌ Это не ваша игра!", show_alert=True)
+        return
+    game.user_choice = choice
+    try:
+        await callback.message.delete()
+    except Exception:
+        pass
+
+    # Бросаем 🎯
+    dice_msg = None
+    try:
+        dice_msg = await callback.message.answer_dice(emoji="🎯")
+        await asyncio.sleep(3)
+        game.dice_value = dice_msg.dice.value
+    except Exception:
+        game.dice_value = random.randint(1, 6)
+
+    game.check_win()
+    # Баланс
+    # Выигрыш и счётчики — одной транзакцией
+    if game.winnings > 0:
+        stats = db.round_stats(win=game.winnings - game.bet, lose=game.bet, games=0)
+    else:
+        stats = db.round_stats(lose=game.bet, games=0)
+    try:
+        await db_async.db.settle_round(user_id, 0, max(game.winnings, 0), stats)
+    except Exception:
+        pass
+
+    result_text = game.get_status_text()
+    repeat_kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🎯 Играть ещё раз", callback_data=f"darts_repeat:{game.bet}")]
+    ])
+    # Отправляем как ответ (reply) на сообщение с кубиком, если оно есть
+    try:
+        if dice_msg is not None:
+            await dice_msg.reply(result_text, reply_markup=repeat_kb, parse_mode="HTML")
+        else:
+            await callback.message.answer(result_text, reply_markup=repeat_kb, parse_mode="HTML")
+    except Exception:
+        await callback.message.answer(result_text, reply_markup=repeat_kb, parse_mode="HTML")
+    if user_id in active_darts_games:
+        del active_darts_games[user_id]
+    await callback.answer()
+
+
+@callbacks.on("darts_cancel")
+async def darts_cancel_callback(callback: types.CallbackQuery):
+    if not callback.from_user or not callback.message:
+        return
+    user_id = callback.from_user.id
+    game = active_darts_games.get(user_id)
+    if not game:
+        await callback.answer("❌ Игра не найдена!", show_alert=True)
+        return
+    if game.user_id != user_id:
+        await callback.answer("❌ Это не ваша игра!", show_alert=True)
+        return
+    del active_darts_games[user_id]
+    await callback.message.edit_text("🎯 Игра отменена", reply_markup=None)
+    await callback.answer()
+
+
+@callbacks.on("darts_repeat:*")
+async def darts_repeat_callback(callback: types.CallbackQuery):
+    from main import format_clickable_name
+    if not callback.from_user:
+        return
+    user_id = callback.from_user.id
+    try:
+        bet = int(callback.data.split(":")[1])
+    except Exception:
+        await callback.answer("❌ Ошибка повтора!", show_alert=True)
+        return
+    if user_id in active_darts_games:
+        await callback.answer("❌ У вас уже есть активный дартс!", show_alert=True)
+        return
+    # Проверка баланса и списание ставки — одной транзакцией
+    try:
+        balance = await db_async.db.settle_round(user_id, bet)
+    except Exception:
+        await callback.answer("❌ Ошибка при списании!", show_alert=True)
+        return
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        balance = user["dan"] if user else 0
+        await callback.answer(f"❌ Недостаточно дань! Баланс: {balance}", show_alert=True)
+        return
+    from plugins.games.darts import DartsGame, build_choice_keyboard as darts_keyboard
+    username = format_clickable_name(callback.from_user) if callback.from_user else "Игрок"
+    game = DartsGame(user_id, username, bet)
+    active_darts_games[user_id] = game
+    try:
+        import tasks
+        tasks.record_any_game(user_id)
+    except Exception:
+        pass
+    text = (
+        f"🎯 <b>Дартс - выбери попадание!</b>\n\n"
+        f"💰 <b>Ставка:</b> {bet} Дань\n"
+    )
+    await callback.message.answer(text, reply_markup=darts_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+
+# ===========================
+# === БАСКЕТБОЛ (заглушка) ===
+# ===========================
+
+@texts.contains("баскетбол", "basketball", "🏀", digits=True)
+async def basketball_stub(message: types.Message):
+    """Заглушка для баскетбола — пока в разработке"""
+    try:
+        text = (
+            "🏀 <b>Баскетбол</b>\n\n"
+            "Игра в разработке и скоро будет доступна.\n"
+            "Следи за обновлениями!"
+        )
+        await message.reply(text, parse_mode="HTML")
+    except Exception:
+        pass
+
+
+# ===========================
+# === ФУТБОЛ (⚽) ===
+# ===========================
+
+@texts.contains("футбол", "soccer", "football", "⚽", digits=True)
+async def cmd_soccer_start(message: types.Message):
+    from main import format_clickable_name, increment_games_count
+    increment_games_count()
+    if not message.from_user:
+        return
+    user_id = message.from_user.id
+    if user_id in active_soccer_games:
+        await message.reply("❌ У вас уже есть активный футбол! Завершите его сначала.")
+        return
+    match = re.search(r"\d+", message.text)
+    if not match:
+        await message.reply("Формат: футбол X (минимум 10)")
+        return
+    try:
+        bet = int(match.group())
+    except Exception:
+        await message.reply("Ставка должна быть числом!")
+        return
+    if bet < 10:
+        await message.reply("❌ Минимальная ставка — 10 дань!")
+        return
+    # Проверка баланса и списание ставки — одной транзакцией
+    try:
+        balance = await db_async.db.settle_round(user_id, bet)
+    except Exception:
+        await message.reply("❌ Ошибка при списании ставки!")
+        return
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        balance = user["dan"] if user else 0
+        await message.reply(f"❌ Недостаточно дань!\n💰 Ваш баланс: {balance}")
+        return
+    from plugins.games.soccer import SoccerGame, build_choice_keyboard as soccer_keyboard
+    username = format_clickable_name(message.from_user) if message.from_user else "Игрок"
+    game = SoccerGame(user_id, username, bet)
+    active_soccer_games[user_id] = game
+    try:
+        import tasks
+        tasks.record_any_game(user_id)
+    except Exception:
+        pass
+    text = (
+        f"⚽ <b>Футбол - угадай исход!</b>\n\n"
+        f"💰 <b>Ставка:</b> {bet} Дань\n"
+    )
+    await message.reply(text, reply_markup=soccer_keyboard(), parse_mode="HTML")
+
+
+@callbacks.on("soccer_choice:*")
+async def soccer_choice_callback(callback: types.CallbackQuery):
+    if not callback.from_user or not callback.message:
+        return
+    user_id = callback.from_user.id
+    choice = callback.data.split(":")[1]
+    game = active_soccer_games.get(user_id)
+    if not game:
+        await callback.answer("❌ Игра не найдена!", show_alert=True)
+        return
+    if game.user_id != user_id:
+        await callback.answer("❌ Это не ваша игра!", show_alert=True)
+        return
+    game.user_choice = choice
+    try:
+        await callback.message.delete()
+    except Exception:
+        pass
+    # Бросаем ⚽
+    dice_msg = None
+    try:
+        dice_msg = await callback.message.answer_dice(emoji="⚽")
+        await asyncio.sleep(3)
+        game.dice_value = dice_msg.dice.value
+    except Exception:
+        game.dice_value = random.randint(1, 6)
+
+    game.check_win()
+    # Выигрыш и счётчики — одной транзакцией
+    if game.winnings > 0:
+        stats = db.round_stats(win=game.winnings - game.bet, lose=game.bet, games=0)
+    else:
+        stats = db.round_stats(lose=game.bet, games=0)
+    try:
+        await db_async.db.settle_round(user_id, 0, max(game.winnings, 0), stats)
+    except Exception:
+        pass
+    result_text = game.get_status_text()
+    repeat_kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⚽ Играть ещё раз", callback_data=f"soccer_repeat:{game.bet}")]
+    ])
+    # Отправляем как reply на сообщение с кубиком, если оно есть
+    try:
+        if dice_msg is not None:
+            await dice_msg.reply(result_text, reply_markup=repeat_kb, parse_mode="HTML")
+        else:
+            await callback.message.answer(result_text, reply_markup=repeat_kb, parse_mode="HTML")
+    except Exception:
+        await callback.message.answer(result_text, reply_markup=repeat_kb, parse_mode="HTML")
+    if user_id in active_soccer_games:
+        del active_soccer_games[user_id]
+    await callback.answer()
+
+
+@callbacks.on("soccer_cancel")
+async def soccer_cancel_callback(callback: types.CallbackQuery):
+    if not callback.from_user or not callback.message:
+        return
+    user_id = callback.from_user.id
+    game = active_soccer_games.get(user_id)
+    if not game:
+        await callback.answer("❌ Игра не найдена!", show_alert=True)
+        return
+    if game.user_id != user_id:
+        await callback.answer("❌ Это не ваша игра!", show_alert=True)
+        return
+    del active_soccer_games[user_id]
+    await callback.message.edit_text("⚽ Игра отменена", reply_markup=None)
+    await callback.answer()
+
+
+@callbacks.on("soccer_repeat:*")
+async def soccer_repeat_callback(callback: types.CallbackQuery):
+    from main import format_clickable_name
+    if not callback.from_user:
+        return
+    user_id = callback.from_user.id
+    try:
+        bet = int(callback.data.split(":")[1])
+    except Exception:
+        await callback.answer("❌ Ошибка повтора!", show_alert=True)
+        return
+    if user_id in active_soccer_games:
+        await callback.answer("❌ У вас уже есть активный футбол!", show_alert=True)
+        return
+    # Проверка баланса и списание ставки — одной транзакцией
+    try:
+        balance = await db_async.db.settle_round(user_id, bet)
+    except Exception:
+        await callback.answer("❌ Ошибка при списании!", show_alert=True)
+        return
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        balance = user["dan"] if user else 0
+        await callback.answer(f"❌ Недостаточно дань! Баланс: {balance}", show_alert=True)
+        return
+    from plugins.games.soccer import SoccerGame, build_choice_keyboard as soccer_keyboard
+    username = format_clickable_name(callback.from_user) if callback.from_user else "Игрок"
+    game = SoccerGame(user_id, username, bet)
+    active_soccer_games[user_id] = game
+    try:
+        import tasks
+        tasks.record_any_game(user_id)
+    except Exception:
+        pass
+    text = (
+        f"⚽ <b>Футбол - угадай исход!</b>\n\n"
+        f"💰 <b>Ставка:</b> {bet} Дань\n"
+    )
+    await callback.message.answer(text, reply_markup=soccer_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+
+# Слоты (🎰) удалены по требованию: обработчики и модуль отключены
+
+
+# --- Обработка кнопок костей ---
+@callbacks.on("dice_accept:*")
+async def callback_dice_accept(callback: types.CallbackQuery):
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    # Не отправляем быстрый ответ, чтобы show_alert работал ниже
+    await betcosty.handle_dice_accept(callback)
+
+
+@callbacks.on("dice_decline:*")
+async def callback_dice_decline(callback: types.CallbackQuery):
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    # Не отправляем быстрый ответ, чтобы show_alert работал ниже
+    await betcosty.handle_dice_decline(callback)
+
+
+# --- Обработка кнопок батла (теперь кнопки реально принимают/отклоняют батл) ---
+@callbacks.on("battle_button_accept:*")
+async def callback_battle_accept(callback: types.CallbackQuery):
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    await callback.answer()  # быстрый ответ Telegram
+    await battles.handle_accept_button(callback)
+
+
+@callbacks.on("battle_button_decline:*")
+async def callback_battle_decline(callback: types.CallbackQuery):
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    await callback.answer()  # быстрый ответ Telegram
+    await battles.handle_decline_button(callback)
+
+
+@callbacks.on("battle_button_*")
+async def callback_battle_button(callback: types.CallbackQuery):
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    await callback.answer()  # быстрый ответ Telegram
+    data = callback.data or ""
+    if data.startswith("battle_button_accept:"):
+        await battles.handle_accept_button(callback)
+    elif data.startswith("battle_button_decline:"):
+        await battles.handle_decline_button(callback)
@@ -0,0 +1,1382 @@
+"""
+Ежедневная лотерея: билеты, бонус дня, розыгрыш в 21:00 по Киеву
+(LotteryScheduler — задачи scheduler.py), история и команды розыгрыша.
+"""
+import os
+import time
+import sqlite3
+import datetime
+import random
+import pytz
+from aiogram import Router, types
+from aiogram.filters import Command
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile
+import database as db
+import sqlite_pool
+import broadcast
+import db_async
+import scheduler
+import routing
+
+
+router = Router(name="lottery")
+callbacks = routing.CallbackRouter()
+router.callback_query.register(callbacks.dispatch, callbacks.filter)
+texts = routing.TextRouter()
+
+
+# === СИСТЕМА БИЛЕТОВ ЛОТЕРЕИ ===
+def init_tickets_db():
+    """Инициализация таблиц для системы билетов"""
+    from main import MESSAGES_DB_FILE_FILE
+    conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+    cursor = conn.cursor()
+    
+    # Таблица билетов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lottery_tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            draw_date DATE NOT NULL,
+            status TEXT DEFAULT 'active'
+        )
+    ''')
+    
+    # Таблица розыгрышей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lottery_draws (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            draw_date DATE UNIQUE NOT NULL,
+            winner_user_id INTEGER,
+            winner_username TEXT,
+            total_tickets INTEGER DEFAULT 0,
+            prize_amount INTEGER DEFAULT 0,
+            draw_time TIMESTAMP,
+            status TEXT DEFAULT 'pending'
+        )
+    ''')
+
+    # Таблица для сохранения заранее сгенерированных бонусов по дате
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lottery_meta (
+            meta_date DATE PRIMARY KEY,
+            bonus INTEGER
+        )
+    ''')
+    
+    conn.commit()
+    conn.close()
+
+
+def get_total_tickets_info():
+    """Получить общую информацию о билетах"""
+    from main import MESSAGES_DB_FILE_FILE
+    
+    
+    conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+    cursor = conn.cursor()
+    
+    # Используем киевское время
+    kyiv_tz = pytz.timezone('Europe/Kiev')
+    now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+    today_kyiv = now_kyiv.date().isoformat()
+    
+    cursor.execute('''
+        SELECT COUNT(*), COUNT(*) * 100 
+        FROM lottery_tickets 
+        WHERE draw_date = ? AND status = 'active'
+    ''', (today_kyiv,))
+    
+    result = cursor.fetchone()
+    conn.close()
+    
+    return result if result else (0, 0)
+
+
+def get_user_tickets_count(user_id: int):
+    """Получить количество билетов пользователя на сегодня"""
+    from main import MESSAGES_DB_FILE_FILE
+    
+    
+    conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+    cursor = conn.cursor()
+    
+    # Используем киевское время
+    kyiv_tz = pytz.timezone('Europe/Kiev')
+    now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+    today_kyiv = now_kyiv.date().isoformat()
+    
+    cursor.execute('''
+        SELECT COUNT(*) 
+        FROM lottery_tickets 
+        WHERE user_id = ? AND draw_date = ? AND status = 'active'
+    ''', (user_id, today_kyiv))
+    
+    result = cursor.fetchone()
+    conn.close()
+    
+    return result[0] if result else 0
+
+
+def get_daily_lottery_bonus():
+    """Получает статичный бонус лотереи на указанный день (или сегодня, если не указан).
+
+    Приоритет: если в БД (messages DB) для даты уже сохранён бонус, возвращаем его.
+    Это позволяет сгенерировать и зафиксировать бонус сразу после розыгрыша, чтобы
+    пользователи видели новый бонус для следующего дня сразу, а не с 00:00.
+    """
+    from main import MESSAGES_DB_FILE_FILE
+    import random
+    import datetime
+
+    # Поддерживаем опциональный аргумент даты через глобалную переменную "_override_date"
+    # (совместимость с вызовами без аргументов сохранена)
+    # Но удобнее: если вызывающий хочет бонус для конкретной даты, он может передать
+    # строку даты в формате YYYY-MM-DD через временную глоб. Перепределять это не нужно
+    # в большинстве вызовов; для наших нужд мы добавим вспомогательные функции ниже.
+
+    today = datetime.date.today()
+
+    # Попытка получить сохранённый бонус из messages DB для сегодня
+    try:
+        stored = get_stored_lottery_bonus_for_date(today.isoformat())
+        if stored is not None:
+            return int(stored)
+    except Exception:
+        # Если что-то с БД, падаем дальше к проверке розыгрыша/генерации
+        pass
+
+    # Если розыгрыш за сегодня уже проведён, попробуем вернуть сохранённый бонус для завтра
+    try:
+        conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+        cursor = conn.cursor()
+        cursor.execute('SELECT status FROM lottery_draws WHERE draw_date = ?', (today.isoformat(),))
+        row = cursor.fetchone()
+        conn.close()
+        if row and row[0] in ('drawn', 'done', 'finished'):
+            # Возвращаем сохранённый бонус для следующего дня, если он есть
+            tomorrow = (today + datetime.timedelta(days=1)).isoformat()
+            try:
+                tb = get_stored_lottery_bonus_for_date(tomorrow)
+                if tb is not None:
+                    return int(tb)
+            except Exception:
+                pass
+    except Exception:
+        pass
+
+    # Если в БД нет сохранённого бонуса для сегодня — генерируем детерминированно
+    seed = int(today.strftime("%Y%m%d"))  # Например: 20251001
+    random.seed(seed)
+    chance = random.random()
+
+    if chance < 0.7:  # 70% шанс - низкий бонус (1000-3000)
+        daily_bonus = random.randint(1000, 3000)
+    elif chance < 0.9:  # 20% шанс - средний бонус (2000-3000)
+        daily_bonus = random.randint(2000, 3000)
+    elif chance < 0.97:  # 7% шанс - высокий бонус (3000-4500)
+        daily_bonus = random.randint(3000, 4500)
+    else:  # 3% шанс - очень высокий бонус (4000-5000)
+        daily_bonus = random.randint(4000, 5000)
+
+    random.seed()
+    return daily_bonus
+
+
+def get_stored_lottery_bonus_for_date(date_str: str):
+    """Возвращает сохранённый бонус (int) для даты YYYY-MM-DD либо None."""
+    from main import MESSAGES_DB_FILE_FILE
+    try:
+        conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+        cursor = conn.cursor()
+        cursor.execute('SELECT bonus FROM lottery_meta WHERE meta_date = ?', (date_str,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+    except Exception:
+        return None
+
+
+def set_stored_lottery_bonus_for_date(date_str: str, bonus: int):
+    """Сохраняет/перезаписывает бонус для даты (YYYY-MM-DD) в messages DB."""
+    from main import MESSAGES_DB_FILE_FILE
+    try:
+        conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO lottery_meta (meta_date, bonus) VALUES (?, ?)', (date_str, int(bonus)))
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        print(f"❌ Не удалось сохранить бонус для {date_str}: {e}")
+        return False
+
+
+def generate_deterministic_lottery_bonus_for_date(date_obj):
+    """Генерирует детерминированный бонус для переданного date объектa (datetime.date).
+
+    Использует тот же алгоритм, что и get_daily_lottery_bonus, но без проверки БД.
+    """
+    import random
+    try:
+        d = date_obj
+        seed = int(d.strftime("%Y%m%d"))
+    except Exception:
+        import datetime
+        d = datetime.date.today()
+        seed = int(d.strftime("%Y%m%d"))
+
+    random.seed(seed)
+    chance = random.random()
+    if chance < 0.7:
+        daily_bonus = random.randint(1000, 3000)
+    elif chance < 0.9:
+        daily_bonus = random.randint(2000, 3000)
+    elif chance < 0.97:
+        daily_bonus = random.randint(3000, 4500)
+    else:
+        daily_bonus = random.randint(4000, 5000)
+    random.seed()
+    return daily_bonus
+
+
+def buy_lottery_ticket(user_id: int, username: str):
+    """Купить билет лотереи"""
+    from main import MESSAGES_DB_FILE_FILE
+    
+    
+    # Проверяем, есть ли достаточно денег
+    user = db.get_user(user_id)
+    if not user:
+        return False, "Пользователь не найден"
+    
+    dan_balance = float(user.get("dan", 0))
+    if dan_balance < 100:
+        return False, "Недостаточно средств"
+    
+    # Проверяем лимит билетов (максимум 10)
+    user_tickets = get_user_tickets_count(user_id)
+    if user_tickets >= 10:
+        return False, "Достигнут максимум билетов (10)"
+    
+    # Списываем деньги
+    from database import set_dan
+    set_dan(user_id, dan_balance - 100)
+    
+    # Добавляем билет
+    conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+    cursor = conn.cursor()
+    
+    # Используем киевское время для определения draw_date
+    kyiv_tz = pytz.timezone('Europe/Kiev')
+    now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+    today_kyiv = now_kyiv.date().isoformat()
+    
+    cursor.execute('''
+        INSERT INTO lottery_tickets (user_id, username, draw_date)
+        VALUES (?, ?, ?)
+    ''', (user_id, username, today_kyiv))
+    
+    conn.commit()
+    conn.close()
+    
+    return True, "Билет успешно куплен!"
+
+
+def cleanup_old_tickets():
+    """Очистка старых билетов и розыгрышей (используя киевское время)"""
+    from main import MESSAGES_DB_FILE_FILE
+    
+    
+    conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+    cursor = conn.cursor()
+    
+    # Используем киевское время
+    kyiv_tz = pytz.timezone('Europe/Kiev')
+    now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+    today_kyiv = now_kyiv.date().isoformat()
+    
+    # Удаляем разыгранные билеты за вчерашний день и раньше
+    cursor.execute('''
+        DELETE FROM lottery_tickets 
+        WHERE draw_date < ? AND status = 'drawn'
+    ''', (today_kyiv,))
+    
+    drawn_deleted = cursor.rowcount
+    print(f"🧹 Удалено {drawn_deleted} разыгранных билетов")
+    
+    # Удаляем старые активные билеты (которые не были разыграны вчера)
+    cursor.execute('''
+        DELETE FROM lottery_tickets 
+        WHERE draw_date < ? AND status = 'active'
+    ''', (today_kyiv,))
+    
+    active_deleted = cursor.rowcount
+    print(f"🧹 Удалено {active_deleted} неразыгранных билетов")
+    
+    # Оставляем только последние 7 розыгрышей для истории
+    cutoff_date = (now_kyiv.date() - datetime.timedelta(days=7)).isoformat()
+    cursor.execute('''
+        DELETE FROM lottery_draws 
+        WHERE draw_date < ?
+    ''', (cutoff_date,))
+    
+    draws_deleted = cursor.rowcount
+    print(f"🧹 Удалено {draws_deleted} старых розыгрышей")
+    
+    conn.commit()
+    conn.close()
+    
+    return drawn_deleted + active_deleted
+
+
+def get_lottery_statistics():
+    """Получить подробную статистику лотереи"""
+    from main import MESSAGES_DB_FILE_FILE
+    
+    
+    conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+    cursor = conn.cursor()
+    
+    # Используем киевское время
+    kyiv_tz = pytz.timezone('Europe/Kiev')
+    now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+    today_kyiv = now_kyiv.date().isoformat()
+    
+    # Статистика за сегодня
+    cursor.execute('''
+        SELECT COUNT(*), SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END)
+        FROM lottery_tickets 
+        WHERE draw_date = ?
+    ''', (today_kyiv,))
+    
+    today_stats = cursor.fetchone() or (0, 0)
+    
+    # Всего билетов в системе
+    cursor.execute('SELECT COUNT(*) FROM lottery_tickets')
+    total_tickets = cursor.fetchone()[0]
+    
+    # Количество уникальных игроков за сегодня
+    cursor.execute('''
+        SELECT COUNT(DISTINCT user_id) 
+        FROM lottery_tickets 
+        WHERE draw_date = ?
+    ''', (today_kyiv,))
+    unique_players_today = cursor.fetchone()[0]
+    
+    conn.close()
+    
+    return {
+        'today_total': today_stats[0],
+        'today_active': today_stats[1],
+        'total_tickets_ever': total_tickets,
+        'unique_players_today': unique_players_today
+    }
+
+
+def conduct_lottery_draw():
+    """Проводит розыгрыш лотереи и определяет победителя"""
+    from main import MESSAGES_DB_FILE_FILE
+    import random
+    import time
+    
+    
+    conn = None
+    try:
+        # Подключаемся к базе с таймаутом для избежания блокировки
+        conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+        cursor = conn.cursor()
+        
+        # Используем киевское время
+        kyiv_tz = pytz.timezone('Europe/Kiev')
+        now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+        today_kyiv = now_kyiv.date().isoformat()
+        
+        # Получаем всех участников с их билетами
+        cursor.execute('''
+            SELECT user_id, username, COUNT(*) as ticket_count
+            FROM lottery_tickets 
+            WHERE draw_date = ? AND status = 'active'
+            GROUP BY user_id, username
+        ''', (today_kyiv,))
+        
+        participants = cursor.fetchall()
+        
+        if not participants:
+            # Используем дневной бонус (теперь может быть от 1000 до 9000)
+            bonus = get_daily_lottery_bonus()
+            prize_pool = bonus  # Только бонус, так как билетов нет
+            print(f"❌ Нет участников лотереи на сегодня")
+            print(f"💸 Упущенный бонус составил бы: {prize_pool} дань")
+            
+            # Если бонус больше 7000 дань, отправляем уведомление всем пользователям
+            if prize_pool > 7000:
+                return "no_participants_high_prize", 0, prize_pool  
+            else:
+                return None, 0, prize_pool
+        
+        total_tickets = sum(ticket_count for _, _, ticket_count in participants)
+        # краткая сводка: участников и билетов (лог DEBUG убран)
+        
+        # Создаем взвешенный список участников
+        weighted_participants = []
+        for user_id, username, ticket_count in participants:
+            weighted_participants.extend([user_id] * ticket_count)
+        
+        # Выбираем случайного победителя
+        winner_user_id = random.choice(weighted_participants)
+        
+        # Находим информацию о победителе
+        winner_info = None
+        winner_username = "Unknown"
+        winner_ticket_count = 0
+        
+        for user_id, username, ticket_count in participants:
+            if user_id == winner_user_id:
+                winner_info = (user_id, username, ticket_count)
+                winner_username = username or f"User_{user_id}"
+                winner_ticket_count = ticket_count
+                break
+        
+        # Вычисляем призовой фонд = ВСЕ билеты ВСЕХ участников + бонус
+        total_base_prize = total_tickets * 100  # Все билеты всех участников
+        # Добавляем статичный дневной бонус
+        bonus = get_daily_lottery_bonus()
+        prize_pool = total_base_prize + bonus
+        
+        # Логирование призового фонда — свести к одному сообщению
+        print(f"🏆 Розыгрыш: участников={len(participants)}, билетов={total_tickets}, призовой фонд={prize_pool} дань")
+        
+        # Записываем результат розыгрыша (заменяем если уже есть запись на сегодня)
+        # Также фиксируем время розыгрыша и помечаем статус как 'drawn'
+        draw_time_str = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz).strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute('''
+            INSERT OR REPLACE INTO lottery_draws (draw_date, winner_user_id, winner_username, total_tickets, prize_amount, draw_time, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (today_kyiv, winner_user_id, winner_username, total_tickets, prize_pool, draw_time_str, 'drawn'))
+        
+        # Помечаем все билеты как разыгранные
+        cursor.execute('''
+            UPDATE lottery_tickets 
+            SET status = 'drawn' 
+            WHERE draw_date = ? AND status = 'active'
+        ''', (today_kyiv,))
+        
+        print(f"✅ Помечено {cursor.rowcount} билетов как разыгранные")
+
+        # Сначала фиксируем изменения в лотерейных таблицах, затем начисляем выигрыш,
+        # чтобы избежать блокировок БД при параллельной записи
+        conn.commit()
+        conn.close()
+        conn = None
+
+        # Начисляем выигрыш победителю (отдельным соединением после коммита)
+        try:
+            db.add_dan(winner_user_id, prize_pool)
+            print(f"💰 Начислено {prize_pool} дань пользователю {winner_user_id}")
+        except Exception as e:
+            print(f"❌ Ошибка начисления выигрыша: {e}")
+
+        return winner_info, total_tickets, prize_pool
+        
+    except sqlite3.OperationalError as e:
+        if "database is locked" in str(e):
+            print(f"❌ База данных заблокирована, повторяю попытку через 5 секунд...")
+            time.sleep(5)
+            return None, 0, 0
+        else:
+            print(f"❌ Ошибка базы данных: {e}")
+            return None, 0, 0
+            
+    except sqlite3.IntegrityError as e:
+        if "UNIQUE constraint failed" in str(e):
+            print(f"❌ Розыгрыш уже проводился сегодня")
+            # Возвращаем данные существующего розыгрыша
+            try:
+                # Используем киевское время
+                kyiv_tz = pytz.timezone('Europe/Kiev')
+                now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+                today_kyiv = now_kyiv.date().isoformat()
+                cursor.execute('''
+                    SELECT winner_user_id, winner_username, total_tickets, prize_amount
+                    FROM lottery_draws WHERE draw_date = ?
+                ''', (today_kyiv,))
+                result = cursor.fetchone()
+                if result:
+                    winner_user_id, winner_username, total_tickets, prize_pool = result
+                    return (winner_user_id, winner_username, 0), total_tickets, prize_pool
+            except Exception:
+                pass
+        print(f"❌ Ошибка целостности данных: {e}")
+        return None, 0, 0
+        
+    except Exception as e:
+        print(f"❌ Неожиданная ошибка при проведении розыгрыша: {e}")
+        return None, 0, 0
+        
+    finally:
+        if conn:
+            conn.close()
+
+
+async def send_lottery_results(winner_info, total_tickets, prize_pool):
+    """Отправляет сообщение о результатах лотереи всем участникам в ЛС"""
+    from main import format_clickable_name, get_display_name
+    if not winner_info:
+        return
+    
+    winner_user_id, winner_username, winner_ticket_count = winner_info
+    
+    # Получаем красивое имя победителя с учетом приватности
+    winner_display_name = get_display_name(winner_user_id, winner_username)
+    winner_display = format_clickable_name(winner_user_id, winner_display_name)
+    
+    win_chance = (winner_ticket_count / total_tickets * 100) if total_tickets > 0 else 0
+    
+    # Вычисляем общую стоимость всех билетов и бонус для отображения
+    total_base_prize = total_tickets * 100  # Все билеты всех участников
+    bonus = prize_pool - total_base_prize   # Дневной бонус
+    
+    # Сообщения для победителя и остальных участников
+    winner_message = (
+        f"🎉 <b>ПОЗДРАВЛЯЕМ! ВЫ ВЫИГРАЛИ!</b> 🎉\n\n"
+        f"🏆 Вы стали победителем лотереи!\n"
+        f"🎫 У вас было {winner_ticket_count} билетов из {total_tickets}\n"
+        f"📈 Ваш шанс на выигрыш был {win_chance:.1f}%\n\n"
+        f"💰 <b>ПОЛНЫЙ ПРИЗОВОЙ ФОНД: {prize_pool:,} Дань 🪙</b>\n"
+        f"├ 🎫 За ВСЕ билеты всех участников: {total_base_prize:,} Дань 🪙\n"
+        f"└ 🎁 Дневной бонус: {bonus:,} Дань 🪙\n\n"
+        f"🎊 ВЫ ЗАБИРАЕТЕ ВСЁ! Деньги уже начислены на ваш баланс!\n"
+        f"🎫 Новая лотерея начинается завтра!"
+    )
+    
+    other_message = (
+        f"🎲 <b>РЕЗУЛЬТАТЫ ЛОТЕРЕИ</b> 🎲\n\n"
+        f"🏆 <b>Победитель:</b> {winner_display}\n"
+        f"🎫 <b>Билетов у победителя:</b> {winner_ticket_count} из {total_tickets}\n"
+        f"📈 <b>Шанс на выигрыш был:</b> {win_chance:.1f}%\n\n"
+        f"💰 <b>ПОЛНЫЙ ПРИЗОВОЙ ФОНД: {prize_pool:,} Дань 🪙</b>\n"
+        f"├ 🎫 За ВСЕ билеты всех участников: {total_base_prize:,} Дань 🪙\n"
+        f"└ 🎁 Дневной бонус: {bonus:,} Дань 🪙\n\n"
+        f"😔 В этот раз не повезло, но не расстраивайтесь!\n"
+        f"👑 Победитель забрал ВЕСЬ призовой фонд!\n"
+        f"🎫 Новая лотерея начинается завтра!"
+    )
+    
+    # Рассылаем участникам сегодняшнего розыгрыша (победителю — отдельный текст)
+    today_kyiv = datetime.datetime.now(scheduler.KYIV_TZ).date().isoformat()
+    await broadcast.start(
+        "text",
+        {"text": other_message, "parse_mode": "HTML", "personal": {str(winner_user_id): winner_message}},
+        audience="lottery", audience_arg=today_kyiv, title="Результаты лотереи",
+    )
+
+
+async def send_missed_lottery_notification(prize_pool):
+    """Отправляет уведомление всем пользователям о пропущенной лотерее с высоким бонусом"""
+    missed_message = (
+        f"� <b>НЕВЕРОЯТНАЯ УПУЩЕННАЯ ВОЗМОЖНОСТЬ!</b> �\n\n"
+        f"🎰 Сегодня в лотерее не было участников!\n"
+        f"💸 Упущенный МЕГА-БОНУС составил: <b>{prize_pool:,} Дань 🪙</b>\n\n"
+        f"⚡ Это был РЕДКИЙ высокий бонус!\n"
+        f"� Шанс такого большого приза выпадает очень редко!\n\n"
+        f"😭 А ведь ты мог поставить всего 100 Дань 🪙\n"
+        f"🏆 И забрать целых {prize_pool:,} Дань 🪙!\n\n"
+        f"🔥 Такие суммы бывают крайне редко!\n"
+        f"🎫 Не упусти следующий шанс!\n"
+        f"📝 Купи билет командой: /ticket"
+    )
+    
+    try:
+        await broadcast.start("text", {"text": missed_message, "parse_mode": "HTML"}, title="Упущенная лотерея")
+    except Exception as e:
+        print(f"❌ Ошибка при отправке уведомлений о пропущенной лотерее: {e}")
+
+
+def get_lottery_history_for_date(date_str: str):
+    """Возвращает историю лотереи для даты: запись розыгрыша, агрегированные билеты и последние покупки.
+
+    Возвращает кортеж: (draw_row_or_None, aggregated_list, recent_tickets_list)
+    - draw_row_or_None: (draw_date, winner_user_id, winner_username, total_tickets, prize_amount, draw_time, status) или None
+    - aggregated_list: [(user_id, username, ticket_count), ...] отсортирован по ticket_count desc
+    - recent_tickets_list: [(user_id, username, purchase_date), ...] (последние 100 записей по времени)
+    """
+    from main import MESSAGES_DB_FILE_FILE
+    try:
+        import datetime
+        conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT draw_date, winner_user_id, winner_username, total_tickets, prize_amount, draw_time, status
+            FROM lottery_draws WHERE draw_date = ?
+        ''', (date_str,))
+        draw_row = cursor.fetchone()
+
+        cursor.execute('''
+            SELECT user_id, username, COUNT(*) as cnt
+            FROM lottery_tickets
+            WHERE draw_date = ?
+            GROUP BY user_id, username
+            ORDER BY cnt DESC
+            LIMIT 50
+        ''', (date_str,))
+        agg = cursor.fetchall()
+
+        cursor.execute('''
+            SELECT user_id, username, purchase_date
+            FROM lottery_tickets
+            WHERE draw_date = ?
+            ORDER BY purchase_date DESC
+            LIMIT 100
+        ''', (date_str,))
+        recent = cursor.fetchall()
+
+        conn.close()
+        return draw_row, agg, recent
+    except Exception as e:
+        print(f"❌ Ошибка получения истории лотереи для {date_str}: {e}")
+        return None, [], []
+
+
+@texts.on(Command("lottery_history"))
+async def cmd_lottery_history(message: types.Message):
+    """Показывает историю лотереи за сегодня (розыгрыш + билеты).
+
+    Команда удобна для администрации — показывает агрегированную информацию и последние покупки.
+    """
+    from main import bot
+    # Для безопасности ограничим показ владельцем бота — если нужно, можно снять проверку
+    try:
+        owner_id = getattr(bot, 'owner_id', None)
+    except Exception:
+        owner_id = None
+
+    # Если задан owner_id, разрешаем только ему, иначе показываем всем (на ваше усмотрение)
+    if owner_id and message.from_user and message.from_user.id != owner_id:
+        await message.reply("❌ Доступно только владельцу бота.")
+        return
+
+    import datetime
+    import pytz
+    
+    # Используем киевское время
+    kyiv_tz = pytz.timezone('Europe/Kiev')
+    now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+    date_str = now_kyiv.date().isoformat()
+    
+    draw_row, agg, recent = get_lottery_history_for_date(date_str)
+
+    lines = [f"📜 История лотереи за {date_str}"]
+    if draw_row:
+        dd, winner_id, winner_username, total_tickets, prize_amount, draw_time, status = draw_row
+        lines.append(f"🏆 Розыгрыш: статус={status}, победитель={winner_username or winner_id}, билетов={total_tickets}, приз={prize_amount}")
+    else:
+        lines.append("ℹ️ Розыгрыш на эту дату отсутствует в БД.")
+
+    lines.append("")
+    lines.append("🔎 Топ участников (аггрегировано по билетам):")
+    if not agg:
+        lines.append("— Нет купленных билетов —")
+    else:
+        for user_id, username, cnt in agg:
+            uname = username or f"User_{user_id}"
+            lines.append(f"{uname} ({user_id}) — {cnt} билет(ов)")
+
+    lines.append("")
+    lines.append("🕘 Последние покупки (до 100):")
+    if not recent:
+        lines.append("— Нет записей о покупках —")
+    else:
+        for user_id, username, purchase_date in recent[:20]:
+            uname = username or f"User_{user_id}"
+            lines.append(f"{purchase_date} — {uname} ({user_id})")
+
+    text = "\n".join(lines)
+    # Если сообщение слишком длинное, отправляем как файл
+    if len(text) > 4000:
+        import tempfile, os
+        try:
+            tmp = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+            tmp.write(text.encode('utf-8'))
+            tmp_path = tmp.name
+            tmp.close()
+            try:
+                await message.answer_document(FSInputFile(tmp_path))
+            except Exception:
+                await message.reply("❌ Не удалось отправить файл с историей лотереи.")
+        finally:
+            try:
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            except Exception:
+                pass
+    else:
+        await message.reply(text)
+
+
+# --- Лотерейные помощники (глобальные) ---
+def build_lottery_keyboard(owner_id: int):
+    cnt = get_user_tickets_count(owner_id)
+    if cnt >= 10:
+        return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ ЗАКРЫТЬ", callback_data=f"close_menu:{owner_id}")]])
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🎫 КУПИТЬ БИЛЕТ", callback_data=f"buy_ticket:{owner_id}"), InlineKeyboardButton(text="🧺 ДОКУПИТЬ ДО 10", callback_data=f"buy_to_10:{owner_id}")],
+        [InlineKeyboardButton(text="❌ ЗАКРЫТЬ", callback_data=f"close_menu:{owner_id}")]
+    ])
+
+
+def render_lottery_text(owner_id: int, status_msg: str | None = None):
+    total_tickets_sold, total_tickets_value = get_total_tickets_info()
+    user_tickets_count = get_user_tickets_count(owner_id)
+    win_chance = (user_tickets_count / total_tickets_sold * 100) if total_tickets_sold > 0 else 0
+    user = db.get_user(owner_id)
+    dan_balance = float(user.get("dan", 0)) if user else 0
+    spent_today = user_tickets_count * 100
+    balance_text = f"💰 Ваш баланс: {dan_balance:,.0f} дань (-{spent_today} дань потрачено сегодня)" if spent_today > 0 else f"💰 Ваш баланс: {dan_balance:,.0f} дань"
+    preview_bonus = get_daily_lottery_bonus()
+    status_block = f"✅ {status_msg}\n\n" if status_msg else ""
+    text = (
+        f"🎫 <b>ЛОТЕРЕЯ KRUZCHAT</b> 🎫\n\n"
+        f"{status_block}"
+        f"📊 <b>Статистика:</b>\n"
+        f"🎟️ Сейчас куплено {total_tickets_sold} билетов, на {total_tickets_value:,.0f} дань\n\n"
+        f"🎯 <b>Ваши шансы:</b>\n"
+        f"📈 Шанс на выигрыш {win_chance:.1f}%\n"
+        f"🎫 У вас {user_tickets_count} билетов (максимум 10)\n"
+        f"🎁 Сегодня бонус +{preview_bonus:,} дань к призовому фонду!\n"
+        f"{balance_text}\n\n"
+        f"💰 <b>Условия:</b>\n"
+        f"💵 Цена 1 билета: 100 дань\n"
+        f"🕛 Ровно в 21:00 рандомно будет выбран победитель\n"
+        f"🏆 Победитель получает ВСЕ!"
+    )
+    keyboard = build_lottery_keyboard(owner_id)
+    return text, keyboard
+
+
+# Универсальная функция для проверки устаревших callback'ов
+async def check_callback_validity(callback):
+    """
+    Проверяет, не устарел ли callback.
+    Возвращает True если callback действителен, False если устарел.
+    """
+    try:
+        await callback.answer()
+        return True
+    except Exception as e:
+        error_msg = str(e).lower()
+        if "query is too old" in error_msg or "query id is invalid" in error_msg:
+            print(f"Устаревший callback: {e}")
+            return False
+        # Если другая ошибка, считаем что callback действителен
+        return True
+
+
+@texts.on(Command("ticket"))
+async def ticket_handler(message: types.Message):
+    """Обработчик команды /ticket - система лотереи"""
+    from main import safe_ensure_user
+    if not getattr(message, 'from_user', None):
+        return
+    
+    user_id = message.from_user.id
+    username = getattr(message.from_user, 'username', None) or "NoUsername"
+    
+    # Обеспечиваем пользователя в базе данных
+    safe_ensure_user(user_id, username)
+    
+    # Получаем статистику билетов
+    total_tickets_sold, total_tickets_value = get_total_tickets_info()
+    user_tickets_count = get_user_tickets_count(user_id)
+    
+    # Получаем баланс пользователя
+    user = db.get_user(user_id)
+    dan_balance = float(user.get("dan", 0)) if user else 0
+    
+    # Вычисляем сколько дань потрачено на билеты сегодня
+    spent_today = user_tickets_count * 100
+    
+    # Форматируем строку баланса
+    if spent_today > 0:
+        balance_text = f"💰 Ваш баланс: {dan_balance:,.0f} дань (-{spent_today} дань потрачено сегодня)"
+    else:
+        balance_text = f"💰 Ваш баланс: {dan_balance:,.0f} дань"
+    
+    # Вычисляем шанс на выигрыш
+    win_chance = (user_tickets_count / total_tickets_sold * 100) if total_tickets_sold > 0 else 0
+    
+    # Получаем статичный дневной бонус
+    preview_bonus = get_daily_lottery_bonus()
+    
+    text = (
+        f"🎫 ЛОТЕРЕЯ 🎫\n\n"
+        f"📊 Статистика:\n"
+        f"🎟️ Сейчас куплено {total_tickets_sold} билетов, на {total_tickets_value:,.0f} дань\n\n"
+        f"🎯 <b>Ваши шансы:</b>\n"
+        f"📈 Шанс на выигрыш {win_chance:.1f}%\n"
+        f"🎫 У вас {user_tickets_count} билетов (максимум 10)\n"
+        f"🎁 Сегодня бонус +{preview_bonus:,} дань к ОБЩЕМУ призовому фонду!\n"
+        f"{balance_text}\n\n"
+        f"💰 Условия:\n"
+        f"💵 Цена 1 билета: 100 дань\n"
+        f"🕛 Ровно в 21:00 рандомно будет выбран победитель\n"
+        f"🏆 Победитель получает ВСЕ деньги от билетов + бонус!"
+    )
+    
+    # Построение текста/клавиатуры через глобальные helper-и
+    text, keyboard = render_lottery_text(user_id)
+    
+    await message.answer(text, reply_markup=keyboard, parse_mode='HTML')
+
+
+# Текстовые обработчики для лотереи
+@texts.exact("билет", "билеты", "ticket")
+async def text_ticket_handler(message: types.Message):
+    """Обработчик текстового сообщения 'билет', 'билеты' или 'ticket'"""
+    await ticket_handler(message)
+
+
+@texts.exact("лотерея", "лотерейя", "lottery")
+async def text_lottery_handler(message: types.Message):
+    """Обработчик текстового сообщения 'лотерея' или 'lottery'"""
+    await ticket_handler(message)
+
+
+@callbacks.on("buy_ticket:*")
+async def buy_ticket_callback(callback: types.CallbackQuery):
+    """Обработчик покупки билета"""
+    from main import safe_edit_message
+    if not callback.from_user:
+        return
+    
+    # Проверяем на устаревший callback
+    if not await check_callback_validity(callback):
+        return
+    
+    parts = callback.data.split(":")
+    owner_user_id = int(parts[1])
+    
+    # Проверяем права доступа
+    if callback.from_user.id != owner_user_id:
+        try:
+            await callback.answer("❌ Это не ваше меню!", show_alert=True)
+        except Exception:
+            pass
+        return
+    
+    username = getattr(callback.from_user, 'username', None) or f"User_{owner_user_id}"
+    success, message = await db_async.run(buy_lottery_ticket, owner_user_id, username)
+    
+    if success:
+        # Обновляем информацию и показываем обновленное меню
+        total_tickets_sold, total_tickets_value = await db_async.run(get_total_tickets_info)
+        user_tickets_count = await db_async.run(get_user_tickets_count, owner_user_id)
+        win_chance = (user_tickets_count / total_tickets_sold * 100) if total_tickets_sold > 0 else 0
+        
+        # Получаем обновленный баланс пользователя
+        user = await db_async.db.get_user(owner_user_id)
+        dan_balance = float(user.get("dan", 0)) if user else 0
+        
+        # Вычисляем сколько дань потрачено на билеты сегодня
+        spent_today = user_tickets_count * 100
+        
+        # Форматируем строку баланса
+        if spent_today > 0:
+            balance_text = f"💰 Ваш баланс: {dan_balance:,.0f} дань (-{spent_today} дань потрачено сегодня)"
+        else:
+            balance_text = f"💰 Ваш баланс: {dan_balance:,.0f} дань"
+        
+        # Получаем статичный дневной бонус
+        preview_bonus = await db_async.run(get_daily_lottery_bonus)
+        
+        text = (
+            f"🎫 <b>ЛОТЕРЕЯ KRUZCHAT</b> 🎫\n\n"
+            f"✅ {message}\n\n"
+            f"📊 <b>Статистика:</b>\n"
+            f"🎟️ Сейчас куплено {total_tickets_sold} билетов, на {total_tickets_value:,.0f} дань\n\n"
+            f"🎯 <b>Ваши шансы:</b>\n"
+            f"📈 Шанс на выигрыш {win_chance:.1f}%\n"
+            f"🎫 У вас {user_tickets_count} билетов (максимум 10)\n"
+            f"🎁 Сегодня бонус +{preview_bonus:,} дань к призовому фонду!\n"
+            f"{balance_text}\n\n"
+            f"💰 <b>Условия:</b>\n"
+            f"💵 Цена 1 билета: 100 дань\n"
+            f"🕛 Ровно в 21:00 рандомно будет выбран победитель\n"
+            f"🏆 Победитель получает ВСЕ!"
+        )
+        
+        # Показываем кнопки в зависимости от текущего количества билетов у пользователя
+        if user_tickets_count >= 10:
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ ЗАКРЫТЬ", callback_data=f"close_menu:{owner_user_id}")]])
+            print(f"[LOTTERY] buy_ticket: user {owner_user_id} now has {user_tickets_count} tickets -> showing only CLOSE")
+        else:
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🎫 КУПИТЬ БИЛЕТ", callback_data=f"buy_ticket:{owner_user_id}"), InlineKeyboardButton(text="🧺 ДОКУПИТЬ ДО 10", callback_data=f"buy_to_10:{owner_user_id}")],[InlineKeyboardButton(text="❌ ЗАКРЫТЬ", callback_data=f"close_menu:{owner_user_id}")]])
+            print(f"[LOTTERY] buy_ticket: user {owner_user_id} now has {user_tickets_count} tickets -> showing BUY and BUY_TO_10")
+        
+        edit_success = await safe_edit_message(callback, text, keyboard, parse_mode='HTML')
+        if edit_success:
+            try:
+                await callback.answer("🎫 Билет куплен!")
+            except Exception:
+                print("Не удалось отправить уведомление о покупке билета")
+            # Попробуем явно обновить клавиатуру через edit_reply_markup — это надежно для медиа-сообщений
+            try:
+                if getattr(callback, 'message', None):
+                    await callback.message.edit_reply_markup(reply_markup=keyboard)
+            except Exception as e:
+                # Игнорируем: safe_edit_message уже пытался редактировать
+                print(f"⚠️ Не удалось обновить reply_markup напрямую: {e}")
+    else:
+        try:
+            await callback.answer(f"❌ {message}", show_alert=True)
+        except Exception:
+            print(f"Не удалось показать ошибку: {message}")
+
+
+@callbacks.on("close_menu:*")
+async def close_menu_callback(callback: types.CallbackQuery):
+    """Обработчик кнопки закрытия меню"""
+    if not callback.from_user:
+        return
+    
+    # Проверяем на устаревший callback
+    if not await check_callback_validity(callback):
+        return
+    
+    parts = callback.data.split(":")
+    owner_user_id = int(parts[1])
+    
+    # Проверяем права доступа
+    if callback.from_user.id != owner_user_id:
+        try:
+            await callback.answer("❌ Это не ваше меню!", show_alert=True)
+        except Exception:
+            pass
+        return
+    
+    # Удаляем сообщение
+    try:
+        await callback.message.delete()
+        await callback.answer("Меню закрыто")
+    except Exception:
+        try:
+            await callback.answer("Меню закрыто")
+        except Exception:
+            print("Не удалось ответить на callback при закрытии меню")
+
+
+@callbacks.on("buy_to_10:*")
+async def buy_to_10_callback(callback: types.CallbackQuery):
+    """Докупить билеты до 10 шт. (сколько не хватает)"""
+    from main import safe_edit_message
+    if not callback.from_user:
+        return
+
+    # Проверяем на устаревший callback
+    if not await check_callback_validity(callback):
+        return
+
+    parts = callback.data.split(":")
+    owner_user_id = int(parts[1])
+
+    # Проверяем права доступа
+    if callback.from_user.id != owner_user_id:
+        try:
+            await callback.answer("❌ Это не ваше меню!", show_alert=True)
+        except Exception:
+            pass
+        return
+
+    # Сколько у пользователя уже есть
+    user_tickets_count = await db_async.run(get_user_tickets_count, owner_user_id)
+    print(f"[LOTTERY] buy_to_10 called by {owner_user_id}, current tickets={user_tickets_count}")
+    if user_tickets_count >= 10:
+        try:
+            await callback.answer("У вас уже 10 билетов", show_alert=True)
+        except Exception:
+            pass
+        return
+
+    needed = 10 - user_tickets_count
+
+    # Даем быстрый ответ, чтобы пользователь видел реакцию
+    try:
+        await callback.answer("Пробую докупить билеты...", show_alert=False)
+    except Exception:
+        pass
+
+    # Пытаемся купить needed билетов по одному (reuse buy_lottery_ticket logic)
+    username = getattr(callback.from_user, 'username', None) or f"User_{owner_user_id}"
+    bought = 0
+    msg_err = None
+    for _ in range(needed):
+        success, message = await db_async.run(buy_lottery_ticket, owner_user_id, username)
+        if success:
+            bought += 1
+        else:
+            msg_err = message
+            break
+    print(f"[LOTTERY] buy_to_10 result for {owner_user_id}: bought={bought}, err={msg_err}")
+    print(f"[LOTTERY] buy_to_10 result for {owner_user_id}: bought={bought}, err={msg_err}")
+
+    # Обновляем меню — повторяем тот же код что и в buy_ticket_callback (обновление текста/кнопок)
+    total_tickets_sold, total_tickets_value = await db_async.run(get_total_tickets_info)
+    user_tickets_count = await db_async.run(get_user_tickets_count, owner_user_id)
+    win_chance = (user_tickets_count / total_tickets_sold * 100) if total_tickets_sold > 0 else 0
+    user = await db_async.db.get_user(owner_user_id)
+    dan_balance = float(user.get("dan", 0)) if user else 0
+    spent_today = user_tickets_count * 100
+    balance_text = f"💰 Ваш баланс: {dan_balance:,.0f} дань (-{spent_today} дань потрачено сегодня)" if spent_today > 0 else f"💰 Ваш баланс: {dan_balance:,.0f} дань"
+    preview_bonus = await db_async.run(get_daily_lottery_bonus)
+
+    # Формируем текст корректно — если что-то куплено, добавляем статус в начало
+    status_block = f"✅ Куплено: {bought} билетов\n\n" if bought > 0 else ""
+    text = (
+        f"🎫 <b>ЛОТЕРЕЯ KRUZCHAT</b> 🎫\n\n"
+        f"{status_block}"
+        f"📊 <b>Статистика:</b>\n"
+        f"🎟️ Сейчас куплено {total_tickets_sold} билетов, на {total_tickets_value:,.0f} дань\n\n"
+        f"🎯 <b>Ваши шансы:</b>\n"
+        f"📈 Шанс на выигрыш {win_chance:.1f}%\n"
+        f"🎫 У вас {user_tickets_count} билетов (максимум 10)\n"
+        f"🎁 Сегодня бонус +{preview_bonus:,} дань к призовому фонду!\n"
+        f"{balance_text}\n\n"
+        f"💰 <b>Условия:</b>\n"
+        f"💵 Цена 1 билета: 100 дань\n"
+        f"🕛 Ровно в 21:00 рандомно будет выбран победитель\n"
+        f"🏆 Победитель получает ВСЕ!"
+    )
+
+    # Кнопки: если уже 10 — только закрыть, иначе две кнопки (купить 1 и докупить до 10)
+    if user_tickets_count >= 10:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="❌ ЗАКРЫТЬ", callback_data=f"close_menu:{owner_user_id}")]])
+    else:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🎫 КУПИТЬ БИЛЕТ", callback_data=f"buy_ticket:{owner_user_id}"), InlineKeyboardButton(text="🧺 ДОКУПИТЬ ДО 10", callback_data=f"buy_to_10:{owner_user_id}")],
+            [InlineKeyboardButton(text="❌ ЗАКРЫТЬ", callback_data=f"close_menu:{owner_user_id}")]
+        ])
+
+    # Сначала попробуем обновить только reply_markup (не трогая текст) — это часто надежнее
+    try:
+        if getattr(callback, 'message', None):
+            await callback.message.edit_reply_markup(reply_markup=keyboard)
+    except Exception as e:
+        # Если не получилось (например, сообщение с медиа), пробуем полное редактирование
+        try:
+            # Обновляем меню
+            await safe_edit_message(callback, text, keyboard, parse_mode='HTML')
+        except Exception as e2:
+            print(f"❌ Ошибка при обновлении меню лотереи: {e2}")
+    else:
+        # Если reply_markup обновился — попробуем обновить текст через safe_edit_message, но не критично
+        try:
+            await safe_edit_message(callback, text, keyboard, parse_mode='HTML')
+        except Exception:
+            pass
+    try:
+        if bought > 0:
+            await callback.answer(f"Куплено {bought} билетов")
+        elif msg_err:
+            await callback.answer(f"{msg_err}", show_alert=True)
+    except Exception:
+        pass
+
+
+@texts.on(Command("test_lottery"))
+async def test_lottery_handler(message: types.Message):
+    """Закрытие текущей лотереи с розыгрышем и отправкой результатов в ЛС (доступно всем участникам)"""
+    if not getattr(message, 'from_user', None):
+        return
+    
+    user_id = message.from_user.id
+    username = getattr(message.from_user, 'username', None) or f"User_{user_id}"
+    
+    await message.answer("🎲 Проводим тестовый розыгрыш лотереи...")
+    
+    try:
+        # Проводим розыгрыш
+        winner_info, total_tickets, prize_pool = await db_async.run(conduct_lottery_draw)
+        
+        if winner_info:
+            winner_user_id, winner_username, winner_ticket_count = winner_info
+            
+            result_text = (
+                f"✅ Розыгрыш лотереи завершен!\n\n"
+                f"🏆 Победитель: @{winner_username} (ID: {winner_user_id})\n"
+                f"🎫 Билетов у победителя: {winner_ticket_count} из {total_tickets}\n"
+                f"💰 Выигрыш: {prize_pool:,} дань\n\n"
+                f"� Результаты отправлены всем участникам в ЛС\n"
+                f"🔒 Все билеты помечены как разыгранные"
+            )
+            
+            # Отправляем результаты участникам в ЛС
+            await send_lottery_results(winner_info, total_tickets, prize_pool)
+            
+        elif winner_info == "no_participants_high_prize":
+            # Случай высокого бонуса без участников
+            result_text = (
+                f"😱 Тестовый розыгрыш завершен!\n\n"
+                f"❌ Участников не было\n" 
+                f"💸 Упущенный бонус: {prize_pool:,} дань\n\n"
+                f"📢 Всем пользователям отправлены уведомления о пропущенной возможности!"
+            )
+            
+            # Отправляем уведомления всем пользователям
+            await send_missed_lottery_notification(prize_pool)
+            
+        else:
+            pass  # Нет участников, просто завершаем
+        
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при тестировании: {e}")
+
+
+@texts.exact("итоги лотереи", "провести розыгрыш", "лотерея конец")
+async def admin_lottery_draw_command(message: types.Message):
+    """Админская команда для принудительного проведения розыгрыша лотереи"""
+    from main import ADMIN_ID
+    if not message.from_user:
+        return
+    
+    user_id = message.from_user.id
+    
+    # Проверяем права администратора
+    if user_id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды!")
+        return
+    
+    try:
+        await message.answer("🎲 Запускаю принудительный розыгрыш лотереи...")
+        
+        # Проводим розыгрыш
+        winner_info, total_tickets, prize_pool = await db_async.run(conduct_lottery_draw)
+        
+        if winner_info:
+            winner_user_id, winner_username, winner_ticket_count = winner_info
+            
+            result_text = (
+                f"🎉 <b>ПРИНУДИТЕЛЬНЫЙ РОЗЫГРЫШ ЗАВЕРШЕН!</b> 🎉\n\n"
+                f"🏆 <b>Победитель:</b> {winner_username}\n"
+                f"🆔 <b>ID победителя:</b> {winner_user_id}\n"
+                f"🎫 <b>Билетов у победителя:</b> {winner_ticket_count} из {total_tickets}\n"
+                f"📈 <b>Шанс победителя:</b> {(winner_ticket_count / total_tickets * 100):.1f}%\n"
+                f"💰 <b>Размер выигрыша:</b> {prize_pool:,} дань\n\n"
+                f"✅ <b>Приз начислен на баланс победителя</b>\n"
+                f"📢 <b>Результаты отправлены всем участникам</b>"
+            )
+            
+            # Отправляем результаты участникам
+            await send_lottery_results(winner_info, total_tickets, prize_pool)
+            
+        else:
+            result_text = (
+                f"❌ <b>РОЗЫГРЫШ НЕ ПРОВЕДЕН</b>\n\n"
+                f"📋 Причина: Нет активных участников лотереи\n"
+                f"💡 Участники должны сначала купить билеты через команду 'лотерея'"
+            )
+        
+        await message.answer(result_text, parse_mode='HTML')
+        # После принудительного розыгрыша тоже сгенерируем бонус для следующего дня
+        try:
+            import pytz
+            kyiv_tz = pytz.timezone('Europe/Kiev')
+            now_utc = datetime.datetime.now(pytz.UTC)
+            now_kyiv = now_utc.astimezone(kyiv_tz)
+            tomorrow_kyiv = (now_kyiv + datetime.timedelta(days=1)).date()
+            next_bonus = generate_deterministic_lottery_bonus_for_date(tomorrow_kyiv)
+            set_stored_lottery_bonus_for_date(tomorrow_kyiv.isoformat(), next_bonus)
+            print(f"🔁 (manual) Бонус для {tomorrow_kyiv.isoformat()} сохранён: {next_bonus}")
+        except Exception as e:
+            print(f"⚠️ Ошибка при сохранении бонуса после принудительного розыгрыша: {e}")
+
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при проведении розыгрыша: {e}")
+
+
+@texts.exact("итоги лотереи", "результаты лотереи", "lottery results")
+async def lottery_results_command(message: types.Message):
+    """Показывает итоги последних розыгрышей лотереи"""
+    from main import MESSAGES_DB_FILE_FILE
+    if not message.from_user:
+        return
+    
+    try:
+        conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+        cursor = conn.cursor()
+        
+        # Получаем последние 5 розыгрышей
+        cursor.execute('''
+            SELECT draw_date, winner_user_id, winner_username, total_tickets, prize_amount
+            FROM lottery_draws 
+            ORDER BY draw_date DESC 
+            LIMIT 5
+        ''')
+        
+        draws = cursor.fetchall()
+        
+        if not draws:
+            await message.answer("📊 Пока не было проведено ни одного розыгрыша лотереи.")
+            conn.close()
+            return
+        
+        # Форматируем результаты
+        results_text = "🏆 <b>ИТОГИ ПОСЛЕДНИХ РОЗЫГРЫШЕЙ ЛОТЕРЕИ</b> 🏆\n\n"
+        
+        for i, (draw_date, winner_id, winner_name, total_tickets, prize_amount) in enumerate(draws, 1):
+            # Форматируем дату
+            try:
+                date_obj = datetime.datetime.strptime(draw_date, '%Y-%m-%d')
+                formatted_date = date_obj.strftime('%d.%m.%Y')
+            except:
+                formatted_date = draw_date
+            
+            results_text += f"<b>{i}. {formatted_date}</b>\n"
+            results_text += f"🏆 Победитель: {winner_name or f'User_{winner_id}'}\n"
+            results_text += f"🎫 Билетов участвовало: {total_tickets}\n"
+            results_text += f"💰 Выигрыш: {prize_amount:,} дань\n\n"
+        
+        # Получаем статистику участников за сегодня
+        import pytz
+        kyiv_tz = pytz.timezone('Europe/Kiev')
+        now_kyiv = datetime.datetime.now(pytz.UTC).astimezone(kyiv_tz)
+        today_kyiv = now_kyiv.date().isoformat()
+        
+        cursor.execute('''
+            SELECT COUNT(DISTINCT user_id) as participants, COUNT(*) as tickets
+            FROM lottery_tickets 
+            WHERE draw_date = ? AND status = 'active'
+        ''', (today_kyiv,))
+        
+        today_stats = cursor.fetchone()
+        participants_today = today_stats[0] if today_stats else 0
+        tickets_today = today_stats[1] if today_stats else 0
+        
+        results_text += "📅 <b>СЕГОДНЯШНЯЯ ЛОТЕРЕЯ</b>\n"
+        results_text += f"👥 Участников: {participants_today}\n"
+        results_text += f"🎫 Билетов продано: {tickets_today}\n"
+        results_text += f"💰 Призовой фонд: {tickets_today * 100:,} дань\n"
+        results_text += f"🕚 Розыгрыш: сегодня в 21:00 по Киеву\n\n"
+        
+        results_text += "💡 Чтобы участвовать, напишите <b>лотерея</b>"
+        
+        conn.close()
+        await message.answer(results_text, parse_mode='HTML')
+        
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при получении итогов: {e}")
+
+
+# Планировщик задач для лотереи (задачи scheduler.py, без отдельных потоков)
+
+
+class LotteryScheduler:
+    # Розыгрыш в 21:00 по Киеву, резервная проверка пропущенного розыгрыша раз в час
+    DRAW_HOUR = 21
+    
+    def __init__(self):
+        self.is_running = False
+    
+    async def run_lottery_draw(self):
+        """Выполняет розыгрыш лотереи"""
+        from main import MESSAGES_DB_FILE_FILE
+        now_kyiv = datetime.datetime.now(scheduler.KYIV_TZ)
+        
+        # Проверяем, что розыгрыш запускается в правильное время (21:00-21:10)
+        current_hour = now_kyiv.hour
+        current_minute = now_kyiv.minute
+        
+        if current_hour == self.DRAW_HOUR and current_minute <= 10:
+            pass  # Время подходит
+        elif current_hour > self.DRAW_HOUR or (current_hour == self.DRAW_HOUR and current_minute > 10):
+            # Проверяем, не был ли розыгрыш сегодня
+            today_iso = now_kyiv.date().isoformat()
+            conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+            cursor = conn.cursor()
+            cursor.execute('SELECT status FROM lottery_draws WHERE draw_date = ?', (today_iso,))
+            row = cursor.fetchone()
+            conn.close()
+            if row:
+                print(f"✅ Розыгрыш за {today_iso} в порядке")
+                return
+        else:
+            # Слишком рано - пропущенный розыгрыш подхватит часовая проверка
+            return
+        
+        try:
+            winner_info, total_tickets, prize_pool = await db_async.run(conduct_lottery_draw)
+            
+            if winner_info == "no_participants_high_prize":
+                await send_missed_lottery_notification(prize_pool)
+            elif winner_info:
+                await send_lottery_results(winner_info, total_tickets, prize_pool)
+            
+            # Очищаем старые билеты
+            await db_async.run(cleanup_old_tickets)
+            
+        except Exception as e:
+            print(f"❌ Ошибка розыгрыша: {e}")
+        
+        # Генерация бонуса для следующего дня
+        try:
+            now_kyiv = datetime.datetime.now(scheduler.KYIV_TZ)
+            tomorrow_kyiv = (now_kyiv + datetime.timedelta(days=1)).date()
+            next_bonus = generate_deterministic_lottery_bonus_for_date(tomorrow_kyiv)
+            set_stored_lottery_bonus_for_date(tomorrow_kyiv.isoformat(), next_bonus)
+        except Exception:
+            pass
+    
+    async def check_missed_lottery(self):
+        """Проверяет, не был ли пропущен розыгрыш за сегодня"""
+        from main import MESSAGES_DB_FILE_FILE
+        now_kyiv = datetime.datetime.now(scheduler.KYIV_TZ)
+        
+        # Проверяем только если уже после 21:00
+        if now_kyiv.hour >= self.DRAW_HOUR:
+            today_iso = now_kyiv.date().isoformat()
+            
+            conn = sqlite_pool.connect(MESSAGES_DB_FILE_FILE)
+            cursor = conn.cursor()
+            
+            # Проверяем, есть ли активные билеты на сегодня
+            cursor.execute('''
+                SELECT COUNT(*) FROM lottery_tickets 
+                WHERE draw_date = ? AND status = 'active'
+            ''', (today_iso,))
+            active_tickets = cursor.fetchone()[0]
+            
+            # Проверяем, был ли розыгрыш
+            cursor.execute('SELECT status FROM lottery_draws WHERE draw_date = ?', (today_iso,))
+            draw_result = cursor.fetchone()
+            
+            conn.close()
+            
+            if active_tickets > 0 and not draw_result:
+                print(f"🚨 ОБНАРУЖЕН ПРОПУЩЕННЫЙ РОЗЫГРЫШ ЗА {today_iso}!")
+                print(f"📊 Активных билетов: {active_tickets}")
+                print(f"⚡ Запускаем экстренный розыгрыш...")
+                await self.run_lottery_draw()
+            else:
+                print(f"✅ Розыгрыш за {today_iso} в порядке")
+    
+    def start(self, loop=None):
+        """Регистрирует задачи лотереи в планировщике"""
+        if self.is_running:
+            return
+        self.is_running = True
+        scheduler.add_job("lottery_draw", self.run_lottery_draw,
+                          scheduler.Daily(self.DRAW_HOUR, 0, scheduler.KYIV_TZ), catch_up=False)
+        # Резервная проверка: при старте и раз в час
+        scheduler.add_job("lottery_check", self.check_missed_lottery, scheduler.Every(3600), run_at_start=True)
+    
+    def stop(self):
+        """Останавливает планировщик"""
+        self.is_running = False
+        scheduler.remove_job("lottery_draw")
+        scheduler.remove_job("lottery_check")
+        print("🛑 Планировщик лотереи остановлен")
+
+# Глобальный экземпляр планировщика
+lottery_scheduler = LotteryScheduler()
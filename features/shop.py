@@ -0,0 +1,857 @@
+"""
+Магазин: предметы за дань по категориям и покупка дани за звёзды Telegram
+(инвойс, pre_checkout_query, successful_payment).
+"""
+import os
+import random
+from aiogram import Router, types, F
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice, ContentType
+import database as db
+import tasks as _tasks
+import media_cache
+import render_cache
+from inv_py.shop import (
+    build_shop_main_menu, get_all_shop_items, get_item_by_slot,
+    render_category_image,
+    purchase_item, can_afford_item, SHOP_ITEMS,
+    get_category_items, build_shop_category_menu, SHOP_CATEGORIES
+)
+import routing
+
+
+router = Router(name="shop")
+callbacks = routing.CallbackRouter()
+router.callback_query.register(callbacks.dispatch, callbacks.filter)
+texts = routing.TextRouter()
+
+
+# --- МАГАЗИН ---
+# removed debug dump/check commands
+
+@callbacks.on("menu_shop*")
+async def menu_shop_callback(callback: types.CallbackQuery):
+    from main import ITEMS_CONFIG, bot, format_number_beautiful, safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    """Главное меню магазина"""
+    # краткий лог начала обработки (помогает отловить случаи, когда callback устарел)
+    try:
+        uid = callback.from_user.id if getattr(callback, 'from_user', None) else None
+    except Exception:
+        uid = None
+    # (debug logging removed)
+    user_id = callback.from_user.id
+
+    # Если в callback.data передан owner id (menu_shop:OWNER), проверяем владельца
+    try:
+        parts = (callback.data or "").split(":")
+        if len(parts) >= 2 and parts[1].isdigit():
+            owner_user_id = int(parts[1])
+            if owner_user_id != user_id:
+                try:
+                    await callback.answer("❌ Это не ваше место!", show_alert=True)
+                except Exception:
+                    pass
+                return
+    except Exception:
+        pass
+    
+    # Получаем баланс пользователя
+    user_row = db.get_user(user_id)
+    dan_balance = 0.0
+    kruz_balance = 0
+    if user_row:
+        try:
+            dan_balance = float(user_row.get("dan", 0))
+        except Exception:
+            dan_balance = 0.0
+        try:
+            kruz_balance = int(user_row.get("kruz", 0))
+        except Exception:
+            kruz_balance = 0
+    
+    dan_balance = 0.00 if abs(dan_balance) < 0.005 else round(dan_balance, 2)
+    
+    # Основная логика: предпочитаем графическое представление (image-grid). Если что-то ломается — откатываемся к тексту.
+    try:
+        await callback.answer()
+    except Exception:
+        pass
+
+    # Получаем данные для первой страницы
+    items, total, max_page = get_all_shop_items(page=1)
+    keyboard = build_shop_main_menu(page=1, max_page=max_page)
+
+    try:
+        from inv_py.shop import render_shop_grid
+        shop_image_path = render_shop_grid(page=1, font_path="C:/Windows/Fonts/arial.ttf")
+
+        caption = (
+            f"🛍️ <b>Магазин</b>\n\n"
+            f"💰 Ваш баланс:\n🪙 Дань: {format_number_beautiful(dan_balance)}\n"
+            f"⭐ Stars: {format_number_beautiful(kruz_balance)}\n\n"
+            f"Всего товаров: {total}\nСтраница 1 из {max_page}"
+        )
+
+        try:
+            await media_cache.edit_photo(
+                callback.message.edit_media, shop_image_path, caption=caption, parse_mode="HTML",
+                reply_markup=keyboard
+            )
+        except Exception:
+            # Если редактирование не получилось — отправляем новое фото и удаляем старое
+            try:
+                if getattr(callback, 'message', None) and getattr(callback.message, 'chat', None):
+                    chat_id = callback.message.chat.id
+                    try:
+                        await callback.message.delete()
+                    except Exception:
+                        pass
+                    await media_cache.send_photo(bot.send_photo, shop_image_path, chat_id=chat_id, caption=caption, reply_markup=keyboard, parse_mode="HTML")
+                else:
+                    # Отправляем лично
+                    await media_cache.send_photo(bot.send_photo, shop_image_path, chat_id=callback.from_user.id, caption=caption, reply_markup=keyboard, parse_mode="HTML")
+            except Exception:
+                try:
+                    await callback.answer("Магазин временно недоступен", show_alert=True)
+                except Exception:
+                    pass
+    except Exception:
+        # Фолбек: текстовое представление
+        caption_lines = [f"🛍️ <b>Магазин</b>", "", f"💰 Ваш баланс:", f"🪙 Дань: {format_number_beautiful(dan_balance)}", f"⭐ Stars: {format_number_beautiful(kruz_balance)}", ""]
+        try:
+            for idx, entry in enumerate(items, start=1):
+                iid = entry[0]
+                if iid and iid != 'empty':
+                    name = ITEMS_CONFIG.get(iid, {}).get('name', iid)
+                    caption_lines.append(f"[{idx}] {name}")
+                else:
+                    caption_lines.append(f"[{idx}] —")
+        except Exception:
+            pass
+
+        caption = "\n".join(caption_lines)
+        try:
+            success = await safe_edit_text_or_caption(callback.message, caption, reply_markup=keyboard, parse_mode="HTML")
+            if not success:
+                await callback.message.answer(caption, reply_markup=keyboard, parse_mode="HTML")
+        except Exception:
+            try:
+                await bot.send_message(callback.from_user.id, caption, reply_markup=keyboard, parse_mode="HTML")
+            except Exception:
+                try:
+                    await callback.answer("Не удалось открыть магазин", show_alert=True)
+                except Exception:
+                    pass
+
+
+# Обработчик для приватных кнопок магазина с проверкой владельца
+@callbacks.on("menu_shop:*")
+async def menu_shop_private_callback(callback: types.CallbackQuery):
+    """Обработчик приватных кнопок магазина с проверкой владельца"""
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    current_user_id = callback.from_user.id
+    username = callback.from_user.username or "unknown"
+    
+    # Проверяем, что кнопку нажал владелец меню
+    try:
+        _, owner_user_id = callback.data.split(":")
+        owner_user_id = int(owner_user_id)
+        print(f"DEBUG: menu_shop - user: @{username}, owner_id: {owner_user_id}, current_id: {current_user_id}")
+    except (ValueError, IndexError):
+        await callback.answer("❌ Ошибка данных кнопки", show_alert=True)
+        return
+    
+    if owner_user_id != callback.from_user.id:
+        print(f"DEBUG: BLOCKING SHOP ACCESS - owner: {owner_user_id}, current: {current_user_id}")
+        await callback.answer("❌ Это не ваше место!", show_alert=True)
+        return
+        await callback.answer("❌ Это не ваше место!", show_alert=True)
+        return
+    
+    # Вызываем основной обработчик магазина
+    await menu_shop_callback(callback)
+
+
+@callbacks.on("shop_main")
+async def shop_main_callback(callback: types.CallbackQuery):
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    """Возврат к главному меню магазина"""
+    await menu_shop_callback(callback)
+
+
+# Новый обработчик для навигации по страницам магазина
+@callbacks.on("shop_page:*")
+async def shop_page_callback(callback: types.CallbackQuery):
+    from main import bot, format_number_beautiful, safe_edit_text_or_caption
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    
+    try:
+        # Импортируем новую функцию рендера магазина
+        from inv_py.shop import render_shop_grid
+        
+        _, page = callback.data.split(":")
+        page = int(page)
+
+        # Получаем данные для страницы
+        items, total, max_page = get_all_shop_items(page=page)
+
+        # Используем новую функцию рендера, которая показывает сток и серым цветом товары с 0 шт
+        shop_image_path = render_shop_grid(page=page)
+        
+        # Кнопки используют функцию build_shop_main_menu
+        keyboard = build_shop_main_menu(page=page, max_page=max_page)
+        
+        # Получаем баланс пользователя для caption
+        user_id = callback.from_user.id
+        user_row = db.get_user(user_id)
+        dan_balance = 0.0
+        kruz_balance = 0
+        if user_row:
+            try:
+                dan_balance = float(user_row.get("dan", 0))
+            except Exception:
+                dan_balance = 0.0
+            try:
+                kruz_balance = int(user_row.get("kruz", 0))
+            except Exception:
+                kruz_balance = 0
+        
+        dan_balance = 0.00 if abs(dan_balance) < 0.005 else round(dan_balance, 2)
+        text = f"🛍️ <b>Магазин</b>\n\n💰 Ваш баланс:\n🪙 Дань: {format_number_beautiful(dan_balance)}\n⭐ Stars: {format_number_beautiful(kruz_balance)}\n\nВсего товаров: {total}\nСтраница {page} из {max_page}"
+        
+        try:
+            await media_cache.edit_photo(
+                callback.message.edit_media, shop_image_path, caption=text, parse_mode="HTML",
+                reply_markup=keyboard
+            )
+        except Exception as e:
+            # Fallback - отправляем новое сообщение
+            try:
+                chat_id = callback.message.chat.id
+                await callback.message.delete()
+                await media_cache.send_photo(
+                    bot.send_photo, shop_image_path,
+                    chat_id=chat_id,
+                    caption=text,
+                    reply_markup=keyboard,
+                    parse_mode="HTML"
+                )
+            except Exception:
+                pass
+        
+        try:
+            await callback.answer()
+        except Exception:
+            pass
+            
+    except Exception as e:
+        # Логируем трейсбек в файл для диагностики
+        # (exception logging removed)
+        try:
+            await callback.answer("Не удалось открыть магазин", show_alert=True)
+        except Exception:
+            pass
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_to_main_menu")]
+        ])
+        try:
+            await safe_edit_text_or_caption(callback.message, caption, reply_markup=kb, parse_mode="HTML")
+        except Exception:
+            try:
+                await callback.answer("Не удалось открыть магазин", show_alert=True)
+            except Exception:
+                pass
+    except ValueError:
+        await callback.answer("Ошибка в данных категории", show_alert=True)
+        return
+    # This handler deals with shop pages (grid). Category-specific handling
+    # is implemented in a different handler; ensure we don't fallthrough
+    # to code that expects `category_id` to be defined.
+    return
+
+    items, total, max_page = get_category_items(category_id, page)
+    
+    if not items or all(item[0] == "empty" for item in items):
+        await callback.answer("В этой категории пока нет товаров", show_alert=True)
+        return
+    
+    # Создаем текст с информацией о категории
+    from inv_py.shop import SHOP_CATEGORIES
+    category_name = SHOP_CATEGORIES.get(category_id, {}).get("name", "Неизвестная категория")
+    text = f"🛍️ {category_name}\n\nВсего товаров: {total}\nСтраница {page}/{max_page}"
+
+    kb = build_shop_category_menu(category_id, page, max_page)
+
+    # Попытаемся отрендерить изображение категории
+    try:
+        img_path = render_category_image(category_id, page, font_path="C:/Windows/Fonts/arial.ttf")
+    except Exception as e:
+        print(f"Ошибка рендера изображения категории: {e}")
+        img_path = None
+
+    try:
+        if img_path and os.path.exists(img_path):
+            # Попытка безопасно заменить media (если текущее сообщение — фото)
+            try:
+                await media_cache.edit_photo(callback.message.edit_media, img_path, caption=text, reply_markup=kb)
+            except Exception:
+                # Если не получилось отредактировать — отправляем новое фото и удаляем старое сообщение кнопками
+                try:
+                    await media_cache.send_photo(callback.message.answer_photo, img_path, caption=text, reply_markup=kb)
+                except Exception:
+                    await callback.answer("Не удалось загрузить категорию", show_alert=True)
+        else:
+            # Без изображения — используем безопасный текстовый редактор
+            try:
+                success = await safe_edit_text_or_caption(callback.message, text, reply_markup=kb)
+                if not success:
+                    await callback.message.edit_text(text, reply_markup=kb)
+            except Exception:
+                await callback.answer("Не удалось загрузить категорию", show_alert=True)
+    except Exception:
+        await callback.answer("Не удалось загрузить категорию", show_alert=True)
+
+
+@callbacks.on("shop_item:*")
+async def shop_item_callback(callback: types.CallbackQuery):
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    """Показ конкретного товара по слоту"""
+    try:
+        _, slot_num, page = callback.data.split(":")
+        slot_num = int(slot_num)
+        page = int(page)
+    except ValueError:
+        await callback.answer("Ошибка в данных товара", show_alert=True)
+        return
+    
+    # Получаем предмет по слоту
+    result = get_item_by_slot(slot_num, page)
+    
+    # Обрабатываем результат (может быть 2 или 3 элемента)
+    if len(result) == 3:
+        item_id, quantity, stock = result
+    else:
+        item_id, quantity = result[:2]
+        stock = -1  # По умолчанию неограничен
+    
+    if item_id == "empty":
+        await callback.answer("Этот слот пуст", show_alert=True)
+        return
+
+    # Получаем информацию о предмете
+    from inv_py.config_inventory import ITEMS_CONFIG
+    item_config = ITEMS_CONFIG.get(item_id, {})
+    
+    if not item_config:
+        await callback.answer("Информация о товаре не найдена", show_alert=True)
+        return
+
+    # Получаем информацию из shop_config - используем полученный stock
+    shop_info = SHOP_ITEMS.get(item_id, {})
+    actual_stock = stock if stock != -1 else shop_info.get('stock', -1)  # Приоритет stock из get_item_by_slot
+    price = shop_info.get('price', item_config.get('price', 0))
+    currency = shop_info.get('currency', item_config.get('currency', 'dan'))
+    
+    # Создаем карточку товара
+    name = item_config.get('name', f'Товар {item_id}')
+    
+    text = f"🛍️ <b>{name}</b>\n\n"
+    
+    # Цена и валюта
+    currency_symbol = "🪙" if currency == "dan" else "⭐"
+    text += f"💰 Цена: {price} {currency_symbol}\n"
+    
+    # Наличие товара
+    if actual_stock == -1:
+        text += f"📦 В наличии: ∞ (неограниченно)\n\n"
+        is_available = True
+    elif actual_stock > 0:
+        text += f"📦 В наличии: {actual_stock} шт.\n\n"
+        is_available = True
+    else:
+        text += f"❌ Товар закончился\n\n"
+        is_available = False
+    
+    # Добавляем описание для разных типов товаров
+    if 'reward_min' in item_config and 'reward_max' in item_config:
+        text += f"💰 Содержимое: {item_config['reward_min']}-{item_config['reward_max']} Дань\n"
+    
+    if item_config.get('duration_days_min') and item_config.get('duration_days_max'):
+        text += f"⏳ Длительность: {item_config['duration_days_min']}-{item_config['duration_days_max']} дней\n"
+    
+    # Проверяем систему покупки за звезды
+    stars_cost = item_config.get('stars_cost')
+    gold_setting = item_config.get('gold', 0)  # Если gold не указан, считаем как 0
+    
+    # Кнопки для покупки (показываем только если товар есть в наличии)
+    kb = []
+    if is_available:
+        # Основная кнопка покупки за обычную валюту
+        kb.append([InlineKeyboardButton(text=f"💰 Купить за {price} {currency_symbol}", callback_data=f"buy_item:{item_id}:{page}")])
+        
+        # Дополнительная кнопка покупки за звезды (если настройки позволяют)
+        if stars_cost and gold_setting != -1:
+            text += f"⭐ Также доступно за звезды: {stars_cost} звезд\n"
+            kb.append([InlineKeyboardButton(text=f"⭐ Купить за {stars_cost} звезд", callback_data=f"buy_stars:{item_id}:{page}")])
+    
+    # Кнопка "Назад" всегда присутствует
+    kb.append([InlineKeyboardButton(text="🔙 Назад к магазину", callback_data=f"shop_page:{page}")])
+    
+    # (hidden item marker removed)
+
+    # Показываем изображение товара если есть
+    displayed_message = getattr(callback, 'message', None)
+    try:
+        photo_path = item_config.get('photo_full') or item_config.get('photo_square')
+        if photo_path and os.path.exists(photo_path):
+            # Попробуем отредактировать текущее сообщение (обычный путь)
+            try:
+                await media_cache.edit_photo(callback.message.edit_media, photo_path, caption=text, parse_mode="HTML",
+                                             reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+            except Exception:
+                # Если не удалось отредактировать — отправляем новое сообщение и используем его
+                try:
+                    sent = await media_cache.send_photo(callback.message.answer_photo, photo_path, caption=text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="HTML")
+                    displayed_message = sent
+                except Exception:
+                    # Оставляем displayed_message как есть и продолжим
+                    pass
+        else:
+            # Пытаемся отредактировать текст в текущем сообщении
+            try:
+                await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="HTML")
+            except Exception:
+                # Если не получилось — отправим новое сообщение с текстом и используем его
+                try:
+                    sent = await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="HTML")
+                    displayed_message = sent
+                except Exception:
+                    pass
+    except Exception as e:
+        # Логируем ошибку отображения товара (ошибка важна)
+        print(f"Ошибка при показе товара: {e}")
+        # Fallback к тексту — пытаемся безопасно отредактировать, иначе отправить новое сообщение
+        try:
+            await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="HTML")
+        except Exception:
+            try:
+                sent = await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="HTML")
+                displayed_message = sent
+            except Exception:
+                pass
+    
+    try:
+        await callback.answer()
+    except Exception:
+        pass
+
+
+    # (no mapping persisted for displayed messages)
+
+@callbacks.on("buy_item:*")
+async def buy_item_callback(callback: types.CallbackQuery):
+    from main import format_number_beautiful
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    """Покупка товара"""
+    try:
+        _, item_id, page = callback.data.split(":")
+        quantity = 1  # Покупаем по 1 штуке
+        page = int(page)
+    except ValueError:
+        await callback.answer("Ошибка в данных покупки", show_alert=True)
+        return
+    
+    user_id = callback.from_user.id
+    
+    # Проверяем возможность покупки
+    can_buy, reason = can_afford_item(user_id, item_id, quantity)
+    if not can_buy:
+        await callback.answer(f"❌ {reason}", show_alert=True)
+        return
+    
+    # Совершаем покупку
+    success, message = purchase_item(user_id, item_id, quantity)
+    
+    if success:
+        # Получаем обновленный баланс
+        user_row = db.get_user(user_id)
+        dan_balance = 0.0
+        kruz_balance = 0
+        if user_row:
+            try:
+                dan_balance = float(user_row.get("dan", 0))
+            except Exception:
+                dan_balance = 0.0
+            try:
+                kruz_balance = int(user_row.get("kruz", 0))
+            except Exception:
+                kruz_balance = 0
+        
+        dan_balance = 0.00 if abs(dan_balance) < 0.005 else round(dan_balance, 2)
+        
+        # Добавляем информацию о балансе к сообщению о покупке
+        balance_info = f"\n\n💰 Ваш баланс:\n🪙 Дань: {format_number_beautiful(dan_balance)}\n⭐ Stars: {format_number_beautiful(kruz_balance)}"
+        full_message = message + balance_info
+        
+        await callback.answer(full_message, show_alert=True)
+        # Регистрируем прогресс задачи "Торговец" (покупки в магазине)
+        try:
+            import tasks as _tasks
+            _tasks.record_shop_purchase(user_id)
+        except Exception:
+            pass
+        
+        # Возвращаемся к главному меню магазина с обновленным балансом
+        new_callback = types.CallbackQuery(
+            id=callback.id,
+            from_user=callback.from_user,
+            message=callback.message,
+            data="menu_shop",
+            chat_instance=callback.chat_instance
+        )
+        await menu_shop_callback(new_callback)
+    else:
+        await callback.answer(f"❌ {message}", show_alert=True)
+
+
+# Обработчик покупки за звезды
+@callbacks.on("buy_stars:*")
+async def buy_stars_callback(callback: types.CallbackQuery):
+    from main import bot
+    if not getattr(callback, 'message', None) or not getattr(callback, 'from_user', None):
+        return
+    """Покупка товара за звезды Telegram"""
+    try:
+        _, item_id, page = callback.data.split(":")
+        page = int(page)
+    except ValueError:
+        await callback.answer("Ошибка в данных покупки", show_alert=True)
+        return
+    
+    user_id = callback.from_user.id
+    
+    # Получаем информацию о предмете
+    from inv_py.config_inventory import ITEMS_CONFIG
+    item_config = ITEMS_CONFIG.get(item_id, {})
+    
+    if not item_config:
+        await callback.answer("Товар не найден", show_alert=True)
+        return
+    
+    # Проверяем настройки звезд
+    stars_cost = item_config.get('stars_cost')
+    gold_setting = item_config.get('gold', 0)
+    
+    if not stars_cost or gold_setting == -1:
+        await callback.answer("Покупка за звезды недоступна для этого товара", show_alert=True)
+        return
+    
+    # Проверяем наличие товара
+    shop_info = SHOP_ITEMS.get(item_id, {})
+    stock = shop_info.get('stock', 999)
+    
+    if stock == 0:  # Только если точно закончился (stock = 0)
+        await callback.answer("❌ Товар закончился", show_alert=True)
+        return
+    
+    # Создаем счет для оплаты звездами
+    from aiogram.types import LabeledPrice
+    
+    item_name = item_config.get('name', f'Товар {item_id}')
+    
+    # Создаем инвойс для Telegram Stars
+    prices = [LabeledPrice(label=item_name, amount=stars_cost)]  # amount в звездах
+    
+    try:
+        await bot.send_invoice(
+            chat_id=callback.from_user.id,
+            title=f"Покупка: {item_name}",
+            description=f"Покупка {item_name} за {stars_cost} ⭐ Telegram Stars",
+            payload=f"shop_stars:{item_id}:1",  # item_id:quantity
+            provider_token="",  # Для Telegram Stars не нужен
+            currency="XTR",  # Telegram Stars currency
+            prices=prices,
+            start_parameter=f"buy_{item_id}"
+        )
+        await callback.answer("💫 Счет на оплату отправлен!")
+    except Exception as e:
+        print(f"Ошибка создания инвойса: {e}")
+        await callback.answer("❌ Не удалось создать счет для оплаты", show_alert=True)
+
+
+# Обработчик предварительного запроса на оплату
+@router.pre_checkout_query()
+async def pre_checkout_query_handler(pre_checkout_query: types.PreCheckoutQuery):
+    """Проверяем возможность оплаты перед ее проведением"""
+    try:
+        payload = pre_checkout_query.invoice_payload
+        
+        # Проверяем оплату рекламы
+        if payload.startswith("ad_payment:"):
+            from ads import get_ad_by_num
+            _, ad_num = payload.split(":")
+            ad = get_ad_by_num(int(ad_num))
+            
+            if not ad:
+                await pre_checkout_query.answer(ok=False, error_message="❌ Реклама не найдена")
+                return
+            
+            if ad['status'] == 'active':
+                await pre_checkout_query.answer(ok=False, error_message="✅ Реклама уже оплачена")
+                return
+            
+            await pre_checkout_query.answer(ok=True)
+            return
+        
+        # Проверяем пополнение Дани за звезды
+        if payload.startswith("buy_dan_stars:"):
+            await pre_checkout_query.answer(ok=True)
+            return
+        
+        # Проверяем оплату товаров из магазина
+        if not payload.startswith("shop_stars:"):
+            await pre_checkout_query.answer(ok=False, error_message="Неверный тип платежа")
+            return
+        
+        # Парсим payload: shop_stars:item_id:quantity
+        _, item_id, quantity_str = payload.split(":")
+        quantity = int(quantity_str)
+        
+        # Проверяем наличие товара
+        shop_info = SHOP_ITEMS.get(item_id, {})
+        stock = shop_info.get('stock', 999)
+        
+        if stock == 0:  # Только если точно закончился
+            await pre_checkout_query.answer(ok=False, error_message="❌ Недостаточно товара в наличии")
+            return
+        
+        # Проверяем конфигурацию товара
+        from inv_py.config_inventory import ITEMS_CONFIG
+        item_config = ITEMS_CONFIG.get(item_id, {})
+        
+        if not item_config or item_config.get('gold', 0) == -1:
+            await pre_checkout_query.answer(ok=False, error_message="❌ Товар недоступен для покупки за звезды")
+            return
+        
+        # Все проверки пройдены
+        await pre_checkout_query.answer(ok=True)
+        
+    except Exception as e:
+        print(f"Ошибка при проверке платежа: {e}")
+        await pre_checkout_query.answer(ok=False, error_message="❌ Ошибка при обработке платежа")
+
+
+# Обработчик успешного платежа
+@texts.on(F.content_type == ContentType.SUCCESSFUL_PAYMENT)
+async def successful_payment_handler(message: types.Message):
+    """Обрабатываем успешный платеж за звезды"""
+    from main import bot
+    try:
+        payment = message.successful_payment
+        payload = payment.invoice_payload
+        
+        # Обработка оплаты рекламы
+        if payload.startswith("ad_payment:"):
+            from ads import get_ad_by_num, update_ad_status
+            _, ad_num = payload.split(":")
+            num = int(ad_num)
+            ad = get_ad_by_num(num)
+            
+            if not ad:
+                await message.answer("❌ Реклама не найдена. Обратитесь к администратору.")
+                return
+            
+            # Активируем рекламу
+            update_ad_status(num, 'active')
+            
+            type_emoji = "👁" if ad['type'] == "views" else "🫵"
+            
+            success_message = (
+                f"✅ Оплата рекламы успешна!\n\n"
+                f"**Реклама:** #{num}\n"
+                f"**Канал:** @{ad['username']}\n"
+                f"**Тип:** {type_emoji}\n"
+                f"**Лимит:** {ad['limit_count']}\n"
+                f"⭐ Оплачено: {payment.total_amount} звезд\n\n"
+                f"🎉 Реклама активирована и начнет показываться пользователям!"
+            )
+            
+            await message.answer(success_message, parse_mode="Markdown")
+            
+            # Уведомляем админа
+            from ads import ADMIN_ID
+            admin_notification = (
+                f"💰 **Новая оплата рекламы!**\n\n"
+                f"**Номер:** #{num}\n"
+                f"**Канал:** @{ad['username']}\n"
+                f"**Плательщик:** {message.from_user.first_name} (@{message.from_user.username or 'без username'})\n"
+                f"**Сумма:** {payment.total_amount} ⭐\n"
+                f"**Статус:** Активирована ✅"
+            )
+            
+            try:
+                await bot.send_message(ADMIN_ID, admin_notification, parse_mode="Markdown")
+            except Exception:
+                pass
+            
+            print(f"✅ Успешная оплата рекламы: пользователь {message.from_user.id} оплатил рекламу #{num}")
+            return
+        
+        # Обработка пополнения Дани за звезды
+        if payload.startswith("buy_dan_stars:"):
+            _, stars_str, dan_str = payload.split(":")
+            stars = int(stars_str)
+            dan = int(dan_str)
+            user_id = message.from_user.id
+            
+            # Начисляем дань
+            db.add_dan(user_id, dan)
+            
+            success_message = (
+                f"✅ Пополнение успешно!\n\n"
+                f"💰 Начислено: {dan:,} Дань 🪙\n"
+                f"⭐ Оплачено: {stars} Telegram Stars\n\n"
+                f"Спасибо за поддержку!"
+            )
+            
+            await message.answer(success_message)
+            print(f"✅ Успешное пополнение: пользователь {user_id} купил {dan} дани за {stars} звезд")
+            return
+        
+        # Обработка оплаты товаров из магазина
+        if not payload.startswith("shop_stars:"):
+            print(f"Неизвестный тип платежа: {payload}")
+            return
+        
+        # Парсим payload: shop_stars:item_id:quantity
+        _, item_id, quantity_str = payload.split(":")
+        quantity = int(quantity_str)
+        user_id = message.from_user.id
+        
+        # Проверяем еще раз наличие товара (на случай если товар закончился после создания инвойса)
+        shop_info = SHOP_ITEMS.get(item_id, {})
+        stock = shop_info.get('stock', 999)
+        
+        if stock == 0:  # Только если точно закончился
+            # Возвращаем деньги автоматически (если это возможно)
+            await message.answer("❌ К сожалению, товар закончился. Обратитесь к администрации для возврата средств.")
+            return
+        
+    # Выдаем товар
+        db.add_item(user_id, item_id, quantity)
+        
+        # Обновляем stock если он не бесконечный
+        if shop_info.get('stock', -1) != -1:
+            shop_info['stock'] = max(0, shop_info['stock'] - quantity)
+            render_cache.invalidate("shop")
+        
+        # Получаем информацию о товаре
+        from inv_py.config_inventory import ITEMS_CONFIG
+        item_config = ITEMS_CONFIG.get(item_id, {})
+        item_name = item_config.get('name', f'Товар {item_id}')
+        
+        # Применяем эффекты товара если есть
+        use_command = item_config.get('use_command')
+        if use_command == 'activate_infinite_storage':
+            import random
+            days = random.randint(7, 14)
+            hours = days * 24
+            db.add_user_effect(user_id, "infinite_storage", f"duration_days:{days}", hours)
+        
+        success_message = (
+            f"✅ Покупка за звезды успешна!\n\n"
+            f"🛍️ Товар: {item_name}\n"
+            f"📦 Количество: {quantity}\n"
+            f"⭐ Оплачено: {payment.total_amount} звезд\n\n"
+            f"Товар добавлен в ваш инвентарь!"
+        )
+        
+        await message.answer(success_message)
+        # Регистрируем прогресс задачи "Торговец" (покупки в магазине за звезды)
+        try:
+            import tasks as _tasks
+            _tasks.record_shop_purchase(user_id)
+        except Exception:
+            pass
+        
+        print(f"✅ Успешная покупка за звезды: пользователь {user_id} купил {quantity}x {item_id}")
+        
+    except Exception as e:
+        print(f"Ошибка при обработке успешного платежа: {e}")
+        await message.answer("❌ Произошла ошибка при обработке покупки. Обратитесь к администратору.")
+
+
+@texts.exact("магаз", "магазин", "шоп")
+async def cmd_shop(message: types.Message):
+    """Команда /магаз - открывает магазин"""
+    from main import (
+        ITEMS_CONFIG, create_back_to_menu_keyboard, format_number_beautiful, safe_ensure_user_from_obj
+    )
+    if not getattr(message, 'from_user', None):
+        return
+    user_id = message.from_user.id
+    safe_ensure_user_from_obj(message.from_user)
+    
+    try:
+        # Получаем баланс пользователя
+        user_row = db.get_user(user_id)
+        dan_balance = 0.0
+        kruz_balance = 0
+        if user_row:
+            try:
+                dan_balance = float(user_row.get("dan", 0))
+            except Exception:
+                dan_balance = 0.0
+            try:
+                kruz_balance = int(user_row.get("kruz", 0))
+            except Exception:
+                kruz_balance = 0
+        dan_balance = 0.00 if abs(dan_balance) < 0.005 else round(dan_balance, 2)
+
+        # Получаем данные для первой страницы
+        items, total, max_page = get_all_shop_items(page=1)
+        keyboard = build_shop_main_menu(page=1, max_page=max_page)
+
+        # Пробуем отправить графическую сетку
+        try:
+            from inv_py.shop import render_shop_grid
+            shop_image_path = render_shop_grid(page=1, font_path="C:/Windows/Fonts/arial.ttf")
+            caption = (
+                f"🛍️ <b>Магазин</b>\n\n"
+                f"💰 Ваш баланс:\n🪙 Дань: {format_number_beautiful(dan_balance)}\n"
+                f"⭐ Stars: {format_number_beautiful(kruz_balance)}\n\n"
+                f"Всего товаров: {total}\nСтраница 1 из {max_page}"
+            )
+            await media_cache.send_photo(message.answer_photo, shop_image_path, caption=caption, reply_markup=keyboard, parse_mode="HTML")
+        except Exception:
+            # Фолбек: текстовое представление
+            caption_lines = [
+                f"🛍️ <b>Магазин</b>",
+                "",
+                f"💰 Ваш баланс:",
+                f"🪙 Дань: {format_number_beautiful(dan_balance)}",
+                f"⭐ Stars: {format_number_beautiful(kruz_balance)}",
+                "",
+            ]
+            try:
+                for idx, entry in enumerate(items, start=1):
+                    iid = entry[0]
+                    if iid and iid != 'empty':
+                        name = ITEMS_CONFIG.get(iid, {}).get('name', iid)
+                        caption_lines.append(f"[{idx}] {name}")
+                    else:
+                        caption_lines.append(f"[{idx}] —")
+            except Exception:
+                pass
+            caption = "\n".join(caption_lines)
+            await message.answer(caption, reply_markup=keyboard, parse_mode="HTML")
+    except Exception as e:
+        await message.reply(f"🛍️ Магазин\n\nВременно недоступен.", 
+                           reply_markup=create_back_to_menu_keyboard(user_id))
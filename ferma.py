@@ -23,6 +23,7 @@ def check_ferma(user_id: int):
         # Если ошибка - не блокируем работу фермы, просто логируем
         return {'available_to_collect': 0, 'periods': 0, 'farm': None}
 import database as db
+import leaderboard
 import time
 
 # === СИСТЕМА ЖИВОТНЫХ НА ФЕРМЕ ===
@@ -56,37 +57,11 @@ ANIMAL_UNLOCK_LEVELS = [3, 5, 7, 9]
 
 def init_animals_table():
     """Создает таблицу для размещенных на ферме животных"""
-    with db._lock:
+    with db._schema_lock:
         conn = db._connect()
         cur = conn.cursor()
         
-        # Проверяем существование таблицы
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='farm_animals'")
-        table_exists = cur.fetchone()
-        
-        if table_exists:
-            # Проверяем структуру таблицы
-            cur.execute("PRAGMA table_info(farm_animals)")
-            columns_rows = cur.fetchall()
-            columns = [row[1] for row in columns_rows]
-            
-            # Если старая структура (с animal_type вместо animal_item_id)
-            if 'animal_type' in columns and 'animal_item_id' not in columns:
-                print("🔄 Миграция таблицы farm_animals...")
-                # Удаляем старую таблицу
-                cur.execute("DROP TABLE farm_animals")
-                conn.commit()
-                print("✅ Старая таблица удалена")
-
-            # Если нет колонки feed_buffer_hours — добавим миграцией
-            if 'feed_buffer_hours' not in columns:
-                try:
-                    cur.execute("ALTER TABLE farm_animals ADD COLUMN feed_buffer_hours INTEGER DEFAULT 0")
-                    conn.commit()
-                    print("🔧 Миграция: добавлен столбец feed_buffer_hours в farm_animals")
-                except Exception as e:
-                    print(f"⚠️ Не удалось добавить feed_buffer_hours: {e}")
-        
+        # Старую структуру таблицы и колонку feed_buffer_hours обрабатывает миграция 8 в database.py
         # Создаем таблицу с правильной структурой
         cur.execute('''
             CREATE TABLE IF NOT EXISTS farm_animals (
@@ -108,7 +83,7 @@ init_animals_table()
 # Таблица владения животными (индивидуальные экземпляры вне слотов)
 def init_owned_animals_table():
     """Создает таблицу индивидуальных животных пользователя вне слотов фермы"""
-    with db._lock:
+    with db._schema_lock:
         conn = db._connect()
         cur = conn.cursor()
         cur.execute('''
@@ -126,7 +101,7 @@ def init_owned_animals_table():
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ ИНДИВИДУАЛЬНЫХ ЖИВОТНЫХ ===
 def add_owned_animal(user_id: int, animal_item_id: str, last_fed_time: int = 0):
     """Добавляет индивидуальное животное пользователю (в хранилище owned_animals)."""
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute(
@@ -138,15 +113,14 @@ def add_owned_animal(user_id: int, animal_item_id: str, last_fed_time: int = 0):
 
 def list_owned_animals(user_id: int):
     """Возвращает список индивидуальных животных пользователя с их id и памятью кормления."""
-    with db._lock:
-        conn = db._connect()
-        cur = conn.cursor()
-        cur.execute(
-            'SELECT id, animal_item_id, last_fed_time FROM owned_animals WHERE user_id = ? ORDER BY id ASC',
-            (user_id,)
-        )
-        rows = cur.fetchall()
-        conn.close()
+    conn = db._connect()
+    cur = conn.cursor()
+    cur.execute(
+        'SELECT id, animal_item_id, last_fed_time FROM owned_animals WHERE user_id = ? ORDER BY id ASC',
+        (user_id,)
+    )
+    rows = cur.fetchall()
+    conn.close()
     result = []
     for rid, item_id, fed in rows:
         animal_type = ANIMAL_ITEMS.get(item_id, 'unknown')
@@ -184,7 +158,7 @@ def place_specific_owned_animal_on_farm(user_id: int, owned_id: int):
         return {'status': 'error', 'msg': 'Нет свободных слотов!'}
 
     # Извлекаем конкретное животное из owned_animals
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute('SELECT animal_item_id, last_fed_time FROM owned_animals WHERE user_id=? AND id=?', (user_id, owned_id))
@@ -211,7 +185,7 @@ def place_specific_owned_animal_on_farm(user_id: int, owned_id: int):
 
 def remove_owned_animal_by_id(user_id: int, owned_id: int) -> bool:
     """Удаляет индивидуальное животное по его owned_id для данного пользователя."""
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute('DELETE FROM owned_animals WHERE user_id=? AND id=?', (user_id, owned_id))
@@ -222,12 +196,11 @@ def remove_owned_animal_by_id(user_id: int, owned_id: int) -> bool:
 
 def get_owned_animal(user_id: int, owned_id: int):
     """Возвращает информацию об индивидуальном животном или None."""
-    with db._lock:
-        conn = db._connect()
-        cur = conn.cursor()
-        cur.execute('SELECT id, animal_item_id, last_fed_time FROM owned_animals WHERE user_id=? AND id=?', (user_id, owned_id))
-        row = cur.fetchone()
-        conn.close()
+    conn = db._connect()
+    cur = conn.cursor()
+    cur.execute('SELECT id, animal_item_id, last_fed_time FROM owned_animals WHERE user_id=? AND id=?', (user_id, owned_id))
+    row = cur.fetchone()
+    conn.close()
     if not row:
         return None
     rid, item_id, fed = row
@@ -239,21 +212,20 @@ init_owned_animals_table()
 
 def get_unassigned_animals_counts(user_id: int):
     """Возвращает количество незадействованных животных по типам (из owned_animals)"""
-    with db._lock:
-        conn = db._connect()
-        cur = conn.cursor()
-        cur.execute('''
-            SELECT animal_item_id, COUNT(*) FROM owned_animals
-            WHERE user_id = ?
-            GROUP BY animal_item_id
-        ''', (user_id,))
-        rows = cur.fetchall()
-        conn.close()
+    conn = db._connect()
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT animal_item_id, COUNT(*) FROM owned_animals
+        WHERE user_id = ?
+        GROUP BY animal_item_id
+    ''', (user_id,))
+    rows = cur.fetchall()
+    conn.close()
     return {item_id: cnt for (item_id, cnt) in rows}
 
 def pop_owned_animal(user_id: int, animal_item_id: str):
     """Извлекает одно животное из owned_animals и возвращает его last_fed_time. Если нет — None"""
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute('''
@@ -305,61 +277,52 @@ def get_farm(user_id: int):
 
 # Get top N farms by income_per_hour
 def get_farm_leaderboard(top_n=10):
-    import sqlite3
-    conn = db._connect()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, username, farm_income FROM users ORDER BY farm_income DESC LIMIT ?", (top_n,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    # (user_id, username, farm_income) из снимка leaderboard
+    return [(user_id, username, income) for user_id, income, username in leaderboard.get_top("farm", top_n)]
 
 # Get position in leaderboard by income_per_hour
 def get_farm_leaderboard_position(user_id: int):
-    conn = db._connect()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users WHERE farm_income > (SELECT farm_income FROM users WHERE user_id = ?)", (user_id,))
-    pos = cur.fetchone()[0] + 1
-    conn.close()
-    return pos
+    return leaderboard.get_rank("farm", user_id)
 
 # Upgrade warehouse (increase warehouse_capacity)
 
 def upgrade_warehouse(user_id: int):
-    farm = get_farm(user_id)
-    user = db.get_user(user_id)
-    if not user:
-        db.ensure_user(user_id)
+    with db._user_locks.hold(user_id):
+        farm = get_farm(user_id)
         user = db.get_user(user_id)
         if not user:
-            return {'status': 'error', 'msg': 'Пользователь не найден'}
-    # стоимость, новая вместимость (более плавная и дорогая прогрессия)
-    upgrades = [
-        (400, 40),
-        (900, 55),
-        (2000, 70),
-        (4500, 90),
-        (9000, 120),
-        (18000, 170),
-        (40000, 230),
-        (90000, 320)
-    ]
-    current_capacity = farm['warehouse_capacity']
-    next_upgrade = None
-    for cost, capacity in upgrades:
-        if capacity > current_capacity:
-            next_upgrade = (cost, capacity)
-            break
-    if not next_upgrade:
-        return {'status': 'error', 'msg': 'Максимальная вместимость склада достигнута!'}
-    cost, new_capacity = next_upgrade
-    if user['dan'] < cost:
-        return {'status': 'error', 'msg': f'Недостаточно Дань для улучшения склада! Нужно: {cost}, у вас: {user["dan"]}'}
-    db.withdraw_dan(user_id, cost)
-    update_farm(user_id, capacity=new_capacity)
-    return {
-        'status': 'ok',
-        'msg': f'Склад улучшен! Новая вместимость: {new_capacity} (минус {cost} Дань)'
-    }
+            db.ensure_user(user_id)
+            user = db.get_user(user_id)
+            if not user:
+                return {'status': 'error', 'msg': 'Пользователь не найден'}
+        # стоимость, новая вместимость (более плавная и дорогая прогрессия)
+        upgrades = [
+            (400, 40),
+            (900, 55),
+            (2000, 70),
+            (4500, 90),
+            (9000, 120),
+            (18000, 170),
+            (40000, 230),
+            (90000, 320)
+        ]
+        current_capacity = farm['warehouse_capacity']
+        next_upgrade = None
+        for cost, capacity in upgrades:
+            if capacity > current_capacity:
+                next_upgrade = (cost, capacity)
+                break
+        if not next_upgrade:
+            return {'status': 'error', 'msg': 'Максимальная вместимость склада достигнута!'}
+        cost, new_capacity = next_upgrade
+        if user['dan'] < cost:
+            return {'status': 'error', 'msg': f'Недостаточно Дань для улучшения склада! Нужно: {cost}, у вас: {user["dan"]}'}
+        db.withdraw_dan(user_id, cost)
+        update_farm(user_id, capacity=new_capacity)
+        return {
+            'status': 'ok',
+            'msg': f'Склад улучшен! Новая вместимость: {new_capacity} (минус {cost} Дань)'
+        }
 
 # Update farm data for a user
 def update_farm(user_id: int, **kwargs):
@@ -371,12 +334,13 @@ def update_farm(user_id: int, **kwargs):
     if not fields:
         return
     values.append(user_id)
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute(f"UPDATE users SET {', '.join(fields)} WHERE user_id = ?", tuple(values))
         conn.commit()
         conn.close()
+        db.invalidate_user(user_id)
 
 # Calculate dan to collect since last collection
 def calculate_income(user_id: int):
@@ -411,112 +375,115 @@ def calculate_income(user_id: int):
 
 # Collect dan from farm to warehouse
 def collect_dan(user_id: int):
-    to_add, periods = calculate_income(user_id)
-    if to_add > 0:
+    with db._user_locks.hold(user_id):
+        to_add, periods = calculate_income(user_id)
+        if to_add > 0:
+            farm = get_farm(user_id)
+            new_stored = farm['stored_dan'] + to_add
+            update_farm(user_id, stored=new_stored, last_collected=int(time.time()))
+        # После начисления дохода, проверяем есть ли дань на складе
         farm = get_farm(user_id)
-        new_stored = farm['stored_dan'] + to_add
-        update_farm(user_id, stored=new_stored, last_collected=int(time.time()))
-    # После начисления дохода, проверяем есть ли дань на складе
-    farm = get_farm(user_id)
-    if farm['stored_dan'] > 0:
-        stored = farm['stored_dan']
-        return {'status': 'ok', 'stored_dan': f'{stored:.2f}', 'msg': f'На складе {stored:.2f} Дань.'}
-    else:
-        return {'status': 'empty', 'stored_dan': '0.00', 'msg': 'На складе нет Дань.'}
+        if farm['stored_dan'] > 0:
+            stored = farm['stored_dan']
+            return {'status': 'ok', 'stored_dan': f'{stored:.2f}', 'msg': f'На складе {stored:.2f} Дань.'}
+        else:
+            return {'status': 'empty', 'stored_dan': '0.00', 'msg': 'На складе нет Дань.'}
 
 # Transfer dan from warehouse to user balance
 def transfer_dan_to_balance(user_id: int):
-    farm = get_farm(user_id)
-    dan = farm['stored_dan']
-    # Забираем только целую часть, остаток оставляем
-    whole = int(dan)
-    fractional = dan - whole
-    if whole > 0:
-        db.add_dan(user_id, whole)
-        update_farm(user_id, stored=fractional)
-    return float(f'{whole:.2f}')
+    with db._user_locks.hold(user_id):
+        farm = get_farm(user_id)
+        dan = farm['stored_dan']
+        # Забираем только целую часть, остаток оставляем
+        whole = int(dan)
+        fractional = dan - whole
+        if whole > 0:
+            db.add_dan(user_id, whole)
+            update_farm(user_id, stored=fractional)
+        return float(f'{whole:.2f}')
 
 # Upgrade farm (level up, increase income/capacity)
 # При улучшении фермы автоматически улучшается и склад!
 
 def upgrade_farm(user_id: int):
-    farm = get_farm(user_id)
-    user = db.get_user(user_id)
-    if not user:
-        db.ensure_user(user_id)
+    with db._user_locks.hold(user_id):
+        farm = get_farm(user_id)
         user = db.get_user(user_id)
         if not user:
-            return {'status': 'error', 'msg': 'Пользователь не найден'}
+            db.ensure_user(user_id)
+            user = db.get_user(user_id)
+            if not user:
+                return {'status': 'error', 'msg': 'Пользователь не найден'}
+    
+        # Новая прогрессия: стоимость, доход/ч, вместимость склада, уровень
+        upgrades = [
+            (400, 15, 70, 2),       # Уровень 2: 400 → 15/ч, склад 70
+            (1500, 20, 90, 3),      # Уровень 3: 2,000 → 20/ч, склад 90
+            (2000, 30, 120, 4),     # Уровень 4: 4,000 → 30/ч, склад 120
+            (4500, 50, 300, 5),     # Уровень 5: 7,500 → 50/ч, склад 300
+            (6000, 70, 400, 6),    # Уровень 6: 10,000 → 70/ч, склад 400
+            (10000, 90, 600, 7),    # Уровень 7: 15,000 → 90/ч, склад 600
+            (25000, 110, 800, 8),   # Уровень 8: 25,000 → 110/ч, склад 800
+            (30400, 150, 2000, 9),  # Уровень 9: 50,400 → 150/ч, склад 2000
+            (70250, 200, 4000, 10) # Уровень 10: 100,000 → 200/ч, склад 4000
+        ]
+    
+        current_level = farm['level']
+        next_upgrade = None
+        for cost, income, capacity, level in upgrades:
+            if level > current_level:
+                next_upgrade = (cost, income, capacity, level)
+                break
+    
+        if not next_upgrade:
+            return {'status': 'error', 'msg': 'Максимальный уровень фермы достигнут!'}
+    
+        cost, new_income, new_capacity, new_level = next_upgrade
+    
+        # Проверяем баланс пользователя
+        user_balance = float(user.get('dan', 0))
+        if user_balance < cost:
+            # Красиво форматируем сообщение об ошибке
+            try:
+                from main import format_number_beautiful
+                balance_formatted = format_number_beautiful(user_balance)
+                cost_formatted = format_number_beautiful(cost)
+                needed = cost - user_balance
+                needed_formatted = format_number_beautiful(needed)
+                return {
+                    'status': 'error', 
+                    'msg': f'❌ Недостаточно дань!\n\n'
+                           f'💰 У вас: {balance_formatted} дань\n'
+                           f'💸 Нужно: {cost_formatted} дань\n'
+                           f'📈 Не хватает: {needed_formatted} дань'
+                }
+            except ImportError:
+                # Fallback без красивого форматирования
+                return {'status': 'error', 'msg': f'❌ Недостаточно дань!\nНужно: {cost}, у вас: {user_balance}'}
+    
+        # Списываем дань и обновляем ферму (доход, склад и уровень одновременно)
+        db.withdraw_dan(user_id, cost)
+        update_farm(user_id, income=new_income, capacity=new_capacity, level=new_level)
+    
+        # Если достигли уровня, на котором даётся животное (3, 5, 7, 9)
+        animal_reward = None
+        if new_level in ANIMAL_UNLOCK_LEVELS:
+            animal_reward = give_random_animal_reward(user_id)
+    
+        msg = f'✅ Ферма улучшена до уровня {new_level}!\n' \
+              f'📈 Доход: {new_income}/ч\n' \
+              f'📦 Склад: {new_capacity}\n' \
+              f'💸 Стоимость: {cost} Дань'
+    
+        if animal_reward:
+            msg += f'\n\n🎁 Вы получили: {animal_reward["name"]}!\n' \
+                   f'💡 Разместите животное на ферме через инвентарь или продайте.'
     
-    # Новая прогрессия: стоимость, доход/ч, вместимость склада, уровень
-    upgrades = [
-        (400, 15, 70, 2),       # Уровень 2: 400 → 15/ч, склад 70
-        (1500, 20, 90, 3),      # Уровень 3: 2,000 → 20/ч, склад 90
-        (2000, 30, 120, 4),     # Уровень 4: 4,000 → 30/ч, склад 120
-        (4500, 50, 300, 5),     # Уровень 5: 7,500 → 50/ч, склад 300
-        (6000, 70, 400, 6),    # Уровень 6: 10,000 → 70/ч, склад 400
-        (10000, 90, 600, 7),    # Уровень 7: 15,000 → 90/ч, склад 600
-        (25000, 110, 800, 8),   # Уровень 8: 25,000 → 110/ч, склад 800
-        (30400, 150, 2000, 9),  # Уровень 9: 50,400 → 150/ч, склад 2000
-        (70250, 200, 4000, 10) # Уровень 10: 100,000 → 200/ч, склад 4000
-    ]
-    
-    current_level = farm['level']
-    next_upgrade = None
-    for cost, income, capacity, level in upgrades:
-        if level > current_level:
-            next_upgrade = (cost, income, capacity, level)
-            break
-    
-    if not next_upgrade:
-        return {'status': 'error', 'msg': 'Максимальный уровень фермы достигнут!'}
-    
-    cost, new_income, new_capacity, new_level = next_upgrade
-    
-    # Проверяем баланс пользователя
-    user_balance = float(user.get('dan', 0))
-    if user_balance < cost:
-        # Красиво форматируем сообщение об ошибке
-        try:
-            from main import format_number_beautiful
-            balance_formatted = format_number_beautiful(user_balance)
-            cost_formatted = format_number_beautiful(cost)
-            needed = cost - user_balance
-            needed_formatted = format_number_beautiful(needed)
-            return {
-                'status': 'error', 
-                'msg': f'❌ Недостаточно дань!\n\n'
-                       f'💰 У вас: {balance_formatted} дань\n'
-                       f'💸 Нужно: {cost_formatted} дань\n'
-                       f'📈 Не хватает: {needed_formatted} дань'
-            }
-        except ImportError:
-            # Fallback без красивого форматирования
-            return {'status': 'error', 'msg': f'❌ Недостаточно дань!\nНужно: {cost}, у вас: {user_balance}'}
-    
-    # Списываем дань и обновляем ферму (доход, склад и уровень одновременно)
-    db.withdraw_dan(user_id, cost)
-    update_farm(user_id, income=new_income, capacity=new_capacity, level=new_level)
-    
-    # Если достигли уровня, на котором даётся животное (3, 5, 7, 9)
-    animal_reward = None
-    if new_level in ANIMAL_UNLOCK_LEVELS:
-        animal_reward = give_random_animal_reward(user_id)
-    
-    msg = f'✅ Ферма улучшена до уровня {new_level}!\n' \
-          f'📈 Доход: {new_income}/ч\n' \
-          f'📦 Склад: {new_capacity}\n' \
-          f'💸 Стоимость: {cost} Дань'
-    
-    if animal_reward:
-        msg += f'\n\n🎁 Вы получили: {animal_reward["name"]}!\n' \
-               f'💡 Разместите животное на ферме через инвентарь или продайте.'
-    
-    return {
-        'status': 'ok',
-        'msg': msg,
-        'animal_reward': animal_reward
-    }
+        return {
+            'status': 'ok',
+            'msg': msg,
+            'animal_reward': animal_reward
+        }
 
 def get_next_upgrade_cost(user_id: int):
     """Получает стоимость следующего улучшения фермы"""
@@ -556,17 +523,16 @@ def get_available_animal_slots(farm_level: int):
 
 def get_user_farm_animals(user_id: int):
     """Получает всех животных, размещенных на ферме пользователя"""
-    with db._lock:
-        conn = db._connect()
-        cur = conn.cursor()
-        cur.execute('''
-            SELECT slot_number, animal_item_id, last_fed_time, COALESCE(feed_buffer_hours, 0)
-            FROM farm_animals 
-            WHERE user_id = ?
-            ORDER BY slot_number
-        ''', (user_id,))
-        rows = cur.fetchall()
-        conn.close()
+    conn = db._connect()
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT slot_number, animal_item_id, last_fed_time, COALESCE(feed_buffer_hours, 0)
+        FROM farm_animals 
+        WHERE user_id = ?
+        ORDER BY slot_number
+    ''', (user_id,))
+    rows = cur.fetchall()
+    conn.close()
     
     animals = {}
     for row in rows:
@@ -624,7 +590,7 @@ def place_animal_on_farm(user_id: int, animal_item_id: str):
         return {'status': 'error', 'msg': 'Нет свободных слотов!'}
     
     # Размещаем на ферму
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute('''
@@ -655,7 +621,7 @@ def remove_animal_from_farm(user_id: int, slot_number: int):
     last_fed_time = animals[slot_number]['last_fed_time']
     
     # Удаляем животное с фермы
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute('''
@@ -732,7 +698,7 @@ def feed_animal(user_id: int, slot_number: int, food_item_id: str):
         new_last_fed = current_last_fed
         new_buf = min(current_buf + 12, max_extra)
     
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute('''
@@ -808,7 +774,7 @@ def give_random_animal_reward(user_id: int):
         animal_name = '🐔 Курица'
     
     # Добавляем как индивидуальное животное в хранилище (не в инвентарь)
-    with db._lock:
+    with db._user_locks.hold(user_id):
         conn = db._connect()
         cur = conn.cursor()
         cur.execute('INSERT INTO owned_animals (user_id, animal_item_id, last_fed_time) VALUES (?, ?, 0)', (user_id, animal_item_id))
@@ -0,0 +1,305 @@
+"""
+Хранилище состояний FSM aiogram в SQLite (таблица fsm_states в game_bot.db).
+
+По умолчанию aiogram держит состояния (AuctionStates, BankStates,
+SellItemStates, CreateBetStates) в MemoryStorage: после перезапуска
+пользователь, вводивший сумму вклада или цену лота, оказывается вне сценария,
+а воркеры webhook.py не видят состояния друг друга. SQLiteStorage:
+
+- читает через кеш в памяти: состояние, только что записанное или
+  прочитанное, берётся из кеша без запроса к БД (LRU на CACHE_SIZE ключей),
+  промах кеша читается в отдельном потоке;
+- коалесцирует запись: set_state/set_data/update_data одного хендлера только
+  меняют кеш, фоновая задача раз в FLUSH_INTERVAL пишет все изменённые ключи
+  одной транзакцией в отдельном потоке (flush() — сразу);
+- хранит компактно: состояние — строкой, данные — JSON без пробелов (пустые
+  данные — NULL); пустое состояние без данных удаляет строку;
+- забывает брошенные сценарии: запись живёт ttl секунд с последнего
+  изменения, истёкшие строки удаляет cleanup_expired() (задача планировщика).
+
+В общем режиме (shared=True, несколько воркеров) кеш хранит только ещё не
+записанные изменения, а чтение идёт в БД: воркер сбрасывает изменения после
+каждого апдейта (flush), поэтому другой процесс видит актуальное состояние.
+Запись уходит из кеша только после COMMIT, так что следующий апдейт того же
+чата не прочитает из БД старое состояние.
+
+    dp = Dispatcher(storage=fsm_storage.SQLiteStorage())
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+import sqlite_pool
+
+# Сколько живёт незавершённый сценарий с последнего изменения, секунд
+FSM_TTL = 24 * 3600
+# Как часто изменённые состояния пишутся в БД, секунд
+FLUSH_INTERVAL = 0.5
+# Сколько ключей держать в кеше (изменённые, но не записанные не вытесняются)
+CACHE_SIZE = 10000
+
+_MISSING = object()
+
+
+class _Record:
+    """Состояние и данные одного ключа в кеше."""
+
+    __slots__ = ("state", "data", "expires_at")
+
+    def __init__(self, state: Optional[str], data: Optional[Dict[str, Any]], expires_at: float):
+        self.state = state
+        self.data = data
+        self.expires_at = expires_at
+
+
+def _encode(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _decode(blob: Optional[str]) -> Dict[str, Any]:
+    return json.loads(blob) if blob else {}
+
+
+class SQLiteStorage(BaseStorage):
+    """BaseStorage aiogram поверх SQLite с кешем и отложенной записью."""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = FSM_TTL, flush_interval: float = FLUSH_INTERVAL,
+                 cache_size: int = CACHE_SIZE, shared: bool = False):
+        # path=None - game_bot.db бота (таблицу создаёт миграция database.py)
+        if path is None:
+            import database
+            path = database.DB_PATH
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.shared = shared
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        # Ключи кеша, изменённые после последней записи (не вытесняются)
+        self._dirty = set()
+        # Записи в БД идут по одной: более старая не должна закоммититься после новой
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [str(key.bot_id), str(key.chat_id), str(key.thread_id or ""), str(key.user_id), key.destiny]
+        business_connection_id = getattr(key, "business_connection_id", None)
+        if business_connection_id:
+            parts.append(business_connection_id)
+        return ":".join(parts)
+
+    def _connect(self):
+        return sqlite_pool.get_pool(self.path).connect(None)
+
+    def _read_row(self, key: str):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT state, data, expires_at FROM fsm_states WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+
+    async def _load(self, key: str) -> _Record:
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            row = await asyncio.to_thread(self._read_row, key)
+            # Пока шло чтение, ключ мог записать другой хендлер - его версия новее
+            record = self._cache.get(key)
+            if record is None:
+                record = _Record(None, None, 0.0) if row is None else _Record(row[0], _decode(row[1]), row[2])
+                if not self.shared:
+                    self._remember(key, record)
+        if record.expires_at <= time.time() and (record.state is not None or record.data):
+            # Брошенный сценарий: считаем, что его нет
+            record.state, record.data = None, None
+        return record
+
+    def _remember(self, key: str, record: _Record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        # Вытесняются только записанные ключи: изменённые ждут записи в БД.
+        # Если записанных не осталось, кеш не перебирается
+        excess = min(len(self._cache) - self.cache_size, len(self._cache) - len(self._dirty))
+        if excess <= 0:
+            return
+        evicted = []
+        for old_key in self._cache:
+            if old_key not in self._dirty:
+                evicted.append(old_key)
+                if len(evicted) == excess:
+                    break
+        for old_key in evicted:
+            del self._cache[old_key]
+
+    async def _write(self, key: str, state=_MISSING, data=_MISSING):
+        record = await self._load(key)
+        if state is not _MISSING:
+            record.state = state
+        if data is not _MISSING:
+            record.data = data
+        record.expires_at = time.time() + self.ttl
+        self._dirty.add(key)
+        self._remember(key, record)
+        self._ensure_flusher()
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        await self._write(self._key(key), state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Данные FSM должны быть dict, получено {type(data).__name__}")
+        # Несериализуемые данные - ошибка в хендлере, а не при фоновой записи
+        _encode(data)
+        await self._write(self._key(key), data=data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = (await self._load(self._key(key))).data
+        return data.copy() if data else {}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        current = await self.get_data(key)
+        current.update(data)
+        await self.set_data(key, current)
+        return current.copy()
+
+    # === Запись в БД ===
+
+    def _collect(self):
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in dirty:
+            record = self._cache[key]
+            if record.state is None and not record.data:
+                deletes.append((key,))
+            else:
+                upserts.append((key, record.state, _encode(record.data), record.expires_at))
+        return upserts, deletes
+
+    def _written(self, upserts, deletes):
+        # Общий режим: записанное читается из БД, в кеше остаются только новые изменения
+        if self.shared:
+            for key in [row[0] for row in upserts] + [key for (key,) in deletes]:
+                if key not in self._dirty:
+                    self._cache.pop(key, None)
+
+    def _write_rows(self, upserts, deletes):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO fsm_states (key, state, data, expires_at) VALUES (?, ?, ?, ?)", upserts
+            )
+            conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.flushes += 1
+        self.rows_written += len(upserts) + len(deletes)
+
+    def _remark(self, upserts, deletes):
+        # Запись не удалась: вернуть ключи в кеш изменёнными (если их не успели изменить снова)
+        for key, state, data, expires_at in upserts:
+            if key not in self._cache:
+                self._cache[key] = _Record(state, _decode(data), expires_at)
+            self._dirty.add(key)
+        for (key,) in deletes:
+            if key not in self._cache:
+                self._cache[key] = _Record(None, None, 0.0)
+            self._dirty.add(key)
+
+    def flush_sync(self) -> int:
+        """Записать изменения сразу, в текущем потоке (при остановке, в бенчмарке)."""
+        upserts, deletes = self._collect()
+        if upserts or deletes:
+            try:
+                self._write_rows(upserts, deletes)
+            except Exception:
+                self._remark(upserts, deletes)
+                raise
+            self._written(upserts, deletes)
+        return len(upserts) + len(deletes)
+
+    async def flush(self) -> int:
+        """Записать изменения сразу (запись в отдельном потоке; после апдейта в воркере)."""
+        async with self._flush_lock:
+            upserts, deletes = self._collect()
+            if upserts or deletes:
+                try:
+                    await asyncio.to_thread(self._write_rows, upserts, deletes)
+                except Exception:
+                    self._remark(upserts, deletes)
+                    raise
+                self._written(upserts, deletes)
+            return len(upserts) + len(deletes)
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ fsm_storage: ошибка записи состояний: {e}")
+
+    def _delete_expired(self, now: float) -> int:
+        conn = self._connect()
+        try:
+            removed = conn.execute("DELETE FROM fsm_states WHERE expires_at <= ?", (now,)).rowcount
+            conn.commit()
+            return removed
+        finally:
+            conn.close()
+
+    async def cleanup_expired(self) -> int:
+        """Удалить брошенные сценарии (истёкшие строки и записи кеша); задача планировщика."""
+        now = time.time()
+        for key in [key for key, record in self._cache.items() if key not in self._dirty and record.expires_at <= now]:
+            del self._cache[key]
+        removed = await asyncio.to_thread(self._delete_expired, now)
+        if removed:
+            print(f"🧹 fsm_storage: удалено брошенных состояний: {removed}")
+        return removed
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "cached": len(self._cache),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"⚠️ fsm_storage: не удалось записать состояния при остановке: {e}")
@@ -2,16 +2,18 @@
 
 This package exposes the modules moved into the inv_py package so other
 modules can import them as `inv_py.shop`, `inv_py.render_inventory`, etc.
-Keeping simple explicit relative imports helps static analyzers and avoids
-runtime import shenanigans.
+Submodules are imported on first attribute access (PEP 562), so importing
+one of them does not pull in the others - render_inventory loads Pillow.
 """
 
-from . import shop
-from . import inventory
-from . import render_inventory
-from . import config_inventory
-from . import shop_config
+import importlib
 
 __all__ = [
     'shop', 'inventory', 'render_inventory', 'config_inventory', 'shop_config'
 ]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,7 +2,6 @@
 Модуль для отображения аукциона с красивым визуальным интерфейсом
 """
 from inv_py.config_inventory import ITEMS_CONFIG
-from inv_py.render_inventory import render_inventory_grid
 import tempfile
 import time
 import os
@@ -43,6 +42,8 @@ def render_auction_grid(auction_items: List[Tuple], font_path: Optional[str] = N
     Returns:
         str: путь к временному файлу с изображением
     """
+    from inv_py.render_inventory import render_inventory_grid
+    
     # Используем читаемый шрифт для основного текста
     # Эмодзи будут обрабатываться отдельно если потребуется
     if font_path is None:
@@ -1,68 +1,195 @@
 """
 Утилиты для работы со шрифтами - поиск лучших шрифтов с поддержкой русского, английского и эмодзи
+
+Реестр шрифтов на весь процесс: семейство (text / emoji / best) раз
+разрешается в список существующих файлов по путям поиска текущей платформы,
+а объекты FreeTypeFont кешируются по (семейство, размер). Раньше каждый вызов
+заново проверял пути через os.path.exists и создавал новый truetype, а пути
+были только виндовые - на Linux молча рисовался растровый шрифт по умолчанию.
+
+Порядок поиска: каталоги из переменной окружения FONT_PATHS (через
+os.pathsep), системные каталоги платформы (FONT_DIRS), затем каталог fonts/ в
+корне проекта (BUNDLED_FONTS_DIR) - туда можно положить свои ttf. Если ничего
+не нашлось - масштабируемый шрифт Pillow по умолчанию.
 """
+import functools
 import os
+import sys
+import threading
 from PIL import ImageFont
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+
+# Системные каталоги шрифтов по платформам (sys.platform)
+FONT_DIRS = {
+    "win32": [os.path.join(os.environ.get("WINDIR", "C:/Windows"), "Fonts")],
+    "darwin": [
+        "/System/Library/Fonts",
+        "/System/Library/Fonts/Supplemental",
+        "/Library/Fonts",
+        "~/Library/Fonts",
+    ],
+    "linux": [
+        "/usr/share/fonts",
+        "/usr/local/share/fonts",
+        "~/.local/share/fonts",
+        "~/.fonts",
+    ],
+}
+
+# Шрифты, поставляемые вместе с ботом
+BUNDLED_FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fonts")
+
+# Семейства: имена файлов в порядке приоритета (лучшие первые)
+FONT_FAMILIES: Dict[str, List[str]] = {
+    # Основной шрифт для текста (латиница, кириллица, цифры)
+    "text": [
+        "segoeui.ttf",                  # Segoe UI - четкий, современный
+        "tahoma.ttf",                   # Tahoma - отличная кириллица
+        "calibri.ttf",                  # Calibri - хорошая читаемость
+        "arial.ttf",                    # Arial - универсальный
+        "Arial.ttf",                    # Arial на macOS
+        "DejaVuSans.ttf",               # DejaVu Sans - есть почти в любом Linux
+        "NotoSans-Regular.ttf",         # Noto Sans
+        "LiberationSans-Regular.ttf",   # метрически совместим с Arial
+    ],
+    # Эмодзи (NotoColorEmoji растровый и открывается не на всех размерах - тогда берётся следующий)
+    "emoji": [
+        "seguiemj.ttf",                 # Segoe UI Emoji
+        "NotoColorEmoji.ttf",           # Noto Color Emoji
+        "AppleColorEmoji.ttc",          # Apple шрифт эмодзи
+        "Apple Color Emoji.ttc",
+        "Symbola.ttf",
+    ],
+    # Один шрифт и для текста, и для эмодзи (в стиле iPhone, как раньше в find_best_font)
+    "best": [
+        "seguiemj.ttf",                 # Segoe UI Emoji - основной шрифт эмодзи Windows
+        "NotoColorEmoji.ttf",
+        "segoeui.ttf",                  # Segoe UI - основной шрифт Windows
+        "calibri.ttf",                  # Calibri - хорошая поддержка Unicode
+        "tahoma.ttf",                   # Tahoma - отличная поддержка кириллицы
+        "arial.ttf",                    # Arial - базовая поддержка
+        "verdana.ttf",                  # Verdana - хорошая читаемость
+        "Arial.ttf",
+        "DejaVuSans.ttf",
+        "NotoSans-Regular.ttf",
+        "LiberationSans-Regular.ttf",
+    ],
+}
+
+_lock = threading.RLock()
+_file_index: Optional[Dict[str, str]] = None            # имя файла (в нижнем регистре) -> путь
+_family_paths: Dict[str, List[str]] = {}                # семейство -> существующие файлы
+_fonts: Dict[Tuple[str, int], Optional[ImageFont.ImageFont]] = {}  # (семейство, размер) -> шрифт
+
+
+def get_search_paths() -> List[str]:
+    """Каталоги поиска шрифтов в порядке приоритета."""
+    extra = [path for path in os.environ.get("FONT_PATHS", "").split(os.pathsep) if path]
+    platform = "linux" if sys.platform.startswith("linux") else sys.platform
+    dirs = extra + FONT_DIRS.get(platform, FONT_DIRS["linux"]) + [BUNDLED_FONTS_DIR]
+    return [os.path.expanduser(path) for path in dirs]
+
+
+def _build_index() -> Dict[str, str]:
+    # Один обход каталогов на процесс; при совпадении имён побеждает более приоритетный каталог
+    index: Dict[str, str] = {}
+    for directory in get_search_paths():
+        if not os.path.isdir(directory):
+            continue
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.lower().endswith((".ttf", ".ttc", ".otf")):
+                    index.setdefault(name.lower(), os.path.join(root, name))
+    return index
+
+
+def _resolve_family(family: str) -> List[str]:
+    global _file_index
+    paths = _family_paths.get(family)
+    if paths is None:
+        if _file_index is None:
+            _file_index = _build_index()
+        paths = []
+        for name in FONT_FAMILIES.get(family, []):
+            path = name if os.path.isabs(name) else _file_index.get(name.lower())
+            if path and os.path.exists(path) and path not in paths:
+                paths.append(path)
+        _family_paths[family] = paths
+        if not paths:
+            print(f"⚠️ Шрифты семейства {family} не найдены (FONT_PATHS, {BUNDLED_FONTS_DIR})")
+    return paths
+
+
+def register_family(family: str, candidates: List[str]):
+    """Задать (или переопределить) семейство: имена файлов или абсолютные пути по приоритету."""
+    with _lock:
+        FONT_FAMILIES[family] = list(candidates)
+        _family_paths.pop(family, None)
+        for key in [key for key in _fonts if key[0] == family]:
+            del _fonts[key]
+
+
+def reset_font_cache():
+    """Забыть найденные файлы и созданные шрифты (после смены FONT_PATHS / FONT_DIRS)."""
+    global _file_index
+    with _lock:
+        _file_index = None
+        _family_paths.clear()
+        _fonts.clear()
+        measure_text.cache_clear()
+
+
+def _default_font(size: int) -> ImageFont.ImageFont:
+    try:
+        # Pillow >= 10.1: масштабируемый встроенный шрифт
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def get_font(family: str = "text", size: int = 12, fallback: bool = True) -> Optional[ImageFont.ImageFont]:
+    """
+    Шрифт семейства family размера size из кеша процесса.
+    fallback=False - вернуть None, если ни один файл семейства не открылся
+    """
+    key = (family, size)
+    with _lock:
+        if key not in _fonts:
+            font = None
+            for path in _resolve_family(family):
+                try:
+                    font = ImageFont.truetype(path, size)
+                    print(f"✅ Используем шрифт {family} {size}px: {path}")
+                    break
+                except Exception as e:
+                    # Например, растровый шрифт эмодзи на неподдерживаемом размере
+                    print(f"⚠️ Ошибка загрузки {path} ({size}px): {e}")
+            _fonts[key] = font
+        font = _fonts[key]
+    if font is None and fallback:
+        return _default_font(size)
+    return font
+
+
+@functools.lru_cache(maxsize=8192)
+def measure_text(text: str, font: ImageFont.ImageFont) -> Tuple[int, int]:
+    """Ширина и высота текста в шрифте font (кешируется: шрифты из реестра живут весь процесс)."""
+    bbox = font.getbbox(text)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
 
 def find_best_font(size: int = 12) -> ImageFont.FreeTypeFont:
     """
     Находит лучший шрифт с поддержкой русского, английского и эмодзи
     Приоритет отдается шрифтам в стиле iPhone
     """
-    # Список шрифтов в порядке приоритета (лучшие первые)
-    font_candidates = [
-        # Эмодзи шрифты Windows (лучшая поддержка эмодзи)
-        "C:/Windows/Fonts/seguiemj.ttf",  # Segoe UI Emoji - основной шрифт эмодзи Windows
-        "C:/Windows/Fonts/NotoColorEmoji.ttf",  # Noto Color Emoji если установлен
-        
-        # Системные шрифты с хорошей поддержкой Unicode
-        "C:/Windows/Fonts/segoeui.ttf",   # Segoe UI - основной шрифт Windows
-        "C:/Windows/Fonts/calibri.ttf",   # Calibri - хорошая поддержка Unicode
-        "C:/Windows/Fonts/tahoma.ttf",    # Tahoma - отличная поддержка кириллицы
-        
-        # Старые надежные шрифты
-        "C:/Windows/Fonts/arial.ttf",     # Arial - базовая поддержка
-        "C:/Windows/Fonts/verdana.ttf",   # Verdana - хорошая читаемость
-    ]
-    
-    for font_path in font_candidates:
-        try:
-            if os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, size)
-                print(f"✅ Используем шрифт: {font_path}")
-                return font
-        except Exception as e:
-            print(f"⚠️ Ошибка загрузки {font_path}: {e}")
-            continue
-    
-    # Fallback к системному шрифту
-    try:
-        font = ImageFont.load_default()
-        print("⚠️ Используем системный шрифт по умолчанию")
-        return font
-    except Exception:
-        # Совсем крайний случай
-        return None
+    return get_font("best", size)
 
 def get_emoji_font(size: int = 12) -> Optional[ImageFont.FreeTypeFont]:
     """
     Специально для эмодзи - ищет шрифт с лучшей поддержкой эмодзи
     """
-    emoji_fonts = [
-        "C:/Windows/Fonts/seguiemj.ttf",  # Segoe UI Emoji
-        "C:/Windows/Fonts/NotoColorEmoji.ttf",  # Noto Color Emoji
-        "C:/Windows/Fonts/AppleColorEmoji.ttc",  # Apple шрифт эмодзи если есть
-    ]
-    
-    for font_path in emoji_fonts:
-        try:
-            if os.path.exists(font_path):
-                return ImageFont.truetype(font_path, size)
-        except Exception:
-            continue
-    
-    return None
+    return get_font("emoji", size, fallback=False)
 
 def get_composite_font_config(base_size: int = 12) -> dict:
     """
@@ -80,16 +207,17 @@ def test_font_support():
     Тестирует поддержку различных символов в найденных шрифтах
     """
     print("🔍 Тестирование шрифтов:")
-    
+    print(f"📂 Пути поиска: {', '.join(get_search_paths())}")
+
     test_strings = [
         "Hello World",      # Английский
         "Привет мир",       # Русский
         "💰🏛️⏰📦✨",        # Эмодзи
         "x50 по 5💰/шт",    # Смешанный текст
     ]
-    
+
     fonts = get_composite_font_config()
-    
+
     for font_name, font_obj in fonts.items():
         if font_obj:
             print(f"\n📝 {font_name.upper()} шрифт:")
@@ -105,4 +233,4 @@ def test_font_support():
                     print(f"  ❌ '{test_str}' - ошибка: {e}")
 
 if __name__ == "__main__":
-    test_font_support()
\ No newline at end of file
+    test_font_support()
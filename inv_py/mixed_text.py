@@ -1,58 +1,21 @@
 """
 Модуль для продвинутого рендеринга текста с эмодзи
 """
-from PIL import Image, ImageDraw, ImageFont
-import os
+from PIL import ImageDraw, ImageFont
 import re
-from typing import Tuple, Optional
+from typing import Tuple
+from .font_utils import get_font, measure_text
 
 def get_mixed_fonts(base_size: int = 12) -> dict:
     """
     Возвращает словарь с оптимальными шрифтами для разных типов текста
+    (шрифты берутся из общего реестра font_utils и не создаются заново)
     """
-    fonts = {}
-    
-    # Основной шрифт для текста (латиница, кириллица, цифры)
-    text_candidates = [
-        "C:/Windows/Fonts/segoeui.ttf",    # Segoe UI - четкий, современный
-        "C:/Windows/Fonts/tahoma.ttf",     # Tahoma - отличная кириллица
-        "C:/Windows/Fonts/calibri.ttf",   # Calibri - хорошая читаемость
-        "C:/Windows/Fonts/arial.ttf",     # Arial - универсальный
-    ]
-    
-    # Эмодзи шрифт
-    emoji_candidates = [
-        "C:/Windows/Fonts/seguiemj.ttf",  # Segoe UI Emoji
-        "C:/Windows/Fonts/NotoColorEmoji.ttf",  # Noto Color Emoji
-    ]
-    
-    # Находим лучший текстовый шрифт
-    fonts['text'] = None
-    for candidate in text_candidates:
-        try:
-            if os.path.exists(candidate):
-                fonts['text'] = ImageFont.truetype(candidate, base_size)
-                break
-        except Exception:
-            continue
-    
-    # Находим лучший эмодзи шрифт  
-    fonts['emoji'] = None
-    for candidate in emoji_candidates:
-        try:
-            if os.path.exists(candidate):
-                fonts['emoji'] = ImageFont.truetype(candidate, base_size)
-                break
-        except Exception:
-            continue
-    
-    # Fallback
-    if fonts['text'] is None:
-        fonts['text'] = ImageFont.load_default()
-    if fonts['emoji'] is None:
-        fonts['emoji'] = fonts['text']
-        
-    return fonts
+    text_font = get_font('text', base_size)
+    return {
+        'text': text_font,
+        'emoji': get_font('emoji', base_size, fallback=False) or text_font,
+    }
 
 def has_emoji(text: str) -> bool:
     """
@@ -116,8 +79,7 @@ def draw_mixed_text(draw: ImageDraw.Draw, position: Tuple[int, int], text: str,
         draw.text((x + total_width, y), part_text, font=font_to_use, fill=fill)
         
         # Вычисляем ширину для следующей части
-        bbox = draw.textbbox((0, 0), part_text, font=font_to_use)
-        part_width = bbox[2] - bbox[0]
+        part_width, _ = measure_text(part_text, font_to_use)
         total_width += part_width
     
     return total_width
@@ -125,12 +87,8 @@ def draw_mixed_text(draw: ImageDraw.Draw, position: Tuple[int, int], text: str,
 def get_mixed_text_size(text: str, text_font: ImageFont.FreeTypeFont, 
                        emoji_font: ImageFont.FreeTypeFont) -> Tuple[int, int]:
     """
-    Вычисляет размер текста с эмодзи
+    Вычисляет размер текста с эмодзи (ширины частей кешируются в font_utils.measure_text)
     """
-    # Создаем временное изображение для измерений
-    temp_img = Image.new('RGB', (1, 1))
-    temp_draw = ImageDraw.Draw(temp_img)
-    
     parts = split_text_and_emoji(text)
     total_width = 0
     max_height = 0
@@ -140,9 +98,7 @@ def get_mixed_text_size(text: str, text_font: ImageFont.FreeTypeFont,
             continue
             
         font_to_use = emoji_font if is_emoji else text_font
-        bbox = temp_draw.textbbox((0, 0), part_text, font=font_to_use)
-        part_width = bbox[2] - bbox[0]
-        part_height = bbox[3] - bbox[1]
+        part_width, part_height = measure_text(part_text, font_to_use)
         
         total_width += part_width
         max_height = max(max_height, part_height)
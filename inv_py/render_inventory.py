@@ -1,6 +1,9 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+import functools
 import os
-from typing import Iterable, Tuple, cast
+import threading
+from collections import OrderedDict
+from typing import Optional
 from .mixed_text import get_mixed_fonts, draw_mixed_text, get_mixed_text_size
 
 # Совместимость с разными версиями Pillow для фильтра LANCZOS
@@ -9,6 +12,80 @@ try:
 except Exception:
     RESAMPLE_LANCZOS = getattr(Image, "LANCZOS", Image.BICUBIC)  # type: ignore[attr-defined]
 
+# Сколько подготовленных иконок держать в памяти
+SPRITE_CACHE_SIZE = 512
+
+# (путь, размер, серая) -> (mtime файла, готовая RGBA-иконка); порядок - по последнему использованию
+_sprites: "OrderedDict[tuple, tuple]" = OrderedDict()
+_sprites_lock = threading.Lock()
+sprite_stats = {"hits": 0, "misses": 0}
+
+# Таблица для канала прозрачности серых иконок: половина непрозрачности
+_HALF_ALPHA = [a // 2 for a in range(256)]
+
+
+def _prepare_sprite(icon_path: str, size: int, greyed: bool) -> Image.Image:
+    with Image.open(icon_path) as source:
+        icon = source.convert('RGBA').resize((size, size), RESAMPLE_LANCZOS)
+    if greyed:
+        # Оттенки серого и половинная прозрачность - операциями над каналами, без цикла по пикселям
+        grey = icon.convert('L')
+        alpha = icon.getchannel('A').point(_HALF_ALPHA)
+        icon = Image.merge('RGBA', (grey, grey, grey, alpha))
+    return icon
+
+
+def get_sprite(icon_path: str, size: int, greyed: bool = False) -> Optional[Image.Image]:
+    """
+    Иконка, уменьшенная до size и (при greyed) обесцвеченная, из LRU-кеша.
+    Файл перечитывается, только если изменилось его время модификации.
+    Возвращаемое изображение общее - его нельзя менять, только вставлять.
+    """
+    try:
+        mtime = os.stat(icon_path).st_mtime_ns
+    except OSError:
+        return None
+    key = (icon_path, size, greyed)
+    with _sprites_lock:
+        cached = _sprites.get(key)
+        if cached is not None and cached[0] == mtime:
+            _sprites.move_to_end(key)
+            sprite_stats["hits"] += 1
+            return cached[1]
+    sprite = _prepare_sprite(icon_path, size, greyed)
+    with _sprites_lock:
+        sprite_stats["misses"] += 1
+        _sprites[key] = (mtime, sprite)
+        _sprites.move_to_end(key)
+        while len(_sprites) > SPRITE_CACHE_SIZE:
+            _sprites.popitem(last=False)
+    return sprite
+
+
+@functools.lru_cache(maxsize=2048)
+def _text_mask(text: str, text_font, emoji_font):
+    """
+    Маска глифов текста (с эмодзи) и её отступ: текст растеризуется один раз,
+    а тень и сам текст - это вставка маски нужным цветом со смещениями.
+    """
+    width, height = get_mixed_text_size(text, text_font, emoji_font)
+    pad = getattr(text_font, 'size', 12)
+    mask = Image.new('L', (width + 2 * pad, height + 2 * pad), 0)
+    draw_mixed_text(ImageDraw.Draw(mask), (pad, pad), text, text_font, emoji_font, fill=255)
+    return mask, pad
+
+
+def _outline_offsets(offset: int):
+    return [(dx, dy) for dx in (-offset, 0, offset) for dy in (-offset, 0, offset) if dx != 0 or dy != 0]
+
+
+def _paste_text(img, position, text, text_font, emoji_font, fill, offsets=((0, 0),)):
+    """Вставить текст цветом fill в каждое из смещений offsets от position."""
+    mask, pad = _text_mask(text, text_font, emoji_font)
+    x, y = position[0] - pad, position[1] - pad
+    for dx, dy in offsets:
+        img.paste(fill, (x + dx, y + dy), mask)
+
 def render_inventory_grid(items, item_images, grid_size=(3, 3), cell_size=128, font_path=None, greyed_out=None):
     """
     Renders inventory grid with optional grayed out items
@@ -28,6 +105,8 @@ def render_inventory_grid(items, item_images, grid_size=(3, 3), cell_size=128, f
     fonts = get_mixed_fonts(12)
     text_font = fonts['text']
     emoji_font = fonts['emoji']
+    # Шрифт для номеров слотов
+    big_font = get_mixed_fonts(27)['text']
 
     for idx, (item_id, count, name) in enumerate(items):
         col = idx % cols
@@ -36,42 +115,20 @@ def render_inventory_grid(items, item_images, grid_size=(3, 3), cell_size=128, f
         y = row * cell_size
         if item_id == "empty":
             slot_num = str(idx + 1)
-            # Шрифт для номеров слотов
-            big_fonts = get_mixed_fonts(27)
-            big_font = big_fonts['text']
-            
             bbox = draw.textbbox((0, 0), slot_num, font=big_font)
             text_w = bbox[2] - bbox[0]
             text_h = bbox[3] - bbox[1]
             text_x = x + (cell_size - text_w) // 2
             text_y = y + (cell_size - text_h) // 2
-            for dx in [-2, 0, 2]:
-                for dy in [-2, 0, 2]:
-                    if dx != 0 or dy != 0:
-                        draw.text((text_x+dx, text_y+dy), slot_num, font=big_font, fill=(255,255,255))
-            draw.text((text_x, text_y), slot_num, font=big_font, fill=(120, 60, 30))
+            _paste_text(img, (text_x, text_y), slot_num, big_font, big_font, (255, 255, 255), _outline_offsets(2))
+            _paste_text(img, (text_x, text_y), slot_num, big_font, big_font, (120, 60, 30))
         else:
             icon_path = item_images.get(item_id)
             is_greyed = item_id in greyed_out
             
-            if icon_path and os.path.exists(icon_path):
-                icon = Image.open(icon_path).convert('RGBA').resize((cell_size-16, cell_size-16), RESAMPLE_LANCZOS)
-                
-                # Apply graying effect if item is out of stock
-                if is_greyed:
-                    # Convert to grayscale and reduce opacity
-                    grayscale = icon.convert('L')  # Convert to grayscale
-                    grayscale_rgba = Image.merge('RGBA', (grayscale, grayscale, grayscale, icon.split()[-1]))
-                    
-                    # Reduce opacity
-                    pixels = cast(Iterable[Tuple[int,int,int,int]], grayscale_rgba.getdata())
-                    new_pixels = []
-                    for r, g, b, a in pixels:
-                        new_a = int(a * 0.5) if a > 0 else 0
-                        new_pixels.append((r, g, b, new_a))
-                    grayscale_rgba.putdata(new_pixels)
-                    icon = grayscale_rgba
-                
+            # Иконка (серая, если товара нет в наличии) из кеша спрайтов
+            icon = get_sprite(icon_path, cell_size-16, is_greyed) if icon_path else None
+            if icon is not None:
                 img.paste(icon, (x+8, y+8), icon)
             
             # Поддержка «сырых» меток без префикса x: если count строка и начинается с '!', рисуем как есть
@@ -100,15 +157,12 @@ def render_inventory_grid(items, item_images, grid_size=(3, 3), cell_size=128, f
             x1 = x + (cell_size - w1) // 2
             x2 = x + (cell_size - w2) // 2
             
-            # Рисуем тени
-            for dx in [-1, 0, 1]:
-                for dy in [-1, 0, 1]:
-                    if dx != 0 or dy != 0:
-                        draw_mixed_text(draw, (x1+dx, y0+dy), count_text, text_font, emoji_font, fill=shadow_color)
-                        draw_mixed_text(draw, (x2+dx, y0+h1+2+dy), name_text, text_font, emoji_font, fill=shadow_color)
+            # Рисуем тени (текст растеризуется один раз и вставляется маской)
+            _paste_text(img, (x1, y0), count_text, text_font, emoji_font, shadow_color, _outline_offsets(1))
+            _paste_text(img, (x2, y0+h1+2), name_text, text_font, emoji_font, shadow_color, _outline_offsets(1))
             
             # Рисуем основной текст с эмодзи
-            draw_mixed_text(draw, (x1, y0), count_text, text_font, emoji_font, fill=text_color)
-            draw_mixed_text(draw, (x2, y0+h1+2), name_text, text_font, emoji_font, fill=text_color)
+            _paste_text(img, (x1, y0), count_text, text_font, emoji_font, text_color)
+            _paste_text(img, (x2, y0+h1+2), name_text, text_font, emoji_font, text_color)
 
     return img
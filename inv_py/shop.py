@@ -3,9 +3,8 @@ from aiogram import types
 import database as db
 from inv_py.config_inventory import ITEMS_CONFIG
 from inv_py.inventory_db import get_item_quantity
-import tempfile
+import render_cache
 import os
-from inv_py.render_inventory import render_inventory_grid
 from typing import Optional
 
 SHOP_ITEMS = {}
@@ -193,6 +192,7 @@ def purchase_item(user_id: int, item_id: str, quantity: int = 1):
         
         # Сохраняем в файл
         save_stock_to_file(item_id, new_stock)
+        render_cache.invalidate("shop")
         print(f"📦 Товар {item_id}: сток {old_stock} → {new_stock}")
     
     item_name = ITEMS_CONFIG.get(item_id, {}).get("name", item_id)
@@ -273,24 +273,25 @@ def render_shop_grid(page: int = 1, font_path: Optional[str] = None):
     while len(grid_items) < PER_PAGE:
         grid_items.append(("empty", 0, "Пусто"))
     
-    # Render with graying out for out-of-stock items
-    img = render_inventory_grid(
-        grid_items, 
-        item_images, 
-        grid_size=(3, 3), 
-        cell_size=128, 
-        font_path=font_path,
-        greyed_out=greyed_out
+    # Render with graying out for out-of-stock items (перерисовка только при изменении стока)
+    return render_cache.get_or_render(
+        "shop",
+        (grid_items, item_images, greyed_out, font_path),
+        lambda: render_inventory_grid(
+            grid_items,
+            item_images,
+            grid_size=(3, 3),
+            cell_size=128,
+            font_path=font_path,
+            greyed_out=greyed_out
+        ),
+        files=item_images.values(),
+        tags=("shop",),
     )
-    
-    # Save to temporary file
-    tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-    tmp_path = tmp.name
-    tmp.close()
-    img.save(tmp_path)
-    return tmp_path
 
 def render_category_image(category_id: str, page: int, font_path: Optional[str] = None):
+    from inv_py.render_inventory import render_inventory_grid
+    
     items, total, max_page = get_category_items(category_id, page)
     grid_items = []
     item_images = {}
@@ -309,12 +310,13 @@ def render_category_image(category_id: str, page: int, font_path: Optional[str]
         grid_items.append((item_id, count, name))
     while len(grid_items) < PER_PAGE:
         grid_items.append(("empty", 0, "Пусто"))
-    img = render_inventory_grid(grid_items, item_images, grid_size=(3,3), cell_size=128, font_path=font_path)
-    tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-    tmp_path = tmp.name
-    tmp.close()
-    img.save(tmp_path)
-    return tmp_path
+    return render_cache.get_or_render(
+        "shop_category",
+        (category_id, grid_items, item_images, font_path),
+        lambda: render_inventory_grid(grid_items, item_images, grid_size=(3,3), cell_size=128, font_path=font_path),
+        files=item_images.values(),
+        tags=("shop",),
+    )
 
 def init_shop():
     try:
@@ -332,6 +334,7 @@ def add_shop_item(item_id: str, price: int, currency: str = "dan", category: str
         print(f"Предмет {item_id} не найден в ITEMS_CONFIG")
         return False
     SHOP_ITEMS[item_id] = {"price": price, "currency": currency, "stock": stock}
+    render_cache.invalidate("shop")
     if category in SHOP_CATEGORIES:
         if item_id not in SHOP_CATEGORIES[category]["items"]:
             SHOP_CATEGORIES[category]["items"].append(item_id)
@@ -350,7 +353,6 @@ import database as db
 from inv_py.config_inventory import ITEMS_CONFIG
 import tempfile
 import os
-from inv_py.render_inventory import render_inventory_grid
 
 # Конфигурация магазина - какие предметы продаются
 # Preserve existing SHOP_ITEMS if already defined
@@ -504,6 +506,8 @@ def get_item_info(item_id: str):
 
 
 def render_category_image(category_id: str, page: int, font_path: Optional[str] = None):
+    from inv_py.render_inventory import render_inventory_grid
+    
     items, total, max_page = get_category_items(category_id, page)
     grid_items = []
     item_images = {}
@@ -0,0 +1,139 @@
+"""
+Ленивая загрузка модулей и реестр фич бота.
+
+main.py при импорте тянул Pillow (через inv_py), все игровые модули и
+вызывал lazy_import_heavy_modules / import_game_modules при каждом старте,
+даже если до рендера картинок или игры дело не доходило. Здесь модуль
+подставляется прокси-объектом и импортируется при первом обращении к
+атрибуту:
+
+    clad = lazy_modules.lazy("plugins.games.clad")
+    clad.start_clad_game(user_id, bet)      # здесь и происходит импорт
+
+FEATURES — какие модули составляют каждую фичу: роутер фичи (features/) и
+модули, которые он использует. Модули фич не импортируют main на уровне
+модуля, поэтому их можно загрузить отдельно (например, в воркере рассылок
+или рендера):
+
+    lazy_modules.load_feature("shop")
+
+Время импорта каждого модуля пишется в load_times() — его же показывает
+tools/startup_benchmark.py.
+"""
+import importlib
+import sys
+import threading
+import time
+import types
+from typing import Callable, Dict, List
+
+# Фича -> модули, которые она использует (порядок = порядок загрузки)
+FEATURES: Dict[str, List[str]] = {
+    "bank": ["features.bank", "bank"],
+    "farm": ["features.farm", "ferma"],
+    "inventory": ["inv_py.config_inventory", "inv_py.inventory", "inv_py.render_inventory"],
+    "auction": ["features.auction", "inv_py.auction"],
+    "shop": ["features.shop", "inv_py.shop"],
+    "lottery": ["features.lottery", "drawkruz"],
+    "arena": ["features.arena", "arena_database", "plugins.games.arena"],
+    "games": [
+        "features.games",
+        "plugins.games.clad",
+        "plugins.games.saper",
+        "plugins.games.battles",
+        "plugins.games.betcosty",
+        "plugins.games.bowling",
+        "plugins.games.darts",
+        "plugins.games.soccer",
+        "plugins.games.tic_tac_toe",
+        "plugins.games.case_system",
+    ],
+    "admin": ["features.admin"],
+    "voice": ["plugins.api_soft_ai.voice"],
+}
+
+_lock = threading.RLock()
+_load_times: Dict[str, float] = {}  # модуль -> секунд на первый импорт
+
+
+def _import(name: str) -> types.ModuleType:
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with _lock:
+        module = sys.modules.get(name)
+        if module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(name)
+            _load_times[name] = time.perf_counter() - started
+            print(f"📦 Загружен модуль {name} ({_load_times[name] * 1000:.0f} мс)")
+    return module
+
+
+class LazyModule(types.ModuleType):
+    """Прокси модуля: настоящий импорт — при первом обращении к атрибуту."""
+
+    def __init__(self, name: str, *fallbacks: str):
+        super().__init__(name)
+        # Имена пробуются по очереди (как load_module в main.py: inv_py.<имя>, затем <имя>)
+        object.__setattr__(self, "_lazy_names", (name,) + fallbacks)
+        object.__setattr__(self, "_lazy_module", None)
+
+    def _load(self) -> types.ModuleType:
+        module = object.__getattribute__(self, "_lazy_module")
+        if module is None:
+            names = object.__getattribute__(self, "_lazy_names")
+            for index, name in enumerate(names):
+                try:
+                    module = _import(name)
+                    break
+                except ImportError:
+                    if index == len(names) - 1:
+                        raise
+            object.__setattr__(self, "_lazy_module", module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    @property
+    def is_loaded(self) -> bool:
+        return object.__getattribute__(self, "_lazy_module") is not None
+
+    def __repr__(self):
+        names = object.__getattribute__(self, "_lazy_names")
+        state = "загружен" if self.is_loaded else "не загружен"
+        return f"<lazy module {names[0]!r} ({state})>"
+
+
+def lazy(name: str, *fallbacks: str) -> LazyModule:
+    """Модуль name (или первый импортируемый из fallbacks), загружаемый при первом использовании."""
+    return LazyModule(name, *fallbacks)
+
+
+def handler(module: str, attr: str) -> Callable:
+    """Асинхронный хендлер handler(event) из модуля module, который импортируется при первом вызове."""
+    proxy = lazy(module)
+
+    async def lazy_handler(event):
+        return await getattr(proxy, attr)(event)
+
+    lazy_handler.__name__ = attr
+    lazy_handler.__qualname__ = f"{module}.{attr}"
+    return lazy_handler
+
+
+def load_feature(feature: str) -> List[types.ModuleType]:
+    """Загрузить все модули фичи (например, заранее в воркере). KeyError — неизвестная фича."""
+    return [_import(name) for name in FEATURES[feature]]
+
+
+def load_times() -> Dict[str, float]:
+    """Время первого импорта (секунды) модулей, загруженных через этот модуль."""
+    return dict(_load_times)
@@ -0,0 +1,184 @@
+"""
+Таблицы лидеров: топ мира по дани, топ по играм, топ ферм и рейтинг арены.
+
+Раньше каждый показ топа делал ORDER BY ... LIMIT 20, полный просмотр
+COUNT(*) WHERE x > (подзапрос) для места игрока и ещё по запросу на каждую
+строку топа. Теперь для каждой таблицы в памяти держится снимок:
+
+- топ-N строк (TOP_SIZE) — для вывода топа;
+- отсортированный список значений всех игроков — место считается бинарным
+  поиском за O(log n).
+
+Снимок читается по индексам (миграция 9 в database.py и индекс рейтинга в
+arena_database.py) и обновляется не чаще раза в REFRESH_INTERVAL секунд при
+первом обращении после устаревания. Готовый текст топа кэшируется отдельно
+(get_text), место игрока считается по его текущему значению.
+
+    top = leaderboard.get_top("dan", 20)
+    place = leaderboard.get_rank("dan", user_id)
+"""
+import threading
+import time
+from bisect import bisect_right
+from typing import Callable, Dict, List, Optional
+
+import database as db
+import ttl_cache
+
+# Как часто перечитывать снимок таблицы, секунд
+REFRESH_INTERVAL = 30
+# Сколько верхних строк держать в снимке
+TOP_SIZE = 100
+
+
+class Board:
+    """Описание таблицы лидеров.
+
+    top_sql — топ по убыванию, первые две колонки: user_id и значение;
+    values_sql — (user_id, значение) всех участников по возрастанию значения;
+    own_value(user_id) — текущее значение игрока (None — игрока нет в таблице).
+    """
+
+    def __init__(self, name: str, top_sql: str, values_sql: str, own_value: Callable):
+        self.name = name
+        self.top_sql = top_sql
+        self.values_sql = values_sql
+        self.own_value = own_value
+        self.top: List[tuple] = []
+        self.values: List[float] = []
+        self.by_user: Dict[int, float] = {}
+        self.loaded_at = 0.0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.loaded_at >= REFRESH_INTERVAL
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            if not force and not self.is_stale():
+                return
+            conn = db._connect(row_factory=None)
+            try:
+                top = conn.execute(self.top_sql, (TOP_SIZE,)).fetchall()
+                rows = conn.execute(self.values_sql).fetchall()
+            finally:
+                conn.close()
+            self.top = top
+            # Строки уже идут по индексу в порядке возрастания, sorted здесь почти бесплатен
+            # и нужен только из-за NULL, которые становятся нулями
+            self.values = sorted(value or 0 for _, value in rows)
+            self.by_user = {user_id: value or 0 for user_id, value in rows}
+            self.loaded_at = time.monotonic()
+            self.refreshes += 1
+
+    def rank(self, value, user_id: Optional[int] = None) -> int:
+        """Место для значения value: 1 + число участников со значением строго больше."""
+        values = self.values
+        higher = len(values) - bisect_right(values, value)
+        # Снимок может помнить старое, большее значение самого игрока
+        if user_id is not None and self.by_user.get(user_id, value) > value:
+            higher -= 1
+        return max(higher, 0) + 1
+
+
+def _user_field(field: str) -> Callable:
+    def own_value(user_id: int):
+        user = db.get_user(user_id)
+        return (user.get(field) or 0) if user else None
+    return own_value
+
+
+def _arena_rating(user_id: int):
+    conn = db._connect(row_factory=None)
+    try:
+        row = conn.execute("SELECT rating FROM arena_ratings WHERE user_id = ?", (user_id,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+BOARDS: Dict[str, Board] = {
+    board.name: board for board in (
+        Board(
+            "dan",
+            "SELECT user_id, dan, username, games_played FROM users "
+            "WHERE games_played > 0 ORDER BY dan DESC LIMIT ?",
+            "SELECT user_id, dan FROM users ORDER BY dan",
+            _user_field("dan"),
+        ),
+        Board(
+            "games",
+            "SELECT user_id, games_played, username FROM users "
+            "WHERE games_played > 0 ORDER BY games_played DESC LIMIT ?",
+            "SELECT user_id, games_played FROM users ORDER BY games_played",
+            _user_field("games_played"),
+        ),
+        Board(
+            "farm",
+            "SELECT user_id, farm_income, username FROM users ORDER BY farm_income DESC LIMIT ?",
+            "SELECT user_id, farm_income FROM users ORDER BY farm_income",
+            _user_field("farm_income"),
+        ),
+        Board(
+            "arena",
+            "SELECT user_id, rating, username, wins, losses, win_streak, games_played "
+            "FROM arena_ratings WHERE games_played > 0 ORDER BY rating DESC, wins DESC LIMIT ?",
+            "SELECT user_id, rating FROM arena_ratings ORDER BY rating",
+            _arena_rating,
+        ),
+    )
+}
+
+# Готовые тексты топов (ключ — имя таблицы или (таблица, вариант))
+_texts = ttl_cache.TTLCache("leaderboard_text", maxsize=64, ttl=REFRESH_INTERVAL)
+
+
+def _board(name: str) -> Board:
+    board = BOARDS[name]
+    if board.is_stale():
+        board.refresh()
+    return board
+
+
+def get_top(name: str, limit: int = 20) -> List[tuple]:
+    """Первые limit строк таблицы name (limit не больше TOP_SIZE)."""
+    return _board(name).top[:limit]
+
+
+def get_rank(name: str, user_id: int, value=None) -> int:
+    """Место игрока в таблице name. value — его текущее значение, если уже известно."""
+    board = _board(name)
+    if value is None:
+        value = board.own_value(user_id)
+        if value is None:
+            # Как и прежний COUNT(*) по подзапросу: игрока нет в таблице — место 1
+            return 1
+    return board.rank(value, user_id)
+
+
+def get_text(key, render: Callable[[], Optional[str]]) -> Optional[str]:
+    """Текст топа из кэша или render() (None не кэшируется)."""
+    return _texts.get_or_load(key, lambda _: render())
+
+
+def invalidate(name: Optional[str] = None):
+    """Принудительно перечитать снимки и тексты при следующем обращении."""
+    for board in BOARDS.values():
+        if name is None or board.name == name:
+            board.loaded_at = 0.0
+    _texts.clear()
+
+
+def get_stats() -> Dict[str, Dict[str, float]]:
+    now = time.monotonic()
+    stats = {
+        board.name: {
+            "players": len(board.values),
+            "refreshes": board.refreshes,
+            "age": round(now - board.loaded_at, 1) if board.loaded_at else None,
+        }
+        for board in BOARDS.values()
+    }
+    stats["text_cache"] = _texts.stats()
+    return stats
@@ -0,0 +1,174 @@
+"""
+Повторное использование фото, уже загруженных в Telegram (file_id).
+
+Статические картинки (fermaday.png/fermanight.png, win*/lose* в battles,
+chest*.png, startphoto.jpg, фото предметов) весят по 1.5–2 МБ, и раньше
+каждая отправка через FSInputFile загружала файл заново. Здесь файл
+загружается один раз, file_id из ответа Telegram запоминается в таблице
+media_files (ключ — путь, рядом хэш содержимого) и дальше отправляется
+вместо файла. Если файл на диске изменился (другой хэш), он загружается
+заново; если Telegram отклоняет устаревший file_id, запись удаляется и
+файл тоже загружается заново.
+
+    await media_cache.send_photo(message.answer_photo, path, caption=text)
+    await media_cache.send_photo(bot.send_photo, path, chat_id=chat_id, caption=text)
+    await media_cache.edit_photo(callback.message.edit_media, path, caption=text, reply_markup=kb)
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto, Message
+
+import database as db
+
+# Фрагменты текста ошибок Telegram о недействительном file_id
+_STALE_ID_ERRORS = ("wrong file identifier", "wrong remote file", "file reference", "file_id")
+
+_lock = threading.Lock()
+_file_ids: Dict[str, Tuple[str, str]] = {}        # путь -> (хэш, file_id)
+_digests: Dict[str, Tuple[int, int, str]] = {}    # путь -> (mtime_ns, размер, хэш)
+_loaded = False
+
+# Статистика для /dbstats
+stats = {"uploads": 0, "reused": 0, "stale": 0}
+
+
+def _key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(str(path)))
+
+
+def _digest(path: str) -> Optional[str]:
+    """sha1 содержимого; пересчитывается только если изменились mtime или размер."""
+    key = _key(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cached = _digests.get(key)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _digests[key] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def _ensure_loaded():
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if _loaded:
+            return
+        conn = db._connect(row_factory=None)
+        try:
+            for path, digest, file_id in conn.execute("SELECT path, digest, file_id FROM media_files"):
+                _file_ids[path] = (digest, file_id)
+        finally:
+            conn.close()
+        _loaded = True
+
+
+def lookup(path: str) -> Optional[str]:
+    """file_id для файла path, если он уже загружался и с тех пор не менялся."""
+    _ensure_loaded()
+    entry = _file_ids.get(_key(path))
+    if not entry:
+        return None
+    return entry[1] if entry[0] == _digest(path) else None
+
+
+def remember(path: str, file_id: str):
+    digest = _digest(path)
+    if not digest:
+        return
+    key = _key(path)
+    with _lock:
+        _file_ids[key] = (digest, file_id)
+    conn = db._connect(row_factory=None)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO media_files (path, digest, file_id, updated_at) VALUES (?, ?, ?, ?)",
+            (key, digest, file_id, int(time.time())),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def forget(path: str):
+    key = _key(path)
+    with _lock:
+        _file_ids.pop(key, None)
+    conn = db._connect(row_factory=None)
+    try:
+        conn.execute("DELETE FROM media_files WHERE path = ?", (key,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _photo_file_id(result) -> Optional[str]:
+    # edit_media для инлайн-сообщений возвращает True — там запоминать нечего
+    if isinstance(result, Message) and result.photo:
+        return result.photo[-1].file_id
+    return None
+
+
+def _is_stale_id(error: TelegramBadRequest) -> bool:
+    text = str(error).lower()
+    return any(fragment in text for fragment in _STALE_ID_ERRORS)
+
+
+async def _send(call, path: str, wrap):
+    """Отправить через call(wrap(media)): сначала file_id, при отказе — загрузка файла."""
+    file_id = await asyncio.to_thread(lookup, path)
+    if file_id:
+        try:
+            result = await call(wrap(file_id))
+            stats["reused"] += 1
+            return result
+        except TelegramBadRequest as e:
+            if not _is_stale_id(e):
+                raise
+            stats["stale"] += 1
+            print(f"⚠️ media_cache: file_id для {path} устарел, загружаем заново")
+            await asyncio.to_thread(forget, path)
+    result = await call(wrap(FSInputFile(path)))
+    stats["uploads"] += 1
+    new_id = _photo_file_id(result)
+    if new_id:
+        try:
+            await asyncio.to_thread(remember, path, new_id)
+        except Exception as e:
+            print(f"⚠️ media_cache: не удалось сохранить file_id для {path}: {e}")
+    return result
+
+
+async def send_photo(send, path: str, **kwargs):
+    """send — message.answer_photo / message.reply_photo / bot.send_photo; kwargs — остальные параметры."""
+    return await _send(lambda media: send(photo=media, **kwargs), path, lambda media: media)
+
+
+async def edit_photo(edit, path: str, caption: Optional[str] = None, parse_mode: Optional[str] = None, **kwargs):
+    """edit — message.edit_media / bot.edit_message_media; kwargs — reply_markup, chat_id, message_id..."""
+    media_kwargs = {"caption": caption}
+    if parse_mode is not None:
+        # Без явного parse_mode остаётся значение по умолчанию бота
+        media_kwargs["parse_mode"] = parse_mode
+    return await _send(
+        lambda media: edit(media=media, **kwargs), path,
+        lambda media: InputMediaPhoto(media=media, **media_kwargs),
+    )
+
+
+def get_stats() -> Dict[str, int]:
+    return dict(stats, known=len(_file_ids))
@@ -0,0 +1,201 @@
+"""
+Версионированные миграции единого хранилища database/game_bot.db.
+
+Раньше данные лежали в шести файлах (game_bot.db, bank.db, arena.db, tasks.db,
+messages.db, referral_bot.db) плюс MESSAGES_DB_FILE в корне. Теперь всё живёт
+в одном файле в режиме WAL, а старые файлы один раз вливаются в него
+шагами-миграциями. Применённые шаги записываются в таблицу schema_version,
+поэтому повторный запуск (и запуск в нескольких процессах) ничего не делает.
+
+Шаг регистрируется декоратором:
+
+    @migrations.migration(3, "merge bank.db", attach={"legacy": BANK_PATH})
+    def _merge_bank(cur, attached):
+        migrations.merge_attached(cur, "legacy", attached)
+
+Если у шага есть attach, файлы подключаются через ATTACH, а сам шаг и запись
+номера версии выполняются в одной транзакции BEGIN IMMEDIATE. Шаг с
+transactional=False выполняется без общей транзакции (например, вызывает
+функции, открывающие свои соединения), поэтому должен быть идемпотентным.
+
+Схема проверяется и дополняется только здесь, один раз при запуске: код,
+обрабатывающий запросы, не делает PRAGMA table_info и ALTER TABLE. Если в
+schema_version есть версия новее, чем знает код, запуск прерывается — старый
+код не должен работать с уже обновлённой схемой.
+"""
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+SCHEMA_TABLE = "schema_version"
+
+# version -> (name, func, attach, transactional)
+_registry: Dict[int, tuple] = {}
+
+
+class StaleCodeError(RuntimeError):
+    """Схема БД новее, чем миграции, известные этому коду."""
+
+
+def migration(version: int, name: str, attach: Optional[Dict[str, str]] = None,
+              transactional: bool = True):
+    """Декоратор: зарегистрировать шаг миграции с номером version."""
+    def decorator(func: Callable):
+        if version in _registry and _registry[version][1] is not func:
+            raise ValueError(f"Миграция {version} уже зарегистрирована: {_registry[version][0]}")
+        _registry[version] = (name, func, dict(attach or {}), transactional)
+        return func
+    return decorator
+
+
+def latest_version() -> int:
+    return max(_registry) if _registry else 0
+
+
+def _ensure_version_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at INTEGER
+        )
+    """)
+    conn.commit()
+
+
+def applied_versions(conn) -> set:
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute(f"SELECT version FROM {SCHEMA_TABLE}")}
+
+
+def check_code_version(done: set):
+    """Не даём старому коду работать с БД, которую уже обновил более новый код."""
+    unknown = sorted(v for v in done if v not in _registry)
+    if unknown:
+        raise StaleCodeError(
+            f"Схема БД версии {max(done)} новее кода (известно до {latest_version()}): "
+            f"неизвестные миграции {unknown}. Обновите бота."
+        )
+
+
+def run_migrations(connect: Callable) -> List[int]:
+    """Применить все ещё не применённые шаги по возрастанию номера.
+
+    connect() должен возвращать соединение с единым хранилищем.
+    Возвращает список применённых сейчас версий.
+    """
+    conn = connect()
+    applied_now = []
+    try:
+        done = applied_versions(conn)
+        check_code_version(done)
+        for version in sorted(_registry):
+            if version in done:
+                continue
+            name, func, attach, transactional = _registry[version]
+            if not transactional:
+                func(conn.cursor(), set())
+                conn.execute(
+                    f"INSERT OR IGNORE INTO {SCHEMA_TABLE} (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, int(time.time())),
+                )
+                conn.commit()
+                applied_now.append(version)
+                print(f"🔧 Миграция {version}: {name}")
+                continue
+            attached = set()
+            try:
+                # ATTACH нельзя выполнять внутри транзакции
+                for alias, path in attach.items():
+                    if path and os.path.exists(path):
+                        conn.execute("ATTACH DATABASE ? AS " + alias, (path,))
+                        attached.add(alias)
+                cur = conn.cursor()
+                cur.execute("BEGIN IMMEDIATE")
+                # Другой процесс мог успеть применить шаг, пока мы ждали блокировку
+                cur.execute(f"SELECT 1 FROM {SCHEMA_TABLE} WHERE version = ?", (version,))
+                if cur.fetchone():
+                    conn.rollback()
+                    continue
+                func(cur, attached)
+                cur.execute(
+                    f"INSERT INTO {SCHEMA_TABLE} (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, int(time.time())),
+                )
+                conn.commit()
+                applied_now.append(version)
+                print(f"🔧 Миграция {version}: {name}")
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                for alias in attached:
+                    try:
+                        conn.execute("DETACH DATABASE " + alias)
+                    except Exception:
+                        pass
+    finally:
+        conn.close()
+    return applied_now
+
+
+def _columns(cur, schema: str, table: str) -> List[str]:
+    cur.execute(f'PRAGMA {schema}.table_info("{table}")')
+    return [row[1] for row in cur.fetchall()]
+
+
+def add_column(cur, table: str, column: str, decl: str):
+    """ALTER TABLE ... ADD COLUMN, если таблица есть, а колонки в ней ещё нет.
+
+    Для шагов миграций: у новых БД колонки уже есть в CREATE TABLE, у старых
+    добавляются здесь один раз.
+    """
+    cols = _columns(cur, "main", table)
+    if cols and column not in cols:
+        cur.execute(f'ALTER TABLE main."{table}" ADD COLUMN {column} {decl}')
+
+
+def merge_attached(cur, alias: str, attached, tables: Optional[List[str]] = None,
+                   only_if_empty: bool = False):
+    """Влить таблицы подключённой БД alias в main.
+
+    Отсутствующие таблицы и индексы создаются по схеме источника, строки
+    копируются по общим колонкам через INSERT OR IGNORE (существующие ключи
+    не перезаписываются). tables ограничивает список таблиц, only_if_empty
+    пропускает таблицы, в которых в main уже есть данные.
+    """
+    if alias not in attached:
+        return
+    cur.execute(f"SELECT name, sql FROM {alias}.sqlite_master WHERE type = 'table' AND sql IS NOT NULL")
+    source_tables = [(n, sql) for n, sql in cur.fetchall() if not n.startswith("sqlite_")]
+    for table, create_sql in source_tables:
+        if tables is not None and table not in tables:
+            continue
+        cur.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        if not cur.fetchone():
+            # Без префикса схемы CREATE TABLE создаёт таблицу в main
+            cur.execute(create_sql)
+        elif only_if_empty:
+            cur.execute(f'SELECT 1 FROM main."{table}" LIMIT 1')
+            if cur.fetchone():
+                continue
+        source_cols = _columns(cur, alias, table)
+        target_cols = set(_columns(cur, "main", table))
+        cols = [c for c in source_cols if c in target_cols]
+        if not cols:
+            continue
+        col_list = ",".join(f'"{c}"' for c in cols)
+        cur.execute(
+            f'INSERT OR IGNORE INTO main."{table}" ({col_list}) SELECT {col_list} FROM {alias}."{table}"'
+        )
+        copied = cur.rowcount
+        if copied:
+            print(f"   ↳ {table}: перенесено строк {copied}")
+    # Индексы источника (автоиндексы PRIMARY KEY/UNIQUE имеют sql = NULL)
+    cur.execute(f"SELECT name, tbl_name, sql FROM {alias}.sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+    for name, tbl_name, sql in cur.fetchall():
+        if tables is not None and tbl_name not in tables:
+            continue
+        cur.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'index' AND name = ?", (name,))
+        if not cur.fetchone():
+            cur.execute(sql)
@@ -2,6 +2,6 @@
 API Soft AI - плагин для транскрипции голосовых сообщений
 """
 
-from .voice import transcribe_voice_message
+from .voice import transcribe_voice_message, transcription_service
 
-__all__ = ['transcribe_voice_message']
+__all__ = ['transcribe_voice_message', 'transcription_service']
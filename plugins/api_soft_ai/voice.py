@@ -1,155 +1,219 @@
-import requests
-import time
+import asyncio
 import os
-import tempfile
-from typing import Optional
+import time
+from typing import AsyncIterator, Dict, Optional
+
+import aiohttp
+
+import session_store
 
 # AssemblyAI API settings
 ASSEMBLYAI_API_KEY = "3e3eebf57daf4aaea8453bcf5c480674"
-ASSEMBLYAI_BASE_URL = "https://api.assemblyai.com"
+# Can be pointed at a local stub HTTP server for testing
+ASSEMBLYAI_BASE_URL = os.getenv("ASSEMBLYAI_BASE_URL", "https://api.assemblyai.com")
 
-HEADERS = {
-    "authorization": ASSEMBLYAI_API_KEY
-}
+# How many voice messages are transcribed at the same time
+MAX_CONCURRENT_JOBS = 4
+# How many voice messages may wait in the queue (beyond that the service reports it is busy)
+MAX_QUEUED_JOBS = 100
+# Polling: first delay, growth factor, maximum delay and overall limit (seconds)
+POLL_INITIAL_DELAY = 1.0
+POLL_BACKOFF = 1.5
+POLL_MAX_DELAY = 10.0
+POLL_TIMEOUT = 180
+# Chunk size for streaming the voice file from Telegram to AssemblyAI
+STREAM_CHUNK_SIZE = 64 * 1024
 
+# Transcripts by Telegram file_unique_id: the same voice (forwards, repeated requests)
+# is not sent to AssemblyAI twice
+transcript_cache = session_store.SessionStore("voice_transcripts", ttl=86400, maxsize=5000)
 
-async def download_voice_file(bot, file_id: str) -> Optional[str]:
-    """
-    Downloads a voice file from Telegram and saves it temporarily
-    Returns the path to the temporary file or None on error
-    """
-    try:
-        # Get file info from Telegram
-        file_info = await bot.get_file(file_id)
-        
-        # Download file
-        file_bytes = await bot.download_file(file_info.file_path)
-        
-        # Save to temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".ogg")
-        temp_file.write(file_bytes.read())
-        temp_file.close()
-        
-        return temp_file.name
-    except Exception as e:
-        print(f"❌ Error downloading voice file: {e}")
-        return None
-
-
-def upload_file_to_assemblyai(file_path: str) -> Optional[str]:
+
+class TranscriptionService:
     """
-    Uploads a local audio file to AssemblyAI
-    Returns the upload URL or None on error
+    Asynchronous AssemblyAI client: a shared aiohttp session, a bounded job queue
+    served by a fixed number of workers and exponential-backoff polling.
+    Nothing here blocks the event loop, so other updates keep being handled
+    while a voice message is transcribed.
     """
-    try:
-        with open(file_path, "rb") as f:
-            response = requests.post(
-                ASSEMBLYAI_BASE_URL + "/v2/upload",
-                headers=HEADERS,
-                data=f
-            )
-        
-        if response.status_code == 200:
-            return response.json()["upload_url"]
-        else:
-            print(f"❌ Upload failed: {response.status_code} - {response.text}")
+
+    def __init__(self, base_url: str = ASSEMBLYAI_BASE_URL, api_key: str = ASSEMBLYAI_API_KEY,
+                 workers: int = MAX_CONCURRENT_JOBS, max_queued: int = MAX_QUEUED_JOBS,
+                 poll_timeout: float = POLL_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.workers = workers
+        self.max_queued = max_queued
+        self.poll_timeout = poll_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+        # file_unique_id -> future of the job already in progress for that voice
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _ensure_started(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers={"authorization": self.api_key})
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queued)
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        """Stop the workers and close the HTTP session (on bot shutdown)."""
+        for task in self._worker_tasks:
+            task.cancel()
+        self._worker_tasks = []
+        self._queue = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def transcribe(self, bot, file_id: str, file_unique_id: Optional[str] = None) -> Optional[str]:
+        """
+        Queue a voice message for transcription and wait for the result.
+        Returns the transcribed text or None on error / when the queue is full
+        """
+        cache_key = file_unique_id or file_id
+        cached = transcript_cache.get(cache_key)
+        if cached is not None:
+            print(f"✅ Transcript cache hit: {cache_key}")
+            return cached
+
+        # The same voice is already being transcribed - wait for that job
+        future = self._in_flight.get(cache_key)
+        if future is None:
+            self._ensure_started()
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self._queue.put_nowait((bot, file_id, cache_key, future))
+            except asyncio.QueueFull:
+                print(f"❌ Transcription queue is full ({self.max_queued} jobs)")
+                return None
+            self._in_flight[cache_key] = future
+        return await asyncio.shield(future)
+
+    async def _worker(self):
+        while True:
+            bot, file_id, cache_key, future = await self._queue.get()
+            try:
+                transcript = await self._process(bot, file_id)
+                if transcript:
+                    transcript_cache[cache_key] = transcript
+                if not future.done():
+                    future.set_result(transcript)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_result(None)
+                raise
+            except Exception as e:
+                print(f"❌ Error during transcription: {e}")
+                if not future.done():
+                    future.set_result(None)
+            finally:
+                self._in_flight.pop(cache_key, None)
+                self._queue.task_done()
+
+    async def _process(self, bot, file_id: str) -> Optional[str]:
+        """Complete pipeline for one voice message: stream upload, start transcription, poll."""
+        print(f"🎙️ Uploading voice {file_id} to AssemblyAI...")
+        audio_url = await self.upload(stream_voice_file(bot, file_id))
+        if not audio_url:
             return None
-    except Exception as e:
-        print(f"❌ Error uploading file: {e}")
-        return None
 
+        print(f"🎙️ Starting transcription...")
+        transcript_id = await self.start_transcription(audio_url)
+        if not transcript_id:
+            return None
 
-def transcribe_audio(audio_url: str) -> Optional[str]:
-    """
-    Transcribes audio from the given URL using AssemblyAI
-    Returns the transcribed text or None on error
-    """
-    try:
-        # Start transcription with language detection enabled
+        transcript = await self.poll(transcript_id)
+        if transcript:
+            print(f"✅ Transcription complete: {transcript[:100]}...")
+        else:
+            print(f"❌ Transcription failed")
+        return transcript
+
+    async def upload(self, chunks: AsyncIterator[bytes]) -> Optional[str]:
+        """
+        Uploads audio to AssemblyAI as a chunked stream
+        Returns the upload URL or None on error
+        """
+        async with self._session.post(self.base_url + "/v2/upload", data=chunks) as response:
+            if response.status != 200:
+                print(f"❌ Upload failed: {response.status} - {await response.text()}")
+                return None
+            return (await response.json())["upload_url"]
+
+    async def start_transcription(self, audio_url: str) -> Optional[str]:
+        """
+        Starts transcription with language detection enabled
+        Returns the transcript id or None on error
+        """
         data = {
             "audio_url": audio_url,
             "speech_model": "best",
             "language_detection": True
         }
-        
-        response = requests.post(
-            ASSEMBLYAI_BASE_URL + "/v2/transcript",
-            json=data,
-            headers=HEADERS
-        )
-        
-        if response.status_code != 200:
-            print(f"❌ Transcription request failed: {response.status_code} - {response.text}")
-            return None
-        
-        transcript_id = response.json()['id']
-        polling_endpoint = ASSEMBLYAI_BASE_URL + "/v2/transcript/" + transcript_id
-        
-        # Poll for completion
-        max_attempts = 60  # Maximum 3 minutes (60 * 3 seconds)
-        attempts = 0
-        
-        while attempts < max_attempts:
-            transcription_result = requests.get(polling_endpoint, headers=HEADERS).json()
-            
-            if transcription_result['status'] == 'completed':
-                return transcription_result.get('text', '')
-            
-            elif transcription_result['status'] == 'error':
-                error_msg = transcription_result.get('error', 'Unknown error')
-                print(f"❌ Transcription failed: {error_msg}")
+        async with self._session.post(self.base_url + "/v2/transcript", json=data) as response:
+            if response.status != 200:
+                print(f"❌ Transcription request failed: {response.status} - {await response.text()}")
+                return None
+            return (await response.json())["id"]
+
+    async def poll(self, transcript_id: str) -> Optional[str]:
+        """
+        Polls the transcript until it is completed, failed or poll_timeout expires.
+        The delay between requests grows from POLL_INITIAL_DELAY up to POLL_MAX_DELAY
+        """
+        polling_endpoint = self.base_url + "/v2/transcript/" + transcript_id
+        deadline = time.monotonic() + self.poll_timeout
+        delay = POLL_INITIAL_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                async with self._session.get(polling_endpoint) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        if result['status'] == 'completed':
+                            return result.get('text', '')
+                        if result['status'] == 'error':
+                            print(f"❌ Transcription failed: {result.get('error', 'Unknown error')}")
+                            return None
+                    elif response.status < 500 and response.status != 429:
+                        print(f"❌ Polling failed: {response.status} - {await response.text()}")
+                        return None
+                    # 5xx and 429 are temporary - keep polling
+            except aiohttp.ClientError as e:
+                print(f"⚠️ Polling error, retrying: {e}")
+            if time.monotonic() + delay > deadline:
+                print(f"❌ Transcription timeout after {self.poll_timeout} seconds")
                 return None
-            
-            else:
-                # Still processing
-                time.sleep(3)
-                attempts += 1
-        
-        print(f"❌ Transcription timeout after {max_attempts * 3} seconds")
-        return None
-        
-    except Exception as e:
-        print(f"❌ Error during transcription: {e}")
-        return None
-
-
-async def transcribe_voice_message(bot, file_id: str) -> Optional[str]:
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+
+async def stream_voice_file(bot, file_id: str) -> AsyncIterator[bytes]:
+    """
+    Streams a voice file from Telegram chunk by chunk, without temporary files
+    """
+    file_info = await bot.get_file(file_id)
+    if bot.session.api.is_local:
+        # Local Bot API server: the file is already on disk
+        with open(file_info.file_path, "rb") as f:
+            while chunk := f.read(STREAM_CHUNK_SIZE):
+                yield chunk
+        return
+    url = bot.session.api.file_url(bot.token, file_info.file_path)
+    async for chunk in bot.session.stream_content(url=url, chunk_size=STREAM_CHUNK_SIZE, raise_for_status=True):
+        yield chunk
+
+
+transcription_service = TranscriptionService()
+
+
+async def transcribe_voice_message(bot, file_id: str, file_unique_id: Optional[str] = None) -> Optional[str]:
     """
-    Complete pipeline: download voice message, upload to AssemblyAI, and transcribe
+    Complete pipeline: stream voice message to AssemblyAI and transcribe it.
+    Results are cached by file_unique_id
     Returns the transcribed text or None on error
     """
     print(f"🎙️ transcribe_voice_message called with file_id: {file_id}")
-    temp_file = None
-    try:
-        # Download voice file
-        print(f"🎙️ Downloading voice file...")
-        temp_file = await download_voice_file(bot, file_id)
-        if not temp_file:
-            print(f"❌ Failed to download voice file")
-            return None
-        print(f"✅ Voice file downloaded: {temp_file}")
-        
-        # Upload to AssemblyAI
-        print(f"🎙️ Uploading to AssemblyAI...")
-        audio_url = upload_file_to_assemblyai(temp_file)
-        if not audio_url:
-            print(f"❌ Failed to upload to AssemblyAI")
-            return None
-        print(f"✅ Uploaded, URL: {audio_url}")
-        
-        # Transcribe
-        print(f"🎙️ Starting transcription...")
-        transcript = transcribe_audio(audio_url)
-        if transcript:
-            print(f"✅ Transcription complete: {transcript[:100]}...")
-        else:
-            print(f"❌ Transcription failed")
-        return transcript
-        
-    finally:
-        # Clean up temporary file
-        if temp_file and os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-            except Exception as e:
-                print(f"⚠️ Failed to remove temp file: {e}")
+    return await transcription_service.transcribe(bot, file_id, file_unique_id)
@@ -3,10 +3,15 @@ Games Plugin Package
 Содержит все игровые модули бота
 """
 
-# Экспортируем основные компоненты для удобного импорта
-from .games_router import setup_games_router
-
 # Lazy imports - модули будут импортированы при обращении
+# (games_router здесь не импортируется: иначе любой `from plugins.games import clad`
+# загружал бы все игры сразу)
 __all__ = [
     'setup_games_router'
 ]
+
+
+def setup_games_router():
+    """Роутер игр (см. games_router.setup_games_router)"""
+    from .games_router import setup_games_router as _setup_games_router
+    return _setup_games_router()
@@ -6,11 +6,14 @@
 import random
 import time
 import asyncio
-from typing import Dict, Optional, Tuple, List
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Optional, Tuple, List
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram.filters import Command
 import arena_database as arena_db
+import session_store
+import timers
 
 # Глобальные переменные для bot и dp - будут установлены через register_handlers
 bot: Optional[Bot] = None
@@ -29,6 +32,19 @@ def get_display_name_safe(user_id: int, username: Optional[str] = None) -> str:
             return username
         return f"Игрок №{abs(user_id) % 1000}"
 
+def get_fighter_names_safe(fighter1, fighter2) -> Tuple[str, str]:
+    """Имена обоих бойцов одним запросом (main.get_display_names) с тем же fallback"""
+    try:
+        import main
+        names = main.get_display_names(
+            [fighter1.user_id, fighter2.user_id],
+            {fighter1.user_id: fighter1.username, fighter2.user_id: fighter2.username},
+        )
+        return names[fighter1.user_id], names[fighter2.user_id]
+    except:
+        return (get_display_name_safe(fighter1.user_id, fighter1.username),
+                get_display_name_safe(fighter2.user_id, fighter2.username))
+
 def format_clickable_name_safe(user_id: int, display_name: Optional[str] = None) -> str:
     """Безопасная версия format_clickable_name с fallback"""
     try:
@@ -42,8 +58,7 @@ def format_clickable_name_safe(user_id: int, display_name: Optional[str] = None)
         return display_name
 
 # Активные арены и поиски
-active_arenas: Dict[str, 'ArenaGame'] = {}
-arena_queue: List[Dict] = []  # Очередь поиска игры
+active_arenas: Dict[str, 'ArenaGame'] = session_store.SessionStore("arena", ttl=3600, maxsize=2000, persist=True)
 arena_search_timeouts: Dict[int, float] = {}  # Таймауты поиска для ботов
 
 # Конфигурация арены
@@ -51,6 +66,7 @@ ARENA_CONFIG = {
     'START_RATING': 200,
     'SEARCH_RANGE': 200,  # ±200 PTS первую 1 минуту
     'EXPANDED_SEARCH_TIME': 60,  # 1 минута - после этого ищем любого
+    'MATCH_INTERVAL': 2,  # Раз в 2 секунды - пакетный подбор пар из очереди
     'SEARCH_TIMEOUT': 3600,  # 1 час общий тайм-аут
     'GAME_DURATION': 300,  # 5 минут на бой (было 600 - 10 минут)
     'TURN_TIMEOUT': 45,  # 45 секунд на ход
@@ -277,6 +293,8 @@ class ArenaGame:
         self.waiting_for = {self.fighter1.user_id: None, self.fighter2.user_id: None}
         self.current_round += 1
         self.last_result = result
+        if not game_over:
+            start_turn_timer(self.game_id)
         
         return result, game_over
         
@@ -287,8 +305,7 @@ class ArenaGame:
         self.fighter2.last_damage_taken = 0
         
         # Получаем красивые имена для отображения
-        name1 = get_display_name_safe(self.fighter1.user_id, self.fighter1.username)
-        name2 = get_display_name_safe(self.fighter2.user_id, self.fighter2.username)
+        name1, name2 = get_fighter_names_safe(self.fighter1, self.fighter2)
         
         # Управление защитой и счетчиком защит
         if action1 == "defend":
@@ -545,8 +562,9 @@ class ArenaGame:
         text = f"🏟️ <b>Арена Раунд {self.current_round}</b> ⏱️ {minutes:02d}:{seconds:02d}\n\n"
         
         # Красивые кликабельные имена
-        name1 = format_clickable_name_safe(self.fighter1.user_id, get_display_name_safe(self.fighter1.user_id, self.fighter1.username))
-        name2 = format_clickable_name_safe(self.fighter2.user_id, get_display_name_safe(self.fighter2.user_id, self.fighter2.username))
+        name1, name2 = get_fighter_names_safe(self.fighter1, self.fighter2)
+        name1 = format_clickable_name_safe(self.fighter1.user_id, name1)
+        name2 = format_clickable_name_safe(self.fighter2.user_id, name2)
         
         # Статус бойцов - основная информация
         text += f"👤 {name1}: {self.fighter1.get_hp_bar()}"
@@ -709,106 +727,204 @@ def get_arena_leaderboard(limit: int = 10) -> List[Dict]:
     return arena_db.get_top_players(limit)
 
 # Функции поиска игры
-def add_to_arena_queue(user_id: int, username: str, bet: int = 0) -> bool:
-    """Добавить игрока в очередь поиска"""
-    # Проверяем, не в очереди ли уже
-    for player in arena_queue:
-        if player['user_id'] == user_id:
+def get_search_range(player: Dict, now: Optional[float] = None) -> float:
+    """Допустимая разница рейтингов для игрока: после EXPANDED_SEARCH_TIME - любой противник"""
+    search_time = (now or time.time()) - player['search_start']
+    if search_time > ARENA_CONFIG['EXPANDED_SEARCH_TIME']:
+        return float('inf')
+    return ARENA_CONFIG['SEARCH_RANGE']
+
+class ArenaMatchmaker:
+    """Очередь поиска арены.
+
+    Игроки проиндексированы по user_id, внутри каждой ставки (bet) лежат
+    в списке, отсортированном по рейтингу, - ближайший по рейтингу соперник
+    ищется бинарным поиском, а не перебором всей очереди.
+    """
+
+    def __init__(self):
+        self._players: Dict[int, Dict] = {}  # user_id -> запись игрока
+        self._buckets: Dict[int, List[Tuple[int, float, int]]] = {}  # bet -> [(rating, search_start, user_id)]
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._players
+
+    def __iter__(self):
+        return iter(list(self._players.values()))
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        return self._players.get(user_id)
+
+    def add(self, player: Dict) -> bool:
+        if player['user_id'] in self._players:
             return False
+        self._players[player['user_id']] = player
+        insort(self._buckets.setdefault(player['bet'], []), self._sort_key(player))
+        return True
+
+    def pop(self, user_id: int) -> Optional[Dict]:
+        """Убрать игрока из очереди и вернуть его запись (None - его там нет)"""
+        player = self._players.pop(user_id, None)
+        if player is None:
+            return None
+        bucket = self._buckets[player['bet']]
+        del bucket[bisect_left(bucket, self._sort_key(player))]
+        if not bucket:
+            del self._buckets[player['bet']]
+        return player
+
+    @staticmethod
+    def _sort_key(player: Dict) -> Tuple[int, float, int]:
+        return (player['rating'], player['search_start'], player['user_id'])
+
+    def nearest(self, user_id: int, rating_range: float) -> Optional[Dict]:
+        """Ближайший по рейтингу соперник с той же ставкой в пределах rating_range"""
+        player = self._players.get(user_id)
+        if player is None:
+            return None
+        bucket = self._buckets[player['bet']]
+        index = bisect_left(bucket, self._sort_key(player))
+        best = None
+        # Соседи слева и справа от самого игрока в отсортированном списке
+        for neighbour in (index - 1, index + 1):
+            if 0 <= neighbour < len(bucket):
+                diff = abs(bucket[neighbour][0] - player['rating'])
+                if diff <= rating_range and (best is None or diff < best[0]):
+                    best = (diff, bucket[neighbour][2])
+        return self._players[best[1]] if best else None
+
+    def pair_all(self, now: Optional[float] = None) -> List[Tuple[Dict, Dict]]:
+        """Пакетный подбор: соседние по рейтингу игроки одной ставки объединяются в пары,
+        если разница укладывается в диапазон хотя бы одного из них. Пары убираются из очереди."""
+        now = now or time.time()
+        pairs = []
+        for bucket in list(self._buckets.values()):
+            entries = list(bucket)
+            i = 0
+            while i + 1 < len(entries):
+                first = self._players[entries[i][2]]
+                second = self._players[entries[i + 1][2]]
+                diff = abs(second['rating'] - first['rating'])
+                if diff <= max(get_search_range(first, now), get_search_range(second, now)):
+                    pairs.append((first, second))
+                    i += 2
+                else:
+                    i += 1
+        for first, second in pairs:
+            self.pop(first['user_id'])
+            self.pop(second['user_id'])
+        return pairs
+
+arena_queue = ArenaMatchmaker()  # Очередь поиска игры
+
+def add_to_arena_queue(user_id: int, username: str, bet: int = 0,
+                       chat_id: Optional[int] = None, message_id: Optional[int] = None) -> bool:
+    """Добавить игрока в очередь поиска (chat_id/message_id - сообщение с экраном поиска)"""
+    if user_id in arena_queue:
+        return False
     
     rating = get_arena_rating(user_id)
     
-    arena_queue.append({
+    arena_queue.add({
         'user_id': user_id,
         'username': username,
         'rating': rating['rating'],
         'bet': bet,
-        'search_start': time.time()
+        'search_start': time.time(),
+        'chat_id': chat_id,
+        'message_id': message_id,
     })
     
     arena_search_timeouts[user_id] = time.time()
+    timers.schedule(("arena_search", user_id), ARENA_CONFIG['SEARCH_TIMEOUT'], _search_timed_out, user_id)
     return True
 
 def find_arena_opponent(user_id: int) -> Optional[Dict]:
-    """Найти противника для игрока"""
-    player = None
-    player_index = -1
-    
-    for i, p in enumerate(arena_queue):
-        if p['user_id'] == user_id:
-            player = p
-            player_index = i
-            break
-    
+    """Найти противника для игрока (оба убираются из очереди)"""
+    player = arena_queue.get(user_id)
     if not player:
         return None
     
-    # Ищем подходящего противника
-    rating_range = ARENA_CONFIG['SEARCH_RANGE']
-    search_time = time.time() - player['search_start']
-    
-    # Расширяем диапазон поиска со временем
-    if search_time > ARENA_CONFIG['EXPANDED_SEARCH_TIME']:  # 1 минута - ищем любого противника
-        rating_range = 9999  # Любой противник в игре
-    
-    best_opponent = None
-    best_opponent_index = -1
-    min_rating_diff = float('inf')
-    
-    for i, opponent in enumerate(arena_queue):
-        if (opponent['user_id'] != user_id and 
-            opponent['bet'] == player['bet'] and
-            abs(opponent['rating'] - player['rating']) <= rating_range):
-            
-            rating_diff = abs(opponent['rating'] - player['rating'])
-            if rating_diff < min_rating_diff:
-                min_rating_diff = rating_diff
-                best_opponent = opponent
-                best_opponent_index = i
-    
+    best_opponent = arena_queue.nearest(user_id, get_search_range(player))
     if best_opponent:
-        # Удаляем обоих игроков из очереди
-        arena_queue.pop(max(player_index, best_opponent_index))
-        arena_queue.pop(min(player_index, best_opponent_index))
-        
-        # Удаляем таймауты
-        arena_search_timeouts.pop(user_id, None)
-        arena_search_timeouts.pop(best_opponent['user_id'], None)
-        
+        arena_queue.pop(user_id)
+        arena_queue.pop(best_opponent['user_id'])
+        _forget_search(user_id, best_opponent['user_id'])
         return best_opponent
     
     return None
 
+def pair_arena_queue() -> List[Tuple[Dict, Dict]]:
+    """Пакетный подбор пар из очереди (вызывается периодически). В паре первым идёт
+    тот, кто встал в очередь позже, - как раньше, когда соперника искал вошедший игрок."""
+    pairs = []
+    for first, second in arena_queue.pair_all():
+        _forget_search(first['user_id'], second['user_id'])
+        if first['search_start'] < second['search_start']:
+            first, second = second, first
+        pairs.append((first, second))
+    return pairs
+
 def remove_from_arena_queue(user_id: int) -> bool:
     """Удалить игрока из очереди"""
-    for i, player in enumerate(arena_queue):
-        if player['user_id'] == user_id:
-            arena_queue.pop(i)
-            arena_search_timeouts.pop(user_id, None)
-            return True
-    return False
+    if arena_queue.pop(user_id) is None:
+        return False
+    _forget_search(user_id)
+    return True
 
-def check_arena_timeouts() -> List[int]:
-    """Проверить таймауты поиска и создать игры с ботами"""
-    timed_out_players = []
-    current_time = time.time()
-    
-    for user_id, start_time in list(arena_search_timeouts.items()):
-        if current_time - start_time >= ARENA_CONFIG['SEARCH_TIMEOUT']:
-            timed_out_players.append(user_id)
-            arena_search_timeouts.pop(user_id, None)
-    
-    return timed_out_players
+def _forget_search(*user_ids: int):
+    for user_id in user_ids:
+        arena_search_timeouts.pop(user_id, None)
+        timers.cancel(("arena_search", user_id))
 
-def check_expired_games() -> List[str]:
-    """Проверить истекшие игры и вернуть их ID для завершения"""
-    expired_games = []
-    
-    for game_id, game in list(active_arenas.items()):
-        if game.is_active and game.is_expired():
-            expired_games.append(game_id)
-    
-    return expired_games
+# Таймауты арены (поиск, ход, бой) срабатывают по таймерам timers.py в нужный момент.
+# Что делать по таймауту, решает main.py через set_timeout_handlers.
+_timeout_handlers: Dict[str, Callable] = {}
+
+def set_timeout_handlers(search: Callable = None, turn: Callable = None, game: Callable = None):
+    """search(player) - поиск не удался; turn(game_id) - истёк ход; game(game_id) - истекло время боя"""
+    for kind, handler in (("search", search), ("turn", turn), ("game", game)):
+        if handler is not None:
+            _timeout_handlers[kind] = handler
+
+async def _search_timed_out(user_id: int):
+    player = arena_queue.pop(user_id)
+    arena_search_timeouts.pop(user_id, None)
+    handler = _timeout_handlers.get("search")
+    if player and handler:
+        await handler(player)
+
+async def _turn_timed_out(game_id: str):
+    handler = _timeout_handlers.get("turn")
+    game = active_arenas.get(game_id)
+    if game and game.is_active and handler:
+        await handler(game_id)
+
+async def _game_timed_out(game_id: str):
+    handler = _timeout_handlers.get("game")
+    game = active_arenas.get(game_id)
+    if game and game.is_active and handler:
+        await handler(game_id)
+
+def start_turn_timer(game_id: str):
+    """Новый ход: через TURN_TIMEOUT секунд сработает обработчик turn"""
+    timers.schedule(("arena_turn", game_id), ARENA_CONFIG['TURN_TIMEOUT'], _turn_timed_out, game_id)
+
+def start_game_timers(game: 'ArenaGame'):
+    """Таймеры боя и текущего хода (при создании игры и после восстановления сессий)"""
+    time_left = ARENA_CONFIG['GAME_DURATION'] - (time.time() - game.start_time)
+    timers.schedule(("arena_game", game.game_id), time_left, _game_timed_out, game.game_id)
+    start_turn_timer(game.game_id)
+
+def restore_game_timers() -> int:
+    """Поставить таймеры всем активным играм (после session_store.restore_all)"""
+    games = [game for game in active_arenas.values() if game.is_active]
+    for game in games:
+        start_game_timers(game)
+    return len(games)
 
 def get_search_failed_message() -> str:
     """Сообщение когда поиск не удался"""
@@ -827,6 +943,7 @@ def create_arena_game(player1_data: Dict, player2_data: Dict, bet: int = 0) -> s
     """Создать новую игру в арене"""
     game = ArenaGame(player1_data, player2_data, bet)
     active_arenas[game.game_id] = game
+    start_game_timers(game)
     return game.game_id
 
 def get_arena_game(game_id: str) -> Optional[ArenaGame]:
@@ -855,6 +972,7 @@ def end_arena_game(game_id: str) -> Optional[Dict]:
     game = active_arenas.pop(game_id, None)
     if not game:
         return None
+    timers.cancel(("arena_game", game_id), ("arena_turn", game_id))
     
     winner = game.get_winner()
     loser = None
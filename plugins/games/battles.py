@@ -2,16 +2,18 @@ import random
 import os
 import logging
 from aiogram import types
-from aiogram.types import FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import database as db  # твоя работа с базой
+import db_async
+import media_cache
+import session_store
 
 # Настроим логгер
 logger = logging.getLogger("battle")
 logging.basicConfig(level=logging.INFO)
 
-# Словарь для отслеживания владельцев игр по message_id
-game_owners = {}
+# Владельцы игр по message_id (для кнопки повтора; старые сообщения забываются)
+game_owners = session_store.SessionStore("bet_owners", ttl=6 * 3600, maxsize=50000)
 
 # Photo assets directory (change if your images are elsewhere)
 PHOTO_DIR = "C:\\BotKruz\\ChatBotKruz\\photo"
@@ -51,7 +53,7 @@ def build_battle_keyboard(initiator_id: int, bet: int, target_id: int):
     kb.adjust(2)
     return kb.as_markup()
 
-active_battles = {}  # key: target_id, value: (initiator_id, bet, chat_id)
+active_battles = session_store.SessionStore("battles", ttl=600, maxsize=5000, persist=True)  # key: target_id, value: (initiator_id, bet, chat_id)
 
 def get_nick(user):
     username = getattr(user, 'username', None)
@@ -76,8 +78,8 @@ async def initiate_battle(message: types.Message, initiator_id: int, bet: int):
         await message.reply("Нельзя сражаться с самим собой.")
         return
 
-    initiator = db.get_user(initiator_id)
-    target = db.get_user(target_user.id)
+    initiator = await db_async.db.get_user(initiator_id)
+    target = await db_async.db.get_user(target_user.id)
     if not initiator or not target:
         await message.reply("Оба игрока должны быть зарегистрированы.")
         return
@@ -125,8 +127,8 @@ async def handle_accept_button(callback: types.CallbackQuery):
         await callback.answer("У вас нет активного батла.", show_alert=True)
         return
     initiator_id, bet, _, initiator_nick, target_nick = battle
-    initiator = db.get_user(initiator_id)
-    target = db.get_user(user_id)
+    initiator = await db_async.db.get_user(initiator_id)
+    target = await db_async.db.get_user(user_id)
     if not initiator or not target:
         await callback.answer("Ошибка: игрок не найден.", show_alert=True)
         return
@@ -140,15 +142,17 @@ async def handle_accept_button(callback: types.CallbackQuery):
     loser_id = user_id if winner_id == initiator_id else initiator_id
     winner = initiator_nick if winner_id == initiator_id else target_nick
     loser = target_nick if loser_id == user_id else initiator_nick
-    # Сбор банка и применение комиссии
-    db.withdraw_dan(initiator_id, bet)
-    db.withdraw_dan(user_id, bet)
+    # Сбор банка, комиссия и выплата победителю — одной транзакцией для обоих игроков
     total_pot = bet * 2
     commission = int(total_pot * PVP_COMMISSION_RATE)
     payout = total_pot - commission
-    db.add_dan(winner_id, payout)
-    db.increment_games(initiator_id)
-    db.increment_games(user_id)
+    settled = await db_async.db.settle_rounds([
+        (initiator_id, bet, payout if winner_id == initiator_id else 0, db.round_stats()),
+        (user_id, bet, payout if winner_id == user_id else 0, db.round_stats()),
+    ])
+    if settled is None:
+        await callback.answer("Недостаточно Дани у одного из игроков.", show_alert=True)
+        return
     m = callback.message
     if m and hasattr(m, "edit_reply_markup"):
         try:
@@ -213,8 +217,8 @@ async def handle_accept_message(message: types.Message):
         await message.reply("У вас нет активного батла.")
         return
     initiator_id, bet, _, initiator_name, target_name = battle
-    initiator = db.get_user(initiator_id)
-    target = db.get_user(user_id)
+    initiator = await db_async.db.get_user(initiator_id)
+    target = await db_async.db.get_user(user_id)
     if not initiator or not target:
         await message.reply("Ошибка: игрок не найден.")
         return
@@ -228,15 +232,17 @@ async def handle_accept_message(message: types.Message):
     loser_id = user_id if winner_id == initiator_id else initiator_id
     winner = initiator_name if winner_id == initiator_id else target_name
     loser = target_name if loser_id == user_id else initiator_name
-    # Сбор банка и комиссия
-    db.withdraw_dan(initiator_id, bet)
-    db.withdraw_dan(user_id, bet)
+    # Сбор банка, комиссия и выплата победителю — одной транзакцией для обоих игроков
     total_pot = bet * 2
     commission = int(total_pot * PVP_COMMISSION_RATE)
     payout = total_pot - commission
-    db.add_dan(winner_id, payout)
-    db.increment_games(initiator_id)
-    db.increment_games(user_id)
+    settled = await db_async.db.settle_rounds([
+        (initiator_id, bet, payout if winner_id == initiator_id else 0, db.round_stats()),
+        (user_id, bet, payout if winner_id == user_id else 0, db.round_stats()),
+    ])
+    if settled is None:
+        await message.reply("Недостаточно Дани у одного из игроков.")
+        return
     await message.reply(
         (
             f"🎲 Результат батла!\n"
@@ -264,60 +270,34 @@ async def handle_decline_message(message: types.Message):
 
 async def solo_bet(message: types.Message, user_id: int, bet: int):
     username = message.from_user.username if message.from_user else None
-    db.ensure_user(user_id, username or "player")
-    user = db.get_user(user_id)
-    if not user or user.get("dan", 0) < bet:
-        await message.reply(f"Недостаточно Дани. Ваш баланс: {user.get('dan',0) if user else 0}")
-        return
-    # Withdraw stake and record first bet
-    ok = db.withdraw_dan(user_id, bet)
-    if not ok:
-        await message.reply("Ошибка списания ставки.")
-        return
-    try:
-        db.set_first_bet(user_id, bet)
-    except Exception:
-        pass
+    await db_async.db.ensure_user(user_id, username or "player")
 
+    # Исход определяем заранее, а ставку, выигрыш и счётчики проводим одной транзакцией
     r = random.random()
     if r < 0.48:
         mult = 0.0
         won = 0
         result_text = f"😢 Вы проиграли.\n\n💶Ставка: {bet}.\n🤣 Пройгрыш: {bet}."
         img_path = random.choice(LOSE_IMAGES)
-        try:
-            from database import increment_dan_lose
-            increment_dan_lose(user_id, bet)
-        except Exception:
-            pass
+        stats = db.round_stats(lose=bet)
     elif r < 0.95:
         mult = round(random.uniform(1.7, 2.1), 2)
         won = int(bet * mult)
-        db.add_dan(user_id, won)
         result_text = f"🙂 Вы выиграли!\n\n💶Ставка: {bet}.\n🎲 Множитель: {mult}x.\n💰 Выигрыш: {won}."
         img_path = random.choice(WIN_IMAGES)
-        try:
-            from database import increment_dan_win, increment_dan_lose
-            increment_dan_win(user_id, max(won - bet, 0))
-            increment_dan_lose(user_id, bet)
-        except Exception:
-            pass
+        stats = db.round_stats(win=max(won - bet, 0), lose=bet)
     else:
         mult = round(random.uniform(2.2, 2.5), 2)
         won = int(bet * mult)
-        db.add_dan(user_id, won)
         result_text = f"🔥 Большой выигрыш!\n\n💶Ставка: {bet}.\n🎲 Множитель: {mult}x.\n💰 Выигрыш: {won}."
         img_path = random.choice(WIN_IMAGES)
-        try:
-            from database import increment_dan_win, increment_dan_lose
-            increment_dan_win(user_id, max(won - bet, 0))
-            increment_dan_lose(user_id, bet)
-        except Exception:
-            pass
+        stats = db.round_stats(win=max(won - bet, 0), lose=bet)
 
-    db.increment_games(user_id)
-    user_row = db.get_user(user_id)
-    balance = user_row["dan"] if user_row else 0
+    balance = await db_async.db.settle_round(user_id, bet, won, stats, first_bet=True)
+    if balance is None:
+        user = await db_async.db.get_user(user_id)
+        await message.reply(f"Недостаточно Дани. Ваш баланс: {user.get('dan',0) if user else 0}")
+        return
     plus_text = f" (+{won} ДАНЬ)" if won > 0 else ""
     result_text += f"\n\n😎 Ваш баланс: {balance:.2f} Дань{plus_text}."
 
@@ -335,9 +315,8 @@ async def solo_bet(message: types.Message, user_id: int, bet: int):
 
     try:
         if img_path and os.path.exists(img_path):
-            from aiogram.types import FSInputFile
-            photo = FSInputFile(img_path)
-            sent = await message.answer_photo(photo=photo, caption=result_text, reply_markup=kb)
+            # win*/lose* загружаются в Telegram один раз, дальше отправляется file_id
+            sent = await media_cache.send_photo(message.answer_photo, img_path, caption=result_text, reply_markup=kb)
             # Сохраняем владельца игры
             if sent and kb:
                 game_owners[sent.message_id] = user_id
@@ -376,11 +355,17 @@ async def repeat_bet_callback(callback: types.CallbackQuery):
                 return
         
         # Проверяем баланс
-        user = db.get_user(user_id)
+        user = await db_async.db.get_user(user_id)
         if not user or user["dan"] < bet:
             await callback.answer(f"Недостаточно средств! Нужно {bet} ДАНЬ", show_alert=True)
             return
         
+        # Запускаем игру (ставка списывается вместе с расчётом раунда):
+        # при повторе используем плейсхолдер 600x100 серый вместо реального фото
+        if not await run_bet_game_and_update_message(callback, user_id, bet, show_image="placeholder"):
+            await callback.answer("Ошибка списания ставки", show_alert=True)
+            return
+        
         # Регистрируем прогресс задач (аналог обычной ставки)
         try:
             import tasks
@@ -388,14 +373,6 @@ async def repeat_bet_callback(callback: types.CallbackQuery):
             tasks.record_bet_play(user_id, bet)
         except Exception:
             pass
-
-        # Списываем ставку
-        if not db.withdraw_dan(user_id, bet):
-            await callback.answer("Ошибка списания ставки", show_alert=True)
-            return
-        
-        # Запускаем игру: при повторе используем плейсхолдер 600x100 серый вместо реального фото
-        await run_bet_game_and_update_message(callback, user_id, bet, show_image="placeholder")
         
     except Exception as e:
         try:
@@ -405,7 +382,8 @@ async def repeat_bet_callback(callback: types.CallbackQuery):
 
 
 async def run_bet_game_and_update_message(callback: types.CallbackQuery, user_id: int, bet: int, show_image: bool | str = True):
-    """Запускает игру бет и обновляет сообщение"""
+    """Запускает игру бет (списание ставки и расчёт — одной транзакцией) и обновляет сообщение.
+    Возвращает False, если ставку списать не удалось."""
     # Логика игры
     r = random.random()
     # Та же матрица, что и в solo_bet
@@ -413,42 +391,23 @@ async def run_bet_game_and_update_message(callback: types.CallbackQuery, user_id
         won = 0
         result_text = f"😢 Вы проиграли.\n\n💶Ставка: {bet}.\n🤣Проигрыш: {bet}."
         img_path = random.choice(LOSE_IMAGES)
-        try:
-            db.increment_dan_lose(user_id, bet)
-        except Exception:
-            pass
+        stats = db.round_stats(lose=bet)
     elif r < 0.95:
         mult = round(random.uniform(1.7, 2.1), 2)
         won = int(bet * mult)
-        db.add_dan(user_id, won)
         result_text = f"🙂 Вы выиграли!\n\n💶Ставка: {bet}.\n🎲 Множитель: {mult}x.\n💰 Выигрыш: {won}."
         img_path = random.choice(WIN_IMAGES)
-        try:
-            db.increment_dan_win(user_id, max(won - bet, 0))
-            db.increment_dan_lose(user_id, bet)
-        except Exception:
-            pass
+        stats = db.round_stats(win=max(won - bet, 0), lose=bet)
     else:
         mult = round(random.uniform(2.2, 2.5), 2)
         won = int(bet * mult)
-        db.add_dan(user_id, won)
         result_text = f"🔥 Большой выигрыш!\n\n💶Ставка: {bet}.\n🎲 Множитель: {mult}x.\n💰 Выигрыш: {won}."
         img_path = random.choice(WIN_IMAGES)
-        try:
-            db.increment_dan_win(user_id, max(won - bet, 0))
-            db.increment_dan_lose(user_id, bet)
-        except Exception:
-            pass
+        stats = db.round_stats(win=max(won - bet, 0), lose=bet)
 
-    # Обновляем счетчик игр
-    try:
-        db.increment_games(user_id)
-    except Exception:
-        pass
-    
-    # Получаем новый баланс
-    user = db.get_user(user_id)
-    balance = user["dan"] if user else 0
+    balance = await db_async.db.settle_round(user_id, bet, won, stats)
+    if balance is None:
+        return False
     plus_text = f" (+{won} ДАНЬ)" if won > 0 else ""
     result_text += f"\n\n😎 Ваш баланс: {balance:.2f} Дань{plus_text}."
     
@@ -481,9 +440,8 @@ async def run_bet_game_and_update_message(callback: types.CallbackQuery, user_id
 
             if selected_image_path and os.path.exists(selected_image_path) and hasattr(callback.message, "edit_media"):
                 try:
-                    photo = FSInputFile(selected_image_path)
-                    media = types.InputMediaPhoto(media=photo, caption=result_text)
-                    await callback.message.edit_media(media=media, reply_markup=kb)
+                    await media_cache.edit_photo(callback.message.edit_media, selected_image_path,
+                                                 caption=result_text, reply_markup=kb)
                 except Exception:
                     # Fallback: try update caption if message is a photo
                     try:
@@ -508,3 +466,4 @@ async def run_bet_game_and_update_message(callback: types.CallbackQuery, user_id
             await callback.answer("Игра сыграна, но ошибка обновления", show_alert=True)
         except Exception:
             pass
+    return True
@@ -1,14 +1,16 @@
 # Для ограничения по времени
 import time
+import session_store
 
 # user_id: timestamp последней игры
-last_dice_time = {}
+last_dice_time = session_store.SessionStore("dice_cooldown", ttl=60, maxsize=50000)
 
 import random
 import asyncio
 from aiogram import types
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import database as db
+import db_async
 
 # Импорт функции счетчика игр
 def get_increment_games_count():
@@ -28,7 +30,7 @@ def get_increment_games_count():
 #   'initiator_roll': int or None,
 #   'target_roll': int or None
 # }
-active_dice_battles = {}
+active_dice_battles = session_store.SessionStore("dice_battles", ttl=600, maxsize=5000, persist=True)
 
 
 def build_dice_keyboard(initiator_id: int, bet: int, target_id: int):
@@ -74,8 +76,8 @@ async def initiate_dice_battle(message: types.Message, initiator_id: int, bet: i
 	if target_user.id == initiator_id:
 		await message.reply("Нельзя играть с самим собой.")
 		return
-	initiator = db.get_user(initiator_id)
-	target = db.get_user(target_user.id)
+	initiator = await db_async.db.get_user(initiator_id)
+	target = await db_async.db.get_user(target_user.id)
 	if not initiator or not target:
 		await message.reply("Оба игрока должны быть зарегистрированы.")
 		return
@@ -136,8 +138,8 @@ async def handle_dice_accept(callback: types.CallbackQuery):
 	bet = battle['bet']
 	initiator_nick = battle['initiator_nick']
 	target_nick = battle['target_nick']
-	initiator = db.get_user(initiator_id)
-	target = db.get_user(user_id)
+	initiator = await db_async.db.get_user(initiator_id)
+	target = await db_async.db.get_user(user_id)
 	if not initiator or not target:
 		await callback.answer("Ошибка: игрок не найден.", show_alert=True)
 		return
@@ -148,8 +150,10 @@ async def handle_dice_accept(callback: types.CallbackQuery):
 		await callback.answer("У тебя недостаточно Дани.", show_alert=True)
 		return
 	# Списываем ставки (банк формируется и комиссия удерживается позже)
-	db.withdraw_dan(initiator_id, bet)
-	db.withdraw_dan(user_id, bet)
+	# Ставки обоих игроков списываются одной транзакцией (всё или ничего)
+	if await db_async.db.settle_rounds([(initiator_id, bet, 0, None), (user_id, bet, 0, None)]) is None:
+		await callback.answer("Недостаточно Дани у одного из игроков.", show_alert=True)
+		return
 	
 	# Увеличиваем счетчик игр
 	increment_func = get_increment_games_count()
@@ -187,13 +191,11 @@ async def handle_dice_accept(callback: types.CallbackQuery):
 	payout = full_pot - commission
 
 	if dice1 > dice2:
-		db.add_dan(initiator_id, payout)
-		try:
-			profit = payout - bet
-			db.increment_dan_win(initiator_id, max(profit,0))
-			db.increment_dan_lose(user_id, bet)
-		except Exception:
-			pass
+		profit = payout - bet
+		settlement = [
+			(initiator_id, 0, payout, db.round_stats(win=max(profit,0))),
+			(user_id, 0, 0, db.round_stats(lose=bet)),
+		]
 		winner = f"#1 {initiator_nick}"
 		loser = f"#2 {target_nick}"
 		result_text += (
@@ -202,13 +204,11 @@ async def handle_dice_accept(callback: types.CallbackQuery):
 			f"{loser} проиграл {bet}"
 		)
 	elif dice2 > dice1:
-		db.add_dan(user_id, payout)
-		try:
-			profit = payout - bet
-			db.increment_dan_win(user_id, max(profit,0))
-			db.increment_dan_lose(initiator_id, bet)
-		except Exception:
-			pass
+		profit = payout - bet
+		settlement = [
+			(user_id, 0, payout, db.round_stats(win=max(profit,0))),
+			(initiator_id, 0, 0, db.round_stats(lose=bet)),
+		]
 		winner = f"#2 {target_nick}"
 		loser = f"#1 {initiator_nick}"
 		result_text += (
@@ -221,13 +221,15 @@ async def handle_dice_accept(callback: types.CallbackQuery):
 		# При ничьей удерживаем половину обычной комиссии (то есть 5% если базовая 10%)
 		commission_tie = int(full_pot * 0.05)
 		refund_each = (full_pot - commission_tie) // 2
-		db.add_dan(initiator_id, refund_each)
-		db.add_dan(user_id, refund_each)
+		settlement = [
+			(initiator_id, 0, refund_each, db.round_stats()),
+			(user_id, 0, refund_each, db.round_stats()),
+		]
 		result_text += (
 			f"Ничья! Возврат каждому: {refund_each}. Комиссия удержана: {commission_tie}"
 		)
-	db.increment_games(initiator_id)
-	db.increment_games(user_id)
+	# Выплата, статистика и счётчики игр обоих игроков — одной транзакцией
+	await db_async.db.settle_rounds(settlement)
 	await callback.message.answer(result_text, parse_mode="HTML")
 	del active_dice_battles[user_id]
 	await callback.answer("Батл завершён.")
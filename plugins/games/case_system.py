@@ -4,6 +4,9 @@ import sqlite3
 from typing import Dict, List, Tuple, Optional
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 import database as db
+import media_cache
+import session_store
+import timers
 
 # NOTE: Экономика кейсов переработана: ограничены максимальные выигрыши.
 # Level1 price (получение через предмет) – не продаётся напрямую, балансируем содержимое отдельно.
@@ -68,7 +71,7 @@ CASE_CONFIG = {
 }
 
 # Активные сессии открытия кейсов
-active_case_sessions = {}
+active_case_sessions = session_store.SessionStore("cases", ttl=600, maxsize=5000, persist=True)
 
 _user_fail_streak: Dict[int, int] = {}
 
@@ -291,15 +294,24 @@ def start_case_opening(user_id: int, case_type: str, message_id: int) -> CaseSes
     """Начинает сессию открытия кейса"""
     session = CaseSession(user_id, case_type, message_id)
     active_case_sessions[f"{user_id}:{message_id}"] = session
+    _schedule_case_expiry(user_id, message_id)
     return session
 
+def _schedule_case_expiry(user_id: int, message_id: int):
+    # Брошенная сессия закрывается через ttl хранилища после последнего действия
+    timers.schedule(("case", user_id, message_id), active_case_sessions.ttl, close_case_session, user_id, message_id)
+
 def get_case_session(user_id: int, message_id: int) -> Optional[CaseSession]:
     """Получает активную сессию"""
-    return active_case_sessions.get(f"{user_id}:{message_id}")
+    session = active_case_sessions.get(f"{user_id}:{message_id}")
+    if session is not None:
+        _schedule_case_expiry(user_id, message_id)
+    return session
 
 def close_case_session(user_id: int, message_id: int):
     """Закрывает сессию"""
     key = f"{user_id}:{message_id}"
+    timers.cancel(("case", user_id, message_id))
     if key in active_case_sessions:
         del active_case_sessions[key]
 
@@ -429,15 +441,14 @@ def setup_case_router() -> Router:
                     sys.path.insert(0, main_dir)
                 from main import get_cached_image
                 
-                out_path = get_cached_image(grid_items, item_images)
+                out_path = get_cached_image(grid_items, item_images, owner=user_id)
                 kb = build_inventory_markup(page=1, max_page=max_page, owner_user_id=user_id)
                 
-                media = InputMediaPhoto(
-                    media=FSInputFile(str(out_path)),
-                    caption=f"🎒 Ваш инвентарь\nВсего предметов: {total}"
-                )
                 msg: Message = cast(Message, callback.message)
-                await msg.edit_media(media=media, reply_markup=kb)
+                await media_cache.edit_photo(
+                    msg.edit_media, str(out_path),
+                    caption=f"🎒 Ваш инвентарь\nВсего предметов: {total}", reply_markup=kb
+                )
                 
             except Exception as e:
                 print(f"Ошибка при отправке инвентаря: {e}")
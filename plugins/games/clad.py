@@ -1,9 +1,10 @@
 import random
 import time
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+import session_store
 
-# Структура для хранения активных игр (теперь по game_id, а не user_id)
-active_clads = {}
+# Структура для хранения активных игр (теперь по game_id, а не user_id); брошенные игры истекают
+active_clads = session_store.SessionStore("clad", ttl=1800, maxsize=10000, persist=True)
 
 # Мультипликаторы (ограничено до 6 реальных этапов, финальный редкий финал x25)
 # Экономически таргетируем средний ранний выход на 2-3 уровне.
@@ -162,9 +163,10 @@ async def step_clad_game(game_id, cell_idx):
         game['clicked_cell'] = cell_idx  # Сохраняем кликнутую ячейку
         try:
             import database as db
-            db.increment_dan_lose(game['user_id'], game['bet'])
-        except Exception:
-            pass
+            import db_async
+            await db_async.db.settle_round(game['user_id'], 0, 0, db.round_stats(lose=game['bet'], games=0))
+        except Exception as e:
+            print(f"Ошибка записи проигрыша в Клад: {e}")
         return {'status': 'lose', 'msg': f'Вы попали на мину! Проигрыш. Потеряно {game["bet"]:.2f}.'}
     else:
         # Генерируем ряд для отображения при успешном прохождении для любого уровня
@@ -173,15 +175,21 @@ async def step_clad_game(game_id, cell_idx):
         game['level'] += 1
         if game['level'] >= len(MINES_PER_ROW):
             game['alive'] = False
+            win = game['bet'] * MULTS[-1]
             try:
-                import database as db
-                db.increment_dan_win(game['user_id'], max(game['bet'] * MULTS[-1] - game['bet'], 0))
-                db.increment_dan_lose(game['user_id'], game['bet'])
-            except Exception:
-                pass
-            return {'status': 'win', 'msg': f'Поздравляем! Вы прошли все уровни и выиграли {game["bet"] * MULTS[-1]:.2f}.'}
+                await _pay_clad_win(game, win)
+            except Exception as e:
+                print(f"Ошибка выплаты выигрыша в Клад: {e}")
+            return {'status': 'win', 'win': win, 'msg': f'Поздравляем! Вы прошли все уровни и выиграли {win:.2f}.'}
         return {'status': 'next', 'msg': f'Успешно! Следующий уровень: {game["level"]+1}'}
 
+# Выплата и статистика выигрыша одной транзакцией (settle_round)
+async def _pay_clad_win(game, win):
+    import database as db
+    import db_async
+    stats = db.round_stats(win=max(win - game['bet'], 0), lose=game['bet'], games=0)
+    await db_async.db.settle_round(game['user_id'], 0, win, stats)
+
 # Забрать выигрыш
 
 
@@ -193,6 +201,9 @@ async def take_clad_game(game_id):
     # Добавляем задержку 0.3 секунды для создания напряжения
     import asyncio
     await asyncio.sleep(0.3)
+    # Повторное нажатие «Забрать» за время задержки не должно выплатить второй раз
+    if not game['alive']:
+        return {'status': 'end', 'msg': 'Игра завершена.'}
     
     # Платим за последний полностью пройденный уровень
     last_level = max(0, game['level'] - 1)
@@ -200,9 +211,10 @@ async def take_clad_game(game_id):
     win = game['bet'] * mult
     game['alive'] = False
     try:
-        import database as db
-        db.increment_dan_win(game['user_id'], max(win-game['bet'],0))
-        db.increment_dan_lose(game['user_id'], game['bet'])
-    except Exception:
-        pass
-    return {'status': 'take', 'msg': f'Вы забрали {win:.2f} Дань!'}
\ No newline at end of file
+        await _pay_clad_win(game, win)
+    except Exception as e:
+        # Ничего не выплачено - игру можно забрать ещё раз
+        print(f"Ошибка выплаты выигрыша в Клад: {e}")
+        game['alive'] = True
+        return {'status': 'error', 'msg': 'Ошибка выплаты, попробуйте ещё раз.'}
+    return {'status': 'take', 'win': win, 'msg': f'Вы забрали {win:.2f} Дань!'}
\ No newline at end of file
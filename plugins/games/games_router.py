@@ -14,11 +14,12 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(_
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-# Импорты игровых модулей
-from plugins.games import arena, battles, betcosty, bowling, case_system, clad, saper, tic_tac_toe
+# Игровые модули загружаются при первом нажатии на их кнопку
+import lazy_modules
 
-# Импорт основных модулей
-import database as db
+battles = lazy_modules.lazy("plugins.games.battles")
+betcosty = lazy_modules.lazy("plugins.games.betcosty")
+saper = lazy_modules.lazy("plugins.games.saper")
 
 # Создаем роутер для игр
 games_router = Router(name="games")
@@ -105,10 +105,12 @@ class SimpleSaper:
 import time
 import random
 from typing import Dict
+import session_store
 
 SIZE = 3
 BOMB_COUNT = 1
-active_saper_games: Dict[str, 'SimpleSaper'] = {}
+# Брошенные игры истекают через полчаса без ходов
+active_saper_games: Dict[str, 'SimpleSaper'] = session_store.SessionStore("saper", ttl=1800, maxsize=10000, persist=True)
 
 def generate_unique_game_id(user_id):
     """Генерирует уникальный ID игры с наносекундной точностью"""
@@ -139,13 +141,14 @@ async def start_saper_game(message, stake):
         await message.reply("Минимальная ставка — 10 Дань.")
         return
     import database as db
-    user = db.get_user(user_id)
-    if not user or user["dan"] < stake:
+    import db_async
+    # Проверка баланса и списание ставки — одной транзакцией
+    if await db_async.db.settle_round(user_id, stake) is None:
+        user = await db_async.db.get_user(user_id)
         await message.reply(f"Недостаточно Дань! Ваш баланс: {user['dan'] if user else 0}")
         return
     # Создаем новую игру с уникальным ID (больше никаких ограничений!)
     game_id = generate_unique_game_id(user_id)
-    db.withdraw_dan(user_id, stake)
     active_saper_games[game_id] = SimpleSaper(stake=stake, owner_id=user_id, game_id=game_id)
     await message.reply(active_saper_games[game_id].status_text(), reply_markup=active_saper_games[game_id].keyboard())
 
@@ -167,7 +170,7 @@ async def saper_callback_handler(callback):
                         await callback.answer("Только владелец игры может повторить", show_alert=True)
                         return
             
-            from main import saper_repeat_callback
+            from features.games import saper_repeat_callback
             await saper_repeat_callback(callback)
         except Exception:
             await callback.answer("Ошибка при повторе игры", show_alert=True)
@@ -218,14 +221,10 @@ async def saper_callback_handler(callback):
         game.finished = True
         import asyncio
         import database as db
+        import db_async
         if any(cell in game.revealed for cell in game.bombs):
             # Проигрыш: задержка 1 секунда, затем показываем поле с бомбами и кнопку "Повторить"
-            try:
-                db.increment_dan_lose(user_id, game.stake)
-            except Exception:
-                pass
-            user_row = db.get_user(user_id)
-            bal = user_row["dan"] if user_row else 0
+            bal = await db_async.db.settle_round(user_id, 0, 0, db.round_stats(lose=game.stake, games=0)) or 0
             import main as main
             await asyncio.sleep(1)
             await main.safe_edit_text(callback.message,
@@ -238,13 +237,8 @@ async def saper_callback_handler(callback):
                 del active_saper_games[game_id]
         else:
             win = int(game.stake * game.multiplier)
-            db.add_dan(user_id, win)
-            try:
-                db.increment_dan_win(user_id, win - game.stake)  # Чистый выигрыш
-            except Exception:
-                pass
-            user_row = db.get_user(user_id)
-            bal_after = user_row["dan"] if user_row else 0
+            # Выигрыш и счётчик чистого выигрыша — одной транзакцией
+            bal_after = await db_async.db.settle_round(user_id, 0, win, db.round_stats(win=win - game.stake, games=0)) or 0
             bal_before = bal_after - win + game.stake
             import main as main
             from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -280,12 +274,8 @@ async def saper_callback_handler(callback):
             game.finished = True
             import asyncio
             import database as db
-            try:
-                db.increment_dan_lose(user_id, game.stake)
-            except Exception:
-                pass
-            user_row = db.get_user(user_id)
-            bal = user_row["dan"] if user_row else 0
+            import db_async
+            bal = await db_async.db.settle_round(user_id, 0, 0, db.round_stats(lose=game.stake, games=0)) or 0
             import main as main
             await asyncio.sleep(1)
             await main.safe_edit_text(callback.message,
@@ -308,9 +298,8 @@ async def saper_callback_handler(callback):
             win = int(game.stake * game.multiplier)
             import asyncio
             import database as db
-            db.add_dan(user_id, win)
-            user_row = db.get_user(user_id)
-            bal = user_row["dan"] if user_row else 0
+            import db_async
+            bal = await db_async.db.settle_round(user_id, 0, win) or 0
             import main as main
             await asyncio.sleep(1)
             await main.safe_edit_text(callback.message,
@@ -8,6 +8,8 @@ import asyncio
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram import types
 import database as db
+import session_store
+import timers
 
 async def safe_edit_text(message, text, reply_markup=None, parse_mode=None):
     """Безопасное редактирование сообщения"""
@@ -17,8 +19,11 @@ async def safe_edit_text(message, text, reply_markup=None, parse_mode=None):
     except Exception:
         pass
 
+# Время жизни игры крестики-нолики, секунд (10 минут)
+TTT_GAME_LIFETIME = 600
+
 # Активные игры крестики-нолики
-active_tic_tac_toe_games = {}
+active_tic_tac_toe_games = session_store.SessionStore("tic_tac_toe", ttl=1800, maxsize=5000, persist=True)
 
 class TicTacToeGame:
     def __init__(self, player1_id, player1_name, player2_id, player2_name, bet_amount, game_id):
@@ -203,6 +208,8 @@ def start_tic_tac_toe_challenge(challenger_id, challenger_name, opponent_id, opp
     game.challenged_player_id = opponent_id
     
     active_tic_tac_toe_games[game_id] = game
+    # Через TTT_GAME_LIFETIME секунд непринятый вызов удаляется (таймер, а не периодический обход)
+    timers.schedule(("ttt", game_id), TTT_GAME_LIFETIME, cleanup_old_ttt_games, game_id)
     
     return game
 
@@ -219,27 +226,20 @@ def accept_tic_tac_toe_challenge(game_id, accepter_id):
     if accepter_id != game.challenged_player_id:
         return {"success": False, "error": "Это не ваш вызов"}
         
-    # Списываем дань у обоих игроков
-    player1_balance = db.get_user(game.player1_id)
-    player2_balance = db.get_user(game.player2_id)
-    
-    if not player1_balance or player1_balance["dan"] < game.bet_amount:
-        return {"success": False, "error": f"У {game.player1_name} недостаточно дани"}
-        
-    if not player2_balance or player2_balance["dan"] < game.bet_amount:
+    # Списываем ставки у обоих игроков одной транзакцией: либо у обоих, либо ни у кого
+    settled = db.settle_rounds([
+        (game.player1_id, game.bet_amount, 0, None),
+        (game.player2_id, game.bet_amount, 0, None),
+    ])
+    if settled is None:
+        player1_balance = db.get_user(game.player1_id)
+        if not player1_balance or player1_balance["dan"] < game.bet_amount:
+            return {"success": False, "error": f"У {game.player1_name} недостаточно дани"}
         return {"success": False, "error": f"У {game.player2_name} недостаточно дани"}
         
-    # Списываем ставки
-    if not db.withdraw_dan(game.player1_id, game.bet_amount):
-        return {"success": False, "error": "Ошибка списания у игрока 1"}
-        
-    if not db.withdraw_dan(game.player2_id, game.bet_amount):
-        # Возвращаем дань первому игроку если у второго ошибка
-        db.add_dan(game.player1_id, game.bet_amount)
-        return {"success": False, "error": "Ошибка списания у игрока 2"}
-        
-    # Начинаем игру
+    # Начинаем игру: ставки списаны, вызов больше не истекает
     game.status = "playing"
+    timers.cancel(("ttt", game_id))
     
     return {"success": True, "game": game}
 
@@ -258,6 +258,7 @@ def decline_tic_tac_toe_challenge(game_id, decliner_id):
         
     # Удаляем игру
     del active_tic_tac_toe_games[game_id]
+    timers.cancel(("ttt", game_id))
     
     return {"success": True}
 
@@ -270,47 +271,37 @@ def make_tic_tac_toe_move(game_id, player_id, row, col):
     result = game.make_move(player_id, row, col)
     
     if result["success"] and result.get("game_over"):
-        # Игра завершена, выплачиваем награды
+        timers.cancel(("ttt", game_id))
+        # Игра завершена: награды и статистика обоих игроков - одной транзакцией
         if game.winner == "draw":
-            # Ничья - возвращаем 90% каждому (10% комиссия)
+            # Ничья - возвращаем 90% каждому (10% комиссия), оба теряют комиссию
             refund = int(game.bet_amount * 0.9)
-            db.add_dan(game.player1_id, refund)
-            db.add_dan(game.player2_id, refund)
+            commission = int(game.bet_amount * 0.1)
+            entries = [
+                (game.player1_id, 0, refund, db.round_stats(lose=commission, games=0)),
+                (game.player2_id, 0, refund, db.round_stats(lose=commission, games=0)),
+            ]
         else:
-            # Есть победитель - отдаем 90% от общего банка
+            # Есть победитель - отдаем 90% от общего банка; у проигравшего - проигрыш
             total_winnings = int(game.bet_amount * 2 * 0.9)
-            db.add_dan(game.winner, total_winnings)
-            
-        # Обновляем статистику
-        try:
-            if game.winner != "draw":
-                # У победителя - выигрыш, у проигравшего - проигрыш
-                loser = game.player2_id if game.winner == game.player1_id else game.player1_id
-                winnings = int(game.bet_amount * 2 * 0.9) - game.bet_amount  # Чистый выигрыш
-                
-                db.increment_dan_win(game.winner, winnings)
-                db.increment_dan_lose(loser, game.bet_amount)
-            else:
-                # При ничьей оба теряют комиссию
-                commission = int(game.bet_amount * 0.1)
-                db.increment_dan_lose(game.player1_id, commission)
-                db.increment_dan_lose(game.player2_id, commission)
-        except Exception as e:
-            print(f"Ошибка обновления статистики: {e}")
+            loser = game.player2_id if game.winner == game.player1_id else game.player1_id
+            winnings = total_winnings - game.bet_amount  # Чистый выигрыш
+            entries = [
+                (game.winner, 0, total_winnings, db.round_stats(win=winnings, games=0)),
+                (loser, 0, 0, db.round_stats(lose=game.bet_amount, games=0)),
+            ]
+        db.settle_rounds(entries)
     
     return result
 
-# Функция для очистки старых игр (вызывается периодически)
-def cleanup_old_ttt_games():
-    """Очистить старые игры (старше 10 минут)"""
-    current_time = int(time.time())
-    to_remove = []
-    
-    for game_id, game in active_tic_tac_toe_games.items():
-        if current_time - game.created_at > 600:  # 10 минут
-            to_remove.append(game_id)
-            
-    for game_id in to_remove:
-        del active_tic_tac_toe_games[game_id]
-        
-    return len(to_remove)
\ No newline at end of file
+# Функция для очистки старой игры (вызывается таймером через TTT_GAME_LIFETIME после создания)
+def cleanup_old_ttt_games(game_id):
+    """Очистить непринятый вызов game_id (старше 10 минут).
+
+    Принятые игры не трогаем: ставки обоих игроков уже списаны.
+    """
+    game = active_tic_tac_toe_games.get(game_id)
+    if game is None or game.status != "waiting":
+        return 0
+    active_tic_tac_toe_games.pop(game_id, None)
+    return 1
\ No newline at end of file
@@ -0,0 +1,283 @@
+"""
+Кеш готовых картинок-сеток (магазин, категории магазина, инвентарь).
+
+Сетка 3×3 рисуется Pillow за десятки миллисекунд, а меняется только вместе
+с данными: стоком магазина или инвентарём. Поэтому картинка адресуется
+содержимым: ключ — хэш всего, что попадает на картинку (предметы, подписи,
+серые слоты, шрифт, а также путь, mtime и размер каждой иконки). Одинаковые
+данные дают тот же файл, изменённые — новый ключ, так что устаревшую
+картинку отдать нельзя.
+
+Два уровня, оба LRU на OrderedDict (вытеснение — popitem, O(1)):
+
+- память: PNG-байты недавно отрисованных картинок (MEMORY_LIMIT байт); если
+  файл удалил другой процесс (воркеры webhook.py делят каталог), он
+  восстанавливается из памяти без перерисовки;
+- диск: файлы <вид>_<хэш>.png в RENDER_CACHE_DIR (переменная окружения, по
+  умолчанию cache/render рядом с ботом), не больше DISK_LIMIT_FILES файлов и
+  DISK_LIMIT_BYTES байт. Каталог просматривается один раз при первом
+  обращении, дальше порядок вытеснения ведётся в памяти.
+
+Постоянный путь к файлу позволяет media_cache отправлять file_id вместо
+повторной загрузки: повторный просмотр той же страницы не передаёт байтов.
+
+Инвалидация: картинки помечаются тегами ("shop", "inventory:<user_id>").
+invalidate(tag) вызывается при изменении стока и инвентаря — картинки тега
+уходят из памяти и первыми в очередь на удаление с диска (файл не удаляется
+сразу: его может прямо сейчас отправлять другой хендлер).
+
+    path = render_cache.get_or_render("shop", (grid_items, greyed), render, files=icons, tags=("shop",))
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Меняется вместе с кодом отрисовки, чтобы не отдавать картинки старого вида
+RENDER_VERSION = 1
+
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "render"
+)
+MEMORY_LIMIT = 32 * 1024 * 1024
+DISK_LIMIT_FILES = 2000
+DISK_LIMIT_BYTES = 512 * 1024 * 1024
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+
+def _file_stamp(path) -> Optional[list]:
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [str(path), None]
+    return [str(path), st.st_mtime_ns, st.st_size]
+
+
+class RenderCache:
+    """Двухуровневый (память + диск) кеш PNG по ключу содержимого."""
+
+    def __init__(self, directory: str, memory_limit: int = MEMORY_LIMIT,
+                 disk_limit_files: int = DISK_LIMIT_FILES, disk_limit_bytes: int = DISK_LIMIT_BYTES):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit_files = disk_limit_files
+        self.disk_limit_bytes = disk_limit_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()  # ключ -> размер файла
+        self._disk_bytes = 0
+        self._tags: Dict[str, set] = {}       # тег -> ключи
+        self._key_tags: Dict[str, set] = {}   # ключ -> теги
+        self._scanned = False
+        self._lock = threading.Lock()
+        self._evict_listeners: List[Callable[[str], None]] = []
+        # Статистика
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(kind: str, parts, files: Iterable = ()) -> str:
+        stamps = sorted((_file_stamp(path) for path in set(files) if path), key=str)
+        raw = json.dumps([RENDER_VERSION, parts, stamps], ensure_ascii=False, sort_keys=True, default=_json_default)
+        return f"{kind}_{hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()}"
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _scan_locked(self):
+        if self._scanned:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp"):
+                    # Недописанный файл после падения процесса
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                elif entry.name.endswith(".png") and entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._scanned = True
+
+    def get_or_render(self, kind: str, parts, render: Callable, files: Iterable = (), tags: Iterable[str] = ()) -> str:
+        """Путь к PNG для данных parts; render() -> PIL.Image вызывается только при промахе."""
+        key = self.make_key(kind, parts, files)
+        path = self.path_for(key)
+        with self._lock:
+            self._scan_locked()
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+            indexed = key in self._disk
+            if indexed:
+                self._disk.move_to_end(key)
+        if indexed and os.path.exists(path):
+            with self._lock:
+                if blob is not None:
+                    self.memory_hits += 1
+                else:
+                    self.disk_hits += 1
+                self._tag_locked(key, tags)
+            return path
+
+        if blob is None and os.path.exists(path):
+            # Файл записал другой процесс
+            size = os.path.getsize(path)
+            with self._lock:
+                self.disk_hits += 1
+                self._store_locked(key, None, size, tags)
+                evicted = self._evict_locked()
+            self._remove_files(evicted)
+            return path
+
+        if blob is None:
+            img = render()
+            buf = io.BytesIO()
+            img.save(buf, format="PNG")
+            blob = buf.getvalue()
+            with self._lock:
+                self.renders += 1
+        else:
+            with self._lock:
+                self.memory_hits += 1
+        self._write_file(path, blob)
+        with self._lock:
+            self._store_locked(key, blob, len(blob), tags)
+            evicted = self._evict_locked()
+        self._remove_files(evicted)
+        return path
+
+    def _write_file(self, path: str, blob: bytes):
+        # Через временный файл: другой поток или процесс не увидит недописанный PNG
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+    def _store_locked(self, key: str, blob: Optional[bytes], size: int, tags: Iterable[str]):
+        if blob is not None and len(blob) <= self.memory_limit:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            self._memory[key] = blob
+            self._memory_bytes += len(blob)
+        self._disk_bytes += size - self._disk.pop(key, 0)
+        self._disk[key] = size
+        self._tag_locked(key, tags)
+
+    def _tag_locked(self, key: str, tags: Iterable[str]):
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+            self._key_tags.setdefault(key, set()).add(tag)
+
+    def _untag_locked(self, key: str):
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _evict_locked(self) -> List[str]:
+        while self._memory_bytes > self.memory_limit:
+            _, blob = self._memory.popitem(last=False)
+            self._memory_bytes -= len(blob)
+        evicted = []
+        while self._disk and (len(self._disk) > self.disk_limit_files or self._disk_bytes > self.disk_limit_bytes):
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            blob = self._memory.pop(key, None)
+            if blob is not None:
+                self._memory_bytes -= len(blob)
+            self._untag_locked(key)
+            self.evictions += 1
+            evicted.append(self.path_for(key))
+        return evicted
+
+    def _remove_files(self, paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            for listener in self._evict_listeners:
+                try:
+                    listener(path)
+                except Exception as e:
+                    print(f"⚠️ render_cache: ошибка обработчика вытеснения {path}: {e}")
+
+    def invalidate(self, *tags: str) -> int:
+        """Убрать картинки с тегами из памяти и поставить их файлы первыми на удаление."""
+        count = 0
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    other_tags = self._key_tags.get(key)
+                    if other_tags is not None:
+                        other_tags.discard(tag)
+                        if not other_tags:
+                            del self._key_tags[key]
+                    blob = self._memory.pop(key, None)
+                    if blob is not None:
+                        self._memory_bytes -= len(blob)
+                    if key in self._disk:
+                        self._disk.move_to_end(key, last=False)
+                    count += 1
+            self.invalidations += count
+        return count
+
+    def add_evict_listener(self, listener: Callable[[str], None]):
+        """listener(path) вызывается после удаления файла с диска (например, media_cache.forget)."""
+        self._evict_listeners.append(listener)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "renders": self.renders,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_cache = RenderCache(RENDER_CACHE_DIR)
+
+
+def get_or_render(kind: str, parts, render: Callable, files: Iterable = (), tags: Iterable[str] = ()) -> str:
+    return _cache.get_or_render(kind, parts, render, files=files, tags=tags)
+
+
+def invalidate(*tags: str) -> int:
+    return _cache.invalidate(*tags)
+
+
+def add_evict_listener(listener: Callable[[str], None]):
+    _cache.add_evict_listener(listener)
+
+
+def get_stats() -> Dict[str, int]:
+    return _cache.stats()
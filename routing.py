@@ -0,0 +1,348 @@
+"""
+Таблицы маршрутизации колбэков и текстовых команд для роутеров бота
+(main.py и features/).
+
+aiogram проверяет фильтры хендлеров по очереди, пока какой-нибудь не
+сработает. В main.py больше сотни колбэков и несколько десятков текстовых
+триггеров на корневом диспетчере, поэтому нажатие на кнопку в конце списка
+прогоняло десятки лямбд со startswith, а каждое текстовое сообщение — ещё и
+регулярки («клад», «боулинг», ...). Здесь каждая группа — один хендлер
+aiogram с индексом (по одной таблице колбэков и текстов на роутер фичи):
+
+- CallbackRouter: маршруты индексируются по части callback_data до первого
+  «:»; кандидаты для этой части считаются один раз и кешируются;
+- TextRouter: точные слова — словарь, префиксы — префиксное дерево по
+  нормализованному тексту (strip + lower; ignore_case=False — только strip),
+  слова «где угодно в тексте» — одна общая скомпилированная регулярка.
+
+Порядок регистрации сохраняется: из подходящих маршрутов срабатывает
+зарегистрированный раньше всех, как и при цепочке фильтров aiogram. Хендлеры
+с обычными фильтрами aiogram (команда, состояние FSM), стоявшие среди
+текстовых триггеров, регистрируются через texts.on(...) и проверяются на
+своём месте в этом порядке. Фильтры асинхронные: синхронный фильтр aiogram
+выполняет в отдельном потоке. TextChain проверяет таблицы нескольких роутеров
+как одну, в заданном порядке хендлеров (features.TEXT_ORDER).
+
+    router = Router(name="main")
+    callbacks = routing.CallbackRouter()
+    router.callback_query.register(callbacks.dispatch, callbacks.filter)
+
+    @callbacks.on("menu_tops", "menu_tops:*")   # точное значение или префикс («*» в конце)
+    async def menu_tops_callback(callback): ...
+
+    texts = routing.TextRouter()
+    dp.message.register(texts.dispatch, texts.filter)   # или вместе с другими таблицами: TextChain
+
+    @texts.exact("ферма")
+    @texts.prefix("дать ", reply=True)
+    @texts.prefix("+ban", reply=True, ignore_case=False)
+    @texts.contains("клад", digits=True)
+    @texts.on(Command("deposit"))
+    @texts.on(BankStates.waiting_for_direct_deposit_amount)
+"""
+import inspect
+import itertools
+import re
+from typing import Callable, Dict, List, Optional
+
+from aiogram.dispatcher.event.handler import FilterObject
+from aiogram.filters import StateFilter
+from aiogram.fsm.state import State
+
+# Сколько разных callback-префиксов держать в кеше кандидатов
+# (callback_data приходит от клиента и может быть любым)
+CANDIDATE_CACHE_SIZE = 4096
+
+_seq = itertools.count()
+
+
+class _Route:
+    """Хендлер с номером регистрации и дополнительной проверкой события."""
+
+    __slots__ = ("seq", "handler", "check", "filters", "params", "takes_kwargs")
+
+    def __init__(self, handler: Callable, check: Optional[Callable] = None, filters=()):
+        self.seq = next(_seq)
+        self.handler = handler
+        self.check = check
+        # Фильтры aiogram (texts.on): проверяются с данными апдейта, как в dp.message(...)
+        self.filters = [FilterObject(f) for f in filters]
+        # Какие именованные аргументы aiogram (state, bot, ...) передавать хендлеру
+        parameters = list(inspect.signature(handler).parameters.values())[1:]
+        self.takes_kwargs = any(p.kind is inspect.Parameter.VAR_KEYWORD for p in parameters)
+        self.params = [p.name for p in parameters
+                       if p.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY)]
+
+    async def call(self, event, data: dict):
+        if self.takes_kwargs:
+            return await self.handler(event, **data)
+        return await self.handler(event, **{name: data[name] for name in self.params if name in data})
+
+    async def match(self, event, data: dict):
+        """False или данные для хендлера (то, что вернули фильтры aiogram)."""
+        if self.check is not None and not self.check(event):
+            return False
+        extra = {}
+        for flt in self.filters:
+            result = await flt.call(event, **data)
+            if not result:
+                return False
+            if isinstance(result, dict):
+                extra.update(result)
+                data = {**data, **result}
+        return extra
+
+
+def _first(routes, event) -> Optional[_Route]:
+    for route in sorted(routes, key=lambda r: r.seq):
+        if route.check is None or route.check(event):
+            return route
+    return None
+
+
+async def _first_matching(routes, event, data: dict, key: Callable = lambda r: r.seq):
+    """Первый по порядку регистрации (или по key) маршрут, прошедший проверки: (маршрут, данные) или (None, None)."""
+    for route in sorted(routes, key=key):
+        extra = await route.match(event, data)
+        if extra is not False:
+            return route, extra
+    return None, None
+
+
+class CallbackRouter:
+    """Маршрутизация callback_query по части callback_data до первого «:»."""
+
+    def __init__(self):
+        self._by_token: Dict[str, List[_Route]] = {}
+        # Префиксы без «:» (например "task_"): подходят всем токенам, которые с них начинаются
+        self._loose: List[tuple] = []
+        self._catch_all: List[_Route] = []
+        self._candidates: Dict[str, List[_Route]] = {}
+
+    def on(self, *patterns: str):
+        """Зарегистрировать хендлер: "x" — точное значение, "x*" — префикс, "*" — любой колбэк."""
+        def decorator(handler):
+            exact = frozenset(p for p in patterns if not p.endswith("*"))
+            prefixes = tuple(p[:-1] for p in patterns if p.endswith("*"))
+            route = _Route(handler, lambda data: data in exact or data.startswith(prefixes))
+            tokens = set()
+            for value in exact:
+                tokens.add(value.partition(":")[0])
+            for prefix in prefixes:
+                if not prefix:
+                    self._catch_all.append(route)
+                elif ":" in prefix:
+                    tokens.add(prefix.partition(":")[0])
+                else:
+                    self._loose.append((prefix, route))
+            for token in tokens:
+                self._by_token.setdefault(token, []).append(route)
+            self._candidates.clear()
+            return handler
+        return decorator
+
+    def _candidates_for(self, token: str) -> List[_Route]:
+        routes = self._candidates.get(token)
+        if routes is None:
+            found = set(self._by_token.get(token, ()))
+            found.update(route for prefix, route in self._loose if token.startswith(prefix))
+            found.update(self._catch_all)
+            routes = sorted(found, key=lambda r: r.seq)
+            if len(self._candidates) >= CANDIDATE_CACHE_SIZE:
+                self._candidates.clear()
+            self._candidates[token] = routes
+        return routes
+
+    async def filter(self, callback):
+        """Фильтр aiogram: находит маршрут и передаёт его хендлеру dispatch."""
+        data = callback.data or ""
+        route = _first(self._candidates_for(data.partition(":")[0]), data)
+        return {"callback_route": route} if route else False
+
+    async def dispatch(self, callback, callback_route: _Route, **data):
+        return await callback_route.call(callback, data)
+
+    def __len__(self):
+        return len({route for routes in self._by_token.values() for route in routes}
+                   | {route for _, route in self._loose} | set(self._catch_all))
+
+
+class _TrieNode:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.routes: List[_Route] = []
+
+
+def normalize(text: str) -> str:
+    return text.strip().lower()
+
+
+_DIGITS = re.compile(r"\d")
+
+
+def _has_reply(message) -> bool:
+    return message.reply_to_message is not None
+
+
+class TextRouter:
+    """Маршрутизация текстовых сообщений-команд («ферма», «бет 100», «клад 50», ...)."""
+
+    def __init__(self):
+        self._exact: Dict[str, List[_Route]] = {}
+        # Точные слова, сравниваемые после удаления знаков препинания: символы -> слово -> маршруты
+        self._exact_stripped: Dict[str, Dict[str, List[_Route]]] = {}
+        self._trie = _TrieNode()
+        # Префиксы с учётом регистра: дерево по тексту после strip
+        self._trie_cased = _TrieNode()
+        # Маршруты texts.on(...): кандидаты для любого текста
+        self._filtered: List[_Route] = []
+        self._contains: List[tuple] = []  # (ключевые слова, только с числом, маршрут)
+        self._contains_re = None
+        self._contains_groups: Dict[str, tuple] = {}
+
+    def exact(self, *words: str, strip: str = "", reply: bool = False):
+        """Текст целиком (без учёта регистра и пробелов по краям; strip — ещё и этих символов по краям)."""
+        def decorator(handler):
+            route = _Route(handler, _has_reply if reply else None)
+            table = self._exact_stripped.setdefault(strip, {}) if strip else self._exact
+            for word in words:
+                key = normalize(word).strip(strip) if strip else normalize(word)
+                table.setdefault(key, []).append(route)
+            return handler
+        return decorator
+
+    def prefix(self, *prefixes: str, reply: bool = False, ignore_case: bool = True):
+        """Текст начинается с одного из префиксов (reply=True — только в ответ на сообщение)."""
+        def decorator(handler):
+            route = _Route(handler, _has_reply if reply else None)
+            for prefix in prefixes:
+                node = self._trie if ignore_case else self._trie_cased
+                for char in (prefix.lower() if ignore_case else prefix):
+                    node = node.children.setdefault(char, _TrieNode())
+                node.routes.append(route)
+            return handler
+        return decorator
+
+    def on(self, *filters):
+        """Хендлер с обычными фильтрами aiogram (Command, состояние FSM) на своём месте в порядке регистрации."""
+        def decorator(handler):
+            # Состояние - через асинхронный StateFilter: синхронный State aiogram проверял бы в потоке
+            flts = [StateFilter(f) if isinstance(f, State) else f for f in filters]
+            self._filtered.append(_Route(handler, filters=flts))
+            return handler
+        return decorator
+
+    def contains(self, *keywords: str, digits: bool = False):
+        """В тексте есть одно из слов (digits=True — и хотя бы одна цифра)."""
+        def decorator(handler):
+            route = _Route(handler)
+            self._contains.append((keywords, digits, route))
+            self._compile_contains()
+            return handler
+        return decorator
+
+    def _compile_contains(self):
+        # Одна регулярка на все слова: группа r<N> — N-й маршрут
+        parts, self._contains_groups = [], {}
+        for index, (keywords, digits, route) in enumerate(self._contains):
+            group = f"r{index}"
+            self._contains_groups[group] = (digits, route)
+            parts.append(f"(?P<{group}>" + "|".join(re.escape(k.lower()) for k in keywords) + ")")
+        self._contains_re = re.compile("|".join(parts))
+
+    @staticmethod
+    def _walk(node: _TrieNode, text: str, candidates: List[_Route]):
+        for char in text:
+            node = node.children.get(char)
+            if node is None:
+                break
+            candidates += node.routes
+
+    def _candidates(self, message) -> List[_Route]:
+        text = normalize(message.text)
+        candidates = list(self._exact.get(text, ()))
+        for chars, table in self._exact_stripped.items():
+            candidates += table.get(text.strip(chars), ())
+        self._walk(self._trie, text, candidates)
+        if self._trie_cased.children:
+            self._walk(self._trie_cased, message.text.strip(), candidates)
+        if self._contains_re is not None:
+            has_digits = None
+            for match in self._contains_re.finditer(text):
+                digits, route = self._contains_groups[match.lastgroup]
+                if digits:
+                    if has_digits is None:
+                        has_digits = _DIGITS.search(text) is not None
+                    if not has_digits:
+                        continue
+                candidates.append(route)
+        return candidates + self._filtered
+
+    async def filter(self, message, **data):
+        """Фильтр aiogram: находит маршрут и передаёт его хендлеру dispatch."""
+        # Без текста (фото с подписью-командой и т.п.) подходят только маршруты texts.on(...)
+        candidates = self._candidates(message) if message.text else self._filtered
+        if not candidates:
+            return False
+        route, extra = await _first_matching(candidates, message, data)
+        return {"text_route": route, **extra} if route else False
+
+    async def dispatch(self, message, text_route: _Route, **data):
+        return await text_route.call(message, data)
+
+    def routes(self) -> List[_Route]:
+        """Все маршруты таблицы (без повторов)."""
+        found = {}
+        for routes in self._exact.values():
+            found.update(dict.fromkeys(routes))
+        for table in self._exact_stripped.values():
+            for routes in table.values():
+                found.update(dict.fromkeys(routes))
+        nodes = [self._trie, self._trie_cased]
+        while nodes:
+            node = nodes.pop()
+            found.update(dict.fromkeys(node.routes))
+            nodes.extend(node.children.values())
+        found.update(dict.fromkeys(self._filtered))
+        found.update(dict.fromkeys(route for _, _, route in self._contains))
+        return list(found)
+
+    def __len__(self):
+        return len(self.routes())
+
+
+class TextChain:
+    """Таблицы текстовых команд нескольких роутеров (по одной на фичу) как одна.
+
+    Из подходящих маршрутов всех таблиц срабатывает первый по order — списку
+    хендлеров в порядке проверки, — как если бы они были зарегистрированы в
+    одной таблице в этом порядке. Хендлер таблицы, которого нет в order, — ошибка.
+
+        chain = routing.TextChain([main_texts, bank.texts], [cmd_bal, bank.bank_handler])
+        dp.message.register(chain.dispatch, chain.filter)
+    """
+
+    def __init__(self, routers, order):
+        position = {handler: index for index, handler in enumerate(order)}
+        self._routers = list(routers)
+        self._rank: Dict[_Route, int] = {}
+        for router in self._routers:
+            for route in router.routes():
+                if route.handler not in position:
+                    raise ValueError(f"TextChain: хендлера {route.handler.__qualname__} нет в order")
+                self._rank[route] = position[route.handler]
+
+    async def filter(self, message, **data):
+        """Фильтр aiogram: первый по order маршрут из всех таблиц."""
+        candidates = []
+        for router in self._routers:
+            candidates += router._candidates(message) if message.text else router._filtered
+        if not candidates:
+            return False
+        route, extra = await _first_matching(candidates, message, data, key=self._rank.__getitem__)
+        return {"text_route": route, **extra} if route else False
+
+    async def dispatch(self, message, text_route: _Route, **data):
+        return await text_route.call(message, data)
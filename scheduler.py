@@ -0,0 +1,295 @@
+"""
+Планировщик периодических задач на asyncio (в стиле cron).
+
+Раньше розыгрыш лотереи планировался через threading.Timer (плюс отдельный
+резервный поток раз в час), а ежедневная очистка сама считала, сколько
+спать. Здесь все регулярные задачи регистрируются в одном месте и живут в
+цикле событий бота — без дополнительных потоков ОС:
+
+    scheduler.add_job("lottery_draw", run_draw, scheduler.Daily(21, 0, scheduler.KYIV_TZ))
+    scheduler.add_job("effects_cleanup", db.remove_expired_effects, scheduler.Every(300))
+    scheduler.start()
+
+- время последнего запуска каждой задачи хранится в таблице scheduler_runs;
+- catch_up=True: если при старте оказалось, что плановый запуск был пропущен
+  (бот лежал), задача выполняется сразу;
+- jitter — случайная задержка до jitter секунд, чтобы задачи не срабатывали
+  одновременно;
+- синхронные функции выполняются в пуле потоков БД (db_async), корутины —
+  прямо в цикле событий;
+- list_jobs() — для админской команды /jobs.
+"""
+import asyncio
+import datetime
+import inspect
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+import pytz
+
+import database as db
+import db_async
+
+# Часовой пояс розыгрышей и недель заданий (создаётся один раз)
+KYIV_TZ = pytz.timezone('Europe/Kiev')
+
+
+def _localize(tz, naive: datetime.datetime) -> datetime.datetime:
+    # pytz требует localize, а не replace(tzinfo=...), иначе смещение будет неверным (LMT)
+    if tz is None:
+        return naive.astimezone()
+    return tz.localize(naive)
+
+
+def _now(tz) -> datetime.datetime:
+    return datetime.datetime.now(tz) if tz is not None else datetime.datetime.now().astimezone()
+
+
+class Every:
+    """Каждые seconds секунд."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        return moment + datetime.timedelta(seconds=self.seconds)
+
+    def previous(self, moment: datetime.datetime) -> Optional[datetime.datetime]:
+        # У интервальных задач нет «плановых» моментов — пропуском считается
+        # последний запуск раньше, чем seconds назад
+        return moment - datetime.timedelta(seconds=self.seconds)
+
+    def __str__(self):
+        if self.seconds % 3600 == 0:
+            return f"каждые {self.seconds // 3600} ч"
+        if self.seconds % 60 == 0:
+            return f"каждые {self.seconds // 60} мин"
+        return f"каждые {self.seconds} с"
+
+
+class Daily:
+    """Каждый день в hour:minute по часовому поясу tz (None — локальное время сервера)."""
+
+    def __init__(self, hour: int, minute: int = 0, tz=None):
+        self.hour = hour
+        self.minute = minute
+        self.tz = tz
+
+    def _at(self, day: datetime.date) -> datetime.datetime:
+        return _localize(self.tz, datetime.datetime.combine(day, datetime.time(self.hour, self.minute)))
+
+    def _local_date(self, moment: datetime.datetime) -> datetime.date:
+        return moment.astimezone(self.tz).date() if self.tz is not None else moment.astimezone().date()
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        day = self._local_date(moment)
+        candidate = self._at(day)
+        while candidate <= moment:
+            day += datetime.timedelta(days=1)
+            candidate = self._at(day)
+        return candidate
+
+    def previous(self, moment: datetime.datetime) -> Optional[datetime.datetime]:
+        day = self._local_date(moment)
+        candidate = self._at(day)
+        while candidate > moment:
+            day -= datetime.timedelta(days=1)
+            candidate = self._at(day)
+        return candidate
+
+    def __str__(self):
+        zone = f" ({self.tz.zone})" if self.tz is not None else ""
+        return f"ежедневно в {self.hour:02d}:{self.minute:02d}{zone}"
+
+
+class Weekly(Daily):
+    """Раз в неделю: день недели weekday (0 — понедельник) в hour:minute."""
+
+    _DAYS = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+    def __init__(self, weekday: int, hour: int, minute: int = 0, tz=None):
+        super().__init__(hour, minute, tz)
+        self.weekday = weekday
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        candidate = super().next_after(moment)
+        while candidate.weekday() != self.weekday:
+            candidate = super().next_after(candidate)
+        return candidate
+
+    def previous(self, moment: datetime.datetime) -> Optional[datetime.datetime]:
+        candidate = super().previous(moment)
+        while candidate.weekday() != self.weekday:
+            candidate = super().previous(candidate - datetime.timedelta(seconds=1))
+        return candidate
+
+    def __str__(self):
+        zone = f" ({self.tz.zone})" if self.tz is not None else ""
+        return f"еженедельно, {self._DAYS[self.weekday]} в {self.hour:02d}:{self.minute:02d}{zone}"
+
+
+class Job:
+    def __init__(self, name: str, func: Callable, schedule, jitter: float = 0,
+                 catch_up: bool = True, run_at_start: bool = False):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.run_at_start = run_at_start
+        self.last_run: Optional[float] = None  # unix-время последнего запуска
+        self.last_status = None
+        self.last_error = None
+        self.runs = 0
+        self.next_run: Optional[datetime.datetime] = None
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+
+    def tz(self):
+        return getattr(self.schedule, "tz", None)
+
+    def missed(self, now: datetime.datetime) -> bool:
+        """Был ли пропущен плановый запуск (по сохранённому времени последнего запуска)."""
+        if self.last_run is None:
+            return False
+        due = self.schedule.previous(now)
+        return due is not None and self.last_run < due.timestamp()
+
+    async def run(self):
+        if self.running:
+            # Прошлый запуск ещё идёт — не запускаем параллельно
+            return
+        self.running = True
+        started = time.time()
+        try:
+            if inspect.iscoroutinefunction(self.func):
+                await self.func()
+            else:
+                await db_async.run(self.func)
+            self.last_status, self.last_error = "ok", None
+        except Exception as e:
+            self.last_status, self.last_error = "error", str(e)
+            print(f"❌ Задача {self.name}: {e}")
+        finally:
+            self.running = False
+        self.last_run = started
+        self.runs += 1
+        try:
+            await db_async.run(_save_run, self)
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить запуск задачи {self.name}: {e}")
+
+
+_jobs: Dict[str, Job] = {}
+_started = False
+
+
+def add_job(name: str, func: Callable, schedule, jitter: float = 0,
+            catch_up: bool = True, run_at_start: bool = False) -> Job:
+    """Зарегистрировать задачу (до или после start()); повторная регистрация заменяет задачу.
+
+    catch_up — выполнить сразу, если плановый запуск был пропущен, пока бот не работал;
+    run_at_start — выполнить при каждом старте.
+    """
+    remove_job(name)
+    job = Job(name, func, schedule, jitter, catch_up, run_at_start)
+    _jobs[name] = job
+    if _started:
+        _load_runs([job])
+        job.task = asyncio.get_running_loop().create_task(_job_loop(job))
+    return job
+
+
+def remove_job(name: str):
+    job = _jobs.pop(name, None)
+    if job and job.task:
+        job.task.cancel()
+
+
+async def _job_loop(job: Job):
+    now = _now(job.tz())
+    if job.run_at_start or (job.catch_up and job.missed(now)):
+        if job.last_run is not None and not job.run_at_start:
+            print(f"⏰ Задача {job.name}: пропущен запуск, выполняем сейчас")
+        await job.run()
+    while True:
+        now = _now(job.tz())
+        job.next_run = job.schedule.next_after(now)
+        delay = (job.next_run - now).total_seconds()
+        if job.jitter:
+            delay += random.uniform(0, job.jitter)
+        await asyncio.sleep(max(delay, 0))
+        await job.run()
+
+
+def _load_runs(jobs: List[Job]):
+    conn = db._connect(row_factory=None)
+    try:
+        for job in jobs:
+            row = conn.execute(
+                "SELECT last_run, last_status, last_error, runs FROM scheduler_runs WHERE job = ?", (job.name,)
+            ).fetchone()
+            if row:
+                job.last_run, job.last_status, job.last_error, job.runs = row
+    finally:
+        conn.close()
+
+
+def _save_run(job: Job):
+    conn = db._connect(row_factory=None)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO scheduler_runs (job, last_run, last_status, last_error, runs) VALUES (?, ?, ?, ?, ?)",
+            (job.name, job.last_run, job.last_status, job.last_error, job.runs),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def start():
+    """Запустить все зарегистрированные задачи (из цикла событий)."""
+    global _started
+    if _started:
+        return
+    _started = True
+    loop = asyncio.get_running_loop()
+    _load_runs(list(_jobs.values()))
+    for job in _jobs.values():
+        job.task = loop.create_task(_job_loop(job))
+    print(f"✅ Планировщик задач запущен ({len(_jobs)} задач)")
+
+
+def stop():
+    global _started
+    _started = False
+    for job in _jobs.values():
+        if job.task:
+            job.task.cancel()
+            job.task = None
+
+
+async def run_now(name: str) -> bool:
+    """Выполнить задачу вне расписания (для /jobs run)."""
+    job = _jobs.get(name)
+    if not job:
+        return False
+    await job.run()
+    return True
+
+
+def list_jobs() -> List[Dict]:
+    result = []
+    for job in _jobs.values():
+        result.append({
+            "name": job.name,
+            "schedule": str(job.schedule),
+            "last_run": datetime.datetime.fromtimestamp(job.last_run) if job.last_run else None,
+            "last_status": job.last_status,
+            "last_error": job.last_error,
+            "runs": job.runs,
+            "next_run": job.next_run,
+            "running": job.running,
+        })
+    return result
@@ -0,0 +1,525 @@
+"""
+Хранилище игровых сессий в памяти с временем жизни и ограничением размера.
+
+Раньше состояние игр лежало в обычных словарях модулей (active_clads,
+active_saper_games, game_owners и т.д.), из которых брошенные игры никогда
+не удалялись, — на занятом боте память росла бесконечно. SessionStore ведёт
+себя как dict, но:
+
+- у каждого пространства имён свой ttl: запись живёт ttl секунд с последнего
+  обращения (get, [], in, запись), брошенные сессии пропадают сами;
+- при превышении maxsize вытесняется сессия, к которой дольше всего не
+  обращались;
+- фоновая задача sweeper() раз в SWEEP_INTERVAL секунд удаляет истёкшие
+  записи во всех хранилищах, get_stats() — статистика для /dbstats;
+- хранилища с persist=True переживают перезапуск: изменённые сессии раз в
+  SNAPSHOT_INTERVAL секунд сохраняются (pickle) в таблицу game_sessions,
+  restore_all() поднимает их при старте до начала опроса.
+
+Снимки инкрементальные. Игры меняются на месте (game.level += 1) после
+active_games.get(...)/[...], поэтому кандидатом в снимок считается любая
+сессия, к которой обращались, а также добавленная или удалённая. Записываются
+из них только те, у которых изменился pickle или заметно отстал срок в
+таблице (EXPIRY_SLACK). Сериализация идёт в цикле событий (там же, где
+меняются игры), запись в БД — в отдельном потоке.
+
+Хранилища используются из цикла событий бота (как и прежние словари), поэтому
+блокировок нет. keys()/values()/items() возвращают списки-снимки: по ним можно
+удалять записи прямо в цикле.
+
+Общий режим (enable_shared(), воркеры webhook.py) касается только хранилищ с
+persist=True — игр; кеши без persist (кулдауны, последние ставки, владельцы
+сообщений, расшифровки) остаются у каждого процесса свои. Память каждого
+процесса — полная копия игровых сессий, game_sessions — их общий журнал:
+
+- каждая запись получает номер seq из game_session_seq, удаление пишется
+  «надгробием» (expires_at в прошлом, таблица чистит их через TOMBSTONE_TTL);
+- refresh() перед апдейтом подтягивает строки с seq больше последнего
+  прочитанного, save() после апдейта пишет изменённые сессии; оба читают и
+  пишут БД в потоке и не пересекаются друг с другом;
+- сессию, изменённую здесь и ещё не записанную, чужая строка не затирает:
+  выигрывает последняя запись в таблице, как и раньше.
+
+Апдейты одного чата webhook.py отдаёт одному воркеру, так что одновременная
+правка одной сессии двумя процессами бывает только для ключей, общих для
+разных чатов.
+
+    active_clads = session_store.SessionStore("clad", ttl=1800, maxsize=10000, persist=True)
+"""
+import asyncio
+import pickle
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import database as db
+
+# Как часто фоновая задача чистит истёкшие сессии, секунд
+SWEEP_INTERVAL = 60
+# Как часто сохраняются изменённые сессии хранилищ с persist=True, секунд
+SNAPSHOT_INTERVAL = 1.0
+# Неизменённая сессия переписывается, когда срок в таблице отстал больше чем на эту долю ttl
+EXPIRY_SLACK = 0.1
+# Сколько секунд надгробия удалённых сессий лежат в таблице (общий режим)
+TOMBSTONE_TTL = 600
+
+
+class _Session:
+    """Запись хранилища: значение, момент истечения и что о ней записано в game_sessions."""
+
+    __slots__ = ("value", "expires_at", "saved", "saved_expires", "seq")
+
+    def __init__(self, value, expires_at: float, saved=None, saved_expires: float = 0.0, seq: int = 0):
+        self.value = value
+        self.expires_at = expires_at
+        # hash() записанного pickle и срок в таблице (time.time()); None - ещё не записана
+        self.saved = saved
+        self.saved_expires = saved_expires
+        # Номер строки в game_sessions (общий режим)
+        self.seq = seq
+
+
+# Общий режим (enable_shared): номер последней прочитанной строки game_sessions
+_shared = False
+_last_seq = 0
+_io_lock = asyncio.Lock()
+
+
+class SessionStore(MutableMapping):
+    """dict-подобное хранилище сессий пространства имён name."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 10000, persist: bool = False):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.persist = persist
+        # Порядок — по последнему обращению: истёкшие и кандидаты на вытеснение в начале
+        self._data: "OrderedDict[Hashable, _Session]" = OrderedDict()
+        # Ключи, изменённые после последнего снимка (только при persist)
+        self._dirty = set()
+        # Общий режим: чужие строки для ключей из _dirty, разбираются в _collect
+        self._incoming: Dict[Hashable, tuple] = {}
+        # Статистика
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.restored = 0
+        _register(self)
+
+    @property
+    def shared(self) -> bool:
+        """Сессии хранилища общие для процессов (общий режим и persist=True)."""
+        return _shared and self.persist
+
+    def _touch(self, key: Hashable):
+        if self.persist:
+            self._dirty.add(key)
+
+    def mark(self, key: Hashable):
+        """Явно отметить сессию изменённой (если её меняли без обращения к хранилищу)."""
+        self._touch(key)
+
+    def _live(self, key: Hashable):
+        """Живая запись key (с продлением срока) или None; истёкшая удаляется."""
+        session = self._data.get(key)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if session.expires_at <= now:
+            del self._data[key]
+            self.expired += 1
+            self._touch(key)
+            return None
+        session.expires_at = now + self.ttl
+        self._data.move_to_end(key)
+        self._touch(key)
+        return session
+
+    def __getitem__(self, key: Hashable):
+        session = self._live(key)
+        if session is None:
+            raise KeyError(key)
+        return session.value
+
+    def __contains__(self, key) -> bool:
+        return self._live(key) is not None
+
+    def get(self, key: Hashable, default=None):
+        session = self._live(key)
+        return default if session is None else session.value
+
+    def __setitem__(self, key: Hashable, value):
+        expires_at = time.monotonic() + self.ttl
+        session = self._data.get(key)
+        if session is None:
+            self._data[key] = _Session(value, expires_at)
+            self.created += 1
+            while len(self._data) > self.maxsize:
+                evicted_key, _ = self._data.popitem(last=False)
+                self.evicted += 1
+                self._touch(evicted_key)
+        else:
+            session.value = value
+            session.expires_at = expires_at
+            self._data.move_to_end(key)
+        self._touch(key)
+
+    def __delitem__(self, key: Hashable):
+        del self._data[key]
+        self._touch(key)
+
+    def pop(self, key: Hashable, *default):
+        session = self._data.pop(key, None)
+        if session is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        self._touch(key)
+        return session.value
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> List[Hashable]:
+        return list(self._data)
+
+    def values(self) -> List[object]:
+        return [session.value for session in self._data.values()]
+
+    def items(self) -> List[tuple]:
+        return [(key, session.value) for key, session in self._data.items()]
+
+    def clear(self):
+        if self.persist:
+            self._dirty.update(self._data)
+        self._data.clear()
+
+    def sweep(self) -> int:
+        """Удалить истёкшие записи; вернуть их число."""
+        now = time.monotonic()
+        removed = 0
+        # ttl у всех записей одинаковый, поэтому истёкшие идут подряд с начала
+        while self._data:
+            key, session = next(iter(self._data.items()))
+            if session.expires_at > now:
+                break
+            del self._data[key]
+            # В общем режиме у всех процессов тот же срок из таблицы - её чистит _purge_expired
+            if not self.shared:
+                self._touch(key)
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def _collect(self) -> List[tuple]:
+        """Изменённые с прошлого снимка сессии: (хранилище, ключ, key_blob, value_blob или None, срок)."""
+        dirty, self._dirty = self._dirty, set()
+        incoming, self._incoming = self._incoming, {}
+        changes = []
+        now_mono, now_wall = time.monotonic(), time.time()
+        for key in dirty:
+            try:
+                key_blob = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                print(f"⚠️ session_store {self.name}: ключ {key!r} не сохраняется: {e}")
+                continue
+            session = self._data.get(key)
+            if session is None:
+                changes.append((self, key, key_blob, None, now_wall))
+                continue
+            try:
+                value_blob = pickle.dumps(session.value, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                print(f"⚠️ session_store {self.name}: сессия {key!r} не сохраняется: {e}")
+                continue
+            expires_at = now_wall + (session.expires_at - now_mono)
+            digest = hash(value_blob)
+            if digest == session.saved:
+                if key in incoming:
+                    # Здесь сессию только читали, а другой процесс её записал - берём его версию
+                    self._adopt(key, *incoming[key])
+                    continue
+                if expires_at - session.saved_expires < self.ttl * EXPIRY_SLACK:
+                    continue
+            session.saved, session.saved_expires = digest, expires_at
+            changes.append((self, key, key_blob, value_blob, expires_at))
+        return changes
+
+    def _receive(self, key: Hashable, value, digest, expires_at: float, seq: int):
+        """Общий режим: строка game_sessions, записанная после последнего refresh()."""
+        session = self._data.get(key)
+        if session is not None and session.seq >= seq:
+            # Своя же запись или уже прочитанная
+            return
+        if key in self._dirty:
+            # Своя версия ещё не записана - решится в _collect
+            self._incoming[key] = (value, digest, expires_at, seq)
+            return
+        self._adopt(key, value, digest, expires_at, seq)
+
+    def _adopt(self, key: Hashable, value, digest, expires_at: float, seq: int):
+        if value is None:
+            # Надгробие: сессию удалил другой процесс
+            self._data.pop(key, None)
+            return
+        self._data[key] = _Session(value, time.monotonic() + (expires_at - time.time()), digest, expires_at, seq)
+        self._data.move_to_end(key)
+
+    def _restore(self, rows) -> List[tuple]:
+        """Поднять сессии из строк (key, value, expires_at, seq); вернуть ключи битых/истёкших строк."""
+        stale = []
+        now_mono, now_wall = time.monotonic(), time.time()
+        for key_blob, value_blob, expires_at, seq in sorted(rows, key=lambda row: row[2]):
+            if expires_at <= now_wall:
+                stale.append((self.name, key_blob))
+                continue
+            try:
+                key = pickle.loads(key_blob)
+                value = pickle.loads(value_blob)
+            except Exception as e:
+                print(f"⚠️ session_store {self.name}: не удалось восстановить сессию: {e}")
+                stale.append((self.name, key_blob))
+                continue
+            self._data[key] = _Session(value, now_mono + (expires_at - now_wall),
+                                       hash(value_blob), expires_at, seq or 0)
+            self.restored += 1
+        return stale
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "restored": self.restored,
+        }
+
+
+_stores: List[SessionStore] = []
+_restored = False
+
+
+def enable_shared():
+    """Включить общий режим (до первого обращения к хранилищам): game_sessions - общее хранилище процессов."""
+    global _shared
+    _shared = True
+
+
+def is_shared() -> bool:
+    return _shared
+
+
+def _purge_expired() -> int:
+    """Общий режим: удалить из таблицы давно истёкшие сессии и надгробия."""
+    conn = db._connect(row_factory=None)
+    try:
+        removed = conn.execute(
+            "DELETE FROM game_sessions WHERE expires_at <= ?", (time.time() - TOMBSTONE_TTL,)
+        ).rowcount
+        conn.commit()
+        return removed
+    finally:
+        conn.close()
+
+
+def _register(store: SessionStore):
+    _stores.append(store)
+    # Хранилища модулей, импортированных после restore_all(), поднимаются сразу
+    if _restored and store.persist:
+        _restore_stores([store])
+
+
+def _restore_stores(stores: List[SessionStore]):
+    global _last_seq
+    conn = db._connect(row_factory=None)
+    try:
+        # Номер и строки - из одного снимка БД: всё, что записано позже, придёт через refresh()
+        conn.execute("BEGIN")
+        if _shared:
+            _last_seq = max(_last_seq, conn.execute("SELECT seq FROM game_session_seq").fetchone()[0])
+        stale = []
+        for store in stores:
+            rows = conn.execute(
+                "SELECT key, value, expires_at, seq FROM game_sessions WHERE namespace = ?", (store.name,)
+            ).fetchall()
+            stale += store._restore(rows)
+            if store.restored:
+                print(f"♻️ session_store {store.name}: восстановлено сессий: {store.restored}")
+        conn.commit()
+        # В общем режиме истёкшие строки и надгробия нужны другим процессам - их чистит _purge_expired
+        if stale and not _shared:
+            conn.executemany("DELETE FROM game_sessions WHERE namespace = ? AND key = ?", stale)
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def restore_all():
+    """Поднять сохранённые сессии всех хранилищ с persist=True (при старте, до опроса)."""
+    global _restored
+    _restored = True
+    if _shared:
+        _purge_expired()
+    _restore_stores([store for store in _stores if store.persist])
+
+
+def _collect_all() -> List[tuple]:
+    changes = []
+    for store in list(_stores):
+        if store.persist and (store._dirty or store._incoming):
+            changes += store._collect()
+    return changes
+
+
+def _write_snapshot(changes: List[tuple]) -> Optional[int]:
+    """Записать изменения одной транзакцией; в общем режиме вернуть seq первой строки."""
+    conn = db._connect(row_factory=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        first_seq = None
+        if _shared:
+            # Номера выдаются под блокировкой записи, поэтому идут в порядке COMMIT
+            first_seq = conn.execute("SELECT seq FROM game_session_seq").fetchone()[0] + 1
+            conn.execute("UPDATE game_session_seq SET seq = ?", (first_seq + len(changes) - 1,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO game_sessions (namespace, key, value, expires_at, seq) VALUES (?, ?, ?, ?, ?)",
+                [(store.name, key_blob, value_blob or b"", expires_at, first_seq + i)
+                 for i, (store, _, key_blob, value_blob, expires_at) in enumerate(changes)],
+            )
+        else:
+            conn.executemany(
+                "INSERT OR REPLACE INTO game_sessions (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                [(store.name, key_blob, value_blob, expires_at)
+                 for store, _, key_blob, value_blob, expires_at in changes if value_blob is not None],
+            )
+            conn.executemany(
+                "DELETE FROM game_sessions WHERE namespace = ? AND key = ?",
+                [(store.name, key_blob) for store, _, key_blob, value_blob, _ in changes if value_blob is None],
+            )
+        conn.commit()
+        return first_seq
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _confirm(changes: List[tuple], first_seq: Optional[int]):
+    """Запомнить номера записанных строк: refresh() не примет их (и более старые) за чужие."""
+    if first_seq is None:
+        return
+    for i, (store, key, *_) in enumerate(changes):
+        session = store._data.get(key)
+        if session is not None:
+            session.seq = first_seq + i
+
+
+def _remark(changes: List[tuple]):
+    """Запись не удалась: повторить эти сессии со следующим снимком."""
+    for store, key, *_ in changes:
+        session = store._data.get(key)
+        if session is not None:
+            session.saved = None
+        store.mark(key)
+
+
+def snapshot_all() -> int:
+    """Синхронно сохранить все изменённые сессии (при остановке бота)."""
+    changes = _collect_all()
+    if changes:
+        _confirm(changes, _write_snapshot(changes))
+    return len(changes)
+
+
+async def save() -> int:
+    """Записать изменённые сессии в потоке (после апдейта в общем режиме и в snapshotter)."""
+    async with _io_lock:
+        changes = _collect_all()
+        if not changes:
+            return 0
+        try:
+            first_seq = await asyncio.to_thread(_write_snapshot, changes)
+        except Exception:
+            _remark(changes)
+            raise
+        _confirm(changes, first_seq)
+        return len(changes)
+
+
+def _fetch_changes(since: int) -> Tuple[List[tuple], int]:
+    """Строки game_sessions с seq > since (pickle разбирается здесь же, в потоке)."""
+    conn = db._connect(row_factory=None)
+    try:
+        rows = conn.execute(
+            "SELECT namespace, key, value, expires_at, seq FROM game_sessions WHERE seq > ? ORDER BY seq", (since,)
+        ).fetchall()
+    finally:
+        conn.close()
+    changes = []
+    now = time.time()
+    for namespace, key_blob, value_blob, expires_at, seq in rows:
+        try:
+            key = pickle.loads(key_blob)
+            value = pickle.loads(value_blob) if expires_at > now else None
+        except Exception as e:
+            print(f"⚠️ session_store {namespace}: не удалось прочитать сессию: {e}")
+            continue
+        changes.append((namespace, key, value, hash(value_blob), expires_at, seq))
+    return changes, (rows[-1][4] if rows else since)
+
+
+async def refresh() -> int:
+    """Общий режим: подтянуть сессии, записанные другими процессами после прошлого вызова."""
+    global _last_seq
+    if not _shared:
+        return 0
+    async with _io_lock:
+        changes, _last_seq = await asyncio.to_thread(_fetch_changes, _last_seq)
+        by_name = {store.name: store for store in _stores if store.shared}
+        for namespace, key, *row in changes:
+            store = by_name.get(namespace)
+            if store is not None:
+                store._receive(key, *row)
+        return len(changes)
+
+
+async def snapshotter(interval: float = SNAPSHOT_INTERVAL):
+    """Фоновая задача: asyncio.create_task(session_store.snapshotter())."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await save()
+            # Изменения таймеров и фоновых задач других процессов - и между апдейтами
+            await refresh()
+        except Exception as e:
+            print(f"⚠️ session_store: ошибка сохранения снимка: {e}")
+
+
+def sweep_all() -> int:
+    """Почистить истёкшие сессии во всех хранилищах."""
+    return sum(store.sweep() for store in list(_stores))
+
+
+async def sweeper(interval: float = SWEEP_INTERVAL):
+    """Фоновая задача: asyncio.create_task(session_store.sweeper())."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = sweep_all()
+            if _shared:
+                removed += await asyncio.to_thread(_purge_expired)
+            if removed:
+                print(f"🧹 session_store: удалено истёкших сессий: {removed}")
+        except Exception as e:
+            print(f"⚠️ session_store: ошибка очистки: {e}")
+
+
+def get_stats() -> Dict[str, Dict[str, float]]:
+    return {store.name: store.stats() for store in _stores}
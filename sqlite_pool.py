@@ -0,0 +1,356 @@
+"""
+Пул долгоживущих SQLite-соединений для всех файлов БД бота.
+
+Вместо sqlite3.connect() на каждый вызов функции держим фиксированный набор
+соединений на каждый файл: PRAGMA применяются один раз при открытии, а кеш
+подготовленных выражений (cached_statements) живёт столько же, сколько соединение.
+Пул также собирает метрики ожидания соединения и времени выполнения запросов.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+# PRAGMA, которые применяются к каждому новому соединению (один раз)
+DEFAULT_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-20000;",  # ~20MB, отрицательное значение — в КБ
+    "PRAGMA busy_timeout=999;",
+)
+
+DEFAULT_POOL_SIZE = 5
+# Сколько ждать свободное соединение, прежде чем открыть временное сверх лимита
+DEFAULT_ACQUIRE_TIMEOUT = 2.0
+# Размер кеша подготовленных выражений на соединение
+DEFAULT_CACHED_STATEMENTS = 256
+
+_UNSET = object()
+
+
+class PoolStats:
+    """Счётчики пула: ожидание соединений и время запросов."""
+
+    __slots__ = (
+        "acquires", "acquire_wait_total", "acquire_wait_max",
+        "queries", "query_time_total", "query_time_max",
+        "overflow", "created",
+    )
+
+    def __init__(self):
+        self.acquires = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+        self.queries = 0
+        self.query_time_total = 0.0
+        self.query_time_max = 0.0
+        self.overflow = 0
+        self.created = 0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "acquires": self.acquires,
+            "acquire_wait_avg_ms": (self.acquire_wait_total / self.acquires * 1000) if self.acquires else 0.0,
+            "acquire_wait_max_ms": self.acquire_wait_max * 1000,
+            "queries": self.queries,
+            "query_time_avg_ms": (self.query_time_total / self.queries * 1000) if self.queries else 0.0,
+            "query_time_max_ms": self.query_time_max * 1000,
+            "overflow": self.overflow,
+            "created": self.created,
+        }
+
+
+class _TimedCursor:
+    """Обёртка над sqlite3.Cursor, замеряющая время execute*.
+
+    Держит ссылку на выдавшее её соединение, чтобы оно не вернулось в пул,
+    пока курсор ещё читается.
+    """
+
+    __slots__ = ("_cursor", "_pool", "_owner")
+
+    def __init__(self, cursor: sqlite3.Cursor, pool: "ConnectionPool", owner=None):
+        self._cursor = cursor
+        self._pool = pool
+        self._owner = owner
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(sql, parameters)
+        finally:
+            self._pool._record_query(time.perf_counter() - started)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_parameters)
+        finally:
+            self._pool._record_query(time.perf_counter() - started)
+        return self
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            self._cursor.executescript(sql_script)
+        finally:
+            self._pool._record_query(time.perf_counter() - started)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        if name in _TimedCursor.__slots__:
+            raise AttributeError(name)
+        return getattr(self._cursor, name)
+
+
+class PooledConnection:
+    """Соединение, выданное пулом.
+
+    Ведёт себя как sqlite3.Connection, но close() возвращает соединение в пул
+    (незакоммиченная транзакция откатывается, как при настоящем закрытии).
+    Контекстный менеджер коммитит/откатывает и тоже возвращает соединение.
+    """
+
+    __slots__ = ("_conn", "_pool", "_overflow")
+
+    def __init__(self, conn: sqlite3.Connection, pool: "ConnectionPool", overflow: bool = False):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_overflow", overflow)
+
+    def _raw(self) -> sqlite3.Connection:
+        conn = self._conn
+        if conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return conn
+
+    def cursor(self, *args, **kwargs):
+        return _TimedCursor(self._raw().cursor(*args, **kwargs), self._pool, self)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        conn = self._conn
+        if conn is None:
+            return
+        object.__setattr__(self, "_conn", None)
+        self._pool._release(conn, self._overflow)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._raw().commit()
+            else:
+                self._raw().rollback()
+        finally:
+            self.close()
+        return False
+
+    def __del__(self):
+        # Страховка от утечек: забытое соединение возвращается в пул сборщиком мусора
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getattr__(self, name):
+        if name in PooledConnection.__slots__:
+            raise AttributeError(name)
+        return getattr(self._raw(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._raw(), name, value)
+
+
+class ConnectionPool:
+    """Фиксированный набор соединений к одному файлу БД.
+
+    Соединения создаются лениво до size штук и больше не закрываются. Если все
+    заняты дольше acquire_timeout, открывается временное соединение сверх лимита,
+    чтобы вложенные вызовы не могли заблокировать друг друга навсегда.
+    """
+
+    def __init__(self, path: str, size: int = DEFAULT_POOL_SIZE, pragmas=DEFAULT_PRAGMAS,
+                 timeout: float = 0.999, acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT,
+                 cached_statements: int = DEFAULT_CACHED_STATEMENTS):
+        self.path = path
+        self.size = size
+        self.pragmas = tuple(pragmas)
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.cached_statements = cached_statements
+        self.stats = PoolStats()
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+        )
+        for pragma in self.pragmas:
+            try:
+                conn.execute(pragma)
+            except Exception:
+                # Если PRAGMA не применилась — продолжаем без падения
+                pass
+        return conn
+
+    def connect(self, row_factory=_UNSET) -> PooledConnection:
+        """Взять соединение из пула. row_factory задаётся на время выдачи (по умолчанию — кортежи)."""
+        started = time.perf_counter()
+        conn = None
+        overflow = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    self.stats.created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.acquire_timeout)
+                except queue.Empty:
+                    conn = self._open()
+                    overflow = True
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.stats.acquires += 1
+            self.stats.acquire_wait_total += waited
+            if waited > self.stats.acquire_wait_max:
+                self.stats.acquire_wait_max = waited
+            if overflow:
+                self.stats.overflow += 1
+        conn.row_factory = None if row_factory is _UNSET else row_factory
+        return PooledConnection(conn, self, overflow)
+
+    def resize(self, size: int):
+        """Увеличить лимит соединений (уменьшение не поддерживается)."""
+        with self._lock:
+            if size > self.size:
+                self.size = size
+
+    def _release(self, conn: sqlite3.Connection, overflow: bool):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            pass
+        if overflow or self._closed:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        conn.row_factory = None
+        self._idle.put(conn)
+
+    def _record_query(self, elapsed: float):
+        with self._lock:
+            self.stats.queries += 1
+            self.stats.query_time_total += elapsed
+            if elapsed > self.stats.query_time_max:
+                self.stats.query_time_max = elapsed
+
+    def close_all(self):
+        """Закрыть все простаивающие соединения (используется при остановке бота)."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._lock:
+                self._created -= 1
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path: str, size: Optional[int] = None, **kwargs) -> ConnectionPool:
+    """Вернуть пул для файла БД (один на абсолютный путь), создав его при первом обращении."""
+    key = os.path.abspath(path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(key, size=size or DEFAULT_POOL_SIZE, **kwargs)
+            _pools[key] = pool
+        elif size:
+            pool.resize(size)
+        return pool
+
+
+def connect(path: str, row_factory=_UNSET) -> PooledConnection:
+    """Короткая форма: get_pool(path).connect(row_factory)."""
+    return get_pool(path).connect(row_factory)
+
+
+def get_all_stats() -> Dict[str, Dict[str, float]]:
+    """Метрики всех пулов, ключ — имя файла БД."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {os.path.basename(pool.path): pool.stats.as_dict() for pool in pools}
+
+
+def format_stats() -> str:
+    """Текстовый отчёт по пулам для админ-команды."""
+    stats = get_all_stats()
+    if not stats:
+        return "Пулы соединений ещё не созданы"
+    lines = []
+    for name, s in sorted(stats.items()):
+        lines.append(
+            f"{name}: соединений {int(s['created'])}, выдач {int(s['acquires'])}, "
+            f"ожидание ср. {s['acquire_wait_avg_ms']:.2f} мс / макс. {s['acquire_wait_max_ms']:.2f} мс, "
+            f"запросов {int(s['queries'])}, время ср. {s['query_time_avg_ms']:.2f} мс / "
+            f"макс. {s['query_time_max_ms']:.2f} мс, сверх лимита {int(s['overflow'])}"
+        )
+    return "\n".join(lines)
+
+
+def close_all_pools():
+    """Закрыть соединения всех пулов."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
@@ -4,6 +4,8 @@ import sqlite3
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime, timedelta
 import database as db
+import sqlite_pool
+import write_behind
 
 # Список всех возможных заданий
 TASK_LIST = [
@@ -121,12 +123,12 @@ TASK_LIST = [
     }
 ]
 
-# Подключение к БД для хранения заданий
+# Задания хранятся в общей БД game_bot.db (старый tasks.db вливается миграцией database.py)
+TASKS_DB_PATH = db.DB_PATH
+
 def get_db_connection():
-    """Создает подключение к БД заданий"""
-    conn = sqlite3.connect('database/tasks.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Берет соединение с БД заданий из общего пула (close() возвращает его в пул)"""
+    return sqlite_pool.connect(TASKS_DB_PATH, row_factory=sqlite3.Row)
 
 def init_tasks_db():
     """Инициализация таблицы заданий"""
@@ -229,8 +231,16 @@ def get_daily_tasks() -> List[dict]:
     # Возвращаем полные данные заданий
     return [task for task in TASK_LIST if task['id'] in task_ids]
 
+def rotate_weekly_tasks() -> List[dict]:
+    """Сгенерировать задания новой недели заранее (задача планировщика, вс 23:00 по Киеву)"""
+    global _active_tasks_cache
+    tasks = get_daily_tasks()
+    _active_tasks_cache = (get_current_week_id(), frozenset(t['id'] for t in tasks))
+    return tasks
+
 def get_user_tasks(user_id: int) -> List[dict]:
     """Получает задания пользователя с прогрессом"""
+    _task_counters.flush()
     week_id = get_current_week_id()
     daily_tasks = get_daily_tasks()
     
@@ -343,6 +353,7 @@ def format_tasks_text(user_id: int) -> str:
 
 def update_task_progress(user_id: int, task_id: int, progress: int):
     """Обновляет прогресс задания (0-100%)"""
+    _task_counters.flush()
     week_id = get_current_week_id()
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -360,6 +371,7 @@ def update_task_progress(user_id: int, task_id: int, progress: int):
 
 def claim_task_reward(user_id: int, task_id: int) -> Optional[int]:
     """Получить награду за выполненное задание. Возвращает сумму награды или None"""
+    _task_counters.flush()
     week_id = get_current_week_id()
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -418,11 +430,19 @@ TASK_GOALS = {
     17: 10,  # Кладоискатель - Профи — 10 раз
 }
 
+# Кеш активных заданий недели: (week_id, множество task_id)
+_active_tasks_cache = (None, frozenset())
+
 def _is_task_active(task_id: int) -> bool:
     """Проверяет, входит ли task_id в сегодняшние 5 заданий."""
+    global _active_tasks_cache
     try:
-        today_ids = {t['id'] for t in get_daily_tasks()}
-        return task_id in today_ids
+        week_id = get_current_week_id()
+        cached_week, cached_ids = _active_tasks_cache
+        if cached_week != week_id:
+            cached_ids = frozenset(t['id'] for t in get_daily_tasks())
+            _active_tasks_cache = (week_id, cached_ids)
+        return task_id in cached_ids
     except Exception:
         return False
 
@@ -433,35 +453,35 @@ def _get_counter(user_id: int, task_id: int) -> int:
     cur.execute('SELECT count FROM user_task_counters WHERE user_id=? AND date=? AND task_id=?', (user_id, week_id, task_id))
     row = cur.fetchone()
     conn.close()
-    return int(row['count']) if row else 0
+    count = int(row['count']) if row else 0
+    return count + _task_counters.pending((user_id, week_id, task_id))
 
-def _set_counter_and_progress(user_id: int, task_id: int, new_count: int, goal: int):
-    """Обновляет сырое значение count и синхронизирует проценты/complete в основной таблице."""
-    week_id = get_current_week_id()
-    conn = get_db_connection()
-    cur = conn.cursor()
-    # ensure rows exist in both tables
-    cur.execute('INSERT OR IGNORE INTO user_task_counters (user_id, date, task_id, count) VALUES (?, ?, ?, 0)', (user_id, week_id, task_id))
-    cur.execute('INSERT OR IGNORE INTO user_task_progress (user_id, date, task_id, progress, completed, claimed) VALUES (?, ?, ?, 0, 0, 0)', (user_id, week_id, task_id))
-    # update counter
-    cur.execute('UPDATE user_task_counters SET count=? WHERE user_id=? AND date=? AND task_id=?', (new_count, user_id, week_id, task_id))
-    # compute percent and completed
-    percent = 100 if new_count >= goal else int(new_count * 100 / max(1, goal))
-    completed = 1 if new_count >= goal else 0
-    cur.execute('UPDATE user_task_progress SET progress=?, completed=? WHERE user_id=? AND date=? AND task_id=?', (percent, completed, user_id, week_id, task_id))
-    conn.commit()
-    conn.close()
+def _apply_task_units(cur, items):
+    """Записать накопленные единицы прогресса: {(user_id, week_id, task_id): units}."""
+    for (user_id, week_id, task_id), units in items.items():
+        goal = TASK_GOALS.get(task_id)
+        if not goal:
+            continue
+        cur.execute('INSERT OR IGNORE INTO user_task_counters (user_id, date, task_id, count) VALUES (?, ?, ?, 0)', (user_id, week_id, task_id))
+        cur.execute('INSERT OR IGNORE INTO user_task_progress (user_id, date, task_id, progress, completed, claimed) VALUES (?, ?, ?, 0, 0, 0)', (user_id, week_id, task_id))
+        cur.execute('UPDATE user_task_counters SET count = MIN(?, count + ?) WHERE user_id=? AND date=? AND task_id=?', (goal, units, user_id, week_id, task_id))
+        cur.execute('SELECT count FROM user_task_counters WHERE user_id=? AND date=? AND task_id=?', (user_id, week_id, task_id))
+        new_count = int(cur.fetchone()[0])
+        percent = 100 if new_count >= goal else int(new_count * 100 / max(1, goal))
+        completed = 1 if new_count >= goal else 0
+        cur.execute('UPDATE user_task_progress SET progress=?, completed=? WHERE user_id=? AND date=? AND task_id=?', (percent, completed, user_id, week_id, task_id))
+
+# Счётчики заданий пишутся пачками (см. write_behind.py), а не коммитом на каждое событие
+_task_counters = write_behind.CounterBuffer("task_counters", get_db_connection, _apply_task_units)
 
 def _add_units(user_id: int, task_id: int, units: int = 1):
     """Добавляет единицы прогресса для количественной задачи (если она активна сегодня)."""
     if not _is_task_active(task_id):
         return
-    goal = TASK_GOALS.get(task_id)
-    if not goal:
+    if not TASK_GOALS.get(task_id):
         return
-    current = _get_counter(user_id, task_id)
-    new_count = min(goal, current + max(1, units))
-    _set_counter_and_progress(user_id, task_id, new_count, goal)
+    # Неделя фиксируется в момент события, чтобы сброс после смены недели не ушёл в новую
+    _task_counters.add((user_id, get_current_week_id(), task_id), max(1, units))
 
 # Публичные API для регистрации событий из модулей игр
 
@@ -0,0 +1,15 @@
+"""
+Общие настройки тестов.
+
+БД и журналы отложенной записи создаются во временном каталоге (BOT_DB_FOLDER),
+а не в database/ бота: database.py при импорте применяет миграции.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("BOT_DB_FOLDER", tempfile.mkdtemp(prefix="bot-tests-"))
@@ -0,0 +1,57 @@
+"""
+Роутеры фич (features/): загрузка без main, порядок подключения к диспетчеру и цепочка текстовых команд.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("aiogram")
+from aiogram import Dispatcher, Router
+
+import features
+import lazy_modules
+import routing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEATURES = [name for name in features.ORDER if name != "main"]
+
+
+@pytest.mark.parametrize("feature", FEATURES)
+def test_feature_loads_without_main(feature):
+    # Отдельный процесс, как у воркера: main и его помощники не импортируются
+    code = (
+        "import sys, lazy_modules\n"
+        f"module = lazy_modules.load_feature({feature!r})[0]\n"
+        "handlers = len(module.texts) + len(module.router.callback_query.handlers)\n"
+        "print('main' in sys.modules, handlers)\n"
+    )
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                          encoding="utf-8", errors="replace", env=dict(os.environ, PYTHONPATH=ROOT))
+    assert proc.returncode == 0, proc.stderr
+    main_loaded, handlers = proc.stdout.split()[-2:]
+    assert main_loaded == "False" and int(handlers) > 0
+
+
+def test_setup_includes_routers_in_order():
+    dp = Dispatcher()
+    main_router, fallback_router = Router(name="main"), Router(name="fallback")
+    features.setup(dp, main_router, routing.TextRouter(), fallback_router)
+    assert [router.name for router in dp.sub_routers] == features.ORDER + ["fallback"]
+    # Текстовые команды фич - один хендлер на диспетчере, в роутерах фич их нет
+    assert len(dp.message.handlers) == 1
+    assert all(not router.message.handlers for router in dp.sub_routers)
+
+
+def test_text_order_lists_only_existing_handlers():
+    # Хендлер, которого нет в TEXT_ORDER, text_chain() не пропустит (ValueError)
+    for feature, name in features.TEXT_ORDER:
+        if feature != "main":
+            texts = lazy_modules.load_feature(feature)[0].texts
+            assert name in {route.handler.__name__ for route in texts.routes()}, (feature, name)
+
+
+def test_every_feature_router_is_registered_in_lazy_modules():
+    for feature in FEATURES:
+        assert lazy_modules.FEATURES[feature][0] == f"features.{feature}"
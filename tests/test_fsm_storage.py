@@ -0,0 +1,162 @@
+"""
+Состояния FSM в SQLite (fsm_storage.py): кеш, отложенная запись, общий режим.
+"""
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+pytest.importorskip("aiogram")
+from aiogram.fsm.storage.base import StorageKey
+
+import fsm_storage
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "fsm.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE fsm_states (key TEXT PRIMARY KEY, state TEXT, data TEXT, expires_at REAL NOT NULL) WITHOUT ROWID"
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def make_storage(db_path, **kwargs):
+    # Фоновая запись не должна срабатывать посреди теста
+    kwargs.setdefault("flush_interval", 3600)
+    return fsm_storage.SQLiteStorage(path=db_path, **kwargs)
+
+
+def read_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {row[0]: row[1:3] for row in conn.execute("SELECT key, state, data FROM fsm_states")}
+    finally:
+        conn.close()
+
+
+def test_state_survives_restart(db_path):
+    async def scenario():
+        storage = make_storage(db_path)
+        await storage.set_state(key(1), "BankStates:waiting_for_direct_deposit_amount")
+        await storage.update_data(key(1), {"amount": 500})
+        await storage.close()
+
+        restarted = make_storage(db_path)
+        state = await restarted.get_state(key(1))
+        data = await restarted.get_data(key(1))
+        await restarted.close()
+        return state, data
+
+    state, data = asyncio.run(scenario())
+    assert state == "BankStates:waiting_for_direct_deposit_amount"
+    assert data == {"amount": 500}
+
+
+def test_changes_are_coalesced_and_cleared_state_deletes_row(db_path):
+    async def scenario():
+        storage = make_storage(db_path)
+        for amount in range(5):
+            await storage.update_data(key(1), {"amount": amount})
+        assert read_rows(db_path) == {}
+        assert await storage.flush() == 1
+        assert list(read_rows(db_path).values()) == [(None, '{"amount":4}')]
+
+        await storage.set_data(key(1), {})
+        await storage.flush()
+        assert read_rows(db_path) == {}
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_scenario_is_forgotten(db_path):
+    async def scenario():
+        storage = make_storage(db_path, ttl=-1)
+        await storage.set_state(key(1), "AuctionStates:waiting_for_price")
+        await storage.flush()
+        restarted = make_storage(db_path)
+        state = await restarted.get_state(key(1))
+        assert await restarted.cleanup_expired() == 1
+        await storage.close()
+        await restarted.close()
+        return state
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_failed_flush_keeps_changes(db_path, monkeypatch):
+    async def scenario():
+        storage = make_storage(db_path)
+        await storage.set_state(key(1), "SellItemStates:waiting_for_quantity")
+        write_rows = storage._write_rows
+
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(storage, "_write_rows", locked)
+        with pytest.raises(sqlite3.OperationalError):
+            await storage.flush()
+        assert storage.stats()["dirty"] == 1
+        monkeypatch.setattr(storage, "_write_rows", write_rows)
+        assert await storage.flush() == 1
+        await storage.close()
+
+    asyncio.run(scenario())
+    assert [row[0] for row in read_rows(db_path).values()] == ["SellItemStates:waiting_for_quantity"]
+
+
+def test_shared_workers_see_flushed_states_and_read_off_loop(db_path, monkeypatch):
+    reads = []
+    read_row = fsm_storage.SQLiteStorage._read_row
+
+    def tracking_read_row(self, storage_key):
+        reads.append(threading.current_thread() is threading.main_thread())
+        return read_row(self, storage_key)
+
+    monkeypatch.setattr(fsm_storage.SQLiteStorage, "_read_row", tracking_read_row)
+
+    async def scenario():
+        first, second = make_storage(db_path, shared=True), make_storage(db_path, shared=True)
+        await first.set_state(key(1), "CreateBetStates:waiting_for_amount")
+        assert await second.get_state(key(1)) is None
+        await first.flush()
+        # Записанное уходит из кеша: следующее чтение - из БД
+        assert first.stats()["cached"] == 0
+        assert await second.get_state(key(1)) == "CreateBetStates:waiting_for_amount"
+
+        await second.set_state(key(1), None)
+        await second.flush()
+        state = await first.get_state(key(1))
+        await first.close()
+        await second.close()
+        return state
+
+    assert asyncio.run(scenario()) is None
+    # Промахи кеша читаются в потоке, а не в цикле событий
+    assert reads and not any(reads)
+
+
+def test_full_cache_evicts_only_written_keys(db_path):
+    async def scenario():
+        storage = make_storage(db_path, cache_size=2)
+        for user_id in range(4):
+            await storage.set_state(key(user_id), "BankStates:waiting_for_direct_deposit_amount")
+        # Изменённые ключи не вытесняются, пока не записаны
+        assert storage.stats()["cached"] == 4
+        await storage.flush()
+        await storage.set_state(key(10), "BankStates:waiting_for_direct_deposit_amount")
+        stats = storage.stats()
+        await storage.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["cached"] == 2 and stats["dirty"] == 1
@@ -0,0 +1,99 @@
+"""
+Таблицы маршрутизации (routing.py): порядок регистрации, texts.on(...), регистр префиксов и TextChain.
+"""
+import asyncio
+import datetime
+
+import pytest
+
+pytest.importorskip("aiogram")
+from aiogram import types
+from aiogram.filters import Command
+from aiogram.fsm.state import State, StatesGroup
+
+import routing
+
+
+class DepositStates(StatesGroup):
+    amount = State()
+
+
+def message(text, reply=False):
+    chat = types.Chat(id=1, type="private")
+    date = datetime.datetime.now()
+    replied = types.Message(message_id=1, date=date, chat=chat, text="...") if reply else None
+    return types.Message(message_id=2, date=date, chat=chat, text=text, reply_to_message=replied)
+
+
+def make_router():
+    texts = routing.TextRouter()
+    called = []
+
+    def handler(name):
+        async def handle(message):
+            called.append(name)
+        return handle
+
+    texts.exact("банк")(handler("bank"))
+    texts.on(Command("deposit"))(handler("deposit_command"))
+    texts.on(DepositStates.amount)(handler("deposit_amount"))
+    texts.exact("додеп")(handler("dodep"))
+    texts.contains("боулинг", digits=True)(handler("bowling"))
+    texts.prefix("+ban", reply=True, ignore_case=False)(handler("ban"))
+    return texts, called
+
+
+def route(texts, msg, raw_state=None):
+    async def run():
+        found = await texts.filter(msg, raw_state=raw_state, bot=None)
+        return found["text_route"].handler if found else None
+
+    return asyncio.run(run())
+
+
+def names(texts, called, cases):
+    for text, state in cases:
+        called.clear()
+        found = route(texts, message(text), state)
+        if found is not None:
+            asyncio.run(found(message(text)))
+        yield called[0] if called else None
+
+
+def test_order_of_state_command_and_triggers():
+    texts, called = make_router()
+    state = DepositStates.amount.state
+    assert list(names(texts, called, [
+        ("банк", state),
+        ("додеп", state),
+        ("5000", state),
+        ("додеп", None),
+        ("5000", None),
+        ("/deposit боулинг 5", None),
+        ("боулинг 5", None),
+    ])) == ["bank", "deposit_amount", "deposit_amount", "dodep", None, "deposit_command", "bowling"]
+
+
+def test_case_sensitive_prefix():
+    texts, _ = make_router()
+    assert route(texts, message("+ban 1д", reply=True)) is not None
+    assert route(texts, message("+BAN 1д", reply=True)) is None
+    assert route(texts, message("+ban 1д")) is None
+
+
+def test_chain_keeps_order_across_routers():
+    bank, games = routing.TextRouter(), routing.TextRouter()
+
+    async def deposit_amount(message): ...
+    async def bowling(message): ...
+    async def dodep(message): ...
+
+    bank.on(DepositStates.amount)(deposit_amount)
+    games.contains("боулинг", digits=True)(bowling)
+    bank.exact("додеп")(dodep)
+    chain = routing.TextChain([bank, games], [bowling, deposit_amount, dodep])
+    assert route(chain, message("боулинг 100"), DepositStates.amount.state) is bowling
+    assert route(chain, message("додеп"), DepositStates.amount.state) is deposit_amount
+    assert route(chain, message("додеп")) is dodep
+    with pytest.raises(ValueError):
+        routing.TextChain([bank, games], [bowling, dodep])
@@ -0,0 +1,118 @@
+"""
+Общий режим session_store (воркеры webhook.py): лента изменений game_sessions.
+
+Второй процесс изображает хранилище peer с тем же пространством имён: его
+изменения пишутся в таблицу, а в реестр хранилищ этого процесса он не входит.
+"""
+import asyncio
+import itertools
+
+import pytest
+
+import database as db
+import session_store
+
+_names = itertools.count(1)
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    monkeypatch.setattr(session_store, "_stores", [])
+    monkeypatch.setattr(session_store, "_shared", True)
+    monkeypatch.setattr(session_store, "_restored", False)
+    monkeypatch.setattr(session_store, "_last_seq", 0)
+    monkeypatch.setattr(session_store, "_io_lock", asyncio.Lock())
+
+
+def make_pair(persist=True):
+    """Хранилище этого процесса и «чужое» хранилище того же имени."""
+    name = f"test_game_{next(_names)}"
+    peer = session_store.SessionStore(name, ttl=600, persist=persist)
+    session_store._stores.remove(peer)
+    return session_store.SessionStore(name, ttl=600, persist=persist), peer
+
+
+def write_peer(peer):
+    changes = peer._collect()
+    session_store._confirm(changes, session_store._write_snapshot(changes))
+
+
+def test_peer_changes_arrive_with_refresh(shared):
+    store, peer = make_pair()
+    peer["g1"] = {"level": 1}
+    write_peer(peer)
+    assert asyncio.run(session_store.refresh()) >= 1
+    assert store["g1"] == {"level": 1}
+    # Как воркер после апдейта: прочитанная сессия не записывается
+    assert asyncio.run(session_store.save()) == 0
+
+    peer["g1"]["level"] = 2
+    write_peer(peer)
+    asyncio.run(session_store.refresh())
+    assert store.values() == [{"level": 2}]
+
+    del peer["g1"]
+    write_peer(peer)
+    asyncio.run(session_store.refresh())
+    assert len(store) == 0
+
+
+def test_reads_do_not_write_and_own_rows_keep_objects(shared):
+    store, _ = make_pair()
+    game = {"level": 1}
+    store["g1"] = game
+    assert asyncio.run(session_store.save()) == 1
+    assert store["g1"] is game
+    # Сессию только прочитали - писать нечего
+    assert asyncio.run(session_store.save()) == 0
+    # Своя строка из ленты не подменяет живой объект
+    asyncio.run(session_store.refresh())
+    assert store["g1"] is game
+
+
+def test_read_session_takes_peer_version_on_save(shared):
+    store, peer = make_pair()
+    peer["g1"] = {"level": 1}
+    write_peer(peer)
+    asyncio.run(session_store.refresh())
+    assert store["g1"] == {"level": 1}
+    # Пока апдейт читал сессию, другой процесс её записал
+    peer["g1"]["level"] = 2
+    write_peer(peer)
+    asyncio.run(session_store.refresh())
+    assert asyncio.run(session_store.save()) == 0
+    assert store["g1"] == {"level": 2}
+
+
+def test_local_change_wins_over_older_peer_row(shared):
+    store, peer = make_pair()
+    store["g1"] = {"owner": "here"}
+    peer["g1"] = {"owner": "peer"}
+    write_peer(peer)
+    asyncio.run(session_store.refresh())
+    # Своя несохранённая версия не затёрта
+    assert store["g1"] == {"owner": "here"}
+    asyncio.run(session_store.save())
+
+    # В таблице - последняя запись, то есть своя
+    session_store._stores.remove(store)
+    restarted = session_store.SessionStore(store.name, ttl=600, persist=True)
+    session_store._restore_stores([restarted])
+    assert restarted["g1"] == {"owner": "here"}
+
+
+def test_caches_stay_local_and_reads_do_not_touch_db(shared, monkeypatch):
+    store, _ = make_pair()
+    cache, _ = make_pair(persist=False)
+    store["g1"] = 1
+    cache["u1"] = 2
+    asyncio.run(session_store.save())
+
+    def no_db(*args, **kwargs):
+        raise AssertionError("обращение к БД")
+
+    monkeypatch.setattr(db, "_connect", no_db)
+    assert not cache.shared
+    assert cache.get("u1") == 2 and store.get("g1") == 1
+    assert len(store) == 1 and store.values() == [1] and list(store) == ["g1"]
+    assert asyncio.run(session_store.save()) == 0
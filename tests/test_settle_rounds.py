@@ -0,0 +1,95 @@
+"""
+Расчёт раундов одной транзакцией (database.settle_rounds / settle_round).
+"""
+import itertools
+
+import pytest
+
+import database as db
+
+_user_ids = itertools.count(900001)
+
+
+@pytest.fixture
+def make_user():
+    def make(dan):
+        user_id = next(_user_ids)
+        db.ensure_user(user_id, f"player{user_id}")
+        db.set_dan(user_id, dan)
+        return user_id
+    return make
+
+
+def test_round_debits_stake_credits_payout_and_counts_stats(make_user):
+    user_id = make_user(100)
+    balance = db.settle_round(user_id, 30, 75, db.round_stats(win=45), first_bet=True)
+    assert balance == 145
+
+    user = db.get_user(user_id)
+    assert user["dan"] == 145
+    assert user["dan_win"] == 45 and user["win_count"] == 1
+    assert user["first_bet"] == 30
+    # games_played ещё в буфере отложенной записи, но уже виден в get_user
+    assert user["games_played"] == 1
+
+
+def test_insufficient_balance_changes_nothing(make_user):
+    rich, poor = make_user(100), make_user(5)
+    entries = [
+        (rich, 10, 0, db.round_stats(lose=10)),
+        (poor, 10, 0, db.round_stats(lose=10)),
+    ]
+    assert db.settle_rounds(entries) is None
+    assert db.get_user(rich)["dan"] == 100
+    assert db.get_user(rich)["lose_count"] == 0
+    assert db.get_user(poor)["dan"] == 5
+
+
+def test_unknown_user_rolls_back_everyone(make_user):
+    user_id = make_user(50)
+    assert db.settle_rounds([(user_id, 10, 0, None), (899999, 0, 10, None)]) is None
+    assert db.get_user(user_id)["dan"] == 50
+
+
+def test_several_entries_of_one_user_see_running_balance(make_user):
+    user_id = make_user(20)
+    # Вторая ставка проходит только за счёт выплаты первой
+    balances = db.settle_rounds([(user_id, 20, 30, None), (user_id, 25, 0, None)])
+    assert balances == {user_id: 5}
+    assert db.get_user(user_id)["dan"] == 5
+
+
+def test_payout_without_stake_ignores_negative_balance(make_user):
+    debtor, winner = make_user(-40), make_user(100)
+    balances = db.settle_rounds([
+        (winner, 10, 0, db.round_stats(lose=10)),
+        (debtor, 0, 15, db.round_stats(win=15)),
+    ])
+    assert balances == {winner: 90, debtor: -25}
+
+
+def test_unknown_stat_column_is_rejected(make_user):
+    user_id = make_user(10)
+    with pytest.raises(ValueError):
+        db.settle_round(user_id, 1, 0, {"dan": 100})
+    assert db.get_user(user_id)["dan"] == 10
+
+
+def test_clad_cashout_pays_once_with_stats(make_user):
+    pytest.importorskip("aiogram")
+    import asyncio
+    from plugins.games import clad
+
+    user_id = make_user(0)
+    game = clad.start_clad_game(user_id, 100)
+    game["level"] = 2
+
+    async def take_twice():
+        return await asyncio.gather(clad.take_clad_game(game["game_id"]), clad.take_clad_game(game["game_id"]))
+
+    results = asyncio.run(take_twice())
+    assert sorted(result["status"] for result in results) == ["end", "take"]
+    win = 100 * clad.MULTS[1]
+    user = db.get_user(user_id)
+    assert user["dan"] == win
+    assert user["dan_win"] == win - 100 and user["dan_lose"] == 100
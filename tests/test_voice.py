@@ -0,0 +1,153 @@
+"""
+Транскрипция голосовых (plugins/api_soft_ai/voice.py) против заглушки AssemblyAI на aiohttp.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from plugins.api_soft_ai import voice
+
+AUDIO = b"OggS" + bytes(range(256)) * 600
+
+
+class StubAssemblyAI:
+    """Заглушка API: запоминает запросы, статусы опроса отдаёт по очереди из polls."""
+
+    def __init__(self, polls):
+        self.polls = list(polls)
+        self.uploads = []
+        self.transcript_requests = []
+        self.poll_count = 0
+        self.auth = set()
+        self.app = web.Application()
+        self.app.router.add_post("/v2/upload", self.upload)
+        self.app.router.add_post("/v2/transcript", self.transcript)
+        self.app.router.add_get("/v2/transcript/{id}", self.poll)
+
+    async def upload(self, request):
+        self.auth.add(request.headers.get("authorization"))
+        self.uploads.append(await request.read())
+        return web.json_response({"upload_url": "https://cdn.example/audio-1"})
+
+    async def transcript(self, request):
+        self.transcript_requests.append(await request.json())
+        return web.json_response({"id": "t-1"})
+
+    async def poll(self, request):
+        self.poll_count += 1
+        status, body = self.polls.pop(0) if len(self.polls) > 1 else self.polls[0]
+        return web.json_response(body, status=status)
+
+
+class FakeBot:
+    """Бот с локальным Bot API: файл голосового уже лежит на диске."""
+
+    def __init__(self, path):
+        self.path = path
+        self.session = SimpleNamespace(api=SimpleNamespace(is_local=True))
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=self.path)
+
+
+@pytest.fixture
+def bot(tmp_path):
+    path = tmp_path / "voice.ogg"
+    path.write_bytes(AUDIO)
+    return FakeBot(str(path))
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(voice, "POLL_INITIAL_DELAY", 0.01)
+    monkeypatch.setattr(voice, "POLL_MAX_DELAY", 0.02)
+    voice.transcript_cache.clear()
+
+
+async def _with_service(stub, scenario, **kwargs):
+    server = TestServer(stub.app)
+    await server.start_server()
+    service = voice.TranscriptionService(base_url=str(server.make_url("")), api_key="test-key", **kwargs)
+    try:
+        return await scenario(service)
+    finally:
+        await service.close()
+        await server.close()
+
+
+COMPLETED = (200, {"status": "completed", "text": "привет"})
+
+
+def test_streams_file_and_polls_until_completed(bot):
+    stub = StubAssemblyAI([(200, {"status": "processing"}), (503, {}), COMPLETED])
+
+    async def scenario(service):
+        return await service.transcribe(bot, "file-1", "unique-1")
+
+    assert asyncio.run(_with_service(stub, scenario)) == "привет"
+    assert stub.uploads == [AUDIO]
+    assert stub.transcript_requests[0]["audio_url"] == "https://cdn.example/audio-1"
+    assert stub.auth == {"test-key"}
+    # 5xx при опросе - временная ошибка, опрос продолжается
+    assert stub.poll_count == 3
+
+
+def test_same_voice_is_transcribed_once(bot):
+    stub = StubAssemblyAI([(200, {"status": "processing"}), COMPLETED])
+
+    async def scenario(service):
+        # Одновременные запросы одного голосового ждут одну задачу...
+        first = await asyncio.gather(*(service.transcribe(bot, "file-1", "unique-2") for _ in range(3)))
+        # ...а повторный берётся из кеша
+        again = await service.transcribe(bot, "file-1", "unique-2")
+        return first, again
+
+    first, again = asyncio.run(_with_service(stub, scenario))
+    assert first == ["привет"] * 3
+    assert again == "привет"
+    assert len(stub.uploads) == 1
+
+
+def test_failures_return_none_and_are_not_cached(bot):
+    stub = StubAssemblyAI([(200, {"status": "error", "error": "bad audio"})])
+
+    async def scenario(service):
+        return await service.transcribe(bot, "file-1", "unique-3")
+
+    assert asyncio.run(_with_service(stub, scenario)) is None
+    assert "unique-3" not in voice.transcript_cache
+
+    stub = StubAssemblyAI([(404, {"error": "not found"})])
+    assert asyncio.run(_with_service(stub, scenario)) is None
+    assert stub.poll_count == 1
+
+
+def test_poll_timeout(bot):
+    stub = StubAssemblyAI([(200, {"status": "processing"})])
+
+    async def scenario(service):
+        return await service.transcribe(bot, "file-1", "unique-4")
+
+    assert asyncio.run(_with_service(stub, scenario, poll_timeout=0.1)) is None
+    assert stub.poll_count >= 2
+
+
+def test_full_queue_reports_busy(bot):
+    stub = StubAssemblyAI([COMPLETED])
+
+    async def scenario(service):
+        # Без воркеров первая задача остаётся в очереди и занимает единственное место
+        waiting = asyncio.create_task(service.transcribe(bot, "file-1", "unique-5"))
+        await asyncio.sleep(0)
+        try:
+            return await service.transcribe(bot, "file-2", "unique-6")
+        finally:
+            waiting.cancel()
+
+    assert asyncio.run(_with_service(stub, scenario, workers=0, max_queued=1)) is None
+    assert stub.uploads == []
@@ -0,0 +1,192 @@
+"""
+Отложенная запись счётчиков (write_behind.py): сброс, pending и восстановление из журнала.
+"""
+import sqlite3
+
+import pytest
+
+import write_behind
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "counters.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def make_buffer(db_path, journal_dir, name="games", apply=None, **kwargs):
+    def connect():
+        return sqlite3.connect(db_path, isolation_level=None)
+
+    def apply_counters(cur, items):
+        for key, delta in items.items():
+            cur.execute(
+                "INSERT INTO counters (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                (key, delta),
+            )
+
+    # Фоновый поток не должен сбрасывать буфер посреди теста
+    kwargs.setdefault("flush_interval", 3600)
+    kwargs.setdefault("max_ops", 10 ** 6)
+    return write_behind.CounterBuffer(name, connect, apply or apply_counters, journal_dir=str(journal_dir), **kwargs)
+
+
+def read_counters(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT key, value FROM counters"))
+    finally:
+        conn.close()
+
+
+def crash(buffer):
+    """Процесс упал: журнал остаётся на диске, буфер больше не используется."""
+    with buffer._lock:
+        if buffer._journal is not None:
+            buffer._journal.close()
+            buffer._journal = None
+        buffer._pending.clear()
+
+
+def test_flush_sums_increments_in_one_batch(db_path, tmp_path):
+    buffer = make_buffer(db_path, tmp_path / "journal")
+    for _ in range(3):
+        buffer.add("a")
+    buffer.add("b", 5)
+    assert buffer.pending("a") == 3
+    assert read_counters(db_path) == {}
+
+    assert buffer.flush() == 4
+    assert read_counters(db_path) == {"a": 3, "b": 5}
+    assert buffer.pending("a") == 0
+    assert buffer.flush() == 0
+
+
+def test_pending_counts_batch_being_written(db_path, tmp_path):
+    seen = []
+    buffer = None
+
+    def apply(cur, items):
+        # До COMMIT пачки её приращения не пропадают из pending
+        seen.append(buffer.pending("a"))
+        for key, delta in items.items():
+            cur.execute("INSERT INTO counters (key, value) VALUES (?, ?)", (key, delta))
+
+    buffer = make_buffer(db_path, tmp_path / "journal", apply=apply)
+    buffer.add("a", 2)
+    buffer.flush()
+    assert seen == [2]
+    assert buffer.pending("a") == 0
+
+
+def test_read_does_not_count_batch_committed_in_between(db_path, tmp_path):
+    buffer = make_buffer(db_path, tmp_path / "journal")
+    buffer.add("a", 2)
+    loads = []
+
+    def load():
+        if not loads:
+            # Пачка записывается после того, как read() взял pending, но до чтения БД
+            buffer.flush()
+        loads.append(read_counters(db_path).get("a", 0))
+        return loads[-1]
+
+    value, pending = buffer.read("a", load)
+    assert value + pending == 2
+    assert loads == [2, 2]
+
+
+def test_failed_flush_keeps_increments(db_path, tmp_path):
+    calls = []
+
+    def flaky_apply(cur, items):
+        calls.append(dict(items))
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        for key, delta in items.items():
+            cur.execute("INSERT INTO counters (key, value) VALUES (?, ?)", (key, delta))
+
+    buffer = make_buffer(db_path, tmp_path / "journal", apply=flaky_apply)
+    buffer.add("a", 2)
+    assert buffer.flush() == 0
+    assert buffer.pending("a") == 2
+    buffer.add("a")
+    # Две операции add, обе записаны одной пачкой
+    assert buffer.flush() == 2
+    assert read_counters(db_path) == {"a": 3}
+
+
+def test_journal_is_replayed_once_after_crash(db_path, tmp_path):
+    journal = tmp_path / "journal"
+    buffer = make_buffer(db_path, journal)
+    buffer.add("a", 2)
+    buffer.flush()
+    buffer.add("a")
+    buffer.add("b")
+    crash(buffer)
+
+    restarted = make_buffer(db_path, journal)
+    restarted.flush()
+    assert read_counters(db_path) == {"a": 3, "b": 1}
+
+    # Повторный запуск ничего не применяет второй раз
+    make_buffer(db_path, journal).flush()
+    assert read_counters(db_path) == {"a": 3, "b": 1}
+
+
+def test_applied_segment_left_on_disk_is_not_reapplied(db_path, tmp_path, monkeypatch):
+    journal = tmp_path / "journal"
+    buffer = make_buffer(db_path, journal)
+    buffer.add("a", 4)
+    # Падение между COMMIT и удалением сегмента журнала
+    monkeypatch.setattr(buffer, "_remove_segments_upto", lambda seq: None)
+    buffer.flush()
+    crash(buffer)
+
+    make_buffer(db_path, journal).flush()
+    assert read_counters(db_path) == {"a": 4}
+
+
+def make_worker(db_path, journal, instance, monkeypatch):
+    """Буфер процесса-воркера webhook.py с экземпляром instance."""
+    monkeypatch.setattr(write_behind, "_instance", instance)
+    buffer = make_buffer(db_path, journal)
+    buffer._ensure_ready()
+    return buffer
+
+
+def test_worker_restart_replays_only_its_own_journal(db_path, tmp_path, monkeypatch):
+    journal = tmp_path / "journal"
+    first = make_worker(db_path, journal, "worker0", monkeypatch)
+    second = make_worker(db_path, journal, "worker1", monkeypatch)
+    first.add("a")
+    first.flush()
+    first.add("a")
+    second.add("a")
+    crash(first)
+
+    # Перезапущенный воркер 0 не трогает журнал живого воркера 1
+    make_worker(db_path, journal, "worker0", monkeypatch)
+    assert read_counters(db_path) == {"a": 2}
+    second.flush()
+    assert read_counters(db_path) == {"a": 3}
+
+
+def test_recover_instances_replays_journals_of_gone_workers(db_path, tmp_path, monkeypatch):
+    journal = tmp_path / "journal"
+    monkeypatch.setattr(write_behind, "_buffers", [])
+    gone = make_worker(db_path, journal, "worker3", monkeypatch)
+    gone.add("a", 5)
+    crash(gone)
+
+    leader = make_worker(db_path, journal, "worker0", monkeypatch)
+    monkeypatch.setattr(write_behind, "_buffers", [leader])
+    write_behind.recover_instances(keep={"worker0", "worker1"})
+    assert read_counters(db_path) == {"a": 5}
+    write_behind.recover_instances(keep={"worker0", "worker1"})
+    assert read_counters(db_path) == {"a": 5}
@@ -0,0 +1,124 @@
+"""
+Таймеры на asyncio: куча дедлайнов вместо периодических полных проходов.
+
+Раньше таймауты арены проверял цикл раз в 30 секунд, перебирая всю очередь
+поиска и все игры, а таймаут хода не проверялся вовсе. Здесь каждый поиск,
+ход или игра регистрирует свой дедлайн под ключом, а одна фоновая задача
+спит ровно до ближайшего дедлайна. Постановка и снятие таймера — O(log n)
+(снятые записи остаются в куче и пропускаются при извлечении).
+
+    timers.schedule(("arena_game", game_id), 300, on_game_expired, game_id)
+    timers.cancel(("arena_game", game_id))
+
+Повторный schedule с тем же ключом заменяет старый таймер. Обработчик может
+быть обычной функцией или корутиной (корутина запускается отдельной задачей).
+Использовать из цикла событий бота.
+"""
+import asyncio
+import heapq
+import inspect
+import itertools
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+_heap: List[Tuple[float, int, Hashable]] = []  # (дедлайн, номер, ключ)
+_timers: Dict[Hashable, Tuple[float, int, Callable, tuple]] = {}  # ключ -> (дедлайн, номер, обработчик, аргументы)
+_counter = itertools.count()
+_wakeup: Optional[asyncio.Event] = None
+_runner: Optional[asyncio.Task] = None
+
+# Статистика для /dbstats
+stats = {"scheduled": 0, "cancelled": 0, "fired": 0, "errors": 0}
+
+
+def schedule(key: Hashable, delay: float, callback: Callable, *args):
+    """Вызвать callback(*args) через delay секунд (заменяет таймер с тем же ключом)."""
+    deadline = time.monotonic() + max(delay, 0)
+    seq = next(_counter)
+    _timers[key] = (deadline, seq, callback, args)
+    heapq.heappush(_heap, (deadline, seq, key))
+    stats["scheduled"] += 1
+    _ensure_runner()
+    # Новый дедлайн раньше того, до которого спит задача, — будим её
+    if _wakeup is not None and _heap[0][1] == seq:
+        _wakeup.set()
+
+
+def cancel(*keys: Hashable) -> int:
+    """Снять таймеры; вернуть, сколько было снято."""
+    removed = 0
+    for key in keys:
+        if _timers.pop(key, None) is not None:
+            removed += 1
+    stats["cancelled"] += removed
+    return removed
+
+
+def pending(key: Hashable) -> Optional[float]:
+    """Сколько секунд осталось до срабатывания таймера key (None — таймера нет)."""
+    entry = _timers.get(key)
+    return None if entry is None else max(entry[0] - time.monotonic(), 0.0)
+
+
+def _pop_due(now: float) -> List[Tuple[Callable, tuple]]:
+    due = []
+    while _heap and _heap[0][0] <= now:
+        deadline, seq, key = heapq.heappop(_heap)
+        entry = _timers.get(key)
+        # Снятый или заменённый таймер — пропускаем
+        if entry is None or entry[1] != seq:
+            continue
+        del _timers[key]
+        due.append((entry[2], entry[3]))
+    # Не даём куче разрастаться снятыми записями
+    if len(_heap) > 64 and len(_heap) > 4 * len(_timers):
+        _heap[:] = [(deadline, seq, key) for key, (deadline, seq, _, _) in _timers.items()]
+        heapq.heapify(_heap)
+    return due
+
+
+async def _run_callback(callback: Callable, args: tuple):
+    try:
+        await callback(*args)
+    except Exception as e:
+        stats["errors"] += 1
+        print(f"⚠️ timers: ошибка в {getattr(callback, '__name__', callback)}: {e}")
+
+
+async def _run():
+    while True:
+        timeout = None
+        if _heap:
+            timeout = max(_heap[0][0] - time.monotonic(), 0)
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for callback, args in _pop_due(time.monotonic()):
+            stats["fired"] += 1
+            if inspect.iscoroutinefunction(callback):
+                asyncio.create_task(_run_callback(callback, args))
+                continue
+            try:
+                callback(*args)
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"⚠️ timers: ошибка в {getattr(callback, '__name__', callback)}: {e}")
+
+
+def _ensure_runner():
+    global _runner, _wakeup
+    if _runner is not None and not _runner.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Вне цикла событий: задача запустится при первом schedule внутри цикла
+        return
+    _wakeup = asyncio.Event()
+    _runner = loop.create_task(_run())
+
+
+def get_stats() -> Dict[str, int]:
+    return dict(stats, pending=len(_timers))
@@ -0,0 +1,126 @@
+"""
+FSM storage benchmark: fsm_storage.SQLiteStorage against aiogram's MemoryStorage.
+
+Every storage runs the same flow for many users: set_state, update_data twice,
+get_state, get_data, then clearing state and data, as a bank or auction dialog
+does. Per-operation latency is reported, plus the time spent writing to SQLite.
+The SQLite storages use a temporary database, not the bot's one:
+
+    python tools/fsm_benchmark.py
+    python tools/fsm_benchmark.py --users 5000 --rounds 3
+
+"shared" is the mode used by webhook.py workers: reads always go to SQLite and
+changes are flushed after every update.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE)
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import fsm_storage
+
+OPERATIONS = ('set_state', 'update_data', 'get_state', 'get_data', 'clear')
+
+
+def create_table(path):
+    # Same schema as database.py migration 15 ("fsm states")
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS fsm_states (key TEXT PRIMARY KEY, state TEXT, data TEXT, expires_at REAL NOT NULL) WITHOUT ROWID'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_expires ON fsm_states(expires_at)')
+    conn.commit()
+    conn.close()
+
+
+async def run_flow(storage, users, rounds, flush_each):
+    timings = {name: [] for name in OPERATIONS}
+    flush_time = 0.0
+    clock = time.perf_counter_ns
+    for round_no in range(rounds):
+        for user_id in range(1, users + 1):
+            key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+            started = clock()
+            await storage.set_state(key, 'AuctionStates:waiting_for_price')
+            timings['set_state'].append(clock() - started)
+
+            for data in ({'item_id': 'gold_%d' % round_no, 'page': 2}, {'quantity': user_id % 50 + 1}):
+                started = clock()
+                await storage.update_data(key, data)
+                timings['update_data'].append(clock() - started)
+
+            started = clock()
+            await storage.get_state(key)
+            timings['get_state'].append(clock() - started)
+
+            started = clock()
+            await storage.get_data(key)
+            timings['get_data'].append(clock() - started)
+
+            started = clock()
+            await storage.set_state(key, None)
+            await storage.set_data(key, {})
+            timings['clear'].append(clock() - started)
+
+            if flush_each:
+                started = time.perf_counter()
+                await storage.flush()
+                flush_time += time.perf_counter() - started
+    if hasattr(storage, 'flush'):
+        started = time.perf_counter()
+        await storage.flush()
+        flush_time += time.perf_counter() - started
+    return timings, flush_time
+
+
+def report(name, timings, flush_time, stats=None):
+    print('\n%s' % name)
+    print('  %-12s %10s %10s %10s' % ('operation', 'mean us', 'p50 us', 'p99 us'))
+    for operation in OPERATIONS:
+        values = sorted(timings[operation])
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        print('  %-12s %10.2f %10.2f %10.2f' % (
+            operation, statistics.mean(values) / 1000, statistics.median(values) / 1000, p99 / 1000))
+    if flush_time:
+        print('  SQLite writes: %.1f ms total' % (flush_time * 1000))
+    if stats:
+        print('  cache: hits=%(hits)d misses=%(misses)d flushes=%(flushes)d rows written=%(rows_written)d' % stats)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'fsm_benchmark.db')
+        create_table(path)
+
+        timings, flush_time = await run_flow(MemoryStorage(), args.users, args.rounds, False)
+        report('MemoryStorage', timings, flush_time)
+
+        storage = fsm_storage.SQLiteStorage(path=path)
+        timings, flush_time = await run_flow(storage, args.users, args.rounds, False)
+        report('SQLiteStorage (cache, background flush)', timings, flush_time, storage.stats())
+        await storage.close()
+
+        storage = fsm_storage.SQLiteStorage(path=path, shared=True)
+        timings, flush_time = await run_flow(storage, args.users, args.rounds, True)
+        report('SQLiteStorage (shared, flush per update)', timings, flush_time, storage.stats())
+        await storage.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
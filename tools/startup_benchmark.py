@@ -0,0 +1,143 @@
+"""
+Startup benchmark: cold import time and peak memory of the bot and of each feature.
+
+Every measurement runs in a fresh interpreter, so nothing is cached between runs:
+
+    python tools/startup_benchmark.py                # main + all features from lazy_modules.FEATURES
+    python tools/startup_benchmark.py main shop -n 10
+    python tools/startup_benchmark.py main --top 15  # plus the slowest imports (python -X importtime)
+
+Importing main runs the database migrations and creates the Bot object, but does
+not start polling. Features are imported without main, the same way a worker
+process would load them (lazy_modules.load_feature).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE)
+
+MARKER = 'STARTUP_BENCHMARK '
+
+CHILD = r'''
+import importlib, json, sys, time
+sys.path.insert(0, %(base)r)
+started = time.perf_counter()
+for name in %(modules)r:
+    importlib.import_module(name)
+elapsed = time.perf_counter() - started
+
+def peak_rss():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                    'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(Counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+    except Exception:
+        return None
+
+print(%(marker)r + json.dumps({
+    'seconds': elapsed,
+    'peak_rss': peak_rss(),
+    'modules': len(sys.modules),
+    'pillow': 'PIL.Image' in sys.modules,
+}), flush=True)
+'''
+
+
+def get_targets():
+    """Target name -> modules to import."""
+    import lazy_modules
+    targets = {'main': ['main']}
+    targets.update(lazy_modules.FEATURES)
+    return targets
+
+
+def run_once(modules, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-c', CHILD % {'base': BASE, 'modules': modules, 'marker': MARKER}]
+    proc = subprocess.run(cmd, cwd=BASE, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    for line in proc.stdout.splitlines():
+        if line.startswith(MARKER):
+            return json.loads(line[len(MARKER):]), proc.stderr
+    raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'no output')
+
+
+def slowest_imports(stderr, top):
+    """Parse `python -X importtime` output: (cumulative microseconds, module)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def mb(value):
+    return '—' if value is None else '%.1f MB' % (value / 1024 / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', nargs='*', help='main and/or feature names (default: all)')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='runs per target (median is reported)')
+    parser.add_argument('--top', type=int, default=0, help='show the N slowest imports of each target')
+    args = parser.parse_args()
+
+    targets = get_targets()
+    names = args.targets or list(targets)
+    unknown = [name for name in names if name not in targets]
+    if unknown:
+        parser.error('unknown targets: %s (known: %s)' % (', '.join(unknown), ', '.join(targets)))
+
+    baseline, _ = run_once([])
+    print('Python %s, interpreter alone: %s peak RSS\n' % (sys.version.split()[0], mb(baseline['peak_rss'])))
+    print('%-10s %10s %10s %12s %8s %7s' % ('target', 'median', 'min', 'peak RSS', 'modules', 'Pillow'))
+
+    for name in names:
+        try:
+            runs = [run_once(targets[name])[0] for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print('%-10s failed: %s' % (name, e))
+            continue
+        seconds = [run['seconds'] for run in runs]
+        rss = [run['peak_rss'] for run in runs if run['peak_rss'] is not None]
+        print('%-10s %8.0f ms %8.0f ms %12s %8d %7s' % (
+            name,
+            statistics.median(seconds) * 1000,
+            min(seconds) * 1000,
+            mb(statistics.median(rss)) if rss else mb(None),
+            runs[-1]['modules'],
+            'yes' if runs[-1]['pillow'] else 'no',
+        ))
+        if args.top:
+            _, stderr = run_once(targets[name], importtime=True)
+            for cumulative, module in slowest_imports(stderr, args.top):
+                print('    %8.1f ms  %s' % (cumulative / 1000, module))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Ограниченный по размеру LRU-кэш с временем жизни записей (TTL).
+
+Нужен там, где одни и те же строки БД читаются по многу раз за апдейт
+(например, db.get_user). Кэш потокобезопасен: читают его и хендлеры, и потоки
+БД из db_async.
+
+Согласованность с записью. Пишущий код после COMMIT вызывает invalidate(key).
+Загрузка через get_or_load запоминает версию ключа до чтения из БД и кладёт
+результат в кэш, только если за это время ключ не инвалидировали, — иначе
+чтение, начатое до коммита, могло бы вернуть в кэш старую строку.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+# Значение «нет в кэше» (None — допустимое значение у вызывающего кода)
+MISSING = object()
+
+
+class TTLCache:
+    """LRU-кэш на maxsize записей, каждая живёт не дольше ttl секунд."""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: Optional[float] = 60.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._loading: Dict[Hashable, list] = {}  # key -> [число загрузок, версия]
+        self._lock = threading.Lock()
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default=None):
+        value = self._lookup(key)
+        return default if value is MISSING else value
+
+    def _lookup(self, key: Hashable):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] is None or entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key: Hashable, value):
+        with self._lock:
+            self._store_locked(key, value)
+
+    def _store_locked(self, key: Hashable, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable, cache_none: bool = False):
+        """Значение из кэша или loader(key); загруженное кладётся в кэш.
+
+        None не кэшируется (если не cache_none): отсутствующая строка может
+        появиться в любой момент.
+        """
+        value = self._lookup(key)
+        if value is not MISSING:
+            return value
+        with self._lock:
+            state = self._loading.get(key)
+            if state is None:
+                state = self._loading[key] = [0, 0]
+            state[0] += 1
+            version = state[1]
+        try:
+            value = loader(key)
+        finally:
+            with self._lock:
+                state[0] -= 1
+                fresh = state[1] == version
+                if state[0] == 0:
+                    del self._loading[key]
+        if fresh and (value is not None or cache_none):
+            with self._lock:
+                self._store_locked(key, value)
+        return value
+
+    def get_many_or_load(self, keys, loader: Callable) -> Dict[Hashable, object]:
+        """Значения для многих ключей: из кэша, недостающие — одним loader(список ключей).
+
+        loader возвращает {ключ: значение}; ключи, которых нет в ответе, не кэшируются.
+        """
+        result = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self._lookup(key)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                result[key] = value
+        if not missing:
+            return result
+        with self._lock:
+            started = []
+            for key in missing:
+                state = self._loading.get(key)
+                if state is None:
+                    state = self._loading[key] = [0, 0]
+                state[0] += 1
+                started.append((key, state, state[1]))
+        loaded = {}
+        try:
+            loaded = loader(missing)
+        finally:
+            with self._lock:
+                for key, state, version in started:
+                    state[0] -= 1
+                    if state[0] == 0:
+                        del self._loading[key]
+                    if key in loaded and state[1] == version:
+                        self._store_locked(key, loaded[key])
+        result.update(loaded)
+        return result
+
+    def invalidate(self, *keys: Hashable):
+        """Удалить ключи и отменить запись в кэш загрузок, начатых до этого момента."""
+        with self._lock:
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+                state = self._loading.get(key)
+                if state is not None:
+                    state[1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            for state in self._loading.values():
+                state[1] += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,370 @@
+"""
+Режим webhook: приём апдейтов по HTTP и раздача их нескольким процессам-воркерам.
+
+В режиме опроса (python main.py) все апдейты, рендер картинок и запись в
+SQLite идут в одном цикле событий на одном ядре. Здесь:
+
+- приёмник (aiohttp) принимает апдейты от Telegram на WEBHOOK_PATH, сразу
+  отвечает 200 и кладёт апдейт в очередь своего воркера;
+- воркер выбирается по chat_id (нет чата — по user_id): все апдейты одного
+  чата попадают в один процесс и в том же порядке, в каком пришли. Арена
+  (общая очередь подбора соперников) закреплена за воркером 0;
+- каждый воркер — отдельный процесс с полным ботом (import main), слушает
+  127.0.0.1:WORKER_BASE_PORT + номер и обрабатывает апдейты одного чата по
+  очереди, разных чатов — параллельно;
+- при нескольких воркерах игровые сессии (хранилища session_store с
+  persist=True) и состояния FSM (fsm_storage) работают в общем режиме через
+  таблицы game_sessions и fsm_states, поэтому любой воркер может обслужить
+  любую сессию (например, после смены числа воркеров). Перед апдейтом воркер
+  подтягивает чужие изменения сессий, после — пишет свои;
+- у каждого воркера свой журнал отложенной записи (write_behind.set_instance);
+- планировщик, продолжение рассылок и арена работают только в воркере 0,
+  он же регистрирует вебхук в Telegram (если задан WEBHOOK_URL) и при
+  запуске проигрывает журналы воркеров, которых больше нет.
+
+Запуск (всё на одной машине):
+
+    WEBHOOK_URL=https://bot.example.com WEBHOOK_SECRET=... python webhook.py --workers 4
+    python webhook.py --workers 2       # без WEBHOOK_URL вебхук не регистрируется:
+    curl -X POST localhost:8080/webhook -H 'Content-Type: application/json' -d @update.json
+
+Вернуться к опросу - обычный python main.py (он снимает вебхук).
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import signal
+import sys
+from typing import Dict, Optional
+
+import aiohttp
+from aiohttp import web
+
+# Публичный адрес бота (без пути); пусто - вебхук в Telegram не регистрируется
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "0")) or os.cpu_count() or 1
+# Воркеры слушают WORKER_HOST:WORKER_BASE_PORT + номер
+WORKER_HOST = "127.0.0.1"
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+
+# Сколько апдейтов ждёт отправки в один воркер (дальше Telegram получает 503 и повторит позже)
+SHARD_QUEUE_SIZE = 1000
+# Сколько апдейтов воркер обрабатывает одновременно (дальше отвечает 503, приёмник повторяет)
+WORKER_MAX_IN_FLIGHT = 256
+# Сколько последних update_id воркер помнит, чтобы не обработать повтор дважды
+WORKER_SEEN_UPDATES = 10000
+# Повтор отправки в воркер (перезапуск, перегрузка): первая и максимальная пауза, секунд
+FORWARD_RETRY_DELAY = 0.2
+FORWARD_RETRY_MAX_DELAY = 5.0
+# Перезапуск упавшего воркера: пауза, секунд
+WORKER_RESTART_DELAY = 2.0
+# Сколько ждать завершения начатых апдейтов при остановке воркера, секунд
+WORKER_DRAIN_TIMEOUT = 30
+
+# Апдейты арены - всегда в воркер 0 (очередь подбора и бои живут в его памяти)
+LEADER_CALLBACK_PREFIXES = ("arena_",)
+LEADER_TEXTS = {"арена", "arena"}
+
+SHARD_KEY_HEADER = "X-Shard-Key"
+
+
+def routing_key(update: dict) -> int:
+    """chat_id апдейта, если есть чат, иначе id пользователя (иначе update_id)."""
+    for name, event in update.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+    return update.get("update_id", 0)
+
+
+def shard_for(update: dict, workers: int) -> int:
+    """Номер воркера для апдейта: один и тот же для всех апдейтов чата."""
+    callback = update.get("callback_query")
+    if callback and (callback.get("data") or "").startswith(LEADER_CALLBACK_PREFIXES):
+        return 0
+    message = update.get("message")
+    if message and (message.get("text") or "").strip().lower() in LEADER_TEXTS:
+        return 0
+    return routing_key(update) % workers
+
+
+def worker_url(index: int) -> str:
+    return f"http://{WORKER_HOST}:{WORKER_BASE_PORT + index}/update"
+
+
+# === ПРИЁМНИК ===
+
+class Ingress:
+    """Принимает апдейты от Telegram и по очереди пересылает их воркерам."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queues = [asyncio.Queue(maxsize=SHARD_QUEUE_SIZE) for _ in range(workers)]
+        self.forwarded = [0] * workers
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks = []
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        self._tasks = [asyncio.create_task(self._forward(index)) for index in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        shard = shard_for(update, self.workers)
+        try:
+            self.queues[shard].put_nowait((routing_key(update), body))
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "workers": self.workers,
+            "queued": [queue.qsize() for queue in self.queues],
+            "forwarded": self.forwarded,
+        })
+
+    async def _forward(self, index: int):
+        # Один отправитель на воркер: апдейты уходят строго в порядке очереди
+        queue = self.queues[index]
+        url = worker_url(index)
+        while True:
+            key, body = await queue.get()
+            delay = FORWARD_RETRY_DELAY
+            while True:
+                try:
+                    async with self._session.post(url, data=body, headers={
+                        "Content-Type": "application/json",
+                        SHARD_KEY_HEADER: str(key),
+                    }) as response:
+                        if response.status < 500:
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                # Воркер перезапускается или перегружен - ждём и повторяем тот же апдейт
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, FORWARD_RETRY_MAX_DELAY)
+            self.forwarded[index] += 1
+
+
+async def _supervise_worker(index: int, workers: int, stopping: asyncio.Event):
+    """Запускает воркер index и перезапускает его, если он упал."""
+    while not stopping.is_set():
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "worker", str(index), "--workers", str(workers),
+        )
+        print(f"🚀 Воркер {index} запущен (pid {process.pid})")
+        try:
+            code = await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(process.wait(), WORKER_DRAIN_TIMEOUT + 5)
+                except asyncio.TimeoutError:
+                    process.kill()
+            raise
+        if stopping.is_set():
+            break
+        print(f"⚠️ Воркер {index} завершился с кодом {code}, перезапуск через {WORKER_RESTART_DELAY} с")
+        await asyncio.sleep(WORKER_RESTART_DELAY)
+
+
+async def run_ingress(workers: int, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+    """Приёмник вебхука и воркеры в дочерних процессах (до Ctrl+C / SIGTERM)."""
+    ingress = Ingress(workers)
+    await ingress.start()
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, ingress.handle_update)
+    app.router.add_get("/health", ingress.handle_health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"✅ Приём вебхука на {host}:{port}{WEBHOOK_PATH}, воркеров: {workers}")
+
+    stopping = asyncio.Event()
+    _on_stop_signals(stopping.set)
+    supervisors = [asyncio.create_task(_supervise_worker(index, workers, stopping)) for index in range(workers)]
+    try:
+        await stopping.wait()
+    finally:
+        print("🛑 Остановка приёмника и воркеров")
+        await runner.cleanup()
+        for task in supervisors:
+            task.cancel()
+        await asyncio.gather(*supervisors, return_exceptions=True)
+        await ingress.close()
+
+
+# === ВОРКЕР ===
+
+class Worker:
+    """Обрабатывает апдейты своего шарда: одного чата - по очереди, разных - параллельно."""
+
+    def __init__(self, bot_main, sessions):
+        self.bot_main = bot_main
+        self.sessions = sessions
+        self._chains: Dict[int, asyncio.Task] = {}
+        self._in_flight = set()
+        self._seen = collections.OrderedDict()
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if len(self._in_flight) >= WORKER_MAX_IN_FLIGHT:
+            return web.Response(status=503)
+        data = await request.json()
+        update_id = data.get("update_id")
+        if update_id in self._seen:
+            # Повтор (Telegram или приёмник не дождались ответа) - уже обработан
+            return web.Response()
+        self._seen[update_id] = True
+        if len(self._seen) > WORKER_SEEN_UPDATES:
+            self._seen.popitem(last=False)
+        key = int(request.headers.get(SHARD_KEY_HEADER) or routing_key(data))
+
+        previous = self._chains.get(key)
+        task = asyncio.create_task(self._process(previous, data))
+        self._chains[key] = task
+        self._in_flight.add(task)
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return web.Response()
+
+    def _finished(self, key: int, task: asyncio.Task):
+        self._in_flight.discard(task)
+        if self._chains.get(key) is task:
+            del self._chains[key]
+
+    async def _process(self, previous: Optional[asyncio.Task], data: dict):
+        from aiogram import types
+        if previous is not None:
+            await asyncio.wait([previous])
+        bot, dp = self.bot_main.bot, self.bot_main.dp
+        try:
+            # Игровые сессии, изменённые другими воркерами
+            await self.sessions.refresh()
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать игровые сессии: {e}")
+        try:
+            update = types.Update.model_validate(data, context={"bot": bot})
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            print(f"❌ Ошибка обработки апдейта {data.get('update_id')}: {e}")
+        finally:
+            if self.sessions.is_shared():
+                # Сессии и состояния FSM этого апдейта сразу видны другим воркерам
+                try:
+                    await self.sessions.save()
+                except Exception as e:
+                    print(f"⚠️ Не удалось записать игровые сессии: {e}")
+                try:
+                    await dp.storage.flush()
+                except Exception as e:
+                    print(f"⚠️ Не удалось записать состояния FSM: {e}")
+
+    async def drain(self):
+        if self._in_flight:
+            await asyncio.wait(list(self._in_flight), timeout=WORKER_DRAIN_TIMEOUT)
+
+
+async def run_worker(index: int, workers: int):
+    """Воркер index из workers: полный бот, апдейты получает от приёмника."""
+    import session_store
+    import write_behind
+    if workers > 1:
+        # До импорта main: сессии читаются и пишутся через общую таблицу game_sessions
+        session_store.enable_shared()
+    # Свой журнал отложенной записи: воркеры не проигрывают журналы друг друга
+    write_behind.set_instance(f"worker{index}")
+    import main as bot_main
+
+    leader = index == 0
+    bot_main.init_databases()
+    if leader:
+        # Журналы воркеров, которых в этой конфигурации нет, и режима опроса
+        try:
+            write_behind.recover_instances(keep={f"worker{i}" for i in range(workers)})
+        except Exception as e:
+            print(f"⚠️ Не удалось проиграть журналы отложенной записи: {e}")
+    await bot_main.on_startup(leader=leader)
+    worker = Worker(bot_main, session_store)
+
+    app = web.Application()
+    app.router.add_post("/update", worker.handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WORKER_HOST, WORKER_BASE_PORT + index).start()
+    print(f"✅ Воркер {index}/{workers} слушает {WORKER_HOST}:{WORKER_BASE_PORT + index}")
+
+    if leader and WEBHOOK_URL:
+        await bot_main.bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=bot_main.dp.resolve_used_update_types(),
+        )
+        print(f"✅ Вебхук зарегистрирован: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+    stopping = asyncio.Event()
+    _on_stop_signals(stopping.set)
+    try:
+        await stopping.wait()
+    finally:
+        await runner.cleanup()
+        await worker.drain()
+        await bot_main.on_shutdown(leader=leader)
+
+
+def _on_stop_signals(callback):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, callback)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остаётся KeyboardInterrupt
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бот в режиме webhook с несколькими процессами-воркерами")
+    parser.add_argument("role", nargs="?", default="ingress", choices=["ingress", "worker"])
+    parser.add_argument("index", nargs="?", type=int, default=0, help="номер воркера (для role=worker)")
+    parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS)
+    parser.add_argument("--host", default=WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    args = parser.parse_args()
+
+    try:
+        if args.role == "worker":
+            asyncio.run(run_worker(args.index, args.workers))
+        else:
+            asyncio.run(run_ingress(args.workers, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
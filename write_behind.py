@@ -0,0 +1,414 @@
+"""
+Отложенная запись (write-behind) для часто увеличиваемых счётчиков.
+
+Каждый раунд игры раньше делал несколько мелких коммитов (games_played,
+счётчик игр за день, прогресс заданий), и каждый коммит — это fsync.
+CounterBuffer копит приращения в памяти, складывает их по ключу и
+сбрасывает одной транзакцией раз в flush_interval секунд или после max_ops
+операций.
+
+Надёжность:
+- каждое приращение дописывается строкой в журнал (append-only, без fsync —
+  переживает падение процесса, но не отключение питания);
+- при сбросе текущий журнал переименовывается в сегмент с номером seq, номер
+  последнего применённого сегмента записывается в ту же транзакцию, что и
+  счётчики, поэтому при повторе после падения ничего не применится дважды;
+- при запуске неприменённые сегменты и журнал проигрываются;
+- flush_all()/shutdown() вызываются при остановке бота (и через atexit).
+
+Несколько процессов на одну БД (воркеры webhook.py): у каждого свой
+экземпляр — set_instance("worker<N>") до первой записи. Журнал экземпляра
+лежит в JOURNAL_DIR/<экземпляр>/, номер применённого сегмента — в строке
+"<имя>@<экземпляр>", поэтому процесс при запуске проигрывает только свой
+журнал и не применяет второй раз то, что записали живые соседи.
+recover_instances() проигрывает журналы экземпляров, которых больше нет
+(воркеров стало меньше, переход между webhook и опросом).
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable
+
+# Рядом с БД (database.DB_FOLDER, в том числе переопределённым через BOT_DB_FOLDER)
+JOURNAL_DIR = os.path.join(
+    os.environ.get("BOT_DB_FOLDER") or os.path.join(os.path.dirname(__file__), "database"), "journal"
+)
+
+# Экземпляр этого процесса ("" - единственный процесс, режим опроса), см. set_instance
+_instance = ""
+
+# Сбрасывать не реже, чем раз в столько секунд
+DEFAULT_FLUSH_INTERVAL = 0.5
+# ...или сразу после стольких операций
+DEFAULT_MAX_OPS = 500
+
+
+def _decode_key(key):
+    # JSON превращает кортежи в списки — возвращаем обратно, чтобы ключи совпадали
+    if isinstance(key, list):
+        return tuple(_decode_key(k) for k in key)
+    return key
+
+
+class CounterBuffer:
+    """Буфер монотонных счётчиков с журналом.
+
+    connect() — функция, возвращающая соединение с БД, в которой лежат счётчики.
+    apply(cur, items) — записывает {ключ: приращение} через курсор; транзакцию
+    открывает и коммитит сам буфер.
+    on_applied(items) — необязательный вызов сразу после COMMIT (например, сбросить
+    кэш); выполняется под блокировкой буфера, поэтому не должен вызывать методы буфера.
+    """
+
+    def __init__(self, name: str, connect: Callable, apply: Callable,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 max_ops: int = DEFAULT_MAX_OPS, journal_dir: str = JOURNAL_DIR,
+                 on_applied: Callable = None):
+        self.name = name
+        self.flush_interval = flush_interval
+        self.max_ops = max_ops
+        self._connect = connect
+        self._apply = apply
+        self._on_applied = on_applied
+        self._base_journal_dir = journal_dir
+        # Каталог журнала и строка write_behind_state экземпляра (_bind при первом обращении)
+        self._journal_dir = journal_dir
+        self._state_name = name
+        self._active_path = self._journal_path(journal_dir)
+        self._pending: Dict[Hashable, int] = {}
+        # Снятая для сброса пачка: ещё не в БД, но уже не в _pending
+        self._in_flight: Dict[Hashable, int] = {}
+        # Число записанных пачек: read() по нему замечает COMMIT между чтениями
+        self._generation = 0
+        self._ops = 0
+        self._first_op_at = 0.0
+        self._journal = None
+        self._next_seq = 1
+        self._ready = False
+        self._lock = threading.Lock()        # _pending, _in_flight и журнал
+        self._flush_lock = threading.Lock()  # сбросы идут строго по порядку seq
+        # Статистика для отчётов
+        self.flushes = 0
+        self.flushed_ops = 0
+        _register(self)
+
+    # --- публичный API ---
+
+    def add(self, key: Hashable, delta: int = 1):
+        """Добавить приращение к счётчику key (запишется при ближайшем сбросе)."""
+        self._ensure_ready()
+        line = json.dumps([key, delta], ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._journal is None:
+                os.makedirs(self._journal_dir, exist_ok=True)
+                self._journal = open(self._active_path, "a", encoding="utf-8")
+            self._journal.write(line)
+            self._journal.flush()
+            if not self._pending:
+                self._first_op_at = time.monotonic()
+            self._pending[key] = self._pending.get(key, 0) + delta
+            self._ops += 1
+            due = self._ops >= self.max_ops
+        if due:
+            _wakeup.set()
+        _ensure_flusher()
+
+    def pending(self, key: Hashable) -> int:
+        """Ещё не записанное в БД приращение ключа (для чтения «свежих» значений).
+
+        Учитывает и пачку, которая сейчас записывается: она снята с _pending до
+        COMMIT и считается здесь, пока COMMIT не выполнен. Сумму со значением из
+        БД даёт read()."""
+        with self._lock:
+            return self._pending.get(key, 0) + self._in_flight.get(key, 0)
+
+    def read(self, key: Hashable, load: Callable):
+        """(load(), pending(key)), согласованные между собой.
+
+        Если между ними записалась пачка, load() мог уже увидеть её в БД, а
+        pending — ещё посчитать: тогда load() повторяется."""
+        while True:
+            with self._lock:
+                generation = self._generation
+                pending = self._pending.get(key, 0) + self._in_flight.get(key, 0)
+            value = load()
+            with self._lock:
+                if self._generation == generation:
+                    return value, pending
+
+    def is_due(self) -> bool:
+        with self._lock:
+            if not self._pending:
+                return False
+            return self._ops >= self.max_ops or time.monotonic() - self._first_op_at >= self.flush_interval
+
+    def flush(self) -> int:
+        """Записать накопленное одной транзакцией. Возвращает число операций."""
+        self._ensure_ready()
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                pending, ops = self._pending, self._ops
+                self._pending, self._ops = {}, 0
+                self._in_flight = pending
+                seq = self._next_seq
+                self._next_seq += 1
+                self._rotate_journal_locked(seq)
+            try:
+                self._apply_batch(seq, pending, flushing=True)
+            except Exception as e:
+                # Возвращаем приращения в буфер; сегмент остаётся на диске и
+                # будет проигран при перезапуске, если процесс упадёт раньше
+                print(f"⚠️ write-behind {self.name}: ошибка сброса: {e}")
+                with self._lock:
+                    self._in_flight = {}
+                    if not self._pending:
+                        self._first_op_at = time.monotonic()
+                    for key, delta in pending.items():
+                        self._pending[key] = self._pending.get(key, 0) + delta
+                    self._ops += ops
+                return 0
+            self._remove_segments_upto(seq)
+            self.flushes += 1
+            self.flushed_ops += ops
+            return ops
+
+    def close(self):
+        """Сбросить буфер и закрыть журнал."""
+        self.flush()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    # --- журнал и транзакции ---
+
+    def _journal_path(self, journal_dir: str) -> str:
+        return os.path.join(journal_dir, f"{self.name}.log")
+
+    def _segment_path(self, seq: int, journal_dir: str = None) -> str:
+        return os.path.join(journal_dir or self._journal_dir, f"{self.name}.{seq}.log")
+
+    def _segments(self, journal_dir: str = None):
+        result = []
+        for path in glob.glob(os.path.join(journal_dir or self._journal_dir, f"{self.name}.*.log")):
+            middle = os.path.basename(path)[len(self.name) + 1:-len(".log")]
+            if middle.isdigit():
+                result.append((int(middle), path))
+        result.sort()
+        return result
+
+    def _rotate_journal_locked(self, seq: int):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self._active_path):
+            os.replace(self._active_path, self._segment_path(seq))
+
+    def _remove_segments_upto(self, seq: int):
+        for segment_seq, path in self._segments():
+            if segment_seq <= seq:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _read_journal(path: str) -> Dict[Hashable, int]:
+        items: Dict[Hashable, int] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    key, delta = json.loads(line)
+                except (ValueError, TypeError):
+                    # Обрезанная последняя строка после падения — пропускаем
+                    continue
+                key = _decode_key(key)
+                items[key] = items.get(key, 0) + delta
+        return items
+
+    def _apply_batch(self, seq: int, items: Dict[Hashable, int], state_name: str = None,
+                     flushing: bool = False):
+        conn = self._connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            self._apply(cur, items)
+            cur.execute(
+                "INSERT INTO write_behind_state (name, applied_seq) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET applied_seq = excluded.applied_seq",
+                (state_name or self._state_name, seq),
+            )
+            # COMMIT, on_applied и снятие пачки из _in_flight - под одной блокировкой:
+            # pending() не вернёт пачку, которая уже видна в БД и не вытеснена из кэша
+            with self._lock:
+                conn.commit()
+                self._generation += 1
+                if flushing:
+                    self._in_flight = {}
+                if self._on_applied is not None:
+                    self._on_applied(items)
+        finally:
+            conn.close()
+
+    def _ensure_ready(self):
+        if self._ready:
+            return
+        with self._flush_lock:
+            if self._ready:
+                return
+            self._bind(_instance)
+            self._next_seq = self._replay(self._journal_dir, self._state_name)
+            self._ready = True
+
+    def _instance_paths(self, instance: str):
+        """(каталог журнала, имя в write_behind_state) экземпляра."""
+        if not instance:
+            return self._base_journal_dir, self.name
+        return os.path.join(self._base_journal_dir, instance), f"{self.name}@{instance}"
+
+    def _bind(self, instance: str):
+        self._journal_dir, self._state_name = self._instance_paths(instance)
+        self._active_path = self._journal_path(self._journal_dir)
+
+    def recover_instance(self, instance: str):
+        """Проиграть журнал чужого экземпляра, процесса которого больше нет."""
+        journal_dir, state_name = self._instance_paths(instance)
+        if (journal_dir, state_name) != (self._journal_dir, self._state_name):
+            self._replay(journal_dir, state_name)
+
+    def _replay(self, journal_dir: str, state_name: str) -> int:
+        """Проиграть журнал, оставшийся после прошлого запуска. Возвращает следующий seq."""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS write_behind_state ("
+                "name TEXT PRIMARY KEY, applied_seq INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.commit()
+            row = conn.execute("SELECT applied_seq FROM write_behind_state WHERE name = ?", (state_name,)).fetchone()
+        finally:
+            conn.close()
+        applied = int(row[0]) if row else 0
+        segments = self._segments(journal_dir)
+        last_seq = max([applied] + [seq for seq, _ in segments])
+        active_path = self._journal_path(journal_dir)
+        if os.path.exists(active_path):
+            last_seq += 1
+            os.replace(active_path, self._segment_path(last_seq, journal_dir))
+            segments.append((last_seq, self._segment_path(last_seq, journal_dir)))
+        replayed = 0
+        for seq, path in segments:
+            if seq > applied:
+                items = self._read_journal(path)
+                if items:
+                    self._apply_batch(seq, items, state_name)
+                    replayed += sum(items.values())
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if replayed:
+            print(f"🔁 write-behind {state_name}: восстановлено из журнала {replayed} операций")
+        return last_seq + 1
+
+
+# --- общий фоновый поток сброса ---
+
+_buffers = []
+_buffers_lock = threading.Lock()
+_wakeup = threading.Event()
+_stop = threading.Event()
+_flusher = None
+
+
+def set_instance(instance: str):
+    """Свой журнал для этого процесса (до первой записи в буферы), например "worker2"."""
+    global _instance
+    _instance = str(instance)
+
+
+def recover_instances(keep=()):
+    """Проиграть журналы всех экземпляров, кроме keep и текущего.
+
+    Вызывать, только когда процессов этих экземпляров точно нет: при запуске
+    бота в режиме опроса или в воркере 0 webhook.py (keep - все воркеры)."""
+    keep = set(keep) | {_instance}
+    with _buffers_lock:
+        buffers = list(_buffers)
+    for buffer in buffers:
+        base = buffer._base_journal_dir
+        instances = [""]
+        if os.path.isdir(base):
+            instances += [entry.name for entry in os.scandir(base) if entry.is_dir()]
+        for instance in instances:
+            if instance not in keep:
+                buffer.recover_instance(instance)
+
+
+def _register(buffer: CounterBuffer):
+    with _buffers_lock:
+        _buffers.append(buffer)
+
+
+def _flusher_loop():
+    while not _stop.is_set():
+        with _buffers_lock:
+            buffers = list(_buffers)
+        interval = min([b.flush_interval for b in buffers] or [DEFAULT_FLUSH_INTERVAL])
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        for buffer in buffers:
+            if buffer.is_due():
+                try:
+                    buffer.flush()
+                except Exception as e:
+                    print(f"⚠️ write-behind {buffer.name}: {e}")
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None or _stop.is_set():
+        return
+    with _buffers_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flusher_loop, name="write-behind", daemon=True)
+            _flusher.start()
+
+
+def flush_all() -> int:
+    """Сбросить все буферы немедленно."""
+    with _buffers_lock:
+        buffers = list(_buffers)
+    return sum(buffer.flush() for buffer in buffers)
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    with _buffers_lock:
+        buffers = list(_buffers)
+    return {
+        b.name: {"pending_keys": len(b._pending), "flushes": b.flushes, "flushed_ops": b.flushed_ops}
+        for b in buffers
+    }
+
+
+def shutdown():
+    """Остановить фоновый поток и записать всё накопленное (при остановке бота)."""
+    _stop.set()
+    _wakeup.set()
+    if _flusher is not None:
+        _flusher.join(timeout=5)
+    with _buffers_lock:
+        buffers = list(_buffers)
+    for buffer in buffers:
+        try:
+            buffer.close()
+        except Exception as e:
+            print(f"⚠️ write-behind {buffer.name}: ошибка при остановке: {e}")
+
+
+atexit.register(shutdown)